@@ -0,0 +1,105 @@
+"""
+Shared helpers for the benchmarks: an in-process og-server on localhost and
+raw websocket clients driven through registration and the tunnel handshake.
+"""
+import asyncio
+import base64
+import logging
+
+import websockets
+
+from oldie_goldie.client.helpers.tunnel_activity import TunnelActivityUtilsForOG
+from oldie_goldie.server.og_server import OGServer
+from oldie_goldie.shared import SecureMethodsForOG, decode_message, encode_message, make_register_message
+
+# Keep the server's per-message logging out of the measurements
+logging.getLogger().setLevel(logging.WARNING)
+
+
+async def start_server(host: str = "localhost", **serve_kwargs):
+    """Start a fresh OGServer on a free port. Returns (server, uri)."""
+    server = await OGServer([f"{host}:0"], compression_options=serve_kwargs).start()
+    return server, f"ws://{server.addresses[0]}"
+
+
+async def recv_type(websocket, msg_type: str, timeout: float = 10.0) -> dict:
+    """Wait for the next text message of `msg_type`, skipping anything else."""
+    while True:
+        message = await asyncio.wait_for(websocket.recv(), timeout)
+        if isinstance(message, bytes):
+            continue
+        decoded = decode_message(message)
+        if decoded.get("type") == msg_type:
+            return decoded
+
+
+async def register(uri: str, username: str, **connect_kwargs):
+    websocket = await websockets.connect(uri, **connect_kwargs)
+    await websocket.send(make_register_message(username=username))
+    await recv_type(websocket, "register")
+    return websocket
+
+
+async def open_tunnel(uri: str, user_a: str = "alice", user_b: str = "bob", psk: str = "benchmark", **connect_kwargs):
+    """
+    Register two users and run the tunnel handshake between them.
+    Returns ((websocket_a, utils_a), (websocket_b, utils_b)) with session keys derived on both ends.
+    """
+    ws_a = await register(uri, user_a, **connect_kwargs)
+    ws_b = await register(uri, user_b, **connect_kwargs)
+    return await legacy_handshake((ws_a, user_a), (ws_b, user_b), psk)
+
+
+async def open_fast_tunnel(uri: str, user_a: str = "alice", user_b: str = "bob", psk: str = "benchmark", **connect_kwargs):
+    """open_tunnel, but with the fast handshake: keys and PSK proofs ride on connect_request/connect_accept."""
+    ws_a = await register(uri, user_a, **connect_kwargs)
+    ws_b = await register(uri, user_b, **connect_kwargs)
+    return await fast_handshake((ws_a, user_a), (ws_b, user_b), psk)
+
+
+async def fast_handshake(side_a, side_b, psk: str = "benchmark"):
+    """Run the fast handshake between two registered connections, given as (websocket, username)."""
+    (ws_a, user_a), (ws_b, user_b) = side_a, side_b
+    utils_a, utils_b = TunnelActivityUtilsForOG(), TunnelActivityUtilsForOG()
+    psk_hash = SecureMethodsForOG.hash_psk(psk)
+    utils_a.set_psk_hash(psk_hash)
+    utils_b.set_psk_hash(psk_hash)
+
+    await ws_a.send(encode_message(type="connect_request", sender=user_a, target=user_b, key=utils_a.prepare_ephemeral_key(), proof=utils_a.psk_proof(user_a, user_b), features=list(utils_a.FEATURES), message="connect_request"))
+    await recv_type(ws_b, "connect_request")
+    await ws_b.send(encode_message(type="connect_accept", sender=user_b, target=user_a, key=utils_b.prepare_ephemeral_key(), proof=utils_b.psk_proof(user_a, user_b), features=list(utils_b.FEATURES), message="connect_accept"))
+
+    ok_a, ok_b = await asyncio.gather(recv_type(ws_a, "tunnel_ok"), recv_type(ws_b, "tunnel_ok"))
+    utils_a.complete_handshake(ok_a["key"], ok_a.get("features"))
+    utils_b.complete_handshake(ok_b["key"], ok_b.get("features"))
+
+    return (ws_a, utils_a), (ws_b, utils_b)
+
+
+async def legacy_handshake(side_a, side_b, psk: str = "benchmark"):
+    """Run the original handshake (validate, secret, key init, key share) between two registered connections."""
+    (ws_a, user_a), (ws_b, user_b) = side_a, side_b
+    utils_a, utils_b = TunnelActivityUtilsForOG(), TunnelActivityUtilsForOG()
+
+    await ws_a.send(encode_message(type="connect_request", sender=user_a, target=user_b, message="connect_request"))
+    await recv_type(ws_b, "connect_request")
+    await ws_b.send(encode_message(type="connect_accept", sender=user_b, target=user_a, message="connect_accept"))
+    await asyncio.gather(recv_type(ws_a, "tunnel_validate"), recv_type(ws_b, "tunnel_validate"))
+
+    # Both peers act concurrently from here on, like two separate clients would
+    psk_hash = SecureMethodsForOG.hash_psk(psk)
+
+    async def submit_secret(websocket, utils, username):
+        utils.set_psk_hash(psk_hash)
+        await websocket.send(encode_message(type="tunnel_secret", sender=username, secret=base64.b64encode(psk_hash).decode(), message="tunnel_secret"))
+        await recv_type(websocket, "tunnel_ok_key_init")
+
+    async def share_key(websocket, utils, username, target):
+        await utils.handle_key_share(websocket=websocket, username=username, target=target)
+        decoded = await recv_type(websocket, "key_share")
+        utils.complete_handshake(decoded["key"], decoded.get("features"))
+
+    await asyncio.gather(submit_secret(ws_a, utils_a, user_a), submit_secret(ws_b, utils_b, user_b))
+    await asyncio.gather(share_key(ws_a, utils_a, user_a, user_b), share_key(ws_b, utils_b, user_b, user_a))
+
+    return (ws_a, utils_a), (ws_b, utils_b)
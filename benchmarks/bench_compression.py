@@ -0,0 +1,67 @@
+"""
+Compress-then-encrypt: bytes on the wire and CPU per message size.
+
+Every message is encoded with encode_binary_message and decoded with
+decode_binary_message, once per codec, on log-like text.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_compression
+    python -m benchmarks.bench_compression --sizes 128 1024 16384 --number 2000
+"""
+import argparse
+import os
+import random
+import time
+
+from oldie_goldie.shared import SessionCipher, decode_binary_message, encode_binary_message
+from oldie_goldie.shared.compression import available_codecs
+
+LOG_WORDS = ["INFO", "DEBUG", "WARNING", "request", "handled", "user", "tunnel", "relay", "latency", "ms", "connection", "closed", "opened", "bytes", "frame", "server", "client"]
+
+
+def log_text(size: int, seed: int = 7) -> str:
+    """Deterministic, log-like text of exactly `size` characters."""
+    rng = random.Random(seed)
+    lines = []
+    length = 0
+    while length < size:
+        line = f"2025-11-28 12:{rng.randrange(60):02d}:{rng.randrange(60):02d} " + " ".join(rng.choice(LOG_WORDS) for _ in range(8)) + f" id={rng.randrange(10**6)}"
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)[:size]
+
+
+def main():
+    p = argparse.ArgumentParser(description="Compress-then-encrypt bytes-on-wire and CPU benchmark")
+    p.add_argument("--sizes", type=int, nargs="+", default=[64, 256, 1024, 4096, 16384, 65536], help="message sizes in characters")
+    p.add_argument("--number", type=int, default=1000, help="messages per measurement")
+    args = p.parse_args()
+
+    key = os.urandom(32)
+    codecs = [None] + list(available_codecs())
+
+    print(f"{'size':>7} {'codec':>6} {'wire B':>8} {'ratio':>6} {'enc µs':>8} {'dec µs':>8}")
+    for size in args.sizes:
+        message = log_text(size)
+        baseline = None
+
+        for codec in codecs:
+            sender, receiver = SessionCipher(key), SessionCipher(key)
+
+            start = time.perf_counter()
+            frames = [encode_binary_message(sender="alice", message=message, target="bob", cipher=sender, compression=codec) for _ in range(args.number)]
+            encode_us = (time.perf_counter() - start) / args.number * 1e6
+
+            start = time.perf_counter()
+            for frame in frames:
+                decode_binary_message(frame, cipher=receiver)
+            decode_us = (time.perf_counter() - start) / args.number * 1e6
+
+            wire = len(frames[0])
+            baseline = baseline or wire
+            print(f"{size:>7} {codec or 'none':>6} {wire:>8} {wire / baseline:>6.2f} {encode_us:>8.1f} {decode_us:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Server memory per idle connection under each websocket compression policy and keepalive.
+
+The og-server runs in a child process so that only its memory is measured. The
+parent opens N connections which offer permessage-deflate like older clients do,
+registers them, leaves them idle and reads the child's RSS.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_connection_memory
+    python -m benchmarks.bench_connection_memory --clients 10000 --policies selective deflate deflate-nct off
+    python -m benchmarks.bench_connection_memory --policies off --keepalive fixed adaptive
+
+10k connections need that many file descriptors in both processes, the benchmark
+raises RLIMIT_NOFILE to the hard limit (check `ulimit -Hn`).
+"""
+import argparse
+import asyncio
+import gc
+import multiprocessing
+import os
+import resource
+import sys
+
+from oldie_goldie.client import OGClient
+from oldie_goldie.shared.ws_compression import server_compression_options
+
+# name -> keyword arguments for server_compression_options
+POLICIES = {
+    "selective": dict(mode="selective"),
+    "selective-nct": dict(mode="selective", no_context_takeover=True),
+    "deflate": dict(mode="deflate"),
+    "deflate-nct": dict(mode="deflate", no_context_takeover=True),
+    "deflate-wb15": dict(mode="deflate", max_window_bits=15),
+    "off": dict(mode="off"),
+}
+
+
+def raise_fd_limit() -> int:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak rather than current RSS, still fine since the server only grows during the run
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def serve(policy: dict, keepalive: str, conn) -> None:
+    """Child process: run the og-server handler and answer RSS queries on `conn`."""
+    import logging
+    from oldie_goldie.server.og_server import OGServer
+    from oldie_goldie.server.helpers.liveness import LivenessMonitor
+
+    raise_fd_limit()
+    logging.getLogger().setLevel(logging.WARNING)
+    sys.stdout = open(os.devnull, "w") # the server prints every registration
+
+    async def run():
+        liveness = LivenessMonitor() if keepalive == "adaptive" else None
+        server = await OGServer(["localhost:0"], compression_options=server_compression_options(**policy), liveness=liveness).start()
+        conn.send(server.listeners[0].getsockname()[1])
+        loop = asyncio.get_running_loop()
+        while await loop.run_in_executor(None, conn.recv) == "rss":
+            gc.collect()
+            conn.send(current_rss())
+
+    asyncio.run(run())
+
+
+async def open_clients(uri: str, count: int, batch: int) -> list[OGClient]:
+    async def connect(index: int) -> OGClient:
+        client = await OGClient(uri, timeout=60, ping_interval=None).connect()
+        await client.register(f"idle{index}")
+        return client
+
+    clients = []
+    for start in range(0, count, batch):
+        clients += await asyncio.gather(*(connect(i) for i in range(start, min(start + batch, count))))
+    return clients
+
+
+async def measure(name: str, policy: dict, keepalive: str, args) -> None:
+    # spawn rather than fork: the parent already runs an event loop and executor threads
+    context = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = context.Pipe()
+    child = context.Process(target=serve, args=(policy, keepalive, child_conn), daemon=True)
+    child.start()
+    loop = asyncio.get_running_loop()
+
+    async def ask(command: str):
+        parent_conn.send(command)
+        return await loop.run_in_executor(None, parent_conn.recv)
+
+    port = await loop.run_in_executor(None, parent_conn.recv)
+    before = await ask("rss")
+    clients = await open_clients(f"ws://localhost:{port}", args.clients, args.batch)
+    await asyncio.sleep(args.settle)
+    after = await ask("rss")
+
+    per_connection = (after - before) / len(clients)
+    print(f"  {name:<14} {keepalive:<9} {len(clients):>6} clients  rss +{(after - before) / 2**20:8.1f} MiB  {per_connection / 1024:7.1f} KiB/connection")
+
+    # No closing handshakes, 10k of them only slow the teardown down
+    child.terminate()
+    await loop.run_in_executor(None, child.join)
+    for client in clients:
+        client.websocket.transport.abort() # type: ignore
+
+
+async def run(args):
+    for name in args.policies:
+        for keepalive in args.keepalive:
+            await measure(name, POLICIES[name], keepalive, args)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Server memory per idle connection for each websocket compression policy")
+    p.add_argument("--clients", type=int, default=10000, help="idle connections to open")
+    p.add_argument("--batch", type=int, default=500, help="connections opened concurrently")
+    p.add_argument("--settle", type=float, default=1.0, help="seconds to wait before measuring")
+    p.add_argument("--policies", nargs="+", choices=POLICIES, default=list(POLICIES), help="policies to measure")
+    p.add_argument("--keepalive", nargs="+", choices=["fixed", "adaptive"], default=["fixed"], help="websockets' ping task per connection, or og-server's liveness monitor")
+    args = p.parse_args()
+
+    hard = raise_fd_limit()
+    if hard < args.clients + 100:
+        print(f"⚠️ RLIMIT_NOFILE hard limit is {hard}, lower --clients or raise the limit")
+
+    print(f"== {args.clients} idle connections ==")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
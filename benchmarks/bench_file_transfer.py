@@ -0,0 +1,85 @@
+"""
+Throughput of `/send_file` transfers through an og-server on localhost.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_file_transfer
+    python -m benchmarks.bench_file_transfer --size-mb 256 --chunk-kb 128 --window 32
+    python -m benchmarks.bench_file_transfer --ws-compression deflate
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from oldie_goldie.client.helpers.file_transfer import FILE_MESSAGE_TYPES, FileTransferUtilsForOG
+from oldie_goldie.shared import decode_binary_frame
+from oldie_goldie.shared.protocol import FRAME_KIND_FILE_CHUNK
+from oldie_goldie.shared.ws_compression import add_compression_arguments, client_compression_options, server_compression_options
+
+from ._tunnel import open_tunnel, start_server
+
+
+async def pump(websocket, utils, files: FileTransferUtilsForOG, username: str):
+    """Minimal receive loop: dispatch file frames like the chat client does."""
+    cipher = utils.get_session_cipher()
+    async for message in websocket:
+        if not isinstance(message, bytes):
+            continue
+        kind, _, _, plaintext = decode_binary_frame(message, cipher=cipher)
+        if kind == FRAME_KIND_FILE_CHUNK:
+            await files.handle_chunk(plaintext, websocket=websocket, cipher=cipher, username=username)
+        else:
+            decoded = json.loads(plaintext)
+            if decoded.get("type") in FILE_MESSAGE_TYPES:
+                await files.handle_message(decoded, websocket=websocket, cipher=cipher, username=username)
+
+
+async def run(args):
+    policy = dict(mode=args.ws_compression, threshold=args.ws_compression_threshold, no_context_takeover=args.ws_no_context_takeover, max_window_bits=args.ws_max_window_bits)
+    server, uri = await start_server(**server_compression_options(**policy))
+    (ws_a, utils_a), (ws_b, utils_b) = await open_tunnel(uri, **client_compression_options(**policy))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, "payload.bin")
+        with open(source, "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+
+        chunk_size = args.chunk_kb * 1024
+        sender = FileTransferUtilsForOG(download_dir=os.path.join(workdir, "sent"), chunk_size=chunk_size, window=args.window)
+        receiver = FileTransferUtilsForOG(download_dir=os.path.join(workdir, "received"), chunk_size=chunk_size, window=args.window, auto_accept=True)
+        pumps = [
+            asyncio.create_task(pump(ws_a, utils_a, sender, "alice")),
+            asyncio.create_task(pump(ws_b, utils_b, receiver, "bob")),
+        ]
+
+        start = time.perf_counter()
+        ok = await sender.send_file(websocket=ws_a, cipher=utils_a.get_session_cipher(), username="alice", target="bob", path=source)
+        elapsed = time.perf_counter() - start
+
+        for task in pumps:
+            task.cancel()
+        await ws_a.close()
+        await ws_b.close()
+
+    await server.stop()
+
+    mb = args.size_mb
+    print(f"size={mb} MiB chunk={args.chunk_kb} KiB window={args.window} ws-compression={args.ws_compression} verified={ok}")
+    print(f"elapsed={elapsed:.3f}s throughput={mb / elapsed:.1f} MiB/s (includes the sender's and receiver's sha256 passes)")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Localhost /send_file throughput benchmark")
+    p.add_argument("--size-mb", type=int, default=64, help="size of the generated file in MiB")
+    p.add_argument("--chunk-kb", type=int, default=FileTransferUtilsForOG.CHUNK_SIZE // 1024, help="chunk size in KiB")
+    p.add_argument("--window", type=int, default=FileTransferUtilsForOG.WINDOW, help="chunks in flight")
+    add_compression_arguments(p)
+    asyncio.run(run(p.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
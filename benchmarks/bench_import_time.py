@@ -0,0 +1,72 @@
+"""
+Import-time report: what short-lived invocations and cold starts spend on imports.
+
+For every target module a fresh interpreter runs `python -X importtime -c "import <module>"`.
+The report shows the total, the slowest imports by cumulative time and whether the heavy
+optional pieces (prompt_toolkit, cryptography, importlib.metadata) got pulled in. It also
+times `--version` of og-client and og-server end to end.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_import_time
+    python -m benchmarks.bench_import_time --modules oldie_goldie.shared --top 20 --runs 10
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+DEFAULT_MODULES = ["oldie_goldie.shared", "oldie_goldie.client", "oldie_goldie.client.chat", "oldie_goldie.server.server"]
+HEAVY = ["prompt_toolkit", "cryptography", "importlib.metadata"]
+COMMANDS = {
+    "og-client --version": ["-m", "oldie_goldie.client.chat", "--version"],
+    "og-server --version": ["-m", "oldie_goldie.server.server", "--version"],
+}
+
+
+def import_times(module: str) -> list[tuple[str, int, int]]:
+    """(name, self µs, cumulative µs) for every module imported by `import module`, in import order."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        rows.append((name, int(self_us), int(cumulative_us)))
+    return rows
+
+
+def wall_time(args: list[str], runs: int) -> float:
+    """Median wall time in ms of `python <args>` over `runs` runs."""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], capture_output=True, stdin=subprocess.DEVNULL)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Import-time report for og-client and og-server")
+    p.add_argument("--modules", nargs="+", default=DEFAULT_MODULES, help="modules to import")
+    p.add_argument("--top", type=int, default=10, help="slowest imports to list per module")
+    p.add_argument("--runs", type=int, default=5, help="runs per --version timing, the median is reported")
+    args = p.parse_args()
+
+    for module in args.modules:
+        rows = import_times(module)
+        total = next((cumulative for name, _, cumulative in rows if name == module), sum(r[1] for r in rows))
+        loaded = {name.strip() for name, _, _ in rows}
+        heavy = ", ".join(f"{h} {'yes' if any(n == h or n.startswith(h + '.') for n in loaded) else 'no'}" for h in HEAVY)
+        print(f"\n== import {module}: {total / 1000:.1f} ms, {len(rows)} modules ({heavy}) ==")
+        for name, self_us, cumulative_us in sorted(rows, key=lambda r: r[2], reverse=True)[1:args.top + 1]:
+            print(f"  {cumulative_us / 1000:8.1f} ms  (self {self_us / 1000:6.1f} ms)  {name.strip()}")
+
+    print()
+    for label, command in COMMANDS.items():
+        print(f"{label:<24} {wall_time(command, args.runs):8.1f} ms (median of {args.runs})")
+
+
+if __name__ == "__main__":
+    main()
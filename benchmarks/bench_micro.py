@@ -0,0 +1,191 @@
+"""
+Microbenchmark suite for the per-message hot paths of the shared package:
+
+- protocol: encode_message / decode_message, plain and encrypted (SessionCipher and legacy key)
+- crypto: EncryptionUtilsForOG.encrypt_message / decrypt_message
+- key derivation: the SecureMethodsForOG chain, step by step and end to end
+- dispatch: CommandHandler.execute_command
+
+Payloads are fixed (deterministic text of --sizes characters, fixed keys) and the
+iteration count of every case is calibrated until one run takes --min-time, so
+results are comparable between runs and machines. Save them with --json and
+compare two runs with benchmarks.compare_micro.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_micro
+    python -m benchmarks.bench_micro --filter protocol --json before.json
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import statistics
+import time
+from typing import Any, Callable
+
+from oldie_goldie.shared import CommandHandler, EncryptionUtilsForOG, SecureMethodsForOG, SessionCipher, decode_message, encode_message
+
+KEY = bytes(range(32))
+PSK = "correct horse battery staple"
+SENDER = "alice"
+PEER_PUBLIC = SecureMethodsForOG.public_key_to_bytes(SecureMethodsForOG.generate_key_pair()[1])
+
+# A case times `n` calls of one operation and returns the elapsed seconds
+Timer = Callable[[int], float]
+
+
+def payload(size: int) -> str:
+    """Deterministic chat-like text of exactly `size` characters."""
+    words = "the quick brown fox jumps over the lazy dog and sends another message".split()
+    text, index = [], 0
+    while sum(len(w) + 1 for w in text) < size:
+        text.append(words[index % len(words)])
+        index += 1
+    return " ".join(text)[:size]
+
+
+def loop_timer(func: Callable[[], Any]) -> Timer:
+    def timer(n: int) -> float:
+        start = time.perf_counter()
+        for _ in range(n):
+            func()
+        return time.perf_counter() - start
+    return timer
+
+
+def cipher_decode_timer(message: str) -> Timer:
+    """SessionCipher rejects replays, so every call needs a fresh frame, made before the clock starts."""
+    def timer(n: int) -> float:
+        sender, receiver = SessionCipher(KEY), SessionCipher(KEY)
+        frames = [encode_message(sender=SENDER, message=message, cipher=sender) for _ in range(n)]
+        start = time.perf_counter()
+        for frame in frames:
+            decode_message(frame, cipher=receiver)
+        return time.perf_counter() - start
+    return timer
+
+
+def command_timer() -> Timer:
+    """execute_command on a handler with og-client's command set, sync and async callbacks mixed."""
+    handler = CommandHandler()
+    for name in ("help", "list_users", "connect", "exit_tunnel", "leave", "send_file", "history", "clear"):
+        handler.register_command(f"/{name}", lambda line: None)
+    async def async_command(line: str) -> None:
+        pass
+    for name in ("accept", "deny", "ping", "whoami"):
+        handler.register_command(f"/{name}", async_command)
+
+    loop = asyncio.new_event_loop()
+    lines = ["/connect bob", "/ping", "/list_users", "/deny bob"]
+
+    async def run(n: int) -> float:
+        start = time.perf_counter()
+        for i in range(n):
+            await handler.execute_command(lines[i & 3])
+        return time.perf_counter() - start
+
+    return lambda n: loop.run_until_complete(run(n))
+
+
+def key_chain() -> None:
+    """Everything one side of a tunnel derives: key pair, shared secret, PSK hash and proof, session key."""
+    private_key, _ = SecureMethodsForOG.generate_key_pair()
+    psk_hash = SecureMethodsForOG.hash_psk(PSK)
+    SecureMethodsForOG.derive_psk_proof(psk_hash, "alice", "bob")
+    shared = SecureMethodsForOG.derive_shared_secret(private_key, PEER_PUBLIC)
+    SecureMethodsForOG.derive_session_key(shared, psk_hash)
+
+
+def cases(sizes: list[int]) -> dict[str, Timer]:
+    suite: dict[str, Timer] = {}
+    for size in sizes:
+        message = payload(size)
+        plain = encode_message(sender=SENDER, message=message, timestamp="2025-01-01T00:00:00")
+        legacy = encode_message(sender=SENDER, message=message, session_key=KEY)
+        legacy_blob = EncryptionUtilsForOG.encrypt_message(session_key=KEY, message=message)
+        cipher = SessionCipher(KEY)
+        suite.update({
+            f"protocol.encode_message[{size}]": loop_timer(lambda: encode_message(sender=SENDER, message=message)),
+            f"protocol.decode_message[{size}]": loop_timer(lambda: decode_message(plain)),
+            f"protocol.encode_message+cipher[{size}]": loop_timer(lambda: encode_message(sender=SENDER, message=message, cipher=cipher)),
+            f"protocol.decode_message+cipher[{size}]": cipher_decode_timer(message),
+            f"protocol.encode_message+legacy_key[{size}]": loop_timer(lambda: encode_message(sender=SENDER, message=message, session_key=KEY)),
+            f"protocol.decode_message+legacy_key[{size}]": loop_timer(lambda: decode_message(legacy, session_key=KEY)),
+            f"crypto.encrypt_message[{size}]": loop_timer(lambda: EncryptionUtilsForOG.encrypt_message(session_key=KEY, message=message)),
+            f"crypto.decrypt_message[{size}]": loop_timer(lambda: EncryptionUtilsForOG.decrypt_message(session_key=KEY, encrypted_message=legacy_blob)),
+        })
+
+    private_key, _ = SecureMethodsForOG.generate_key_pair()
+    shared = SecureMethodsForOG.derive_shared_secret(private_key, PEER_PUBLIC)
+    psk_hash = SecureMethodsForOG.hash_psk(PSK)
+    suite.update({
+        "keys.generate_key_pair": loop_timer(SecureMethodsForOG.generate_key_pair),
+        "keys.derive_shared_secret": loop_timer(lambda: SecureMethodsForOG.derive_shared_secret(private_key, PEER_PUBLIC)),
+        "keys.hash_psk": loop_timer(lambda: SecureMethodsForOG.hash_psk(PSK)),
+        "keys.derive_psk_proof": loop_timer(lambda: SecureMethodsForOG.derive_psk_proof(psk_hash, "alice", "bob")),
+        "keys.derive_session_key": loop_timer(lambda: SecureMethodsForOG.derive_session_key(shared, psk_hash)),
+        "keys.chain": loop_timer(key_chain),
+        "dispatch.execute_command": command_timer(),
+    })
+    return suite
+
+
+def measure(timer: Timer, min_time: float, repeat: int) -> dict[str, Any]:
+    """Calibrates the call count so one run takes `min_time`, then times `repeat` runs with gc off."""
+    n = 1
+    while True:
+        elapsed = timer(n)
+        if elapsed >= min_time:
+            break
+        n = max(n * 2, int(n * min_time / elapsed * 1.2)) if elapsed > 0 else n * 10
+
+    runs = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            runs.append(timer(n) / n * 1e9)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return {"number": n, "repeat": repeat, "best_ns": round(min(runs), 1), "median_ns": round(statistics.median(runs), 1)}
+
+
+def main():
+    p = argparse.ArgumentParser(description="Microbenchmarks for the protocol, crypto and dispatch hot paths")
+    p.add_argument("--sizes", type=int, nargs="+", default=[32, 256, 500], help="message sizes in characters, chat messages are capped at 500")
+    p.add_argument("--min-time", type=float, default=0.2, help="seconds one timing run should take, the call count is calibrated to it")
+    p.add_argument("--repeat", type=int, default=5, help="timing runs per case, best and median are reported")
+    p.add_argument("--filter", type=str, nargs="*", default=[], help="only run cases whose name contains one of these")
+    p.add_argument("--json", type=str, default=None, metavar="FILE", help="also write the results to FILE (input for benchmarks.compare_micro)")
+    args = p.parse_args()
+
+    results = {}
+    print(f"{'case':<44} {'best':>12} {'median':>12} {'calls':>10}")
+    for name, timer in cases(args.sizes).items():
+        if args.filter and not any(f in name for f in args.filter):
+            continue
+        results[name] = measure(timer, args.min_time, args.repeat)
+        r = results[name]
+        print(f"{name:<44} {r['best_ns'] / 1000:9.3f} µs {r['median_ns'] / 1000:9.3f} µs {r['number']:>10}")
+
+    if args.json:
+        meta = {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "sizes": args.sizes,
+            "min_time": args.min_time,
+            "repeat": args.repeat,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+        print(f"\nSaved to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Microbenchmark: SessionCipher vs the EncryptionUtilsForOG static helpers.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_session_cipher
+    python -m benchmarks.bench_session_cipher --sizes 64 500 4096 --number 20000
+"""
+import argparse
+import os
+import timeit
+
+from oldie_goldie.shared import EncryptionUtilsForOG, SessionCipher
+
+
+def bench(label: str, func, number: int, repeat: int) -> float:
+    """Run `func` and print the best time per call in microseconds."""
+    best = min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+    print(f"  {label:<40} {best:8.2f} µs/op")
+    return best
+
+
+def main():
+    p = argparse.ArgumentParser(description="SessionCipher vs EncryptionUtilsForOG microbenchmark")
+    p.add_argument('--sizes', type=int, nargs='+', default=[32, 500, 4096], help='plaintext sizes in bytes')
+    p.add_argument('--number', type=int, default=10000, help='calls per timing run')
+    p.add_argument('--repeat', type=int, default=5, help='timing runs, the best one is reported')
+    p.add_argument('--batch', type=int, default=64, help='batch size for encrypt_many/decrypt_many')
+    args = p.parse_args()
+
+    key = os.urandom(32)
+
+    for size in args.sizes:
+        message = "x" * size
+        print(f"\n== plaintext: {size} bytes ==")
+
+        # Original static helpers
+        legacy_blob = EncryptionUtilsForOG.encrypt_message(session_key=key, message=message)
+        legacy_enc = bench("EncryptionUtilsForOG.encrypt_message", lambda: EncryptionUtilsForOG.encrypt_message(session_key=key, message=message), args.number, args.repeat)
+        legacy_dec = bench("EncryptionUtilsForOG.decrypt_message", lambda: EncryptionUtilsForOG.decrypt_message(session_key=key, encrypted_message=legacy_blob), args.number, args.repeat)
+
+        # SessionCipher, the receiver needs a fresh blob for every call since replays are rejected
+        sender = SessionCipher(key)
+        receiver = SessionCipher(key)
+        blobs = iter(sender.encrypt_many([message] * (args.number * args.repeat)))
+        cipher_enc = bench("SessionCipher.encrypt", lambda: sender.encrypt(message), args.number, args.repeat)
+        cipher_dec = bench("SessionCipher.decrypt", lambda: receiver.decrypt(next(blobs)), args.number, args.repeat)
+
+        # Batch APIs, reported per message
+        batch = [message] * args.batch
+        batch_number = max(1, args.number // args.batch)
+        batch_blobs = iter([sender.encrypt_many(batch) for _ in range(batch_number * args.repeat)])
+        many_enc = bench(f"SessionCipher.encrypt_many (x{args.batch})", lambda: sender.encrypt_many(batch), batch_number, args.repeat) / args.batch
+        many_dec = bench(f"SessionCipher.decrypt_many (x{args.batch})", lambda: receiver.decrypt_many(next(batch_blobs)), batch_number, args.repeat) / args.batch
+
+        print(f"  speedup encrypt: {legacy_enc / cipher_enc:.2f}x (batched {legacy_enc / many_enc:.2f}x)")
+        print(f"  speedup decrypt: {legacy_dec / cipher_dec:.2f}x (batched {legacy_dec / many_dec:.2f}x)")
+        print(f"  wire size: legacy {len(legacy_blob)} B, session cipher {len(sender.encrypt(message))} B")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+End-to-end tunnel setup latency: the original handshake vs `--fast-handshake`.
+
+Measured from the requester's `connect_request` until both peers hold the session
+key, the PSK prompt and the /accept decision excluded. `--rtt-ms` adds a simulated
+client <-> server round trip (half on every send, half on every receive) to model
+a server reached through a trycloudflare URL.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_tunnel_setup
+    python -m benchmarks.bench_tunnel_setup --rtt-ms 200 --iterations 10
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from ._tunnel import fast_handshake, legacy_handshake, register, start_server
+
+
+class DelayedConnection:
+    """Wraps a client connection, adding half of the simulated round trip to each send and receive."""
+
+    def __init__(self, websocket, delay: float):
+        self.websocket = websocket
+        self.delay = delay
+
+    async def send(self, message):
+        await asyncio.sleep(self.delay)
+        await self.websocket.send(message)
+
+    async def recv(self):
+        message = await self.websocket.recv()
+        await asyncio.sleep(self.delay)
+        return message
+
+
+async def measure(uri: str, handshake, label: str, args) -> list[float]:
+    timings = []
+    for i in range(args.iterations):
+        users = (f"{label}a{i}", f"{label}b{i}")
+        websockets_ = [await register(uri, user) for user in users]
+        sides = [(DelayedConnection(ws, args.rtt_ms / 2000), user) for ws, user in zip(websockets_, users)]
+
+        start = time.perf_counter()
+        (_, utils_a), (_, utils_b) = await handshake(*sides)
+        timings.append(time.perf_counter() - start)
+        assert utils_a.get_session_key() == utils_b.get_session_key()
+
+        for websocket in websockets_:
+            await websocket.close()
+    return timings
+
+
+async def run(args):
+    server, uri = await start_server()
+
+    results = {}
+    for label, handshake in (("legacy", legacy_handshake), ("fast", fast_handshake)):
+        results[label] = await measure(uri, handshake, label, args)
+
+    await server.stop()
+
+    print(f"iterations={args.iterations} simulated rtt={args.rtt_ms} ms")
+    for label, timings in results.items():
+        median = statistics.median(timings)
+        round_trips = f"   ~{median * 1000 / args.rtt_ms:.1f} round trips" if args.rtt_ms else ""
+        print(f"  {label:<7} median {median * 1000:8.1f} ms   min {min(timings) * 1000:8.1f} ms{round_trips}")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Tunnel setup latency, original vs fast handshake")
+    p.add_argument("--iterations", type=int, default=20, help="tunnels opened per handshake")
+    p.add_argument("--rtt-ms", type=float, default=100.0, help="simulated client <-> server round trip in milliseconds")
+    asyncio.run(run(p.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
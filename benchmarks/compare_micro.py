@@ -0,0 +1,59 @@
+"""
+Compare two benchmarks.bench_micro result files and flag regressions.
+
+Cases are compared on their best time per call (the least noisy figure). A case
+slower than the baseline by more than --threshold percent is a regression and
+makes the exit status 1, so this can gate a release.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_micro --json before.json
+    # ... change things ...
+    python -m benchmarks.bench_micro --json after.json
+    python -m benchmarks.compare_micro before.json after.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+
+def load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Compare two bench_micro result files")
+    p.add_argument("baseline", help="results of the reference run")
+    p.add_argument("candidate", help="results of the run to check")
+    p.add_argument("--threshold", type=float, default=10.0, help="slowdown in percent reported as a regression (default: 10)")
+    args = p.parse_args()
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    for key in ("python", "platform"):
+        if baseline["meta"].get(key) != candidate["meta"].get(key):
+            print(f"⚠️ {key} differs: {baseline['meta'].get(key)} vs {candidate['meta'].get(key)}")
+
+    regressions = 0
+    print(f"{'case':<44} {'baseline':>12} {'candidate':>12} {'change':>9}")
+    for name, base in baseline["results"].items():
+        new = candidate["results"].get(name)
+        if new is None:
+            print(f"{name:<44} {base['best_ns'] / 1000:9.3f} µs {'missing':>12}")
+            continue
+        change = (new["best_ns"] - base["best_ns"]) / base["best_ns"] * 100
+        flag = ""
+        if change > args.threshold:
+            flag, regressions = "  REGRESSION", regressions + 1
+        elif change < -args.threshold:
+            flag = "  faster"
+        print(f"{name:<44} {base['best_ns'] / 1000:9.3f} µs {new['best_ns'] / 1000:9.3f} µs {change:+8.1f}%{flag}")
+    for name in candidate["results"].keys() - baseline["results"].keys():
+        print(f"{name:<44} {'new':>12} {candidate['results'][name]['best_ns'] / 1000:9.3f} µs")
+
+    print(f"\n{regressions} regression(s) above {args.threshold:g}%")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
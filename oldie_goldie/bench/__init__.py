@@ -0,0 +1,6 @@
+"""og-bench: load generator and latency benchmarks for og-server (see bench/cli.py)."""
+
+from .stats import LatencyRecorder, percentile
+from .workloads import WORKLOADS, BenchContext
+
+__all__ = ["LatencyRecorder", "percentile", "WORKLOADS", "BenchContext"]
@@ -0,0 +1,309 @@
+# bench/cli.py
+"""og-bench: load generator and latency benchmark for og-server.
+
+Spins up N simulated clients (OGClient) against a server and runs scripted
+workloads, reporting throughput and p50/p99/p999 latency per operation.
+
+    og-bench register --clients 1000
+    og-bench broadcast relay --clients 200 --workers 4 --json --output run.json
+    og-bench tunnel-churn --uri ws://127.0.0.1:8765 --clients 100 --rounds 20
+    og-bench relay --transport unix          # same-host clients over a Unix socket
+
+Without --uri (or --unix-socket) a fresh server is started per workload (in a child process, or in
+this process with --server inline). Clients run in this process, or spread over
+--workers processes which start their measured phase together.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import secrets
+import sys
+import tempfile
+import time
+from typing import Any
+
+from oldie_goldie.bench.stats import LatencyRecorder
+from oldie_goldie.bench.workloads import WORKLOADS, BenchContext
+from oldie_goldie.shared import package_version
+
+logger = logging.getLogger(__name__)
+
+SERVER_START_TIMEOUT = 30
+
+def raise_fd_limit() -> int:
+    """Thousands of clients need as many file descriptors, go up to the hard limit."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+# ==== #
+# Server under test
+# ==== #
+
+UNIX_URI = "ws://localhost/" # over a Unix socket the URI only fills in the handshake
+
+def unix_connect_kwargs(path: str) -> dict[str, Any]:
+    return {"unix": True, "path": path}
+
+async def start_server(unix_path: str | None = None) -> Any:
+    """A fresh OGServer on a free loopback port or `unix_path`, with its output muted."""
+    from oldie_goldie.server.og_server import OGServer
+
+    for name in ("oldie_goldie", "websockets"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    # Writes to the clients aborted at the end of a workload
+    logging.getLogger("asyncio").setLevel(logging.ERROR)
+    return await OGServer([f"unix:{unix_path}" if unix_path is not None else "127.0.0.1:0"]).start()
+
+def server_address(server: Any, unix_path: str | None) -> tuple[str, dict[str, Any]]:
+    """URI and websockets.connect keyword arguments for clients of `server`."""
+    if unix_path is not None:
+        return UNIX_URI, unix_connect_kwargs(unix_path)
+    return f"ws://{server.addresses[0]}", {}
+
+def _serve_in_child(conn: Any, unix_path: str | None) -> None:
+    """Child process: serve until the parent sends anything on `conn`."""
+    raise_fd_limit()
+    sys.stdout = open(os.devnull, "w") # the server prints every registration and broadcast
+
+    async def run() -> None:
+        server = await start_server(unix_path)
+        conn.send(server_address(server, unix_path))
+        await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+        await server.stop()
+
+    asyncio.run(run())
+
+class ServerProcessForOG:
+    """A throwaway og-server in a child process, so that it does not share a core with the clients."""
+
+    def __init__(self, unix_path: str | None = None):
+        context = multiprocessing.get_context("spawn")
+        self._conn, child_conn = context.Pipe()
+        self._proc = context.Process(target=_serve_in_child, args=(child_conn, unix_path), daemon=True)
+
+    def start(self) -> tuple[str, dict[str, Any]]:
+        """Returns the URI and connect keyword arguments of the server."""
+        self._proc.start()
+        if not self._conn.poll(SERVER_START_TIMEOUT):
+            self.stop()
+            raise RuntimeError("og-server did not start")
+        return self._conn.recv()
+
+    def stop(self) -> None:
+        try:
+            self._conn.send("stop")
+        except OSError:
+            pass
+        self._proc.join(timeout=5)
+        if self._proc.is_alive():
+            self._proc.kill()
+
+# ==== #
+# Running a workload
+# ==== #
+
+def _split(total: int, parts: int) -> list[int]:
+    """`total` clients over `parts` workers, pairs kept whole for the tunnel workloads."""
+    pairs, rest = divmod(total // 2, parts)
+    shares = [2 * (pairs + (1 if i < rest else 0)) for i in range(parts)]
+    shares[0] += total % 2
+    return shares
+
+async def _run_context(workload: str, ctx: BenchContext) -> tuple[dict[str, Any], float]:
+    await WORKLOADS[workload](ctx)
+    return ctx.recorder.to_dict(), ctx.elapsed
+
+def _worker(workload: str, uri: str, options: dict[str, Any], worker: int, clients: int, total: int, barrier: Any, results: Any) -> None:
+    """Worker process: run this worker's share of the clients and send back the samples."""
+    raise_fd_limit()
+    logging.getLogger("oldie_goldie").setLevel(logging.WARNING)
+    try:
+        ctx = BenchContext(uri, options, worker=worker, clients=clients, total_clients=total, barrier=barrier)
+        results.put((worker, *asyncio.run(_run_context(workload, ctx)), None))
+    except BaseException as e:
+        barrier.abort()
+        results.put((worker, None, 0.0, f"{type(e).__name__}: {e}"))
+
+def run_in_workers(workload: str, uri: str, options: dict[str, Any], clients: int, workers: int) -> tuple[LatencyRecorder, float]:
+    context = multiprocessing.get_context("spawn")
+    barrier, results = context.Barrier(workers), context.Queue()
+    procs = [
+        context.Process(target=_worker, args=(workload, uri, options, index, share, clients, barrier, results))
+        for index, share in enumerate(_split(clients, workers))
+    ]
+    for proc in procs:
+        proc.start()
+
+    recorder, elapsed, failures = LatencyRecorder(), 0.0, []
+    for _ in procs:
+        worker, state, worker_elapsed, error = results.get()
+        if error:
+            failures.append(f"worker {worker}: {error}")
+            continue
+        recorder.merge(state)
+        elapsed = max(elapsed, worker_elapsed)
+    for proc in procs:
+        proc.join()
+    if failures:
+        raise RuntimeError("; ".join(failures))
+    return recorder, elapsed
+
+def run_workload(workload: str, args: argparse.Namespace, options: dict[str, Any]) -> dict[str, Any]:
+    """One workload against --uri / --unix-socket or a fresh server, returns its result record."""
+    server_proc, temp_dir, unix_path = None, None, None
+    uri, connect_kwargs = args.uri, {}
+    if args.unix_socket:
+        uri, connect_kwargs = UNIX_URI, unix_connect_kwargs(args.unix_socket)
+    elif uri is None and args.transport == "unix":
+        temp_dir = tempfile.TemporaryDirectory(prefix="og-bench-")
+        unix_path = os.path.join(temp_dir.name, "og.sock")
+
+    try:
+        if uri is None and args.server == "process":
+            server_proc = ServerProcessForOG(unix_path)
+            uri, connect_kwargs = server_proc.start()
+        options = dict(options, run_id=f"b{secrets.token_hex(3)}", connect_kwargs=connect_kwargs)
+
+        if args.workers:
+            recorder, elapsed = run_in_workers(workload, uri, options, args.clients, args.workers)
+        else:
+            recorder, elapsed = asyncio.run(_run_local(workload, uri, options, args.clients, unix_path))
+    finally:
+        if server_proc is not None:
+            server_proc.stop()
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    return {
+        "workload": workload,
+        "clients": args.clients,
+        "workers": args.workers,
+        "elapsed_s": round(elapsed, 3),
+        "ops": recorder.summary(elapsed),
+    }
+
+async def _run_local(workload: str, uri: str | None, options: dict[str, Any], clients: int, unix_path: str | None = None) -> tuple[LatencyRecorder, float]:
+    """Clients in this process, with the server inline too when there is no uri."""
+    if uri is not None:
+        ctx = BenchContext(uri, options, worker=0, clients=clients, total_clients=clients)
+        await WORKLOADS[workload](ctx)
+        return ctx.recorder, ctx.elapsed
+
+    # Inline the server prints every registration and broadcast on our stdout, the results go there too
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        server = await start_server(unix_path)
+        try:
+            uri, connect_kwargs = server_address(server, unix_path)
+            return await _run_local(workload, uri, dict(options, connect_kwargs=connect_kwargs), clients)
+        finally:
+            await server.stop()
+
+# ==== #
+# Reporting
+# ==== #
+
+def _run_metadata(args: argparse.Namespace) -> dict[str, Any]:
+    return {
+        "tool": "og-bench",
+        "version": package_version(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "server": "external" if args.uri or args.unix_socket else args.server,
+        "options": {key: value for key, value in vars(args).items() if key not in ("json", "output")},
+    }
+
+def format_table(result: dict[str, Any]) -> str:
+    lines = [
+        f"== {result['workload']}: {result['clients']} clients, {result['workers'] or 'no'} worker processes, {result['elapsed_s']} s ==",
+        f"  {'operation':<20} {'count':>8} {'errors':>7} {'ops/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'p999 ms':>9} {'max ms':>9}",
+    ]
+    cell = lambda value: "-" if value is None else value
+    for op, stats in result["ops"].items():
+        lines.append(
+            f"  {op:<20} {stats['count']:>8} {stats['errors']:>7} {cell(stats['throughput_per_s']):>10} "
+            f"{cell(stats['p50_ms']):>9} {cell(stats['p99_ms']):>9} {cell(stats['p999_ms']):>9} {cell(stats['max_ms']):>9}"
+        )
+    return "\n".join(lines)
+
+# ==== #
+# CLI
+# ==== #
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(prog="og-bench", description="Load generator and latency benchmark for og-server")
+    p.add_argument("workloads", nargs="+", choices=sorted(WORKLOADS), metavar="WORKLOAD", help=f"One or more of: {', '.join(WORKLOADS)}")
+    p.add_argument("--clients", type=int, default=100, help="Simulated clients (pairs for tunnel-churn and relay) (default: 100)")
+    p.add_argument("--workers", type=int, default=0, help="Spread the clients over this many processes (default: 0, all in this process)")
+    p.add_argument("--uri", type=str, default=None, help="Benchmark a running server (without invite tokens) instead of starting one")
+    p.add_argument("--unix-socket", type=str, default=None, metavar="PATH", help="Benchmark a running server listening on this Unix socket (og-server --listen unix:PATH)")
+    p.add_argument("--server", choices=("process", "inline"), default="process", help="Where to start the server without --uri (default: process)")
+    p.add_argument("--transport", choices=("tcp", "unix"), default="tcp", help="How clients reach the server started by og-bench: loopback TCP or a Unix socket (default: tcp)")
+    p.add_argument("--messages", type=int, default=20, help="Lines per sender for broadcast and relay (default: 20)")
+    p.add_argument("--rate", type=float, default=0.0, help="Lines per second per sender, 0 sends back to back (default: 0)")
+    p.add_argument("--size", type=int, default=64, help="Characters per line (default: 64)")
+    p.add_argument("--rounds", type=int, default=10, help="Tunnel open/close rounds per pair for tunnel-churn (default: 10)")
+    p.add_argument("--handshake", choices=("fast", "legacy"), default="fast", help="Tunnel handshake to use (default: fast)")
+    p.add_argument("--concurrency", type=int, default=200, help="Connections being set up at once per process (default: 200)")
+    p.add_argument("--timeout", type=float, default=30.0, help="Per operation timeout, in seconds (default: 30)")
+    p.add_argument("--json", action="store_true", help="Print the results as JSON instead of a table")
+    p.add_argument("--output", type=str, default=None, help="Also write the JSON results to this file")
+    args = p.parse_args()
+
+    if args.clients < 1:
+        p.error("--clients must be at least 1")
+    if args.workers < 0:
+        p.error("--workers cannot be negative")
+    if args.uri and args.unix_socket:
+        p.error("--uri and --unix-socket both name the server, pass one of them")
+    if args.workers and args.uri is None and args.unix_socket is None and args.server == "inline":
+        p.error("--server inline runs the server in this process, it cannot be combined with --workers")
+    if args.workers and args.clients < 2 * args.workers:
+        p.error("--clients must be at least twice --workers")
+    return args
+
+def cli() -> None:
+    args = parse_args()
+    raise_fd_limit()
+    logging.basicConfig(level=logging.WARNING)
+    options = {
+        "messages": args.messages,
+        "rate": args.rate,
+        "size": args.size,
+        "rounds": args.rounds,
+        "handshake": args.handshake,
+        "concurrency": args.concurrency,
+        "timeout": args.timeout,
+    }
+
+    report = {"meta": _run_metadata(args), "results": []}
+    try:
+        for workload in args.workloads:
+            result = run_workload(workload, args, options)
+            report["results"].append(result)
+            if not args.json:
+                print(format_table(result), flush=True)
+    except KeyboardInterrupt:
+        print("\n🛑 Interrupted, partial results only", file=sys.stderr)
+    except RuntimeError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    cli()
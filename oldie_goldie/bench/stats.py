@@ -0,0 +1,74 @@
+# bench/stats.py
+"""Latency samples per operation, merged across worker processes and summarised as percentiles."""
+
+import math
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+class LatencyRecorder:
+    """
+    Collects latencies (seconds) and errors per operation name.
+    - measure(): context manager timing one operation
+    - add() / error(): record a sample or a failure directly
+    - merge(): fold in the samples of another recorder (e.g. from a worker process)
+    - summary(): count, errors, throughput and p50/p99/p999 per operation
+    """
+
+    def __init__(self):
+        self.samples: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+    def add(self, op: str, seconds: float) -> None:
+        self.samples.setdefault(op, []).append(seconds)
+
+    def error(self, op: str) -> None:
+        self.errors[op] = self.errors.get(op, 0) + 1
+
+    @contextmanager
+    def measure(self, op: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.error(op)
+            raise
+        self.add(op, time.perf_counter() - start)
+
+    def merge(self, other: "LatencyRecorder | dict[str, Any]") -> None:
+        state = other if isinstance(other, dict) else other.to_dict()
+        for op, samples in state["samples"].items():
+            self.samples.setdefault(op, []).extend(samples)
+        for op, count in state["errors"].items():
+            self.errors[op] = self.errors.get(op, 0) + count
+
+    def to_dict(self) -> dict[str, Any]:
+        """Picklable state, to send a worker's samples back to the parent."""
+        return {"samples": self.samples, "errors": self.errors}
+
+    def summary(self, elapsed: float) -> dict[str, dict[str, Any]]:
+        """Per operation: count, errors, throughput over `elapsed` seconds and latency percentiles in ms."""
+        ops = {}
+        for op in sorted(set(self.samples) | set(self.errors)):
+            samples = sorted(self.samples.get(op, []))
+            ops[op] = {
+                "count": len(samples),
+                "errors": self.errors.get(op, 0),
+                "throughput_per_s": round(len(samples) / elapsed, 2) if elapsed > 0 else None,
+                "mean_ms": _ms(sum(samples) / len(samples)) if samples else None,
+                "p50_ms": _ms(percentile(samples, 0.50)),
+                "p99_ms": _ms(percentile(samples, 0.99)),
+                "p999_ms": _ms(percentile(samples, 0.999)),
+                "max_ms": _ms(samples[-1]) if samples else None,
+            }
+        return ops
+
+def percentile(sorted_samples: list[float], q: float) -> float | None:
+    """Nearest-rank percentile of already sorted samples."""
+    if not sorted_samples:
+        return None
+    rank = max(1, math.ceil(q * len(sorted_samples)))
+    return sorted_samples[min(rank, len(sorted_samples)) - 1]
+
+def _ms(seconds: float | None) -> float | None:
+    return None if seconds is None else round(seconds * 1000, 3)
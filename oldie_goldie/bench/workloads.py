@@ -0,0 +1,235 @@
+# bench/workloads.py
+"""Scripted og-bench workloads, each driving a set of OGClient instances against one server.
+
+A workload connects its clients (setup, not measured), calls `ctx.begin()` (all workers
+start together), runs the measured phase and calls `ctx.end()`. Latencies go to
+`ctx.recorder` under an operation name, e.g. `register` or `relay_delivery`.
+
+Delivery latencies are measured from a wall clock timestamp carried in the message,
+so they stay valid when sender and receiver run in different worker processes.
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+
+from oldie_goldie.client import OGClient, OGClientError
+from oldie_goldie.bench.stats import LatencyRecorder
+
+BENCH_PREFIX = "bench"
+PSK = "og-bench"
+
+class BenchContext:
+    """What a workload gets: its share of the clients, the options and a recorder."""
+
+    def __init__(self, uri: str, options: dict[str, Any], worker: int, clients: int, total_clients: int, barrier: Any = None):
+        self.uri = uri
+        self.options = options
+        self.worker = worker
+        self.clients = clients
+        self.total_clients = total_clients
+        self.recorder = LatencyRecorder()
+        self._barrier = barrier
+        self.started = 0.0
+        self.ended = 0.0
+
+    def username(self, index: int) -> str:
+        return f"{self.options['run_id']}w{self.worker}c{index}"
+
+    def client(self) -> OGClient:
+        return OGClient(self.uri, fast_handshake=self.options["handshake"] == "fast", timeout=self.options["timeout"], **self.options.get("connect_kwargs", {}))
+
+    async def begin(self) -> None:
+        """Waits for the other workers, then starts the clock of the measured phase."""
+        if self._barrier is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._barrier.wait)
+        self.started = time.perf_counter()
+
+    def end(self) -> None:
+        self.ended = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return max(self.ended - self.started, 0.0)
+
+# ==== #
+# Helpers
+# ==== #
+
+async def _gather_limited(count: int, limit: int, make: Callable[[int], Awaitable[Any]]) -> list[Any]:
+    """Runs make(0..count-1) with at most `limit` in flight, failures come back as exceptions."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(index: int) -> Any:
+        async with semaphore:
+            return await make(index)
+
+    return await asyncio.gather(*(run(i) for i in range(count)), return_exceptions=True)
+
+async def connect_clients(ctx: BenchContext, count: int) -> list[OGClient]:
+    """Connects and registers `count` clients (setup, not measured). Failed ones are left out."""
+    async def make(index: int) -> OGClient:
+        client = await ctx.client().connect()
+        await client.register(ctx.username(index))
+        return client
+
+    results = await _gather_limited(count, ctx.options["concurrency"], make)
+    clients = [client for client in results if isinstance(client, OGClient)]
+    if len(clients) < count:
+        ctx.recorder.errors["setup"] = count - len(clients)
+    return clients
+
+def close_clients(clients: list[OGClient]) -> None:
+    """Drops the connections without closing handshakes, thousands of them only slow the teardown down."""
+    for client in clients:
+        if client.websocket is not None:
+            client.websocket.transport.abort()
+
+async def open_tunnel(requester: OGClient, responder: OGClient) -> None:
+    """Requests a tunnel and accepts it on the other side."""
+    async def accept() -> None:
+        while (message := await responder.receive(timeout=requester.timeout)) is not None:
+            if message.get("type") == "connect_request" and message.get("sender") == requester.username:
+                await responder.accept_tunnel(requester.username, psk=PSK) # type: ignore
+                return
+        raise OGClientError("Connection closed before the request arrived")
+
+    await asyncio.gather(requester.request_tunnel(responder.username, psk=PSK), accept()) # type: ignore
+
+def _payload(size: int) -> str:
+    """Message text: marker, send time, padding up to `size` characters."""
+    head = f"{BENCH_PREFIX} {time.time():.6f} "
+    return head + "x" * max(0, size - len(head))
+
+def _sent_at(text: str) -> float | None:
+    if not text.startswith(BENCH_PREFIX + " "):
+        return None
+    try:
+        return float(text.split(" ", 2)[1])
+    except (IndexError, ValueError):
+        return None
+
+async def _paced_sends(ctx: BenchContext, client: OGClient, op: str) -> None:
+    """Sends --messages lines at --rate per second (0: back to back), timing each send."""
+    rate, size = ctx.options["rate"], ctx.options["size"]
+    start = time.perf_counter()
+    for index in range(ctx.options["messages"]):
+        if rate:
+            delay = start + index / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        try:
+            with ctx.recorder.measure(op):
+                await client.send(_payload(size))
+        except Exception:
+            return
+
+async def _collect(ctx: BenchContext, client: OGClient, msg_type: str, op: str, counter: list[int]) -> None:
+    """Records the delivery latency of every bench message of `msg_type` reaching `client`."""
+    async for message in client:
+        if message.get("type") != msg_type:
+            continue
+        sent = _sent_at(str(message.get("message", "")))
+        if sent is not None:
+            ctx.recorder.add(op, time.time() - sent)
+            counter[0] += 1
+
+async def _settle(counter: list[int], expected: int, timeout: float) -> None:
+    """Waits until `expected` deliveries arrived, or none did for a second, or `timeout`."""
+    deadline = time.perf_counter() + timeout
+    last, quiet_since = counter[0], time.perf_counter()
+    while counter[0] < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+        if counter[0] != last:
+            last, quiet_since = counter[0], time.perf_counter()
+        elif time.perf_counter() - quiet_since > 1.0:
+            break
+
+# ==== #
+# Workloads
+# ==== #
+
+async def registration_storm(ctx: BenchContext) -> None:
+    """All clients connect and register at once (bounded by --concurrency): `connect` and `register`."""
+    clients: list[OGClient] = []
+
+    async def make(index: int) -> None:
+        client = ctx.client()
+        with ctx.recorder.measure("connect"):
+            await client.connect()
+        clients.append(client)
+        with ctx.recorder.measure("register"):
+            await client.register(ctx.username(index))
+
+    await ctx.begin()
+    await _gather_limited(ctx.clients, ctx.options["concurrency"], make)
+    ctx.end()
+    close_clients(clients)
+
+async def broadcast_chat(ctx: BenchContext) -> None:
+    """Every client broadcasts --messages lines to everyone: `broadcast_send` and `broadcast_delivery`."""
+    clients = await connect_clients(ctx, ctx.clients)
+    counter = [0]
+    collectors = [asyncio.create_task(_collect(ctx, client, "chat_message", "broadcast_delivery", counter)) for client in clients]
+
+    await ctx.begin()
+    await asyncio.gather(*(_paced_sends(ctx, client, "broadcast_send") for client in clients))
+    # Everyone receives everyone else's lines
+    await _settle(counter, expected=len(clients) * (ctx.total_clients - 1) * ctx.options["messages"], timeout=ctx.options["timeout"])
+    ctx.end()
+
+    for task in collectors:
+        task.cancel()
+    close_clients(clients)
+
+async def tunnel_churn(ctx: BenchContext) -> None:
+    """Pairs open and close tunnels --rounds times: `tunnel_setup` (request until established) and `tunnel_exit`."""
+    clients = await connect_clients(ctx, ctx.clients - ctx.clients % 2)
+    pairs = list(zip(clients[0::2], clients[1::2]))
+
+    async def churn(requester: OGClient, responder: OGClient) -> None:
+        for _ in range(ctx.options["rounds"]):
+            try:
+                with ctx.recorder.measure("tunnel_setup"):
+                    await open_tunnel(requester, responder)
+                with ctx.recorder.measure("tunnel_exit"):
+                    await requester.exit_tunnel()
+                # The responder is idle again once the server relayed the exit
+                while responder.status != "idle":
+                    await asyncio.sleep(0.001)
+            except (OGClientError, asyncio.TimeoutError):
+                await requester.exit_tunnel()
+                return
+
+    await ctx.begin()
+    await asyncio.gather(*(churn(a, b) for a, b in pairs))
+    ctx.end()
+    close_clients(clients)
+
+async def encrypted_relay(ctx: BenchContext) -> None:
+    """Pairs hold a tunnel, one side sends --messages encrypted lines: `relay_send` and `relay_delivery`."""
+    clients = await connect_clients(ctx, ctx.clients - ctx.clients % 2)
+    pairs = list(zip(clients[0::2], clients[1::2]))
+    results = await asyncio.gather(*(open_tunnel(a, b) for a, b in pairs), return_exceptions=True)
+    pairs = [pair for pair, result in zip(pairs, results) if not isinstance(result, BaseException)]
+    if len(pairs) < len(results):
+        ctx.recorder.errors["setup"] = ctx.recorder.errors.get("setup", 0) + len(results) - len(pairs)
+
+    counter = [0]
+    collectors = [asyncio.create_task(_collect(ctx, responder, "encrypted_message", "relay_delivery", counter)) for _, responder in pairs]
+
+    await ctx.begin()
+    await asyncio.gather(*(_paced_sends(ctx, requester, "relay_send") for requester, _ in pairs))
+    await _settle(counter, expected=len(pairs) * ctx.options["messages"], timeout=ctx.options["timeout"])
+    ctx.end()
+
+    for task in collectors:
+        task.cancel()
+    close_clients(clients)
+
+WORKLOADS: dict[str, Callable[[BenchContext], Awaitable[None]]] = {
+    "register": registration_storm,
+    "broadcast": broadcast_chat,
+    "tunnel-churn": tunnel_churn,
+    "relay": encrypted_relay,
+}
@@ -0,0 +1,20 @@
+"""_summary_
+Headless client API. The terminal UI (og-client) lives in `chat.py` and is not imported here.
+"""
+from typing import TYPE_CHECKING
+
+from oldie_goldie.utilities.lazy_imports import lazy_exports
+
+# Imported on first use: og-client (chat.py) and its helpers do not need OGClient
+__getattr__, __dir__ = lazy_exports(__name__, {
+    "OGClient": ".og_client",
+    "OGClientError": ".og_client",
+})
+
+if TYPE_CHECKING:
+    from .og_client import OGClient, OGClientError
+
+__all__ = [
+    "OGClient",
+    "OGClientError",
+]
@@ -1,38 +1,53 @@
 import asyncio
-from typing import Any
+from typing import Any, TYPE_CHECKING
 import websockets
+from websockets.protocol import State
 import logging
 import base64
 from datetime import datetime
 import argparse
 
-from oldie_goldie.client.helpers.tunnel_activity import TunnelActivityUtilsForOG
+from oldie_goldie.client.helpers.file_transfer import FileTransferUtilsForOG, FileTransferError, FILE_MESSAGE_TYPES
 
 from oldie_goldie.shared import encode_message, decode_message, make_register_message,make_system_request
-from oldie_goldie.shared import version_banner
-from oldie_goldie.shared import SecureMethodsForOG
+from oldie_goldie.shared import encode_binary_message, decode_binary_frame
+from oldie_goldie.shared.protocol import FEATURE_BINARY_FRAMES, FEATURE_FILE_TRANSFER, FRAME_KIND_FILE_CHUNK
+from oldie_goldie.shared.ws_compression import add_compression_arguments, client_compression_options
+from oldie_goldie.shared.loop_monitor import add_loop_monitor_arguments, loop_monitor_from_args, loop_activity
+import json
+import os
+import random
+from collections import deque
+from urllib.parse import quote
+from oldie_goldie.shared import version_banner, package_version
+
+# The tunnel helpers and the history load cryptography (and sqlite3), they are imported in main()
+# and where they are used once the arguments are parsed: `--help` and `--version` never need them.
+if TYPE_CHECKING:
+    from oldie_goldie.client.helpers.tunnel_activity import TunnelActivityUtilsForOG
+    from oldie_goldie.client.helpers.chat_history import ChatHistoryForOG
+    from oldie_goldie.shared import SessionCipher
 
 # Importing the CommandHandler class from shared.command_handler module
 # This class is responsible for managing commands and their execution in the chat client.
 from oldie_goldie.shared import CommandHandler
 
-from importlib.metadata import version, PackageNotFoundError
 
 # Importing the async input utility function and async print utility function
 # These functions are used to handle asynchronous input and output in the chat client.
 
-# Importing ainput from the utility module
-# This utility function is used to handle asynchronous input without blocking the event loop.
-from prompt_toolkit import HTML, PromptSession, print_formatted_text
-from prompt_toolkit.application import get_app_or_none
-from prompt_toolkit.patch_stdout import patch_stdout
-from prompt_toolkit.formatted_text import FormattedText
+# prompt_toolkit is imported where it is used and the PromptSession created on first input:
+# importing it takes longer than the rest of the client together, and `--help` / `--version`
+# or a stdin that is not a terminal never get that far.
+session = None
 
-
-session = PromptSession()
-
-# expose session and allow external refresh
-get_prompt_session = lambda: session
+def get_prompt_session():
+    """The prompt session, created on first use. Also exposed to allow external refresh."""
+    global session
+    if session is None:
+        from prompt_toolkit import PromptSession
+        session = PromptSession()
+    return session
 
 # Importing aprint from the utility module ## Deprecated, utility module is no longer needed using prompt_toolkit as a default dependency
 # This utility function is used to handle asynchronous output without blocking the event loop.
@@ -52,6 +67,9 @@ async def prompt_async_print(*args, **kwargs) -> None:
                   ansibrightblue, ansibrightmagenta, ansibrightcyan, ansiwhite
         """
 
+        from prompt_toolkit import HTML, print_formatted_text
+        from prompt_toolkit.patch_stdout import patch_stdout
+
         # Use patch_stdout to ensure that the output is flushed immediately
         # and does not interfere with the prompt_toolkit's input handling
         with patch_stdout():
@@ -86,7 +104,54 @@ logger = logging.getLogger(__name__)
 active_websocket: websockets.ClientConnection
 current_username: str
 
-tunnel_utils = TunnelActivityUtilsForOG()
+# Created in main()
+tunnel_utils: "TunnelActivityUtilsForOG"
+
+async def _notify_file_transfer(text: str) -> None:
+    await aprint(f"----\n<ansigray>{text}</ansigray>\n----")
+
+# Download directory is updated from the command line args in main()
+file_utils = FileTransferUtilsForOG(notify=_notify_file_transfer)
+
+# Local encrypted history (--history PATH), opened in main() once the passphrase is entered
+history: "ChatHistoryForOG | None" = None
+
+def record_history(channel: str, sender: str, text: str, timestamp: str | None = None) -> None:
+    """Hands a chat line to the history writer. `channel` is 'chat' or '@peer' for tunnel messages."""
+    if history is None:
+        return
+    try:
+        ts = datetime.fromisoformat(timestamp).timestamp() if timestamp else None
+    except ValueError:
+        ts = None
+    history.record(channel=channel, sender=sender, text=text, timestamp=ts)
+
+# === Connection link and offline outbox === #
+# While the connection is down, chat lines go to the outbox as (message, input mode) and are
+# encoded only when flushed, so encrypted ones pick up the cipher state of the resumed tunnel.
+# New lines go behind the queued ones of the same kind until the flush has sent them.
+link_up = False
+OUTBOX_LIMIT = 100 # messages
+outbox: deque[tuple[str, str]] = deque()
+flushing = False
+
+# Session ticket from the server, presented on reconnect (X-OG-Ticket) instead of the invite token,
+# which may be single-use. Rotated with every tunnel, the server then also keeps our tunnel for us.
+session_ticket: str | None = None
+
+def keep_session_ticket(ticket: str | None) -> None:
+    global session_ticket
+    if ticket:
+        session_ticket = ticket
+
+# Set when the server stores tunnel messages for a dropped peer (og-server --store-forward):
+# encrypted lines are then sent while the tunnel is suspended instead of waiting in the outbox
+suspended_store_forward = False
+
+# Graceful server restart: on `server_draining` we leave the old server once no tunnel is active,
+# after a random delay within this window so its clients do not all reconnect at once
+DRAIN_MOVE_WINDOW = 30 # seconds
+drain_task: asyncio.Task | None = None
 
 # === Input management state === #
 input_mode = 'chat' # other possible value: "chat", "psk", "locked","encrypted"
@@ -96,8 +161,13 @@ def set_input_mode(mode: str):
     global input_mode
     input_mode = mode
 
+    # Nothing to refresh before the first prompt
+    if session is None:
+        return
+
     # Immediately force the prompt refresh using prompt_toolkit
     try:
+        from prompt_toolkit.application import get_app_or_none
         app = get_app_or_none()
         if app:
             app.invalidate()
@@ -161,6 +231,9 @@ async def safe_input(prompt: str = "> ", password: bool = False, color: str = No
         str: the user input entered as a string
     """
     
+    from prompt_toolkit.formatted_text import FormattedText
+    from prompt_toolkit.patch_stdout import patch_stdout
+
     # Build colored prompt
     ## First take in normal prompt if color is not passed
     workable_prompt = prompt
@@ -185,7 +258,7 @@ async def safe_input(prompt: str = "> ", password: bool = False, color: str = No
     try:
         with patch_stdout():
             # Use password masking if requested
-            return await session.prompt_async(
+            return await get_prompt_session().prompt_async(
                 workable_prompt,
                 is_password=password,
                 enable_history_search=True,
@@ -266,6 +339,10 @@ async def cmd_help(_: str):
         "/accept - Accept incoming connection request\n"
         "/list_users - List the users connected to the server you are connected to.\n"
         "/exit_tunnel - Close an active private tunnel\n"
+        "/send_file - Send a file through the active tunnel; usage `/send_file {path}`\n"
+        "/accept_file - Accept a file your peer offers; usage `/accept_file [{name}]`, the oldest offer without a name\n"
+        "/reject_file - Reject a file your peer offers; usage `/reject_file [{name}]`\n"
+        "/search - Search the local history (--history); usage `/search {words} [from:{username}]`\n"
         "Type your message and press Enter to send it.\n"
     )
 
@@ -300,6 +377,10 @@ connection_state: dict[str, str | None] = {
 }
 
 TUNNEL_TIMEOUT = 10 # seconds
+
+# Fast handshake (--fast-handshake): the PSK is asked on /connect and /accept, and a proof of it travels
+# with our public key on `connect_request`/`connect_accept`. The server answers both peers with `tunnel_ok`.
+fast_handshake = False
 # This section handles the connection state logic and respective command methods for the chat client.
 
 async def reset_connection_state():
@@ -314,13 +395,11 @@ async def reset_connection_state():
         "direction": None,
     })
 
-async def start_tunnel_validation(peer: str):
-    """Ask user for PSK and send to server within timeout."""
+async def prompt_psk(peer: str) -> bool:
+    """Ask user for PSK within timeout and keep its hash in the tunnel utils."""
     global input_future
 
-    connection_state["status"] = "tunnel_validating"
-
-    logger.debug(f"[start_tunnel_validation] Private tunnel with @{peer} requires PSK entry.")
+    logger.debug(f"[prompt_psk] Private tunnel with @{peer} requires PSK entry.")
     await aprint(f"----\nPrivate tunnel with @<ansicyan>{peer}</ansicyan> requires PSK entry\n----")
 
     set_input_mode("psk")
@@ -329,42 +408,26 @@ async def start_tunnel_validation(peer: str):
     try:
         psk_entered = await asyncio.wait_for(input_future, timeout=TUNNEL_TIMEOUT)
         
-        # Hash the psk to confidentially send it to the server for validation
+        # Hash the psk, only the hash (or a proof derived from it) ever leaves the client
+        from oldie_goldie.shared import SecureMethodsForOG
         hashed_psk = SecureMethodsForOG.hash_psk(psk=psk_entered)
-        logger.debug('[start_tunnel_validation] Hashing PSK')
+        logger.debug('[prompt_psk] Hashing PSK')
         
         # set the psk_hash in the tunnel utils, to use its functionality if the psk gets verified
         tunnel_utils.set_psk_hash(psk_hash=hashed_psk)
 
-        # encode the bytes to make them suitable for transmission
-        encoded_psk_hash = base64.b64encode(hashed_psk).decode('utf-8')
-        logger.debug('[start_tunnel_validation] Encoding the psk hash to base 64')
-
-        # Send encoded PSK hash to server
-        await active_websocket.send(
-            encode_message(
-                type="tunnel_secret",
-                sender=current_username,
-                secret=encoded_psk_hash,
-                message="tunnel_secret"
-            )
-        )
-
-        logger.debug("[start_tunnel_validation] PSK submitted. Waiting for server confirmation.")
-        await aprint("----\n<ansigray>PSK submitted\nAwaiting for server confirmation.</ansigray>\n----")
-        
         return True
     
     except (KeyboardInterrupt, EOFError):
         
-        logger.debug("[start_tunnel_validation] Validation interrupted. Closing tunnel.")
+        logger.debug("[prompt_psk] Validation interrupted. Closing tunnel.")
         await aprint("----\n<ansired>!</ansired> <ansigray>Validation interrupted\nClosing tunnel.</ansigray>\n----")
 
         return False
 
     except asyncio.TimeoutError:
         
-        logger.debug("[start_tunnel_validation] PSK entry timed out. Connection attempt cancelled.")
+        logger.debug("[prompt_psk] PSK entry timed out. Connection attempt cancelled.")
         await aprint("----\n<ansired>!</ansired> <ansigray>PSK entry timed out\nConnection attempt cancelled.</ansigray>\n----")
         
         return False
@@ -373,6 +436,98 @@ async def start_tunnel_validation(peer: str):
         input_future = None
         # set_input_mode('chat')
 
+async def start_tunnel_validation(peer: str):
+    """Ask user for PSK and send to server within timeout."""
+
+    connection_state["status"] = "tunnel_validating"
+
+    # A fast handshake request already holds the PSK, the peer answered with the regular validation
+    if tunnel_utils.get_psk_hash() is not None:
+        logger.debug("[start_tunnel_validation] Reusing the PSK entered with /connect.")
+        set_input_mode('locked')
+    elif not await prompt_psk(peer=peer):
+        return False
+
+    # encode the bytes to make them suitable for transmission
+    encoded_psk_hash = base64.b64encode(tunnel_utils.get_psk_hash()).decode('utf-8')
+    logger.debug('[start_tunnel_validation] Encoding the psk hash to base 64')
+
+    # Send encoded PSK hash to server
+    await active_websocket.send(
+        encode_message(
+            type="tunnel_secret",
+            sender=current_username,
+            secret=encoded_psk_hash,
+            message="tunnel_secret"
+        )
+    )
+
+    logger.debug("[start_tunnel_validation] PSK submitted. Waiting for server confirmation.")
+    await aprint("----\n<ansigray>PSK submitted\nAwaiting for server confirmation.</ansigray>\n----")
+    
+    return True
+
+async def abandon_fast_handshake(peer: str) -> None:
+    """PSK entry failed before anything was sent: withdraw from the request and reset."""
+    await reset_connection_state()
+    await tunnel_utils.reset()
+    set_input_mode('chat')
+    await active_websocket.send(
+        encode_message(
+            type="connect_deny",
+            sender=current_username,
+            target=peer,
+            message="connect_deny"
+        )
+    )
+
+async def start_fast_connect(peer: str):
+    """Fast handshake, requester side: the PSK proof and our public key go out with the `connect_request`."""
+    if not await prompt_psk(peer=peer):
+        await abandon_fast_handshake(peer=peer)
+        return
+
+    # Chat stays available while the peer decides
+    set_input_mode('chat')
+
+    await active_websocket.send(
+        encode_message(
+            type="connect_request",
+            sender=current_username,
+            target=peer,
+            key=tunnel_utils.prepare_ephemeral_key(),
+            proof=tunnel_utils.psk_proof(requester=current_username, responder=peer),
+            features=list(tunnel_utils.FEATURES),
+            message="connect_request"
+        )
+    )
+
+    logger.debug(f"[start_fast_connect] Connection request sent to @{peer}.")
+    await aprint(f"----\n<ansigray>Connection request sent to</ansigray> @<ansiyellow>{peer}</ansiyellow>\n----")
+
+async def start_fast_accept(peer: str):
+    """Fast handshake, responder side: answer with our public key and PSK proof, `tunnel_ok` completes the tunnel."""
+    if not await prompt_psk(peer=peer):
+        await abandon_fast_handshake(peer=peer)
+        return
+
+    connection_state["status"] = "tunnel_validating"
+
+    await active_websocket.send(
+        encode_message(
+            type="connect_accept",
+            sender=current_username,
+            target=peer,
+            key=tunnel_utils.prepare_ephemeral_key(),
+            proof=tunnel_utils.psk_proof(requester=peer, responder=current_username),
+            features=list(tunnel_utils.FEATURES),
+            message="connect_accept"
+        )
+    )
+
+    logger.debug("[start_fast_accept] PSK proof submitted. Waiting for server confirmation.")
+    await aprint("----\n<ansigray>PSK submitted\nAwaiting for server confirmation.</ansigray>\n----")
+
 # ========================== #
 # Connection Commands
 # ========================== #
@@ -408,6 +563,11 @@ async def cmd_connect(line: str):
         "direction": "outgoing",
     })
 
+    # The PSK prompt needs the input loop this command runs on, so it happens in a task
+    if fast_handshake:
+        _ = asyncio.create_task(wait_and_log_task(asyncio.create_task(start_fast_connect(peer=target_username)), "cmd_connect"))
+        return
+
     logger.debug(f"[cmd_connect] Connection request sent to @{target_username}.")
     await aprint(f"----\n<ansigray>Connection request sent to</ansigray> @<ansiyellow>{target_username}</ansiyellow>\n----")
 
@@ -441,6 +601,12 @@ async def cmd_accept(_: str):
     logger.debug(f"[cmd_accept] Accepting connection from @{peer}")
     await aprint(f"----\n<ansigray>Accepting connection from @</ansigray><ansiyellow>{peer}</ansiyellow>\n----")
 
+    # The requester offered a fast handshake, see start_fast_accept
+    if fast_handshake and tunnel_utils.get_peer_public_key_bytes():
+        connection_state["status"] = 'wait_tunnel_trigger'
+        _ = asyncio.create_task(wait_and_log_task(asyncio.create_task(start_fast_accept(peer=str(peer))), "cmd_accept"))
+        return
+
     task = asyncio.create_task(
         active_websocket.send(
             encode_message(
@@ -476,6 +642,7 @@ async def cmd_deny(_: str):
         await aprint(f"----\n<ansigray>Denied incoming connection request from @</ansigray><ansiyellow>{peer}</ansiyellow>.\n----")
 
     await reset_connection_state()
+    await tunnel_utils.reset()
 
     task = asyncio.create_task(
         active_websocket.send(
@@ -517,6 +684,7 @@ async def cmd_exit_tunnel(_: str):
     await aprint(f"----\n<ansigray>Tunnel closed with @</ansigray><ansiyellow>{connection_state['target']}</ansiyellow>\n----")
     
     await reset_connection_state()
+    file_utils.reset()
     set_input_mode('chat')
 
 async def cmd_pending(_: str):
@@ -541,6 +709,83 @@ async def cmd_list_users(_:str):
     )
     logger.debug('[cmd_list_users] Sent a request to server for a list of users.')    
 
+async def cmd_send_file(line: str):
+    """Stream a file to the peer of the active tunnel."""
+
+    parts = line.strip().split(maxsplit=1)
+    if len(parts) != 2:
+        await aprint("----\n<ansicyan>?</ansicyan> <ansigray>Usage:</ansigray> /send_file path/to/file\n----")
+        return
+
+    path = os.path.expanduser(parts[1].strip().strip('"'))
+    session_cipher = tunnel_utils.get_session_cipher()
+
+    if connection_state["status"] != "tunnel_active" or session_cipher is None:
+        await aprint("----\n<ansigray>Files can only be sent through an active tunnel.</ansigray>\n----")
+        return
+
+    if not tunnel_utils.peer_supports(FEATURE_FILE_TRANSFER):
+        await aprint("----\n<ansigray>Your peer's client does not support file transfers.</ansigray>\n----")
+        return
+
+    if not os.path.isfile(path):
+        await aprint(f"----\n<ansired>!</ansired> <ansigray>No such file:</ansigray> {path}\n----")
+        return
+
+    peer = str(connection_state["target"])
+
+    async def transfer():
+        await aprint(f"----\n<ansigray>Sending</ansigray> {os.path.basename(path)} <ansigray>to @</ansigray><ansiyellow>{peer}</ansiyellow>\n----")
+        try:
+            ok = await file_utils.send_file(websocket=active_websocket, cipher=session_cipher, username=current_username, target=peer, path=path, compression=tunnel_utils.negotiated_compression())
+            if ok:
+                await aprint(f"----\n<ansigreen>!</ansigreen> {os.path.basename(path)} <ansigray>delivered to @</ansigray><ansiyellow>{peer}</ansiyellow>\n----")
+            else:
+                await aprint(f"----\n<ansired>!</ansired> <ansigray>@{peer} could not verify</ansigray> {os.path.basename(path)}\n----")
+        except (FileTransferError, OSError) as e:
+            await aprint(f"----\n<ansired>!</ansired> <ansigray>File transfer failed:</ansigray> {e}\n----")
+
+    # Run in the background so the prompt stays usable during the transfer
+    _ = asyncio.create_task(wait_and_log_task(asyncio.create_task(transfer()), "cmd_send_file"))
+
+async def cmd_accept_file(line: str):
+    """Accept a file offered through the active tunnel."""
+    await answer_file_offer(line, accept=True)
+
+async def cmd_reject_file(line: str):
+    """Reject a file offered through the active tunnel."""
+    await answer_file_offer(line, accept=False)
+
+async def answer_file_offer(line: str, accept: bool):
+    parts = line.strip().split(maxsplit=1)
+    name = parts[1].strip().strip('"') if len(parts) == 2 else None
+
+    if not await file_utils.answer_offer(accept=accept, name=name):
+        offers = file_utils.pending_offers()
+        if offers:
+            await aprint("----\n<ansigray>No offer of that file. Pending:</ansigray>\n" + "\n".join(offers) + "\n----")
+        else:
+            await aprint("----\n<ansigray>No pending file offer.</ansigray>\n----")
+
+async def cmd_search(line: str):
+    """Search the local chat history."""
+
+    query = line.strip()[len("/search"):].strip()
+    if history is None:
+        await aprint("----\n<ansigray>History is off. Start og-client with</ansigray> <ansicyan>--history PATH</ansicyan> <ansigray>to keep and search your messages.</ansigray>\n----")
+        return
+    if not query:
+        await aprint("----\n<ansicyan>?</ansicyan> <ansigray>Usage:</ansigray> /search words [from:username]\n----")
+        return
+
+    results = await history.search(query)
+    if not results:
+        await aprint(f"----\n<ansigray>No message matches</ansigray> '{query}'\n----")
+        return
+
+    lines = [f"[{datetime.fromtimestamp(entry['timestamp']).isoformat(sep=' ', timespec='seconds')}] <ansigray>{entry['channel']}</ansigray> <ansiyellow>{entry['sender']}</ansiyellow>: {entry['text']}" for entry in reversed(results)]
+    await aprint("----\n" + "\n".join(lines) + f"\n<ansigray>{len(results)} match(es), newest last</ansigray>\n----")
+
 # Helper for task logging (to make sonarQube happy)
 async def wait_and_log_task(task: asyncio.Task, context: str):
     """Wait for a task and log any exception"""
@@ -557,15 +802,20 @@ command_handler.register_command("/deny", cmd_deny)
 command_handler.register_command("/exit_tunnel", cmd_exit_tunnel)
 command_handler.register_command("/pending", cmd_pending)
 command_handler.register_command("/list_users", cmd_list_users)
+command_handler.register_command("/send_file", cmd_send_file)
+command_handler.register_command("/accept_file", cmd_accept_file)
+command_handler.register_command("/reject_file", cmd_reject_file)
+command_handler.register_command("/search", cmd_search)
 
 # ========================== #
 # Messaging
 # ========================== #
 
-async def handle_chat_input(message: str, websocket: websockets.ClientConnection, username: str, session_key: bytes):
+async def handle_chat_input(message: str, websocket: websockets.ClientConnection, username: str, session_cipher: "SessionCipher | None"):
     
     # Handle custom commands
     if message.strip().startswith("/"):
+        loop_activity.set(message.split()[0])
         
         if command_handler.has_command(message):
             # Execute the command using the command handler
@@ -594,16 +844,97 @@ async def handle_chat_input(message: str, websocket: websockets.ClientConnection
     
     # Send the message if everything is fine
     else:
-        if not session_key:
+        if not session_cipher:
             encoded = encode_message(message=message, sender=username)
             await websocket.send(encoded)
-        elif session_key:
-            encoded = encode_message(message=message, sender=username, type='encrypted_message', session_key=session_key, target=connection_state['target'])
+        elif session_cipher and tunnel_utils.peer_supports(FEATURE_BINARY_FRAMES):
+            # Binary frame: compact header + nonce/ciphertext/tag, no base64 or outer JSON
+            encoded_frame = encode_binary_message(message=message, sender=username, cipher=session_cipher, target=connection_state['target'], compression=tunnel_utils.negotiated_compression())
+            await websocket.send(encoded_frame)
+        elif session_cipher:
+            encoded = encode_message(message=message, sender=username, type='encrypted_message', cipher=session_cipher, target=connection_state['target'])
             await websocket.send(encoded)
 
-async def send_messages(websocket: websockets.ClientConnection, username: str):
+        # Recorded once handed to the websocket, a line that ends up in the outbox is recorded when flushed
+        record_history(channel=f"@{connection_state['target']}" if session_cipher else 'chat', sender=username, text=message)
+
+async def queue_outgoing(message: str, mode: str) -> None:
+    """Keeps a chat line in the outbox until the connection (or the tunnel) is back."""
+    if len(outbox) >= OUTBOX_LIMIT:
+        await aprint(f"----\n<ansired>!</ansired> <ansigray>Outbox full ({OUTBOX_LIMIT} messages), message dropped</ansigray>\n----")
+        return
+
+    outbox.append((message, mode))
+    if not flushing: # sent in a moment otherwise
+        await aprint(f"----\n<ansigray>Offline, message queued ({len(outbox)}/{OUTBOX_LIMIT})</ansigray>\n----")
+
+async def send_or_queue(message: str, username: str, session_cipher: "SessionCipher | None") -> None:
+    """Sends a chat line, or queues it while the connection is down or the tunnel is suspended."""
+    mode = 'encrypted' if session_cipher else 'chat'
+    is_command = message.strip().startswith("/")
+
+    holding = session_cipher and connection_state["status"] == "tunnel_suspended" and not suspended_store_forward
+    # Sent right away only if it cannot overtake a queued line
+    queued_ahead = flushing or any(queued_mode == mode for _, queued_mode in outbox)
+    if is_command or (link_up and not holding and not queued_ahead):
+        try:
+            await handle_chat_input(message=message, websocket=active_websocket, username=username, session_cipher=session_cipher)
+            return
+        except websockets.exceptions.ConnectionClosed:
+            if is_command:
+                raise
+
+    await queue_outgoing(message=message, mode=mode)
+
+async def flush_outbox(username: str) -> None:
+    """
+    Sends the messages typed while offline, in order, once the connection is back.
+    Lines typed meanwhile are queued behind (see send_or_queue) and sent in the same pass.
+    A line leaves the outbox only once sent, so a connection lost again keeps the rest in order.
+    Encrypted ones wait for a suspended tunnel to resume and are dropped if the tunnel is gone.
+    """
+    global flushing
+    if not outbox or flushing:
+        return
+
+    status = connection_state["status"]
+    tunnel_usable = status == "tunnel_active" or (status == "tunnel_suspended" and suspended_store_forward)
+    session_cipher = tunnel_utils.get_session_cipher() if tunnel_usable else None
+
+    held: list[tuple[str, str]] = []
+    sent = dropped = 0
+
+    flushing = True
+    try:
+        while outbox:
+            message, mode = outbox[0]
+            if mode == 'encrypted' and session_cipher is None:
+                outbox.popleft()
+                if status == "tunnel_suspended":
+                    held.append((message, mode))
+                else:
+                    dropped += 1
+                continue
+
+            try:
+                await handle_chat_input(message=message, websocket=active_websocket, username=username, session_cipher=session_cipher if mode == 'encrypted' else None)
+            except websockets.exceptions.ConnectionClosed:
+                # Lost the connection again, keep everything not sent yet for the next flush
+                outbox.extendleft(reversed(held))
+                return
+            outbox.popleft()
+            sent += 1
+    finally:
+        flushing = False
+
+    outbox.extend(held)
+
+    logger.debug(f"[flush_outbox] sent: {sent}, held: {len(held)}, dropped: {dropped}")
+    await aprint(f"----\n<ansigray>Outbox flushed: {sent} sent" + (f", {len(held)} waiting for the tunnel" if held else "") + (f", {dropped} dropped (tunnel closed)" if dropped else "") + "</ansigray>\n----")
+
+async def send_messages(username: str):
     """ 
-    Handles sending messages through the websocket.
+    Handles sending messages through the active websocket, it keeps running across reconnects.
     
     This coroutine runs as a task and handles user input in a loop.
     If the user types `/exit`, it raises a `CancelledError` to signal shutdown
@@ -644,13 +975,13 @@ async def send_messages(websocket: websockets.ClientConnection, username: str):
 
                     else:
                         if input_mode == 'chat':
-                            await handle_chat_input(message=message,websocket=websocket, username=username, session_key=None)
+                            await send_or_queue(message=message, username=username, session_cipher=None)
                         
                         elif input_mode == 'encrypted':
-                            session_key = tunnel_utils.get_session_key()
+                            session_cipher = tunnel_utils.get_session_cipher()
                             
-                            if session_key:
-                                await handle_chat_input(message=message, websocket=websocket, username=username, session_key=session_key)
+                            if session_cipher:
+                                await send_or_queue(message=message, username=username, session_cipher=session_cipher)
                             
                             else:
                                 
@@ -690,14 +1021,31 @@ async def send_messages(websocket: websockets.ClientConnection, username: str):
 
 async def receive_messages(websocket: websockets.ClientConnection):
     """ Handles receiving and decoding messages from the websocket server. """
-    global input_mode
+    global input_mode, suspended_store_forward, drain_task
 
     while True:
 
         try:
             message = await websocket.recv()
-            decoded = decode_message(message_str=str(message), session_key=tunnel_utils.get_session_key())
+
+            # Binary frames only ever carry encrypted tunnel traffic
+            if isinstance(message, bytes):
+                session_cipher = tunnel_utils.get_session_cipher()
+                if session_cipher is None:
+                    logger.debug("[receive_messages] Dropping binary frame received outside of an active tunnel.")
+                    continue
+                kind, _, _, plaintext = decode_binary_frame(message, cipher=session_cipher)
+
+                if kind == FRAME_KIND_FILE_CHUNK:
+                    loop_activity.set("file_chunk")
+                    await file_utils.handle_chunk(plaintext, websocket=websocket, cipher=session_cipher, username=current_username)
+                    continue
+
+                decoded = json.loads(plaintext)
+            else:
+                decoded = decode_message(message_str=message, cipher=tunnel_utils.get_session_cipher())
             msg_type = decoded.get("type")
+            loop_activity.set(str(msg_type))
 
             # ==========================
             # Handle Connection Events
@@ -715,6 +1063,11 @@ async def receive_messages(websocket: websockets.ClientConnection):
                         "direction": "incoming",
                         })
 
+                    # Keep the requester's fast handshake offer for /accept
+                    if fast_handshake and decoded.get("key"):
+                        tunnel_utils.set_peer_public_key(encoded_peer_public_key=decoded["key"])
+                        tunnel_utils.set_peer_features(decoded.get("features"))
+
                 else:
                     await websocket.send(
                         encode_message(
@@ -730,6 +1083,7 @@ async def receive_messages(websocket: websockets.ClientConnection):
                 message = decoded.get("message")
                 await aprint(f"----\n<ansiyellow>{peer}</ansiyellow>: <ansigray>{message}</ansigray>\n----")
                 await reset_connection_state()
+                await tunnel_utils.reset()
 
             elif msg_type == "connect_accept":
                 peer = decoded.get("sender")
@@ -746,6 +1100,7 @@ async def receive_messages(websocket: websockets.ClientConnection):
                 await aprint(f"----\n<ansigray>Connection request denied by @</ansigray> <ansiyellow>{peer}</ansiyellow>\n----")
                 
                 await reset_connection_state()
+                await tunnel_utils.reset()
             
             # ==========================
             # Tunnel Validation Events
@@ -772,6 +1127,7 @@ async def receive_messages(websocket: websockets.ClientConnection):
                 await aprint("----\n<ansigreen>!</ansigreen> <ansigray>Tunnel PSK confirmed\nInvoking key share</ansigray>\n----")
 
                 connection_state["status"] = "tunnel_active"
+                keep_session_ticket(decoded.get("ticket"))
                 input_mode = "chat"
 
                 # Invoke the helper method to establish changes like generating
@@ -781,12 +1137,61 @@ async def receive_messages(websocket: websockets.ClientConnection):
                 task = asyncio.create_task(tunnel_utils.handle_key_share(target=str(peer), username=current_username, websocket=active_websocket))
                 await task
 
+            elif msg_type == "tunnel_ok":
+                # Fast handshake: the server matched both PSK proofs and relays the peer's public key
+                peer = decoded.get("sender")
+                if connection_state.get("target") == peer:
+                    tunnel_utils.complete_handshake(encoded_peer_public_key=decoded.get("key"), features=decoded.get("features"))
+                    keep_session_ticket(decoded.get("ticket"))
+                    connection_state["status"] = "tunnel_active"
+
+                    logger.debug(f"[receive_messages.tunnel_ok] Tunnel with @{peer} established.")
+                    await aprint(f"----\n<ansigreen>!</ansigreen> <ansigray>Tunnel PSK confirmed\nPrivate tunnel established with @</ansigray><ansiyellow>{peer}</ansiyellow>\n----")
+
+                    set_input_mode('encrypted')
+
+            elif msg_type == "tunnel_suspended":
+                # Our peer dropped (or we are back before them): keys are kept until the tunnel resumes
+                peer = decoded.get("sender")
+                if connection_state.get("target") == peer:
+                    keep_session_ticket(decoded.get("ticket"))
+                    connection_state["status"] = "tunnel_suspended"
+                    suspended_store_forward = bool(decoded.get("stored"))
+                    file_utils.reset()
+
+                    logger.debug(f"[receive_messages.tunnel_suspended] Tunnel with @{peer} suspended (stored: {suspended_store_forward}).")
+                    if suspended_store_forward:
+                        await aprint(f"----\n<ansiyellow>!</ansiyellow> <ansigray>{decoded.get('message')}\nThe server keeps your messages until the tunnel resumes.</ansigray>\n----")
+                        await flush_outbox(username=current_username)
+                    else:
+                        await aprint(f"----\n<ansiyellow>!</ansiyellow> <ansigray>{decoded.get('message')}\nMessages are not delivered until the tunnel resumes.</ansigray>\n----")
+
+            elif msg_type == "tunnel_resumed":
+                peer = decoded.get("sender")
+                if connection_state.get("target") == peer:
+                    keep_session_ticket(decoded.get("ticket"))
+                    connection_state["status"] = "tunnel_active"
+                    suspended_store_forward = False
+
+                    logger.debug(f"[receive_messages.tunnel_resumed] Tunnel with @{peer} resumed.")
+                    await aprint(f"----\n<ansigreen>!</ansigreen> <ansigray>{decoded.get('message')}</ansigray>\n----")
+
+                    set_input_mode('encrypted')
+                    await flush_outbox(username=current_username)
+
+            elif msg_type == "server_draining":
+                logger.debug(f"[receive_messages.server_draining] Server restarting, deadline {decoded.get('deadline')}s")
+                await aprint(f"----\n<ansiyellow>!</ansiyellow> <ansigray>{decoded.get('message')}</ansigray>\n----")
+                if drain_task is None or drain_task.done():
+                    drain_task = asyncio.create_task(move_to_new_server(websocket=websocket, deadline=float(decoded.get("deadline") or DRAIN_MOVE_WINDOW)))
+
             elif msg_type == "tunnel_failed":
                 
                 logger.debug("[receive_messages] Tunnel validation failed. PSK mismatch.")
                 await aprint("<ansibrightred>----</ansibrightred>\n<ansired>!</ansired> Tunnel validation failed\n<ansired>Bye Bye !</ansired>\n<ansibrightred>----</ansibrightred>")
                 
                 await reset_connection_state()
+                await tunnel_utils.reset()
                 input_mode = "chat"
             
             # ========================== 
@@ -797,6 +1202,7 @@ async def receive_messages(websocket: websockets.ClientConnection):
                 encoded_public_key = decoded.get('key')
                 if connection_state.get('target') == sender:
                     tunnel_utils.set_peer_public_key(encoded_peer_public_key=encoded_public_key)
+                    tunnel_utils.set_peer_features(decoded.get('features'))
                     
                     logger.debug(f"[receive_messages] Received Public Key from @{sender}")
                     await aprint(f"----\n<ansigreen>!</ansigreen> <ansigray>Received Public Key from @</ansigray><ansiyellow>{sender}</ansiyellow>\n----")
@@ -822,6 +1228,12 @@ async def receive_messages(websocket: websockets.ClientConnection):
                 _type = decoded.get('type','')
                 
                 await aprint(f"\n[{readable_timestamp}] [{_type}] <ansiyellow>{sender}</ansiyellow>: {text}")                
+                record_history(channel=f"@{sender}", sender=sender, text=text, timestamp=decoded.get('timestamp'))
+
+            elif msg_type in FILE_MESSAGE_TYPES:
+                session_cipher = tunnel_utils.get_session_cipher()
+                if session_cipher is not None and connection_state.get('target') == decoded.get('sender'):
+                    await file_utils.handle_message(decoded, websocket=websocket, cipher=session_cipher, username=current_username)
 
             # ========================== 
             # Tunnel Exit Event
@@ -834,6 +1246,7 @@ async def receive_messages(websocket: websockets.ClientConnection):
                 
                 await reset_connection_state()
                 await tunnel_utils.reset()
+                file_utils.reset()
                 set_input_mode('chat')
 
             # ========================== 
@@ -864,6 +1277,7 @@ async def receive_messages(websocket: websockets.ClientConnection):
                 if connection_state.get("target") == user:
                     await reset_connection_state()
                     await tunnel_utils.reset()
+                    file_utils.reset()
                     set_input_mode('chat')
 
             # ==========================
@@ -875,6 +1289,8 @@ async def receive_messages(websocket: websockets.ClientConnection):
                 sender = decoded.get("sender", "unknown")
                 text = decoded.get("message", "")
                 await aprint(f"\n[{readable_timestamp}] <ansiyellow>{sender}</ansiyellow>: {text}")
+                if msg_type == 'chat_message':
+                    record_history(channel='chat', sender=sender, text=text, timestamp=timestamp if timestamp != '???' else None)
 
         except websockets.exceptions.ConnectionClosed:
             # This exception occurs when a keyboard interrupt is experienced 
@@ -1010,6 +1426,7 @@ async def handle_username_registration(websocket) -> str | None:
                 continue
 
             if decoded["type"] == "register":
+                keep_session_ticket(decoded.get("ticket"))
                 
                 logger.debug(f"[handle_username_registration] Received confirmation from the server. Welcome `{username}`!")
                 await aprint(f"----\n<ansigray>Confirmation received\nWelcome</ansigray>`<ansiyellow>{username}</ansiyellow>`!----\n")
@@ -1045,6 +1462,146 @@ async def handle_username_registration(websocket) -> str | None:
             return None
 
 
+# ========================== #
+# Reconnect
+# ========================== #
+
+RECONNECT_ATTEMPTS = 12
+RECONNECT_BASE_DELAY = 0.5 # seconds
+RECONNECT_MAX_DELAY = 30 # seconds
+
+def reconnect_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter, so clients dropped together do not come back together."""
+    return random.uniform(0, min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** attempt))
+
+async def reconnect(uri: str, headers: list[tuple[str, str]] | None, connect_options: dict[str, Any], username: str) -> tuple[websockets.ClientConnection, bool] | None:
+    """
+    Reconnects after the connection dropped and re-registers with the same username, presenting the
+    session ticket (and the token, for a server that forgot the ticket). Returns (websocket, resumed) or None after the last attempt.
+    """
+    for attempt in range(1, RECONNECT_ATTEMPTS + 1):
+        delay = reconnect_delay(attempt)
+        await aprint(f"----\n<ansiyellow>!</ansiyellow> <ansigray>Connection lost. Reconnecting in {delay:.1f}s (attempt {attempt}/{RECONNECT_ATTEMPTS})</ansigray>\n----")
+        await asyncio.sleep(delay)
+
+        connect_headers = list(headers or []) + ([('X-OG-Ticket', session_ticket)] if session_ticket else [])
+
+        try:
+            websocket = await websockets.connect(uri, additional_headers=connect_headers or None, **connect_options)
+            await websocket.send(make_register_message(username=username))
+            decoded = decode_message(await asyncio.wait_for(websocket.recv(), timeout=TUNNEL_TIMEOUT))
+
+            if decoded.get("type") == "register":
+                keep_session_ticket(decoded.get("ticket"))
+                logger.debug(f"[reconnect] Re-registered as @{username}, resumed: {decoded.get('resumed')}")
+                return websocket, bool(decoded.get("resumed"))
+
+            await websocket.close()
+            logger.debug(f"[reconnect] Registration refused: {decoded.get('message')}")
+
+            # Blocked usernames never come back, anything else (e.g. the server has not noticed the old connection is gone yet) is retried
+            if "blocked" in str(decoded.get("message")):
+                await aprint(f"----\n<ansired>!</ansired> {decoded.get('message')}\n----")
+                return None
+
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+            logger.debug(f"[reconnect] Attempt {attempt} failed: {e}")
+
+    return None
+
+async def move_to_new_server(websocket: websockets.ClientConnection, deadline: float) -> None:
+    """
+    Closes the connection to a draining server once we are idle or our tunnel is suspended. The
+    reconnect loop then lands on the new server, presenting the session ticket.
+    An active tunnel stays until it ends or the server closes it at its deadline.
+    """
+    movable = ("idle", "tunnel_suspended")
+    while websocket.state is State.OPEN:
+        if connection_state["status"] not in movable:
+            await asyncio.sleep(1)
+            continue
+
+        await asyncio.sleep(random.uniform(0, min(DRAIN_MOVE_WINDOW, deadline)))
+        if connection_state["status"] in movable:
+            logger.debug("[move_to_new_server] Leaving the draining server")
+            await websocket.close(code=1001, reason="Moving to the restarted server")
+            return
+
+async def restore_session_state(resumed: bool) -> None:
+    """Brings the connection state in line with what the server kept after a reconnect."""
+    global suspended_store_forward
+    suspended_store_forward = False
+    file_utils.reset()
+
+    if resumed:
+        # `tunnel_resumed` (or `tunnel_suspended` if the peer is away too) follows the registration
+        connection_state["status"] = "tunnel_suspended"
+        return
+
+    if connection_state["status"] in ("tunnel_active", "tunnel_suspended"):
+        await aprint(f"----\n<ansired>!</ansired> <ansigray>The tunnel with @</ansigray><ansiyellow>{connection_state['target']}</ansiyellow> <ansigray>could not be resumed</ansigray>\n----")
+
+    # The server forgot any pending request or tunnel
+    if connection_state["status"] != "idle":
+        await reset_connection_state()
+    await tunnel_utils.reset()
+    set_input_mode('chat')
+
+async def run_session(send_task: asyncio.Task, websocket: websockets.ClientConnection) -> bool:
+    """Runs the receive loop of a connection next to the input loop. Returns True if the connection was lost."""
+    receive_task = asyncio.create_task(receive_messages(websocket=websocket))
+
+    # Process the tasks by waiting them accordingly
+    done, _ = await asyncio.wait(
+        [send_task, receive_task],
+        return_when=asyncio.FIRST_COMPLETED
+    )
+
+    if receive_task not in done:
+        receive_task.cancel()
+        
+        try:
+            await receive_task
+            
+        except asyncio.CancelledError:
+            logger.debug("[run_session] Cancelled pending task: receive_messages")
+
+    # The input loop ended: /exit (raised here as CancelledError), Ctrl+C or an unhandled exception
+    if send_task in done:
+        send_task.result()
+        return False
+
+    if receive_task.exception():
+        logger.error(f"[run_session] Exception from task receive_messages raised: {receive_task.exception()}")
+        raise receive_task.exception() # type: ignore
+
+    # receive_messages only returns once the connection is closed
+    return True
+
+async def open_history(path: str) -> None:
+    """Asks for the history passphrase and opens it. Three wrong passphrases leave the history off."""
+    from oldie_goldie.client.helpers.chat_history import ChatHistoryForOG, HistoryPassphraseError
+    global history
+
+    for _ in range(3):
+        passphrase = await safe_input(prompt='🗝️ History passphrase: ', password=True, color='ansiyellow')
+        if not passphrase:
+            continue
+
+        candidate = ChatHistoryForOG(path)
+        try:
+            await candidate.open(passphrase)
+        except HistoryPassphraseError:
+            await candidate.close()
+            await aprint("----\n<ansired>!</ansired> <ansigray>Wrong passphrase for this history</ansigray>\n----")
+            continue
+
+        history = candidate
+        await aprint(f"----\n<ansigreen>!</ansigreen> <ansigray>History enabled:</ansigray> {path}\n----")
+        return
+
+    await aprint("----\n<ansired>!</ansired> <ansigray>History disabled for this session</ansigray>\n----")
+
 # Utility method to parse the arguments
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -1058,24 +1615,33 @@ def parse_args():
         formatter_class=argparse.RawDescriptionHelpFormatter,  # keeps formatting & newlines
     )
 
-    parser.add_argument('--server-host', choices=['local','public'], required=True, help="Server type: 'local' or 'public'")
+    parser.add_argument('--server-host', choices=['local','public','unix'], required=True, help="Server type: 'local', 'public' or 'unix' (a server on this host listening on --unix-socket)")
     parser.add_argument('--server-port', type=int, default=8765, help='Port to connect to (default: 8765)')
     parser.add_argument('--url', help='Public Websocket URL (required if --server-host=public)')
+    parser.add_argument('--tenant', metavar='NAME', help="Group to join on a server hosting several (og-server --tenant). Not needed with an invite token of that group")
+    parser.add_argument('--unix-socket', metavar='PATH', help="Unix domain socket of the server, see og-server --listen unix:PATH (required if --server-host=unix)")
+    parser.add_argument('--download-dir', default='og_downloads', help='Directory where files received through a tunnel are saved (default: ./og_downloads)')
+    parser.add_argument('--max-file-size', type=int, default=FileTransferUtilsForOG.MAX_FILE_SIZE // 2**20, metavar='MIB', help=f'Refuse files offered through a tunnel that are larger than MIB mebibytes, 0 for no limit (default: {FileTransferUtilsForOG.MAX_FILE_SIZE // 2**20})')
+    parser.add_argument('--history', metavar='PATH', help='Keep an encrypted, searchable history of your messages in PATH (SQLite). Asks for its passphrase on startup, search it with /search')
+    parser.add_argument('--fast-handshake', action='store_true', help='Open tunnels in about two round trips: the PSK is asked on /connect and /accept and its proof travels with the public keys. Falls back to the regular PSK validation with older peers')
+    add_loop_monitor_arguments(parser)
+    add_compression_arguments(parser)
     parser.add_argument('--token', help="Authorization token (optional). Required if it is a protected server. Find out with the server provider. If it starts with '-', prefix it with '--' or use '=' syntax.")
 
     # 👇 Add version flag
-    try:
-        pkg_version = version("oldie-goldie")
-    except PackageNotFoundError:
-        pkg_version = "0.0.0-dev"
-    
-    parser.add_argument("--version", action="version", version=f"Oldie Goldie {pkg_version}")
+    parser.add_argument("--version", action="version", version=f"Oldie Goldie {package_version()}")
 
     args = parser.parse_args()
 
     # --- validation ---
     if args.server_host == "public" and not args.url:
         parser.error('--url is required when --server-host=public')
+    if args.server_host == "unix" and not args.unix_socket:
+        parser.error('--unix-socket is required when --server-host=unix')
+    if args.loop_monitor is not None and args.loop_monitor <= 0:
+        parser.error('--loop-monitor must be > 0')
+    if args.max_file_size < 0:
+        parser.error('--max-file-size cannot be negative')
 
     return args
 
@@ -1092,9 +1658,25 @@ async def main():
     # Get the command line args
     args = parse_args()
 
+    from oldie_goldie.client.helpers.tunnel_activity import TunnelActivityUtilsForOG
+    global tunnel_utils, file_utils, fast_handshake
+    tunnel_utils = TunnelActivityUtilsForOG()
+    file_utils = FileTransferUtilsForOG(download_dir=args.download_dir, notify=_notify_file_transfer, max_file_size=args.max_file_size * 2**20 or None)
+    fast_handshake = args.fast_handshake
+
+    # Reports go to the log, the lag summary is logged on exit
+    loop_monitor = loop_monitor_from_args(args)
+    if loop_monitor is not None:
+        loop_monitor.start()
+
     # --- build the connection url ---
+    # Over a Unix socket the URI only fills in the Host header and the path of the handshake
+    unix_options: dict[str, Any] = {}
     if args.server_host == 'local':
         uri=f"ws://localhost:{args.server_port}"
+    elif args.server_host == 'unix':
+        uri = "ws://localhost/"
+        unix_options = {"unix": True, "path": args.unix_socket}
     else:
         uri = args.url.strip()
         
@@ -1103,6 +1685,8 @@ async def main():
             uri = 'wss://' + uri[len('https://'):]
         elif uri.startswith('http://'):
             uri = 'ws://' + uri[len('http://'):]
+    if args.tenant:
+        uri = uri.rstrip('/') + '/' + quote(args.tenant)
     
     # --- prepare headers if token is given ---
     headers = [('Authorization', args.token)] if args.token else None
@@ -1111,7 +1695,10 @@ async def main():
 
     # Welcome banner
     await aprint(version_banner(app_name='Client'))
-    global active_websocket, current_username
+
+    if args.history:
+        await open_history(path=args.history)
+    global active_websocket, current_username, link_up
 
     if headers:
         
@@ -1120,11 +1707,18 @@ async def main():
         
     
     # Connect to the websocket server via async context manager
-    async with websockets.connect(uri, additional_headers=headers) as websocket:
+    connect_options = client_compression_options(
+        mode=args.ws_compression,
+        threshold=args.ws_compression_threshold,
+        no_context_takeover=args.ws_no_context_takeover,
+        max_window_bits=args.ws_max_window_bits,
+    ) | unix_options
+    server_address = f"unix:{args.unix_socket}" if unix_options else uri
+    async with websockets.connect(uri, additional_headers=headers, **connect_options) as websocket:
         
         # Log the connection to the server
-        logger.debug(f"Connected to secure chat websocket server at {uri}, Beginning username registration...")
-        await aprint(f"----\n<ansigreen>!!</ansigreen> Connected to secure chat websocket server at {uri}\nBeginning username registration...\n----")
+        logger.debug(f"Connected to secure chat websocket server at {server_address}, Beginning username registration...")
+        await aprint(f"----\n<ansigreen>!!</ansigreen> Connected to secure chat websocket server at {server_address}\nBeginning username registration...\n----")
 
         active_websocket = websocket
         
@@ -1136,36 +1730,26 @@ async def main():
             raise asyncio.CancelledError # Gracefully exit
         
         current_username = username
-        
-        # Now continue as before
-        tasks = [
-            asyncio.create_task(send_messages(websocket=websocket, username=username)),
-            asyncio.create_task(receive_messages(websocket=websocket))
-            ]
+        link_up = True
+
+        # The input loop spans reconnects, only the receive loop is tied to a connection
+        send_task = asyncio.create_task(send_messages(username=username))
 
         try:
+            while await run_session(send_task=send_task, websocket=active_websocket):
+                link_up = False
 
-            # Process the tasks by waiting them accordingly
-            done, pending = await asyncio.wait(
-                tasks,
-                return_when=asyncio.FIRST_COMPLETED
-            )
+                reconnected = await reconnect(uri=uri, headers=headers, connect_options=connect_options, username=username)
+                if reconnected is None:
+                    await aprint("----\n<ansired>!</ansired> <ansigray>Could not reconnect to the server</ansigray>\n----")
+                    break
 
-            # Cancel other tasks that did not finish
-            for task in pending:                
-                task.cancel()
-                
-                try:
-                    await task
-                    
-                except asyncio.CancelledError:
-                    logger.debug(f"[main] Cancelled pending task: {task.get_coro().__name__}")  # type: ignore    
-            
-            # Get the exceptions of tasks which have not been handled appropriately 
-            for task in done:
-                if task.exception():
-                    logger.error(f"[main] Exception from task {task.get_coro().__name__} raised: {task.exception()}") # type: ignore 
-                    raise task.exception() # type: ignore
+                active_websocket, resumed = reconnected
+                await aprint(f"----\n<ansigreen>!!</ansigreen> <ansigray>Reconnected as</ansigray> `<ansiyellow>{username}</ansiyellow>`\n----")
+                await restore_session_state(resumed=resumed)
+
+                link_up = True
+                await flush_outbox(username=username)
                 
         except asyncio.CancelledError:
             logger.debug("[main] Main task cancelled.")
@@ -1179,6 +1763,23 @@ async def main():
             raise
 
         finally:
+            link_up = False
+            if not send_task.done():
+                send_task.cancel()
+                await asyncio.gather(send_task, return_exceptions=True)
+
+            # Connections opened by reconnect() are not covered by the context manager
+            if active_websocket is not websocket:
+                await active_websocket.close()
+
+            # Commits the messages still queued for the history writer
+            if history is not None:
+                await history.close()
+
+            if loop_monitor is not None:
+                loop_monitor.stop()
+                logger.info(f"[main] {loop_monitor.summary()}")
+
             logger.debug("[main] All tasks completed or cancelled. The app will exit automatically. If the input seems to be blocked then press 'Enter' to finish exiting. Thanks for using Secure Chat Client :)")
             await aprint("<ansigreen>----</ansigreen>\nAll tasks completed or cancelled\nThe app will exit automatically\nIf the input seems to be blocked then press 'Enter' to finish exiting\nThanks for using <ansigreen>Oldie Goldie</ansigreen> Client :)\n<ansigreen>----</ansigreen>")
 
@@ -0,0 +1,200 @@
+"""Local chat history, encrypted at rest and searchable.
+
+Messages are kept in a SQLite database (og-client --history PATH):
+- `messages` holds the timestamp and an AES-GCM blob of (channel, sender, text).
+- `message_index` is an FTS5 index over blind tokens: every word is replaced by a
+  truncated HMAC of it, so the index can be queried without storing any plaintext.
+  Only whole words match, there is no prefix or fuzzy search.
+
+Both keys come from the user's passphrase (scrypt, with a random salt kept in the
+database). All database work runs on a single background thread: `record()` only
+queues the message and a writer task commits the queue in batches.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, ts REAL NOT NULL, blob BLOB NOT NULL);
+CREATE VIRTUAL TABLE IF NOT EXISTS message_index USING fts5(tokens, content='', columnsize=0, detail=none);
+"""
+
+_WORD = re.compile(r"\w+")
+_KEY_CHECK = b"oldie-goldie-history"
+_NONCE_SIZE = 12
+
+class HistoryPassphraseError(ValueError):
+    """Raised when the passphrase does not open an existing history database."""
+
+class ChatHistoryForOG:
+
+    WRITE_BATCH = 1024 # messages per transaction at most
+    WRITE_LINGER = 0.1 # seconds the writer waits for more messages before committing
+    TOKEN_SIZE = 8 # bytes of HMAC kept per blind token
+
+    # scrypt work factor, opening the history takes about 0.1 s
+    SCRYPT_N = 2 ** 15
+    SCRYPT_R = 8
+    SCRYPT_P = 1
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db: sqlite3.Connection | None = None
+        self._aead: AESGCM | None = None
+        self._index_key = b""
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="og-history")
+        self._queue: asyncio.Queue[tuple[float, str, str, str]] = asyncio.Queue()
+        self._writer_task: asyncio.Task | None = None
+
+    # ==== #
+    # Lifecycle
+    # ==== #
+
+    async def open(self, passphrase: str) -> None:
+        """Opens (or creates) the database and starts the writer. Raises HistoryPassphraseError on a wrong passphrase."""
+        await self._run(self._open, passphrase)
+        self._writer_task = asyncio.create_task(self._writer())
+
+    def _open(self, passphrase: str) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(_SCHEMA)
+
+        row = db.execute("SELECT value FROM meta WHERE key = 'salt'").fetchone()
+        salt = row[0] if row else os.urandom(16)
+
+        keys = Scrypt(salt=salt, length=64, n=self.SCRYPT_N, r=self.SCRYPT_R, p=self.SCRYPT_P).derive(passphrase.encode("utf-8"))
+        aead = AESGCM(keys[:32])
+
+        if row is None:
+            nonce = os.urandom(_NONCE_SIZE)
+            with db:
+                db.execute("INSERT INTO meta (key, value) VALUES ('salt', ?)", (salt,))
+                db.execute("INSERT INTO meta (key, value) VALUES ('check', ?)", (nonce + aead.encrypt(nonce, _KEY_CHECK, None),))
+        else:
+            check = db.execute("SELECT value FROM meta WHERE key = 'check'").fetchone()[0]
+            try:
+                aead.decrypt(check[:_NONCE_SIZE], check[_NONCE_SIZE:], None)
+            except InvalidTag:
+                db.close()
+                raise HistoryPassphraseError("Wrong passphrase for this history")
+
+        self._db = db
+        self._aead = aead
+        self._index_key = keys[32:]
+
+    async def close(self) -> None:
+        """Commits whatever is still queued and closes the database."""
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+            self._writer_task = None
+
+        pending = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        if pending and self._db is not None:
+            await self._run(self._write_batch, pending)
+
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+        self._executor.shutdown(wait=False)
+
+    async def _run(self, func, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    # ==== #
+    # Writing
+    # ==== #
+
+    def record(self, channel: str, sender: str, text: str, timestamp: float | None = None) -> None:
+        """Queues a message for the writer, never blocks the caller."""
+        if self._db is None:
+            return
+        self._queue.put_nowait((timestamp or time.time(), channel, sender, text))
+
+    async def _writer(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            # A lone message waits a little for company, a backlog is written right away
+            if self._queue.empty():
+                await asyncio.sleep(self.WRITE_LINGER)
+            while len(batch) < self.WRITE_BATCH and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            try:
+                await self._run(self._write_batch, batch)
+            except sqlite3.Error as e:
+                logger.error(f"[ChatHistoryForOG] Could not write {len(batch)} message(s) to the history: {e}")
+
+    def _write_batch(self, batch: list[tuple[float, str, str, str]]) -> None:
+        """Runs on the history thread: encrypts and indexes a batch in one transaction."""
+        assert self._db is not None and self._aead is not None
+        with self._db:
+            for timestamp, channel, sender, text in batch:
+                nonce = os.urandom(_NONCE_SIZE)
+                plaintext = json.dumps({"channel": channel, "sender": sender, "text": text}).encode("utf-8")
+                cursor = self._db.execute("INSERT INTO messages (ts, blob) VALUES (?, ?)", (timestamp, nonce + self._aead.encrypt(nonce, plaintext, None)))
+
+                tokens = {self._blind(word) for word in _WORD.findall(text.lower())}
+                tokens.add(self._blind(f"from:{sender.lower()}"))
+                self._db.execute("INSERT INTO message_index (rowid, tokens) VALUES (?, ?)", (cursor.lastrowid, " ".join(tokens)))
+
+    def _blind(self, word: str) -> str:
+        return hmac.new(self._index_key, word.encode("utf-8"), hashlib.sha256).digest()[:self.TOKEN_SIZE].hex()
+
+    # ==== #
+    # Search
+    # ==== #
+
+    async def search(self, query: str, limit: int = 20) -> list[dict[str, Any]]:
+        """
+        Messages containing every word of `query`, newest first.
+        A `from:<username>` term restricts the results to one sender.
+        """
+        if self._db is None:
+            return []
+        return await self._run(self._search, query, limit)
+
+    def _search(self, query: str, limit: int) -> list[dict[str, Any]]:
+        assert self._db is not None and self._aead is not None
+        terms = []
+        for term in query.lower().split():
+            if term.startswith("from:"):
+                terms.append(self._blind(f"from:{term[len('from:'):].lstrip('@')}"))
+            else:
+                terms.extend(self._blind(word) for word in _WORD.findall(term))
+        if not terms:
+            return []
+
+        rows = self._db.execute(
+            "SELECT m.ts, m.blob FROM message_index i JOIN messages m ON m.id = i.rowid WHERE message_index MATCH ? ORDER BY i.rowid DESC LIMIT ?",
+            (" ".join(terms), limit),
+        ).fetchall()
+
+        results = []
+        for timestamp, blob in rows:
+            entry = json.loads(self._aead.decrypt(blob[:_NONCE_SIZE], blob[_NONCE_SIZE:], None))
+            entry["timestamp"] = timestamp
+            results.append(entry)
+        return results
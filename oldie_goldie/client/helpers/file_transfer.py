@@ -0,0 +1,439 @@
+"""_summary_
+Streaming file transfer over an encrypted tunnel.
+
+Control messages are encrypted binary message frames, file data travels in
+FRAME_KIND_FILE_CHUNK frames (one AEAD per chunk).
+
+1. sender   -> `file_offer`    transfer_id, name, size, sha256, chunk_size
+2. receiver -> `file_accept`   offset to start from (0 for a new transfer, more when resuming),
+                               once the user answered /accept_file (a resume is accepted right away)
+3. sender   -> chunks          never more than `window` chunks ahead of the last acknowledgement
+4. receiver -> `file_ack`      contiguous bytes received, every window/2 chunks
+5. receiver -> `file_complete` once the sha256 of the assembled file has been verified
+Either side may send `file_cancel`.
+
+The transfer_id is the first 16 bytes of the file's sha256, so offering the same file
+again resumes from the `.part` file the receiver kept from the interrupted attempt.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+from typing import Any, Awaitable, Callable, TYPE_CHECKING
+
+import websockets
+
+from oldie_goldie.shared import encode_binary_message, encode_file_chunk, parse_file_chunk
+from oldie_goldie.shared.compression import compress
+
+if TYPE_CHECKING:
+    from oldie_goldie.shared import SessionCipher
+
+logging.basicConfig(
+    level=logging.INFO,
+    format= "%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%H:%M:%S"
+    )
+logger = logging.getLogger(__name__)
+
+# Message types handled by FileTransferUtilsForOG.handle_message
+FILE_MESSAGE_TYPES = ('file_offer', 'file_accept', 'file_ack', 'file_complete', 'file_cancel')
+
+class FileTransferError(Exception):
+    """Raised when a transfer is cancelled, rejected or stalls."""
+
+class _OutgoingTransfer:
+    def __init__(self, path: str, size: int, target: str):
+        loop = asyncio.get_running_loop()
+        self.path = path
+        self.size = size
+        self.target = target
+        self.accepted: asyncio.Future[int] = loop.create_future()
+        self.completed: asyncio.Future[bool] = loop.create_future()
+        self.acked = 0
+        self.ack_event = asyncio.Event()
+        self.error: str | None = None
+
+    def fail(self, reason: str) -> None:
+        self.error = reason
+        for future in (self.accepted, self.completed):
+            if not future.done():
+                future.set_exception(FileTransferError(reason))
+                # Retrieved here so an unawaited future does not log "exception was never retrieved"
+                future.exception()
+        self.ack_event.set()
+
+class _PendingOffer:
+    """A file offer waiting for the user's /accept_file or /reject_file."""
+
+    def __init__(self, sender: str, name: str, size: int, sha256: str, chunk_size: int, websocket: websockets.ClientConnection, cipher: "SessionCipher", username: str):
+        self.sender = sender
+        self.name = name
+        self.size = size
+        self.sha256 = sha256
+        self.chunk_size = chunk_size
+        self.websocket = websocket
+        self.cipher = cipher
+        self.username = username
+        self.received_at = asyncio.get_running_loop().time()
+
+class _IncomingTransfer:
+    def __init__(self, sender: str, name: str, size: int, sha256: str, part_path: str, file: Any, offset: int):
+        self.sender = sender
+        self.name = name
+        self.size = size
+        self.sha256 = sha256
+        self.part_path = part_path
+        self.file = file
+        self.offset = offset
+        self.chunks_since_ack = 0
+
+class FileTransferUtilsForOG:
+
+    CHUNK_SIZE = 64 * 1024
+    WINDOW = 16 # chunks in flight before the sender waits for an acknowledgement
+    ACCEPT_TIMEOUT = 60 # seconds, the receiver answers the offer by hand
+    ACK_TIMEOUT = 30 # seconds
+    MAX_FILE_SIZE = 1024 * 1024 * 1024 # bytes
+    DISK_MARGIN = 64 * 1024 * 1024 # bytes left free on the download disk once a file is received
+
+    def __init__(self, download_dir: str = "og_downloads", notify: Callable[[str], Awaitable[None]] | None = None, chunk_size: int = CHUNK_SIZE, window: int = WINDOW, max_file_size: int | None = MAX_FILE_SIZE, auto_accept: bool = False):
+        self._download_dir = download_dir
+        self._notify = notify
+        self._chunk_size = chunk_size
+        self._window = max(2, window)
+        self._max_file_size = max_file_size
+        self._auto_accept = auto_accept # scripts and benchmarks, nobody is there to answer /accept_file
+        self._outgoing: dict[bytes, _OutgoingTransfer] = {}
+        self._incoming: dict[bytes, _IncomingTransfer] = {}
+        self._offers: dict[bytes, _PendingOffer] = {} # oldest first
+
+    async def _say(self, text: str) -> None:
+        logger.debug(f"[FileTransferUtilsForOG] {text}")
+        if self._notify is not None:
+            await self._notify(text)
+
+    @staticmethod
+    def _file_sha256(path: str) -> bytes:
+        """Hash a file with constant memory."""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while chunk := f.read(1024 * 1024):
+                digest.update(chunk)
+        return digest.digest()
+
+    @staticmethod
+    def _safe_name(name: Any) -> str | None:
+        name = os.path.basename(str(name or "")).strip()
+        if name in ("", ".", ".."):
+            return None
+        return name
+
+    def _unique_path(self, name: str) -> str:
+        path = os.path.join(self._download_dir, name)
+        stem, ext = os.path.splitext(name)
+        copy = 1
+        while os.path.exists(path):
+            path = os.path.join(self._download_dir, f"{stem} ({copy}){ext}")
+            copy += 1
+        return path
+
+    # ========================== #
+    # Sending
+    # ========================== #
+
+    async def send_file(self, websocket: websockets.ClientConnection, cipher: "SessionCipher", username: str, target: str, path: str, compression: str | None = None) -> bool:
+        """
+        Stream the file at `path` to `target`. Returns True once the receiver confirmed the checksum.
+        Chunks are compressed with `compression` unless the first chunk shows the file does not compress.
+        Raises FileTransferError if the transfer is cancelled or stalls, OSError if the file cannot be read.
+        """
+        size = os.path.getsize(path)
+        digest = await asyncio.to_thread(self._file_sha256, path)
+        transfer_id = digest[:16]
+
+        if transfer_id in self._outgoing:
+            raise FileTransferError("This file is already being sent.")
+
+        transfer = _OutgoingTransfer(path=path, size=size, target=target)
+        self._outgoing[transfer_id] = transfer
+
+        try:
+            await websocket.send(encode_binary_message(
+                type='file_offer',
+                sender=username,
+                target=target,
+                cipher=cipher,
+                message='file_offer',
+                transfer_id=transfer_id.hex(),
+                name=os.path.basename(path),
+                size=size,
+                sha256=digest.hex(),
+                chunk_size=self._chunk_size
+            ))
+
+            try:
+                offset = await asyncio.wait_for(transfer.accepted, timeout=self.ACCEPT_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise FileTransferError("Peer did not answer the file offer.")
+
+            transfer.acked = offset
+            if offset:
+                await self._say(f"Resuming {os.path.basename(path)} at {offset}/{size} bytes")
+
+            window_bytes = self._window * self._chunk_size
+
+            # Unbuffered reads into one reusable buffer keep memory constant regardless of the file size
+            with open(path, 'rb', buffering=0) as f:
+                f.seek(offset)
+                buffer = bytearray(self._chunk_size)
+                view = memoryview(buffer)
+                probe_compression = compression is not None
+
+                while offset < size:
+                    # Windowed flow control: wait for the receiver to catch up
+                    while offset - transfer.acked >= window_bytes and transfer.error is None:
+                        transfer.ack_event.clear()
+                        try:
+                            await asyncio.wait_for(transfer.ack_event.wait(), timeout=self.ACK_TIMEOUT)
+                        except asyncio.TimeoutError:
+                            raise FileTransferError("Transfer stalled, no acknowledgement from peer.")
+
+                    if transfer.error is not None:
+                        raise FileTransferError(transfer.error)
+
+                    read = f.readinto(buffer)
+                    if not read:
+                        raise FileTransferError("File was truncated while being sent.")
+
+                    # Already compressed or random data: stop spending CPU on compression after the first chunk
+                    if probe_compression:
+                        probe_compression = False
+                        if compress(view[:read], compression)[1] is None:
+                            compression = None
+
+                    await websocket.send(encode_file_chunk(target=target, transfer_id=transfer_id, offset=offset, data=view[:read], cipher=cipher, compression=compression))
+                    offset += read
+
+            try:
+                return await asyncio.wait_for(transfer.completed, timeout=self.ACK_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise FileTransferError("Peer did not confirm the transfer.")
+
+        except (asyncio.CancelledError, FileTransferError, OSError) as e:
+            # Let the receiver keep its partial file for a later resume
+            reason = "Transfer cancelled by sender." if isinstance(e, asyncio.CancelledError) else str(e)
+            try:
+                await self._send_control(websocket, cipher, username, target, 'file_cancel', transfer_id, reason=reason)
+            except Exception:
+                pass
+            raise
+
+        finally:
+            del self._outgoing[transfer_id]
+
+    # ========================== #
+    # Receiving
+    # ========================== #
+
+    async def _send_control(self, websocket: websockets.ClientConnection, cipher: "SessionCipher", username: str, target: str, type: str, transfer_id: bytes, **kwargs: Any) -> None:
+        await websocket.send(encode_binary_message(
+            type=type,
+            sender=username,
+            target=target,
+            cipher=cipher,
+            message=type,
+            transfer_id=transfer_id.hex(),
+            **kwargs
+        ))
+
+    async def handle_message(self, decoded: dict[str, Any], websocket: websockets.ClientConnection, cipher: "SessionCipher", username: str) -> None:
+        """Handle a decrypted file transfer control message (one of FILE_MESSAGE_TYPES)."""
+        msg_type = decoded.get('type')
+        sender = str(decoded.get('sender'))
+
+        try:
+            transfer_id = bytes.fromhex(str(decoded.get('transfer_id')))
+        except ValueError:
+            logger.warning(f"[FileTransferUtilsForOG.handle_message] Invalid transfer id in {msg_type}")
+            return
+
+        if msg_type == 'file_offer':
+            await self._accept_offer(decoded, transfer_id, websocket, cipher, username, sender)
+
+        elif msg_type == 'file_accept':
+            outgoing = self._outgoing.get(transfer_id)
+            if outgoing and not outgoing.accepted.done():
+                outgoing.accepted.set_result(max(0, min(int(decoded.get('offset', 0)), outgoing.size)))
+
+        elif msg_type == 'file_ack':
+            outgoing = self._outgoing.get(transfer_id)
+            if outgoing:
+                outgoing.acked = max(outgoing.acked, int(decoded.get('offset', 0)))
+                outgoing.ack_event.set()
+
+        elif msg_type == 'file_complete':
+            outgoing = self._outgoing.get(transfer_id)
+            if outgoing and not outgoing.completed.done():
+                outgoing.completed.set_result(bool(decoded.get('ok')))
+
+        elif msg_type == 'file_cancel':
+            reason = decoded.get('reason', 'cancelled')
+            outgoing = self._outgoing.get(transfer_id)
+            if outgoing:
+                outgoing.fail(f"Peer cancelled the transfer: {reason}")
+            offer = self._offers.pop(transfer_id, None)
+            if offer:
+                await self._say(f"@{offer.sender} withdrew the offer of {offer.name}")
+            incoming = self._incoming.pop(transfer_id, None)
+            if incoming:
+                incoming.file.close()
+                await self._say(f"Transfer of {incoming.name} interrupted at {incoming.offset}/{incoming.size} bytes ({reason}). Offer it again to resume.")
+
+    async def _accept_offer(self, decoded: dict[str, Any], transfer_id: bytes, websocket: websockets.ClientConnection, cipher: "SessionCipher", username: str, sender: str) -> None:
+        name = self._safe_name(decoded.get('name'))
+        try:
+            size = int(decoded.get('size', -1))
+            chunk_size = int(decoded.get('chunk_size', self._chunk_size))
+        except (TypeError, ValueError):
+            size, chunk_size = -1, 0
+
+        if name is None or size < 0 or chunk_size <= 0:
+            await self._send_control(websocket, cipher, username, sender, 'file_cancel', transfer_id, reason='invalid offer')
+            return
+
+        if self._max_file_size is not None and size > self._max_file_size:
+            await self._say(f"Refused {name} ({size} bytes) from @{sender}: over the {self._max_file_size} bytes limit (--max-file-size)")
+            await self._send_control(websocket, cipher, username, sender, 'file_cancel', transfer_id, reason='file too large')
+            return
+
+        # A re-offer of a transfer we are still receiving (e.g. the sender restarted it) replaces the old state
+        previous = self._incoming.pop(transfer_id, None)
+        if previous:
+            previous.file.close()
+
+        offer = _PendingOffer(sender=sender, name=name, size=size, sha256=str(decoded.get('sha256', '')), chunk_size=chunk_size, websocket=websocket, cipher=cipher, username=username)
+
+        # A transfer the user accepted before resumes without asking again, scripts never ask
+        if self._auto_accept or os.path.exists(self._part_path(transfer_id)):
+            await self._start_receiving(transfer_id, offer)
+            return
+
+        self._offers.pop(transfer_id, None)
+        self._offers[transfer_id] = offer
+        await self._say(f"@{sender} offers {name} ({size} bytes). Answer within {self.ACCEPT_TIMEOUT}s with /accept_file or /reject_file")
+
+    def _part_path(self, transfer_id: bytes) -> str:
+        return os.path.join(self._download_dir, f"{transfer_id.hex()}.part")
+
+    def _find_offer(self, name: str | None) -> tuple[bytes, _PendingOffer] | None:
+        """The oldest pending offer, or the one of file `name`. Offers the sender stopped waiting for are dropped."""
+        now = asyncio.get_running_loop().time()
+        for transfer_id in [key for key, offer in self._offers.items() if now - offer.received_at > self.ACCEPT_TIMEOUT]:
+            del self._offers[transfer_id]
+        for transfer_id, offer in self._offers.items():
+            if not name or offer.name == name:
+                return transfer_id, offer
+        return None
+
+    def pending_offers(self) -> list[str]:
+        return [f"{offer.name} ({offer.size} bytes) from @{offer.sender}" for offer in self._offers.values()]
+
+    async def answer_offer(self, accept: bool, name: str | None = None) -> bool:
+        """Accepts or rejects the oldest pending offer, or the one of file `name`. False if there is none."""
+        found = self._find_offer(name)
+        if found is None:
+            return False
+        transfer_id, offer = found
+        del self._offers[transfer_id]
+
+        if accept:
+            await self._start_receiving(transfer_id, offer)
+        else:
+            await self._say(f"Rejected {offer.name} from @{offer.sender}")
+            await self._send_control(offer.websocket, offer.cipher, offer.username, offer.sender, 'file_cancel', transfer_id, reason='rejected')
+        return True
+
+    async def _start_receiving(self, transfer_id: bytes, offer: _PendingOffer) -> None:
+        websocket, cipher, username, sender, name, size, chunk_size = offer.websocket, offer.cipher, offer.username, offer.sender, offer.name, offer.size, offer.chunk_size
+
+        os.makedirs(self._download_dir, exist_ok=True)
+        part_path = self._part_path(transfer_id)
+
+        # Resume from whole chunks kept from an interrupted attempt
+        offset = 0
+        if os.path.exists(part_path):
+            existing = os.path.getsize(part_path)
+            offset = existing - (existing % chunk_size) if existing <= size else 0
+
+        free = shutil.disk_usage(self._download_dir).free
+        if size - offset > free - self.DISK_MARGIN:
+            await self._say(f"Refused {name} ({size} bytes) from @{sender}: only {free} bytes free in {self._download_dir}")
+            await self._send_control(websocket, cipher, username, sender, 'file_cancel', transfer_id, reason='not enough disk space')
+            return
+
+        file = open(part_path, 'r+b' if os.path.exists(part_path) else 'w+b')
+        file.truncate(offset)
+        file.seek(offset)
+
+        incoming = _IncomingTransfer(sender=sender, name=name, size=size, sha256=offer.sha256, part_path=part_path, file=file, offset=offset)
+        self._incoming[transfer_id] = incoming
+
+        await self._say(f"Receiving {name} ({size} bytes) from @{sender}" + (f", resuming at {offset} bytes" if offset else ""))
+        await self._send_control(websocket, cipher, username, sender, 'file_accept', transfer_id, offset=offset)
+
+        if offset == size:
+            await self._finish(transfer_id, incoming, websocket, cipher, username)
+
+    async def handle_chunk(self, plaintext: bytes, websocket: websockets.ClientConnection, cipher: "SessionCipher", username: str) -> None:
+        """Handle a decrypted FRAME_KIND_FILE_CHUNK payload."""
+        transfer_id, offset, data = parse_file_chunk(plaintext)
+        incoming = self._incoming.get(transfer_id)
+
+        if incoming is None:
+            logger.debug("[FileTransferUtilsForOG.handle_chunk] Chunk for an unknown transfer, ignoring.")
+            return
+
+        if offset != incoming.offset or offset + len(data) > incoming.size:
+            logger.warning(f"[FileTransferUtilsForOG.handle_chunk] Unexpected chunk at {offset} (expected {incoming.offset}), cancelling.")
+            self._incoming.pop(transfer_id)
+            incoming.file.close()
+            await self._send_control(websocket, cipher, username, incoming.sender, 'file_cancel', transfer_id, reason='unexpected chunk')
+            return
+
+        incoming.file.write(data)
+        incoming.offset += len(data)
+        incoming.chunks_since_ack += 1
+
+        if incoming.offset == incoming.size:
+            await self._finish(transfer_id, incoming, websocket, cipher, username)
+        elif incoming.chunks_since_ack >= self._window // 2:
+            incoming.chunks_since_ack = 0
+            await self._send_control(websocket, cipher, username, incoming.sender, 'file_ack', transfer_id, offset=incoming.offset)
+
+    async def _finish(self, transfer_id: bytes, incoming: _IncomingTransfer, websocket: websockets.ClientConnection, cipher: "SessionCipher", username: str) -> None:
+        self._incoming.pop(transfer_id, None)
+        incoming.file.close()
+
+        digest = await asyncio.to_thread(self._file_sha256, incoming.part_path)
+        ok = digest.hex() == incoming.sha256
+
+        if ok:
+            final_path = self._unique_path(incoming.name)
+            os.replace(incoming.part_path, final_path)
+            await self._say(f"Received {incoming.name} from @{incoming.sender}, saved to {final_path}")
+        else:
+            os.remove(incoming.part_path)
+            await self._say(f"Checksum mismatch for {incoming.name} from @{incoming.sender}, file discarded")
+
+        await self._send_control(websocket, cipher, username, incoming.sender, 'file_complete', transfer_id, ok=ok, offset=incoming.offset)
+
+    def reset(self) -> None:
+        """Abort every transfer, e.g. when the tunnel closes. Partial files are kept for resuming."""
+        for outgoing in self._outgoing.values():
+            outgoing.fail("Tunnel closed.")
+        for incoming in self._incoming.values():
+            incoming.file.close()
+        self._incoming.clear()
+        self._offers.clear()
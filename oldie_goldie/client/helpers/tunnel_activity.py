@@ -6,7 +6,9 @@ first what do we need to do
 4. Compute shared secret
 """
 import websockets
-from oldie_goldie.shared import SecureMethodsForOG, encode_message
+from oldie_goldie.shared import SecureMethodsForOG, SessionCipher, encode_message
+from oldie_goldie.shared.protocol import FEATURE_BINARY_FRAMES, FEATURE_FILE_TRANSFER
+from oldie_goldie.shared.compression import available_codecs, negotiate_codec
 import base64
 import logging
 logging.basicConfig(
@@ -18,28 +20,35 @@ logger = logging.getLogger(__name__)
 
 class TunnelActivityUtilsForOG:
 
+    # Tunnel features this client supports, advertised to the peer along with the public key.
+    # The compression codecs we can decode are advertised as features too.
+    FEATURES = (FEATURE_BINARY_FRAMES, FEATURE_FILE_TRANSFER) + available_codecs()
+
     def __init__(self):
         self._private_key = None
         self._public_key = None
         self._shared_secret = None
         self._session_key = None
+        self._session_cipher = None
         self._peer_public_key_bytes = None
         self._psk_hash = None
+        self._peer_features: set[str] = set()
 
-    async def handle_key_share(self, websocket: websockets.ClientConnection, username: str, target: str):
-        try:
-            priv_key, pub_key = SecureMethodsForOG.generate_key_pair()
+    def prepare_ephemeral_key(self) -> str:
+        """Generates this tunnel's X25519 key pair and returns the public key, base64 encoded for json transport."""
+        priv_key, pub_key = SecureMethodsForOG.generate_key_pair()
 
-            # Update the instance variables
-            self._private_key = priv_key
-            self._public_key = pub_key
+        # Update the instance variables
+        self._private_key = priv_key
+        self._public_key = pub_key
 
-            # the pub_key is of type X25519PublicKey, convert it to bytes
-            pub_key_bytes = SecureMethodsForOG.public_key_to_bytes(pub_key)
+        # the pub_key is of type X25519PublicKey, convert it to bytes
+        pub_key_bytes = SecureMethodsForOG.public_key_to_bytes(pub_key)
+        return base64.b64encode(pub_key_bytes).decode()
 
-            # encode those bytes to base 64 to make it
-            #  suitable for json transport
-            encoded_pub_key_bytes = base64.b64encode(pub_key_bytes).decode()
+    async def handle_key_share(self, websocket: websockets.ClientConnection, username: str, target: str):
+        try:
+            encoded_pub_key_bytes = self.prepare_ephemeral_key()
 
             logger.debug(f'[TunnelActivityUtilsForOG.handle_key_share] Encoded Pub Key: {encoded_pub_key_bytes}')
 
@@ -48,6 +57,7 @@ class TunnelActivityUtilsForOG:
                 sender=username,
                 type='key_share',
                 key=encoded_pub_key_bytes,
+                features=list(self.FEATURES),
                 target = target,
                 message='sharing public key'
             )
@@ -56,6 +66,18 @@ class TunnelActivityUtilsForOG:
         except Exception as e:
             logger.error(f"[TunnelActivityUtilsForOG.handle_key_share] Unknown Exception: {e}")
 
+    def psk_proof(self, requester: str, responder: str) -> str:
+        """Fast handshake: the base64 PSK proof the server compares between both peers."""
+        proof = SecureMethodsForOG.derive_psk_proof(psk_hash=self._psk_hash, requester=requester, responder=responder)
+        return base64.b64encode(proof).decode()
+
+    def complete_handshake(self, encoded_peer_public_key: str, features: list[str] | None) -> None:
+        """Derives the session from the peer's public key, once the PSK hash and our key pair are set."""
+        self.set_peer_public_key(encoded_peer_public_key)
+        self.set_peer_features(features)
+        self.handle_shared_secret()
+        self.handle_session_secret()
+
     def handle_shared_secret(self):
         shared_secret = SecureMethodsForOG.derive_shared_secret(self._private_key, self._peer_public_key_bytes)
         self._shared_secret = shared_secret
@@ -63,11 +85,24 @@ class TunnelActivityUtilsForOG:
     def handle_session_secret(self):
         session_key = SecureMethodsForOG.derive_session_key(psk_hash=self._psk_hash, shared_secret=self._shared_secret)
         self._session_key = session_key
+
+        # Bind a cipher to the fresh key, it keeps the AES-GCM context and the nonce counters for the whole tunnel
+        self._session_cipher = SessionCipher(session_key)
     
     def set_peer_public_key(self, encoded_peer_public_key: str):
         decoded_peer_public_key_bytes = base64.b64decode(encoded_peer_public_key)
         self._peer_public_key_bytes = decoded_peer_public_key_bytes
     
+    def set_peer_features(self, features: list[str] | None) -> None:
+        self._peer_features = set(features or [])
+
+    def peer_supports(self, feature: str) -> bool:
+        return feature in self._peer_features
+
+    def negotiated_compression(self) -> str | None:
+        """The compression codec to apply before encrypting for this peer, None if there is no common codec."""
+        return negotiate_codec(self._peer_features)
+
     def set_psk_hash(self, psk_hash: bytes) -> None:
         self._psk_hash = psk_hash
 
@@ -79,11 +114,16 @@ class TunnelActivityUtilsForOG:
     
     def get_session_key(self) -> bytes | None:
         return self._session_key
-    
+
+    def get_session_cipher(self) -> SessionCipher | None:
+        return self._session_cipher
+
     async def reset(self) -> None:
         self._private_key = None
         self._public_key = None
         self._shared_secret = None
         self._session_key = None
+        self._session_cipher = None
         self._peer_public_key_bytes = None
-        self._psk_hash = None
\ No newline at end of file
+        self._psk_hash = None
+        self._peer_features = set()
@@ -0,0 +1,313 @@
+"""Headless, programmatic Oldie Goldie client.
+
+`OGClient` speaks the same protocol as og-client without any terminal UI: no
+prompt_toolkit import and no module globals, so bots, tests and load generators
+can run thousands of instances in one process.
+
+    async with OGClient("ws://localhost:8765", token=...) as client:
+        await client.register("alice")
+        await client.request_tunnel("bob", psk="correct horse")
+        await client.send("hi bob")            # encrypted, the tunnel is up
+        async for message in client:           # decoded (and decrypted) messages
+            print(message["type"], message.get("sender"), message.get("message"))
+
+A single reader task per client decodes incoming frames, answers the tunnel
+handshake and queues everything else for iteration. Handshake steps (validate,
+key share, tunnel_ok...) are handled internally and are not yielded.
+"""
+import asyncio
+import base64
+import json
+import logging
+from typing import Any, AsyncIterator
+
+import websockets
+
+from oldie_goldie.client.helpers.tunnel_activity import TunnelActivityUtilsForOG
+from oldie_goldie.shared import SecureMethodsForOG, decode_binary_frame, decode_message, encode_binary_message, encode_message, make_register_message, make_system_request
+from oldie_goldie.shared.protocol import FEATURE_BINARY_FRAMES, FRAME_KIND_MESSAGE
+
+logger = logging.getLogger(__name__)
+
+# Messages that only drive the tunnel handshake, consumed by the reader
+_HANDSHAKE_TYPES = {"connect_accept", "tunnel_validate", "tunnel_ok_key_init", "key_share", "tunnel_ok"}
+
+class OGClientError(Exception):
+    """Raised when the server refuses a registration or a tunnel."""
+
+class OGClient:
+    """
+    Async client for one Oldie Goldie user.
+    - connect() / close(): open and close the websocket (or use `async with`)
+    - register(): claim a username
+    - request_tunnel() / accept_tunnel() / deny_tunnel() / exit_tunnel(): private tunnels
+    - send(): chat line, encrypted when a tunnel is active
+    - list_users(): usernames connected to the server
+    - async iteration: incoming messages as decoded dicts, ends when the connection closes
+
+    Extra keyword arguments go to websockets.connect, e.g. `unix=True, path="/run/og.sock"`
+    for a server listening on a Unix socket (og-server --listen unix:PATH).
+    """
+
+    def __init__(self, uri: str, token: str | None = None, fast_handshake: bool = True, timeout: float = 10.0, **connect_kwargs: Any):
+        self.uri = uri
+        self.token = token
+        self.fast_handshake = fast_handshake
+        self.timeout = timeout
+        self.connect_kwargs = connect_kwargs
+
+        self.websocket: websockets.ClientConnection | None = None
+        self.username: str | None = None
+        self.status = "idle" # idle, request_sent, request_received, tunnel_validating, tunnel_active, tunnel_suspended
+        self.peer: str | None = None
+
+        self._tunnel = TunnelActivityUtilsForOG()
+        self._offer: dict[str, Any] | None = None # fast handshake offer of an incoming connect_request
+        self._tunnel_ready: asyncio.Future | None = None
+        self._waiters: dict[str, list[asyncio.Future]] = {}
+        self._incoming: asyncio.Queue[dict[str, Any] | None] = asyncio.Queue()
+        self._reader_task: asyncio.Task | None = None
+        self._ticket: str | None = None # session ticket, presented when connecting again
+
+    # ==== #
+    # Connection
+    # ==== #
+
+    async def connect(self) -> "OGClient":
+        headers = [('Authorization', self.token)] if self.token else []
+        if self._ticket:
+            headers.append(('X-OG-Ticket', self._ticket))
+        self.websocket = await websockets.connect(self.uri, additional_headers=headers or None, open_timeout=self.timeout, **self.connect_kwargs)
+        return self
+
+    async def close(self) -> None:
+        if self.websocket is not None:
+            await self.websocket.close()
+        if self._reader_task is not None:
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+            self._reader_task = None
+
+    async def __aenter__(self) -> "OGClient":
+        return await self.connect()
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+    async def register(self, username: str) -> dict[str, Any]:
+        """Claims `username`. Returns the server's confirmation, raises OGClientError if it is refused."""
+        assert self.websocket is not None, "connect() first"
+        await self.websocket.send(make_register_message(username=username))
+        reply = decode_message(await asyncio.wait_for(self.websocket.recv(), timeout=self.timeout))
+        if reply.get("type") != "register":
+            raise OGClientError(reply.get("message", "Registration refused"))
+
+        self._keep_ticket(reply.get("ticket"))
+        self.username = username
+        self._reader_task = asyncio.create_task(self._reader())
+        return reply
+
+    # ==== #
+    # Tunnels
+    # ==== #
+
+    async def request_tunnel(self, peer: str, psk: str) -> None:
+        """Asks `peer` for a private tunnel and waits until it is established (the peer has to accept)."""
+        self._start_tunnel(peer, psk, status="request_sent")
+        message: dict[str, Any] = {"type": "connect_request", "sender": self.username, "target": peer, "message": "connect_request"}
+        if self.fast_handshake:
+            message.update(key=self._tunnel.prepare_ephemeral_key(), proof=self._tunnel.psk_proof(requester=self.username, responder=peer), features=list(self._tunnel.FEATURES)) # type: ignore
+        await self._send_json(**message)
+        await self._wait_tunnel()
+
+    async def accept_tunnel(self, peer: str, psk: str) -> None:
+        """Accepts the pending connect_request of `peer` and waits until the tunnel is established."""
+        if self.status != "request_received" or self.peer != peer:
+            raise OGClientError(f"No pending connection request from @{peer}")
+        offer = self._offer
+        self._start_tunnel(peer, psk, status="tunnel_validating")
+
+        message: dict[str, Any] = {"type": "connect_accept", "sender": self.username, "target": peer, "message": "connect_accept"}
+        if offer is not None:
+            # The requester offered the fast handshake: answer with our key and PSK proof
+            message.update(key=self._tunnel.prepare_ephemeral_key(), proof=self._tunnel.psk_proof(requester=peer, responder=self.username), features=list(self._tunnel.FEATURES)) # type: ignore
+        await self._send_json(**message)
+        await self._wait_tunnel()
+
+    async def deny_tunnel(self, peer: str) -> None:
+        await self._send_json(type="connect_deny", sender=self.username, target=peer, message="connect_deny")
+        await self._reset_tunnel()
+
+    async def exit_tunnel(self) -> None:
+        if self.status == "tunnel_active":
+            await self._send_json(type="tunnel_exit", sender=self.username, target=self.peer, message="tunnel_exit")
+        await self._reset_tunnel()
+
+    def _start_tunnel(self, peer: str, psk: str, status: str) -> None:
+        self.status, self.peer = status, peer
+        self._tunnel.set_psk_hash(SecureMethodsForOG.hash_psk(psk))
+        self._tunnel_ready = asyncio.get_running_loop().create_future()
+
+    async def _wait_tunnel(self) -> None:
+        try:
+            await asyncio.wait_for(asyncio.shield(self._tunnel_ready), timeout=self.timeout) # type: ignore
+        except (asyncio.TimeoutError, OGClientError):
+            await self._reset_tunnel()
+            raise
+
+    def _tunnel_done(self, error: str | None = None) -> None:
+        if self._tunnel_ready is not None and not self._tunnel_ready.done():
+            if error:
+                self._tunnel_ready.set_exception(OGClientError(error))
+            else:
+                self._tunnel_ready.set_result(None)
+
+    async def _reset_tunnel(self) -> None:
+        self.status, self.peer, self._offer = "idle", None, None
+        await self._tunnel.reset()
+
+    def _keep_ticket(self, ticket: str | None) -> None:
+        if ticket:
+            self._ticket = ticket
+
+    # ==== #
+    # Sending
+    # ==== #
+
+    async def send(self, text: str) -> None:
+        """Sends a chat line: to the tunnel peer (encrypted) while a tunnel is active, to everyone otherwise."""
+        assert self.websocket is not None and self.username is not None, "register() first"
+        cipher = self._tunnel.get_session_cipher()
+        if cipher is None or self.status != "tunnel_active":
+            await self.websocket.send(encode_message(message=text, sender=self.username))
+        elif self._tunnel.peer_supports(FEATURE_BINARY_FRAMES):
+            await self.websocket.send(encode_binary_message(message=text, sender=self.username, cipher=cipher, target=self.peer, compression=self._tunnel.negotiated_compression())) # type: ignore
+        else:
+            await self.websocket.send(encode_message(message=text, sender=self.username, type="encrypted_message", cipher=cipher, target=self.peer))
+
+    async def list_users(self) -> list[str]:
+        assert self.websocket is not None and self.username is not None, "register() first"
+        waiter = self._expect("system_response")
+        await self.websocket.send(make_system_request(need="list_users", username=self.username))
+        response = await asyncio.wait_for(waiter, timeout=self.timeout)
+        return list(response.get("res_info") or [])
+
+    async def _send_json(self, **fields: Any) -> None:
+        assert self.websocket is not None, "connect() first"
+        await self.websocket.send(encode_message(**fields))
+
+    # ==== #
+    # Receiving
+    # ==== #
+
+    def __aiter__(self) -> AsyncIterator[dict[str, Any]]:
+        return self.messages()
+
+    async def messages(self) -> AsyncIterator[dict[str, Any]]:
+        """Incoming messages, oldest first, until the connection closes."""
+        while (message := await self._incoming.get()) is not None:
+            yield message
+
+    async def receive(self, timeout: float | None = None) -> dict[str, Any] | None:
+        """Next incoming message, None once the connection is closed."""
+        return await asyncio.wait_for(self._incoming.get(), timeout=timeout)
+
+    def _expect(self, msg_type: str) -> asyncio.Future:
+        """A future resolved with the next message of `msg_type`, which is then not queued for iteration."""
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(msg_type, []).append(waiter)
+        return waiter
+
+    async def _reader(self) -> None:
+        assert self.websocket is not None
+        try:
+            async for frame in self.websocket:
+                try:
+                    decoded = self._decode(frame)
+                    if decoded is not None:
+                        await self._dispatch(decoded)
+                except Exception as e:
+                    logger.error(f"[OGClient._reader] @{self.username}: could not handle a frame: {e}")
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self._tunnel_done(error="Connection closed")
+            for waiters in self._waiters.values():
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.cancel()
+            self._waiters.clear()
+            self._incoming.put_nowait(None)
+
+    def _decode(self, frame: str | bytes) -> dict[str, Any] | None:
+        cipher = self._tunnel.get_session_cipher()
+        if isinstance(frame, bytes):
+            if cipher is None:
+                return None
+            kind, _, _, plaintext = decode_binary_frame(frame, cipher=cipher)
+            if kind != FRAME_KIND_MESSAGE:
+                return None # file chunks are for og-client
+            return json.loads(plaintext)
+        return decode_message(message_str=frame, cipher=cipher)
+
+    async def _dispatch(self, decoded: dict[str, Any]) -> None:
+        msg_type = decoded.get("type")
+        sender = decoded.get("sender")
+
+        if msg_type in _HANDSHAKE_TYPES:
+            await self._handshake_step(msg_type, decoded) # type: ignore
+            return
+
+        if msg_type == "connect_request":
+            if self.status != "idle":
+                await self._send_json(type="connect_busy", sender=self.username, target=sender, message="connect_busy")
+                return
+            self.status, self.peer = "request_received", sender
+            self._offer = decoded if decoded.get("key") else None
+
+        elif msg_type in ("connect_deny", "connect_busy", "connect_error", "tunnel_failed"):
+            self._tunnel_done(error=decoded.get("message") or msg_type)
+            await self._reset_tunnel()
+
+        elif msg_type == "tunnel_suspended" and sender == self.peer:
+            self._keep_ticket(decoded.get("ticket"))
+            self.status = "tunnel_suspended"
+
+        elif msg_type == "tunnel_resumed" and sender == self.peer:
+            self._keep_ticket(decoded.get("ticket"))
+            self.status = "tunnel_active"
+
+        elif msg_type == "tunnel_exit" or (msg_type == "user_disconnected" and decoded.get("username") == self.peer):
+            await self._reset_tunnel()
+
+        waiters = self._waiters.get(msg_type) # type: ignore
+        if waiters:
+            waiter = waiters.pop(0)
+            if not waiter.done():
+                waiter.set_result(decoded)
+                return
+        self._incoming.put_nowait(decoded)
+
+    async def _handshake_step(self, msg_type: str, decoded: dict[str, Any]) -> None:
+        sender = decoded.get("sender")
+
+        if msg_type == "tunnel_ok" and sender == self.peer:
+            # Fast handshake: the server matched both PSK proofs
+            self._tunnel.complete_handshake(encoded_peer_public_key=decoded["key"], features=decoded.get("features"))
+            self._keep_ticket(decoded.get("ticket"))
+            self.status = "tunnel_active"
+            self._tunnel_done()
+
+        elif msg_type == "connect_accept" and self.status == "request_sent":
+            self.status = "tunnel_validating"
+
+        elif msg_type == "tunnel_validate":
+            await self._send_json(type="tunnel_secret", sender=self.username, secret=base64.b64encode(self._tunnel.get_psk_hash() or b"").decode(), message="tunnel_secret")
+
+        elif msg_type == "tunnel_ok_key_init":
+            self._keep_ticket(decoded.get("ticket"))
+            await self._tunnel.handle_key_share(websocket=self.websocket, username=self.username, target=self.peer) # type: ignore
+
+        elif msg_type == "key_share" and sender == self.peer:
+            self._tunnel.complete_handshake(encoded_peer_public_key=decoded["key"], features=decoded.get("features"))
+            self.status = "tunnel_active"
+            self._tunnel_done()
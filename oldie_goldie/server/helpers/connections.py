@@ -0,0 +1,183 @@
+# server/helpers/connections.py
+"""One record per registered connection, indexed by username and by websocket.
+
+A record holds everything the server tracks about a connected user: its websocket, where it
+is in the tunnel life cycle, its tunnel peer (the peer's record, so relaying and cleanup need
+no search), a few counters and what the liveness monitor needs. Handshake state is only
+allocated while a tunnel is being set up.
+
+SessionTickets holds the session tickets of the users, findable by the ticket a reconnect presents.
+"""
+
+import asyncio
+import hashlib
+import time
+from collections.abc import MutableMapping
+from typing import Any, Iterator
+
+import websockets
+
+IDLE = "idle"
+VALIDATING = "validating" # PSK round trip in progress
+TUNNEL = "tunnel"
+
+class TunnelValidation:
+    """PSK validation of a tunnel being set up, shared by both records until it succeeds, fails or times out."""
+    __slots__ = ("requester", "responder", "secrets", "deadline")
+
+    def __init__(self, requester: "ConnectionRecord", responder: "ConnectionRecord", deadline: float):
+        self.requester = requester
+        self.responder = responder
+        self.secrets: dict[str, Any] = {}
+        self.deadline = deadline
+
+    @property
+    def pair(self) -> tuple[str, str]:
+        return self.requester.username, self.responder.username
+
+class ConnectionRecord:
+    """A registered user. `offers` and `validation` stay None unless a tunnel is being set up."""
+    __slots__ = (
+        "username", "websocket", "state", "peer", "token", "received", "relayed", "offers", "validation",
+        "fanout", "seen", "last_seen", "ping_interval", "ping", "ping_sent",
+    )
+
+    def __init__(self, username: str, websocket: websockets.ServerConnection, token: str | None = None):
+        self.username = username
+        self.websocket = websocket
+        self.state = IDLE
+        self.peer: ConnectionRecord | None = None # other end of the active tunnel
+        self.token = token # invite token the user registered with
+        self.received = 0 # frames received from the user
+        self.relayed = 0 # tunnel frames relayed to the peer
+        self.offers: set[tuple[str, str]] | None = None # fast handshake offers made or received, (requester, responder)
+        self.validation: TunnelValidation | None = None
+
+        # Liveness (server/helpers/liveness.py)
+        self.fanout = 0 # broadcast frames sent to the user since the last sweep
+        self.seen = 0 # `received` at the last sweep
+        self.last_seen = time.monotonic() # last frame or pong from the user
+        self.ping_interval = 0.0 # 0 until the first sweep
+        self.ping: asyncio.Future | None = None # pong waiter of the ping in flight
+        self.ping_sent = 0.0
+
+    def __repr__(self) -> str:
+        return f"<ConnectionRecord @{self.username} {self.state}{f' with @{self.peer.username}' if self.peer else ''}>"
+
+class ConnectionRegistry:
+    """Connection records by username and by websocket. Adding, finding and removing a record is O(1)."""
+
+    def __init__(self):
+        self.by_username: dict[str, ConnectionRecord] = {}
+        self.by_websocket: dict[websockets.ServerConnection, ConnectionRecord] = {}
+
+    def add(self, record: ConnectionRecord) -> None:
+        self.by_username[record.username] = record
+        self.by_websocket[record.websocket] = record
+
+    def remove(self, record: ConnectionRecord) -> ConnectionRecord | None:
+        """Unregisters the record and ends its tunnel. Returns the tunnel peer, None if there was no tunnel."""
+        if self.by_username.get(record.username) is record:
+            del self.by_username[record.username]
+        self.by_websocket.pop(record.websocket, None)
+        return self.close_tunnel(record)
+
+    def get(self, username: str | None) -> ConnectionRecord | None:
+        return self.by_username.get(username) if username else None
+
+    def of(self, websocket: websockets.ServerConnection) -> ConnectionRecord | None:
+        return self.by_websocket.get(websocket)
+
+    def __contains__(self, username: object) -> bool:
+        return username in self.by_username
+
+    def __len__(self) -> int:
+        return len(self.by_username)
+
+    def __iter__(self) -> Iterator[ConnectionRecord]:
+        return iter(list(self.by_username.values()))
+
+    def usernames(self) -> list[str]:
+        return list(self.by_username)
+
+    # ==== #
+    # Tunnels
+    # ==== #
+
+    @staticmethod
+    def open_tunnel(a: ConnectionRecord, b: ConnectionRecord) -> None:
+        a.peer, b.peer = b, a
+        a.state = b.state = TUNNEL
+        a.validation = b.validation = None
+
+    @staticmethod
+    def close_tunnel(record: ConnectionRecord) -> ConnectionRecord | None:
+        """Ends the tunnel of `record` on both ends. Returns the peer, None if there was no tunnel."""
+        peer = record.peer
+        record.peer = None
+        record.state = IDLE
+        if peer is not None and peer.peer is record:
+            peer.peer = None
+            peer.state = IDLE
+        return peer
+
+    @staticmethod
+    def in_tunnel_together(a: ConnectionRecord | None, b: ConnectionRecord | None) -> bool:
+        """True if both records are the two ends of the same active tunnel."""
+        return a is not None and b is not None and a.peer is b and b.peer is a
+
+    def tunnel_count(self) -> int:
+        return sum(1 for record in self.by_username.values() if record.peer is not None) // 2
+
+class SessionTickets(MutableMapping):
+    """
+    Session ticket records by username: {"ticket", "peer", "expiry"}. Also indexed by a digest
+    of the ticket, so finding the owner of a presented ticket is O(1) whatever the number of users.
+    Only `peer` and `expiry` may be changed in place, a new ticket means a new record.
+    """
+
+    def __init__(self):
+        self._records: dict[str, dict[str, Any]] = {}
+        self._owners: dict[bytes, str] = {} # sha256(ticket) -> username
+
+    @staticmethod
+    def _digest(ticket: str) -> bytes:
+        return hashlib.sha256(ticket.encode()).digest()
+
+    def __getitem__(self, username: str) -> dict[str, Any]:
+        return self._records[username]
+
+    def __setitem__(self, username: str, record: dict[str, Any]) -> None:
+        self._forget(username)
+        self._records[username] = record
+        self._owners[self._digest(record["ticket"])] = username
+
+    def __delitem__(self, username: str) -> None:
+        if username not in self._records:
+            raise KeyError(username)
+        self._forget(username)
+        del self._records[username]
+
+    def _forget(self, username: str) -> None:
+        previous = self._records.get(username)
+        if previous is not None and self._owners.get(self._digest(previous["ticket"])) == username:
+            del self._owners[self._digest(previous["ticket"])]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._records)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __repr__(self) -> str:
+        # Never dump the tickets
+        return f"<SessionTickets: {len(self._records)} ticket(s)>"
+
+    def owner(self, ticket: str) -> str | None:
+        """The username holding `ticket`, None if no one does."""
+        return self._owners.get(self._digest(ticket))
+
+    @staticmethod
+    def is_live(record: dict[str, Any], now: float) -> bool:
+        """False once the ticket of a user who dropped has run out."""
+        return record["expiry"] is None or now <= record["expiry"]
@@ -0,0 +1,141 @@
+# server/helpers/handoff.py
+"""Hand a running og-server over to a fresh process (graceful restart, SIGHUP).
+
+The old process starts its successor with one end of a socketpair (`--handoff-fd N`)
+and sends over it:
+1. the listening socket(s) and, in public mode, the cloudflared output pipe, as
+   SCM_RIGHTS ancillary data on a single marker byte
+2. a length-prefixed JSON document with the in-memory state to carry over
+
+The successor serves on the inherited sockets, so the port never stops accepting,
+then answers with READY. Only then does the old process stop accepting and drain.
+The socket stays open during the drain: the old process streams, as JSON lines, the
+state that still changes on its side (session tickets, invite tokens and the blocklist)
+and closes it once drained.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import struct
+import subprocess
+import sys
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+HANDOFF_ARG = "--handoff-fd"
+READY = b"R"
+MAX_FDS = 16
+
+_LENGTH = struct.Struct("!Q")
+
+def _successor_argv() -> list[str]:
+    """This process' arguments without a previous handoff's fd."""
+    argv, skip = [], False
+    for arg in sys.argv[1:]:
+        if skip:
+            skip = False
+        elif arg == HANDOFF_ARG:
+            skip = True
+        elif not arg.startswith(HANDOFF_ARG + "="):
+            argv.append(arg)
+    return argv
+
+def spawn_successor(module: str) -> tuple[subprocess.Popen, socket.socket]:
+    """Starts `python -m module` with this process' arguments and the child end of a socketpair."""
+    parent_sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        proc = subprocess.Popen(
+            [sys.executable, "-m", module, *_successor_argv(), HANDOFF_ARG, str(child_sock.fileno())],
+            pass_fds=(child_sock.fileno(),),
+        )
+    except Exception:
+        parent_sock.close()
+        raise
+    finally:
+        child_sock.close()
+    return proc, parent_sock
+
+def send_handoff(sock: socket.socket, fds: list[int], state: dict[str, Any]) -> None:
+    """Blocking, run it in a worker thread: the state of a busy server can take a while to write."""
+    payload = json.dumps(state, separators=(",", ":")).encode("utf-8")
+    socket.send_fds(sock, [b"\0"], fds)
+    sock.sendall(_LENGTH.pack(len(payload)) + payload)
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks, remaining = [], size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("Handoff socket closed early")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+def receive_handoff(fd: int) -> tuple[socket.socket, list[int], dict[str, Any]]:
+    """Successor side: returns the handoff socket, the inherited fds (in the order sent) and the state."""
+    sock = socket.socket(fileno=fd)
+    _, fds, _, _ = socket.recv_fds(sock, 1, MAX_FDS)
+    (length,) = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))
+    state = json.loads(_recv_exactly(sock, length))
+    logger.info(f"[receive_handoff] Received {len(fds)} fd(s) and {length} bytes of state from pid {os.getppid()}")
+    return sock, fds, state
+
+def notify_ready(sock: socket.socket) -> None:
+    """Successor side: tells the old process it is serving, it stops accepting from then on."""
+    try:
+        sock.sendall(READY)
+    except OSError:
+        sock.close()
+        raise
+
+class UpdateStream:
+    """Old process side: the updates sent to the successor during the drain, buffered until it is serving."""
+
+    def __init__(self):
+        self.pending: list[dict[str, Any]] = [] # taken back if the handoff fails
+        self.writer: asyncio.StreamWriter | None = None
+
+    @staticmethod
+    def _line(update: dict[str, Any]) -> bytes:
+        return json.dumps(update, separators=(",", ":")).encode("utf-8") + b"\n"
+
+    def send(self, update: dict[str, Any]) -> None:
+        if self.writer is None:
+            self.pending.append(update)
+        elif not self.writer.is_closing():
+            self.writer.write(self._line(update))
+
+    async def attach(self, sock: socket.socket) -> None:
+        """Starts writing to the handoff socket once the successor answered READY."""
+        _, self.writer = await asyncio.open_unix_connection(sock=sock)
+        self.writer.writelines(map(self._line, self.pending))
+        self.pending = []
+
+    async def close(self) -> None:
+        if self.writer is None:
+            return
+        try:
+            await self.writer.drain()
+            self.writer.close()
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError) as e:
+            logger.warning(f"[UpdateStream] The new server stopped reading updates: {e}")
+
+async def follow_predecessor(sock: socket.socket, apply: Callable[[dict[str, Any]], None]) -> None:
+    """Successor side: applies the old process' updates until it closes the handoff socket, drained or gone."""
+    sock.setblocking(False)
+    reader, writer = await asyncio.open_unix_connection(sock=sock)
+    updates = 0
+    try:
+        async for line in reader:
+            apply(json.loads(line))
+            updates += 1
+    except (ConnectionError, ValueError) as e:
+        logger.warning(f"[follow_predecessor] Handoff updates cut short: {e}")
+    finally:
+        writer.close()
+    logger.info(f"[follow_predecessor] The old server is done, {updates} update(s) applied")
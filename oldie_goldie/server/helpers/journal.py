@@ -0,0 +1,326 @@
+# server/helpers/journal.py
+"""Append-only event journal of og-server (og-server --journal DIR) and its reader (og-journal).
+
+Events are JSON lines, one object per event:
+
+    {"ts": 1760000000.123, "seq": 42, "event": "tunnel_established", "requester": "alice", ...}
+
+`record()` only appends to an in-memory buffer. A committer task hands the buffer to a
+dedicated thread which writes and fsyncs it in one go, either every `commit_interval`
+seconds or as soon as `commit_events` events are waiting (group commit). Events recorded
+while a commit is in flight go into the next one, so journaling never blocks the event
+loop and costs one fsync per batch rather than per event.
+
+Segments are named journal-<first seq>.jsonl and rotate once they reach `segment_bytes`.
+Every start opens a new segment, a torn last line left by a crash stays in the previous one.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Iterator, TextIO
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COMMIT_INTERVAL = 0.05 # seconds
+DEFAULT_COMMIT_EVENTS = 256
+DEFAULT_SEGMENT_BYTES = 16 * 1024 * 1024
+
+SEGMENT_PREFIX = "journal-"
+SEGMENT_SUFFIX = ".jsonl"
+
+def list_segments(directory: str) -> list[str]:
+    """Segment paths of a journal directory, oldest first."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    segments = [name for name in names if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)]
+    return [os.path.join(directory, name) for name in sorted(segments, key=lambda name: int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))]
+
+def _last_seq(path: str) -> int:
+    """Sequence number of the last complete event of a segment, 0 if there is none."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 64 * 1024))
+        for line in reversed(f.read().splitlines()):
+            try:
+                return int(json.loads(line)["seq"])
+            except (ValueError, KeyError, TypeError):
+                continue
+    return 0
+
+class EventJournal:
+    """
+    Group-committed, segmented JSON-lines journal.
+    - start() / close(): run and stop the committer
+    - record(): add an event, never blocks
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        commit_interval: float = DEFAULT_COMMIT_INTERVAL,
+        commit_events: int = DEFAULT_COMMIT_EVENTS,
+        segment_bytes: int = DEFAULT_SEGMENT_BYTES,
+        fsync: bool = True,
+    ):
+        self.directory = directory
+        self.commit_interval = commit_interval
+        self.commit_events = commit_events
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+
+        self._buffer: list[tuple[float, int, str, dict[str, Any]]] = []
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self._committer_task: asyncio.Task | None = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="og-journal")
+        self._file: TextIO | None = None
+        self._segment_size = 0
+
+        # Only touched by the journal thread
+        self.commits = 0
+        self.committed_events = 0
+
+    async def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        segments = list_segments(self.directory)
+        if segments:
+            self._seq = await asyncio.get_running_loop().run_in_executor(self._executor, _last_seq, segments[-1])
+        self._committer_task = asyncio.create_task(self._committer())
+
+    async def close(self) -> None:
+        """Commits what is still buffered and closes the current segment."""
+        if self._committer_task is not None:
+            self._committer_task.cancel()
+            await asyncio.gather(self._committer_task, return_exceptions=True)
+            self._committer_task = None
+
+        loop = asyncio.get_running_loop()
+        if self._buffer:
+            batch, self._buffer = self._buffer, []
+            await loop.run_in_executor(self._executor, self._commit, batch)
+        await loop.run_in_executor(self._executor, self._close_segment)
+        self._executor.shutdown(wait=False)
+
+    def record(self, event: str, **fields: Any) -> None:
+        """Adds an event to the next commit."""
+        self._seq += 1
+        self._buffer.append((time.time(), self._seq, event, fields))
+        if len(self._buffer) >= self.commit_events:
+            self._wakeup.set()
+
+    async def _committer(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.commit_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            if not self._buffer:
+                continue
+            batch, self._buffer = self._buffer, []
+            try:
+                await loop.run_in_executor(self._executor, self._commit, batch)
+            except OSError as e:
+                logger.error(f"[EventJournal] Could not commit {len(batch)} event(s): {e}")
+
+    # ==== #
+    # Journal thread
+    # ==== #
+
+    def _commit(self, batch: list[tuple[float, int, str, dict[str, Any]]]) -> None:
+        data = "".join(json.dumps({"ts": round(ts, 6), "seq": seq, "event": event, **fields}, default=str) + "\n" for ts, seq, event, fields in batch)
+
+        if self._file is None or self._segment_size >= self.segment_bytes:
+            self._open_segment(first_seq=batch[0][1])
+
+        assert self._file is not None
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+        self._segment_size += len(data)
+        self.commits += 1
+        self.committed_events += len(batch)
+
+    def _open_segment(self, first_seq: int) -> None:
+        self._close_segment()
+        path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{first_seq:012d}{SEGMENT_SUFFIX}")
+        self._file = open(path, "a", encoding="utf-8")
+        self._segment_size = self._file.tell()
+
+    def _close_segment(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+# ==== #
+# Reader
+# ==== #
+
+def _segment_first_ts(path: str) -> float | None:
+    with open(path, "rb") as f:
+        try:
+            return float(json.loads(f.readline())["ts"])
+        except (ValueError, KeyError, TypeError):
+            return None
+
+def iter_events(
+    directory: str,
+    events: set[str] | None = None,
+    user: str | None = None,
+    since: float | None = None,
+    until: float | None = None,
+) -> Iterator[tuple[str, dict[str, Any]]]:
+    """
+    Streams the matching events as (raw line, event), oldest first.
+    Whole segments are skipped on their mtime and first timestamp, and lines are matched
+    as text before being parsed, so only candidate lines are decoded.
+    """
+    event_markers = tuple(f'"event": "{event}"' for event in events) if events else None
+    user_marker = f'"{user}"' if user else None
+
+    for path in list_segments(directory):
+        # The mtime is the time of the last commit of the segment
+        if since is not None and os.path.getmtime(path) < since:
+            continue
+        if until is not None:
+            first_ts = _segment_first_ts(path)
+            if first_ts is not None and first_ts > until:
+                break
+
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if event_markers and not any(marker in line for marker in event_markers):
+                    continue
+                if user_marker and user_marker not in line:
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue # torn line at the end of a segment
+
+                ts = event.get("ts", 0)
+                if since is not None and ts < since:
+                    continue
+                if until is not None and ts > until:
+                    return
+                if user and user not in (value for key, value in event.items() if key not in ("ts", "seq", "event")):
+                    continue
+                yield line, event
+
+def follow_events(
+    directory: str,
+    after_seq: int = 0,
+    events: set[str] | None = None,
+    user: str | None = None,
+    poll_interval: float = 0.5,
+) -> Iterator[tuple[str, dict[str, Any]]]:
+    """Tails the journal like `tail -f`: yields the matching events committed after `after_seq`, forever."""
+    path, offset, pending = None, 0, ""
+    while True:
+        segments = list_segments(directory)
+        if path is None and segments:
+            path = segments[-1]
+
+        if path is not None:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                f.seek(offset)
+                chunk = f.read()
+                offset = f.tell()
+
+            # Keep a partly committed line for the next poll
+            lines = (pending + chunk).split("\n")
+            pending = lines.pop()
+            for line in lines:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event.get("seq", 0) <= after_seq:
+                    continue
+                after_seq = event["seq"]
+                if events and event.get("event") not in events:
+                    continue
+                if user and user not in (value for key, value in event.items() if key not in ("ts", "seq", "event")):
+                    continue
+                yield line + "\n", event
+
+            # The old segment was read to its end above, move on once the server rotated
+            if segments and segments[-1] != path:
+                path, offset, pending = segments[-1], 0, ""
+                continue
+
+        sys.stdout.flush()
+        time.sleep(poll_interval)
+
+def _parse_time(value: str) -> float:
+    """Epoch seconds, an ISO date/time, or a duration back from now such as 90s, 15m, 2h, 1d."""
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if value and value[-1] in units and value[:-1].replace(".", "", 1).isdigit():
+        return time.time() - float(value[:-1]) * units[value[-1]]
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid time: {value!r}")
+
+def _format_event(event: dict[str, Any]) -> str:
+    when = datetime.fromtimestamp(event.get("ts", 0)).isoformat(sep=" ", timespec="milliseconds")
+    fields = " ".join(f"{key}={value}" for key, value in event.items() if key not in ("ts", "seq", "event"))
+    return f"{when} #{event.get('seq')} {event.get('event')} {fields}".rstrip()
+
+def cli():
+    """Entry point for 'og-journal' command."""
+    p = argparse.ArgumentParser(description="Stream and filter the event journal written by og-server --journal")
+    p.add_argument("directory", help="journal directory")
+    p.add_argument("--event", nargs="+", help="only these event types (e.g. tunnel_failed token_rejected)")
+    p.add_argument("--user", help="only events involving this username")
+    p.add_argument("--since", type=_parse_time, help="start time: epoch seconds, ISO date/time or a duration back from now (30m, 2h, 1d)")
+    p.add_argument("--until", type=_parse_time, help="end time, same formats as --since")
+    p.add_argument("--json", action="store_true", help="print the raw JSON lines (for jq and friends)")
+    p.add_argument("--count", action="store_true", help="only print the number of events per type")
+    p.add_argument("--follow", "-f", action="store_true", help="keep printing new events as they are committed")
+    args = p.parse_args()
+
+    counts: dict[str, int] = {}
+    last_seq = 0 # the follow mode picks up after the last event read
+    events = set(args.event) if args.event else None
+
+    def emit(line: str, event: dict[str, Any]) -> None:
+        if args.count:
+            counts[event.get("event", "?")] = counts.get(event.get("event", "?"), 0) + 1
+        else:
+            sys.stdout.write(line if args.json else _format_event(event) + "\n")
+
+    try:
+        for line, event in iter_events(args.directory, events=events, user=args.user, since=args.since, until=args.until):
+            emit(line, event)
+            last_seq = event.get("seq", last_seq)
+
+        if args.follow:
+            for line, event in follow_events(args.directory, after_seq=last_seq, events=events, user=args.user):
+                emit(line, event)
+    except KeyboardInterrupt:
+        pass
+    except BrokenPipeError:
+        sys.stderr.close()
+        return
+
+    if args.count:
+        for name, count in sorted(counts.items(), key=lambda item: -item[1]):
+            print(f"{count:>8}  {name}")
@@ -0,0 +1,128 @@
+# server/helpers/listeners.py
+"""Listening sockets for og-server (`--listen`).
+
+Addresses:
+- HOST:PORT      IPv4 or a hostname, e.g. 0.0.0.0:8765, 127.0.0.1:8765
+- [HOST]:PORT    IPv6, e.g. [::]:8765, [::1]:8765 (IPv6 only, so it can sit next to 0.0.0.0 on the same port)
+- unix:PATH      Unix domain socket, for same-host clients (cloudflared, bots, a reverse proxy)
+
+The sockets are bound here rather than by websockets.serve() so that any number of them can
+be served, and handed over as they are on a graceful restart.
+"""
+
+import errno
+import ipaddress
+import logging
+import os
+import socket
+import stat
+
+logger = logging.getLogger(__name__)
+
+UNIX_PREFIX = "unix:"
+BACKLOG = 1024
+
+def parse_listen_address(address: str) -> tuple[str, str, int]:
+    """Returns (family, host or path, port), family being "unix", "ipv4" or "ipv6". Raises ValueError."""
+    if address.startswith(UNIX_PREFIX):
+        path = address[len(UNIX_PREFIX):]
+        if not path:
+            raise ValueError(f"{address!r}: missing socket path")
+        return "unix", path, 0
+
+    host, sep, port_text = address.rpartition(":")
+    if not sep or not port_text.isdigit() or not 0 <= int(port_text) <= 65535:
+        raise ValueError(f"{address!r}: expected HOST:PORT, [IPV6]:PORT or unix:PATH")
+    if host.startswith("[") and host.endswith("]"):
+        host = host[1:-1]
+        try:
+            ipaddress.IPv6Address(host)
+        except ValueError:
+            raise ValueError(f"{address!r}: {host!r} is not an IPv6 address") from None
+        return "ipv6", host, int(port_text)
+    if not host or ":" in host:
+        raise ValueError(f"{address!r}: put IPv6 addresses in brackets, e.g. [::]:8765")
+    return "ipv4", host, int(port_text)
+
+def open_listener(address: str) -> socket.socket:
+    """
+    Binds and listens on `address`. A stale Unix socket file from a previous run is replaced,
+    one a server still accepts on raises OSError(EADDRINUSE).
+    """
+    family, host, port = parse_listen_address(address)
+
+    if family == "unix":
+        try:
+            if stat.S_ISSOCK(os.stat(host).st_mode):
+                _remove_stale_unix_socket(host)
+        except FileNotFoundError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(host)
+        except OSError:
+            sock.close()
+            raise
+
+    else:
+        sock = socket.socket(socket.AF_INET6 if family == "ipv6" else socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if family == "ipv6":
+                sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+            sock.bind((host, port))
+        except OSError:
+            sock.close()
+            raise
+
+    sock.listen(BACKLOG)
+    sock.setblocking(False)
+    return sock
+
+def _remove_stale_unix_socket(path: str) -> None:
+    """Unlinks a socket file nobody listens on anymore, found by connecting to it."""
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        logger.info(f"[open_listener] Replacing the stale socket file {path}")
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(errno.EADDRINUSE, os.strerror(errno.EADDRINUSE), path)
+
+def describe_listener(sock: socket.socket) -> str:
+    """The address of a listening socket in --listen syntax."""
+    if sock.family == socket.AF_UNIX:
+        return UNIX_PREFIX + sock.getsockname()
+    host, port = sock.getsockname()[:2]
+    return f"[{host}]:{port}" if sock.family == socket.AF_INET6 else f"{host}:{port}"
+
+def unix_socket_path(sock: socket.socket) -> str | None:
+    return sock.getsockname() if sock.family == socket.AF_UNIX else None
+
+def tunnel_origin(listeners: list[socket.socket]) -> tuple[str, str]:
+    """
+    Where cloudflared should send its traffic: ("unix", path) when there is a Unix socket,
+    the loopback path being cheaper, otherwise ("url", http://host:port) of the first TCP listener.
+    """
+    for sock in listeners:
+        path = unix_socket_path(sock)
+        if path:
+            return "unix", path
+    for sock in listeners:
+        host, port = sock.getsockname()[:2]
+        if host in ("0.0.0.0", "::"):
+            host = "localhost"
+        return "url", f"http://[{host}]:{port}" if ":" in host else f"http://{host}:{port}"
+    raise ValueError("no listener for cloudflared")
+
+def remove_unix_socket(path: str) -> None:
+    """Removes the socket file of a Unix listener this process is done with."""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"[remove_unix_socket] Could not remove {path}: {e}")
@@ -0,0 +1,108 @@
+# server/helpers/liveness.py
+"""Server-side keepalive: finds clients that vanished (closed laptop, NAT dropped the mapping) and drops them.
+
+websockets pings every connection from a task of its own, every 20s, and gives up after 20s
+more. The monitor replaces this with one sweep of all connections from the housekeeping timer,
+with an interval per connection that follows its activity:
+- a client that sent a frame since the last sweep is alive, it is not pinged
+- tunnel users, and users the server is broadcasting to, are pinged after `min_interval` of silence
+- a quiet client that keeps answering is pinged less and less often, up to `max_interval`
+
+A client that does not answer within `timeout`, or does not read what is sent to it for as long,
+is dropped by aborting its connection. The handler then runs the usual disconnect path:
+the tunnel is suspended, the other users are told and the record is removed.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Iterable
+
+import websockets
+
+from oldie_goldie.server.helpers.connections import ConnectionRecord
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_INTERVAL = 10.0 # seconds
+DEFAULT_MAX_INTERVAL = 60.0 # seconds
+DEFAULT_TIMEOUT = 10.0 # seconds
+
+# websockets.serve() options: no keepalive task per connection, the monitor pings
+SERVE_OPTIONS = {"ping_interval": None, "ping_timeout": None}
+
+# Room left in the write buffer for a ping frame. Past it, ping() would wait for the client to read.
+PING_ROOM = 64 # bytes
+
+def consume_pong(waiter: asyncio.Future) -> None:
+    """Retrieves the ConnectionClosed of a ping whose connection closed, so asyncio does not log it."""
+    if not waiter.cancelled():
+        waiter.exception()
+
+class LivenessMonitor:
+    """Pings idle connections from the housekeeping timer and reaps the unresponsive ones. Stateless, one can serve many OGServers."""
+
+    def __init__(self, min_interval: float = DEFAULT_MIN_INTERVAL, max_interval: float = DEFAULT_MAX_INTERVAL, timeout: float = DEFAULT_TIMEOUT):
+        if not 0 < min_interval <= max_interval or timeout <= 0:
+            raise ValueError("expected 0 < min_interval <= max_interval and timeout > 0")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+
+    async def sweep(self, records: Iterable[ConnectionRecord]) -> list[ConnectionRecord]:
+        """Sends the pings that are due and aborts the connections that stopped answering, which are returned."""
+        now = time.monotonic()
+        reaped: list[ConnectionRecord] = []
+
+        for record in records:
+            transport = record.websocket.transport
+            if transport.is_closing():
+                continue
+
+            # A frame from the client says as much as a pong
+            if record.received != record.seen:
+                record.seen = record.received
+                record.last_seen = now
+                record.ping = None
+                record.ping_interval = self.min_interval
+                record.fanout = 0
+                continue
+
+            busy = record.peer is not None or record.fanout > 0
+            interval = self.min_interval if busy else record.ping_interval or self.min_interval
+
+            if record.ping is not None:
+                if not record.ping.done():
+                    if now - record.ping_sent > self.timeout:
+                        reaped.append(record)
+                    continue
+                if record.ping.cancelled() or record.ping.exception() is not None:
+                    record.ping = None # closed, the handler is cleaning up
+                    continue
+                # Pong: back off while nothing goes on
+                record.last_seen = now
+                record.ping = None
+                record.ping_interval = self.min_interval if busy else min(interval * 2, self.max_interval)
+                record.fanout = 0
+                continue
+
+            if now - record.last_seen < interval:
+                continue
+
+            # The client has not read what we sent for a while, a ping would only queue behind it
+            if transport.get_write_buffer_size() + PING_ROOM >= transport.get_write_buffer_limits()[1]:
+                if now - record.last_seen > interval + self.timeout:
+                    reaped.append(record)
+                continue
+
+            try:
+                record.ping = await record.websocket.ping()
+            except websockets.exceptions.ConnectionClosed:
+                continue
+            record.ping.add_done_callback(consume_pong)
+            record.ping_sent = now
+
+        for record in reaped:
+            logger.info(f"[sweep] @{record.username} did not answer for {now - record.last_seen:.0f}s, dropping the connection")
+            record.websocket.transport.abort()
+        return reaped
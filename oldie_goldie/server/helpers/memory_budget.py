@@ -0,0 +1,108 @@
+# server/helpers/memory_budget.py
+"""Server-wide memory budget for connection buffers (`--memory-budget MIB`).
+
+Every connection may hold up to `max_queue` received frames of up to the frame limit, plus
+what is waiting in its write buffer. With websockets' defaults (16 frames of 1 MiB) a burst of
+large frames over thousands of connections has no bound. The budget keeps those limits in
+proportion to the number of connections and to the memory actually in use:
+- the frame and write buffer limits are the budget's share per connection, between a floor that
+  still fits a file transfer chunk and websockets' defaults
+- past half the budget in write buffers, every connection drops to the floor
+- past 90%, new connections are refused (503) until the buffers drain
+
+Text frames carry JSON control messages and chat lines, anything past MAX_TEXT_FRAME is refused
+before it is decoded.
+"""
+
+import logging
+from typing import Iterable
+
+import websockets
+
+from oldie_goldie.server.helpers.metrics import Metric
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUDGET = 256 * 1024 * 1024 # bytes
+
+MAX_QUEUE = 4 # received frames buffered per connection before reading pauses (websockets: 16)
+MAX_FRAME = 1024 * 1024 # websockets' max_size default
+MIN_FRAME = 128 * 1024 # a 64 KiB file chunk, its headers and some room
+MAX_WRITE = 32 * 1024 # websockets' write_limit default
+MIN_WRITE = 16 * 1024
+MAX_TEXT_FRAME = 64 * 1024 # characters
+
+PRESSURE = 0.5 # share of the budget in write buffers past which limits go to the floor
+SATURATION = 0.9 # share past which new connections are refused
+
+def floor_power_of_two(value: float) -> int:
+    return 1 << max(int(value), 1).bit_length() - 1
+
+class MemoryBudget:
+    """Sizes the buffers of the connections of one listener set. rebalance() runs from the housekeeping timer."""
+
+    def __init__(self, budget: int = DEFAULT_BUDGET):
+        if budget <= 0:
+            raise ValueError("the memory budget must be > 0")
+        self.budget = budget
+        self.frame_limit = MAX_FRAME
+        self.write_limit = MAX_WRITE
+        self.connections = 0
+        self.write_buffered = 0 # bytes in the write buffers at the last rebalance
+        self.saturated = False
+        self.refused = 0 # connections refused while saturated
+        self.oversized = 0 # text frames refused for their size
+
+    @property
+    def serve_options(self) -> dict[str, int]:
+        """websockets.serve() options, the limits of a connection are then set by apply()."""
+        return {"max_size": MAX_FRAME, "max_queue": MAX_QUEUE, "write_limit": MAX_WRITE}
+
+    @property
+    def reserved(self) -> int:
+        """Worst case with the current limits: every connection with a full receive queue and write buffer."""
+        return self.connections * ((MAX_QUEUE + 1) * self.frame_limit + self.write_limit)
+
+    def apply(self, connection: websockets.ServerConnection) -> None:
+        """Puts a connection on the current limits."""
+        connection.protocol.max_size = self.frame_limit
+        connection.transport.set_write_buffer_limits(high=self.write_limit)
+
+    def rebalance(self, connections: Iterable[websockets.ServerConnection]) -> None:
+        connections = list(connections)
+        self.connections = len(connections)
+        self.write_buffered = sum(connection.transport.get_write_buffer_size() for connection in connections)
+
+        if self.write_buffered > PRESSURE * self.budget:
+            frame_limit, write_limit = MIN_FRAME, MIN_WRITE
+        else:
+            share = self.budget / max(self.connections, 1)
+            frame_limit = min(max(floor_power_of_two(share / (MAX_QUEUE + 1)), MIN_FRAME), MAX_FRAME)
+            write_limit = min(max(floor_power_of_two(share / 16), MIN_WRITE), MAX_WRITE)
+
+        saturated = self.write_buffered > SATURATION * self.budget
+        if saturated != self.saturated:
+            self.saturated = saturated
+            if saturated:
+                logger.warning(f"[rebalance] {self.write_buffered // 1024} KiB in write buffers, over 90% of the budget: refusing new connections")
+            else:
+                logger.info("[rebalance] Write buffers back under 90% of the budget, accepting connections")
+
+        if (frame_limit, write_limit) != (self.frame_limit, self.write_limit):
+            logger.info(f"[rebalance] {self.connections} connection(s), {self.write_buffered // 1024} KiB buffered: frame limit {frame_limit // 1024} KiB, write buffer {write_limit // 1024} KiB")
+            self.frame_limit, self.write_limit = frame_limit, write_limit
+            for connection in connections:
+                if not connection.transport.is_closing():
+                    self.apply(connection)
+
+    def metrics(self) -> list[Metric]:
+        return [
+            Metric.single("og_memory_budget_bytes", "gauge", "Memory budget for connection buffers", self.budget),
+            Metric.single("og_memory_reserved_bytes", "gauge", "Worst-case connection buffers with the current limits", self.reserved),
+            Metric.single("og_write_buffer_bytes", "gauge", "Bytes waiting in connection write buffers", self.write_buffered),
+            Metric.single("og_frame_limit_bytes", "gauge", "Largest frame a connection may send", self.frame_limit),
+            Metric.single("og_write_limit_bytes", "gauge", "Write buffer high-water mark per connection", self.write_limit),
+            Metric.single("og_memory_saturated", "gauge", "1 while new connections are refused", int(self.saturated)),
+            Metric.single("og_connections_refused_total", "counter", "Connections refused over the memory budget", self.refused),
+            Metric.single("og_oversized_frames_total", "counter", "Text frames refused before decoding", self.oversized),
+        ]
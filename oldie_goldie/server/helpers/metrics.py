@@ -0,0 +1,84 @@
+# server/helpers/metrics.py
+"""Metrics in the Prometheus text format, served over plain HTTP (`og-server --metrics ADDR`).
+
+The listener is separate from the websocket ones so that metrics are never exposed through
+cloudflared. Components describe their state as Metric tuples, collected on each scrape.
+"""
+
+import asyncio
+import logging
+import socket
+from typing import Callable, Iterable, NamedTuple
+
+from oldie_goldie.shared.loop_monitor import LagHistogram, LoopMonitor
+
+logger = logging.getLogger(__name__)
+
+class Metric(NamedTuple):
+    name: str
+    kind: str # "gauge", "counter" or "histogram"
+    help: str
+    samples: list[tuple[str, dict[str, str], float]] # (name suffix, labels, value)
+
+    @classmethod
+    def single(cls, name: str, kind: str, help: str, value: float) -> "Metric":
+        return cls(name, kind, help, [("", {}, value)])
+
+    @classmethod
+    def histogram(cls, name: str, help: str, histogram: LagHistogram) -> "Metric":
+        samples: list[tuple[str, dict[str, str], float]] = [
+            ("_bucket", {"le": "+Inf" if bound == float("inf") else format_value(bound)}, count) for bound, count in histogram.cumulative()
+        ]
+        samples += [("_sum", {}, histogram.sum), ("_count", {}, histogram.count)]
+        return cls(name, "histogram", help, samples)
+
+def escape_label(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def loop_metrics(monitor: LoopMonitor) -> list[Metric]:
+    return [
+        Metric.histogram("og_loop_lag_seconds", "Event loop lag, how late a timer fires", monitor.lag),
+        Metric.single("og_loop_lag_max_seconds", "gauge", "Largest event loop lag seen", monitor.lag.max),
+        Metric("og_slow_callbacks_total", "counter", "Callbacks that blocked the event loop past the threshold, by activity", [("", {"activity": activity or "none"}, count) for activity, count in monitor.slow.items()]),
+        Metric.single("og_loop_overloaded", "gauge", "1 while new connections are refused for loop lag", int(monitor.overloaded)),
+        Metric.single("og_connections_shed_total", "counter", "Connections refused for loop lag", monitor.shed),
+    ]
+
+def render(metrics: Iterable[Metric]) -> str:
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for suffix, labels, value in metric.samples:
+            label_text = ",".join(f'{key}="{escape_label(label)}"' for key, label in labels.items())
+            lines.append(f"{metric.name}{suffix}{{{label_text}}} {format_value(value)}" if label_text else f"{metric.name}{suffix} {format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+async def serve_metrics(listener: socket.socket, collect: Callable[[], Iterable[Metric]]) -> asyncio.Server:
+    """Answers GET /metrics on `listener` with the collected metrics, 404 on any other path."""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+                pass # headers
+            method, path, *_ = request_line.decode("latin-1").split() + ["", ""]
+            if method == "GET" and path.split("?")[0] == "/metrics":
+                status, body = "200 OK", render(collect()).encode()
+            else:
+                status, body = "404 Not Found", b"Not found, try /metrics\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception:
+            logger.exception("[serve_metrics] Failed to answer a metrics request")
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, sock=listener)
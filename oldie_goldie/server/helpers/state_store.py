@@ -0,0 +1,550 @@
+# server/helpers/state_store.py
+"""Durable invite tokens and blocklist of og-server (og-server --state-dir DIR).
+
+Two files live in DIR:
+- `state.snapshot`: tokens sorted by value in fixed-size entries, the username bindings
+  and the blocklist. It is mmap'd at startup and never parsed as a whole: token lookups
+  binary search the mapping, so a restart costs the same with ten or ten million tokens.
+- `state.wal`: every change since the snapshot, appended as CRC-checked records and
+  replayed on top of it at startup (a torn last record is dropped).
+
+Changes made while running live in memory (an overlay of added tokens and tombstones of
+removed ones). Expired tokens are found through the expiry index of the snapshot and a heap
+of the expiries set since, so removing them never scans the table. When the WAL grows, compact() writes a new snapshot in a worker thread:
+the WAL is first rotated to `state.wal.1`, so writes carry on into a fresh WAL meanwhile,
+and `state.wal.1` is only deleted once the new snapshot is in place. If a crash left it
+behind, open() replays it before `state.wal` and finishes that compaction.
+
+Snapshot layout (big-endian):
+
+    header   | magic "OGST" | version u8 | token_count u64 | name_count u32 | blocked_len u64 | expiring_count u64
+    names    | name_count x (len u16 | utf-8 username | bound tokens u64)   bindings, index 1..n
+    blocked  | blocked_len bytes, "\\n"-joined usernames
+    tokens   | token_count x (token 32s | name index u32, 0 = unbound | expiry f64, NaN = none | flags u8)
+    expiries | expiring_count x (expiry f64 | token index u64), sorted by expiry
+"""
+
+import asyncio
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections.abc import MutableMapping
+from typing import Any, Callable, Iterator
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = "state.snapshot"
+WAL_FILE = "state.wal"
+WAL_FROZEN_FILE = "state.wal.1"
+
+SNAPSHOT_MAGIC = b"OGST"
+SNAPSHOT_VERSION = 2
+COMPACT_AFTER = 10_000 # WAL records
+
+TOKEN_SIZE = 32 # bytes, invite tokens are 22 characters
+FLAG_REUSE = 0x01
+
+_HEADER = struct.Struct("!4sBQIQQ")
+_NAME_HEADER = struct.Struct("!H")
+_NAME_COUNT = struct.Struct("!Q")
+_TOKEN_ENTRY = struct.Struct(f"!{TOKEN_SIZE}sIdB")
+_EXPIRY_ENTRY = struct.Struct("!dQ")
+_WAL_RECORD = struct.Struct("!IBI") # crc32, op, payload length
+
+OP_TOKEN_PUT = 1
+OP_TOKEN_DEL = 2
+OP_BLOCK_ADD = 3
+OP_BLOCK_DEL = 4
+
+TokenMeta = dict[str, Any] # {"username": str | None, "expiry": float | None, "reuse": bool}
+
+def _encode_token(token: str) -> bytes:
+    raw = token.encode("utf-8")
+    if len(raw) > TOKEN_SIZE:
+        raise ValueError(f"Tokens are limited to {TOKEN_SIZE} bytes")
+    return raw.ljust(TOKEN_SIZE, b"\0")
+
+def apply_change(tokens: "TokenTable", blocked: "BlockList", op: int, record: dict[str, Any]) -> None:
+    """Applies a change as reported to `on_change`: WAL replay, and the updates of a server handing over."""
+    if op == OP_TOKEN_PUT:
+        record = dict(record)
+        tokens[record.pop("token")] = record
+    elif op == OP_TOKEN_DEL:
+        tokens.pop(record["token"], None)
+    elif op == OP_BLOCK_ADD:
+        blocked.add(record["username"])
+    elif op == OP_BLOCK_DEL:
+        blocked.discard(record["username"])
+
+class _Snapshot:
+    """
+    Read-only view of a snapshot file through mmap. close() waits for the scans in progress
+    (items() may run in a worker thread, or be paused in a generator) before unmapping.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.count = 0
+        self.expiring = 0
+        self.names: list[str | None] = [None]
+        self.name_counts: dict[str, int] = {}
+        self.blocked: list[str] = []
+        self._mm: mmap.mmap | None = None
+        self._tokens_offset = 0
+        self._expiries_offset = 0
+        self._lock = threading.Lock()
+        self._readers = 0
+        self._closing = False
+
+        if path is None or not os.path.exists(path) or os.path.getsize(path) == 0:
+            return
+
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mm = self._mm
+
+        magic, version, self.count, name_count, blocked_len, self.expiring = _HEADER.unpack_from(mm, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} is not an og-server state snapshot")
+
+        offset = _HEADER.size
+        for _ in range(name_count):
+            (length,) = _NAME_HEADER.unpack_from(mm, offset)
+            offset += _NAME_HEADER.size
+            name = mm[offset:offset + length].decode("utf-8")
+            offset += length
+            (bound,) = _NAME_COUNT.unpack_from(mm, offset)
+            offset += _NAME_COUNT.size
+            self.names.append(name)
+            self.name_counts[name] = bound
+
+        if blocked_len:
+            self.blocked = mm[offset:offset + blocked_len].decode("utf-8").split("\n")
+        self._tokens_offset = offset + blocked_len
+        self._expiries_offset = self._tokens_offset + self.count * _TOKEN_ENTRY.size
+
+    def close(self) -> None:
+        with self._lock:
+            self._closing = True
+            if self._readers:
+                return # the last scan unmaps
+            mm, self._mm = self._mm, None
+        if mm is not None:
+            mm.close()
+
+    def _release_reader(self) -> None:
+        with self._lock:
+            self._readers -= 1
+            if self._readers or not self._closing:
+                return
+            mm, self._mm = self._mm, None
+        if mm is not None:
+            mm.close()
+
+    def _key(self, index: int) -> bytes:
+        start = self._tokens_offset + index * _TOKEN_ENTRY.size
+        return self._mm[start:start + TOKEN_SIZE] # type: ignore
+
+    def _meta(self, index: int) -> TokenMeta:
+        _, name_index, expiry, flags = _TOKEN_ENTRY.unpack_from(self._mm, self._tokens_offset + index * _TOKEN_ENTRY.size) # type: ignore
+        return {"username": self.names[name_index], "expiry": None if math.isnan(expiry) else expiry, "reuse": bool(flags & FLAG_REUSE)}
+
+    def get(self, token: str) -> TokenMeta | None:
+        if not self.count:
+            return None
+        try:
+            key = _encode_token(token)
+        except ValueError:
+            return None
+
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self._key(lo) == key:
+            return self._meta(lo)
+        return None
+
+    def items(self) -> Iterator[tuple[str, TokenMeta]]:
+        if not self.count:
+            return
+        with self._lock:
+            if self._mm is None:
+                raise ValueError("Snapshot closed")
+            self._readers += 1
+        view = memoryview(self._mm)[self._tokens_offset:self._expiries_offset]
+        try:
+            for raw, name_index, expiry, flags in _TOKEN_ENTRY.iter_unpack(view):
+                yield raw.rstrip(b"\0").decode("utf-8"), {"username": self.names[name_index], "expiry": None if math.isnan(expiry) else expiry, "reuse": bool(flags & FLAG_REUSE)}
+        finally:
+            view.release()
+            self._release_reader()
+
+    def next_expiry(self, position: int) -> float:
+        """Expiry of entry `position` of the expiry index, inf past its end."""
+        if position >= self.expiring:
+            return math.inf
+        return _EXPIRY_ENTRY.unpack_from(self._mm, self._expiries_offset + position * _EXPIRY_ENTRY.size)[0] # type: ignore
+
+    def expired(self, position: int, now: float) -> tuple[list[tuple[str, float]], int]:
+        """The (token, expiry) pairs of the expiry index from `position` that are expired at `now`, and the position after them."""
+        due = []
+        while self.next_expiry(position) < now:
+            expiry, index = _EXPIRY_ENTRY.unpack_from(self._mm, self._expiries_offset + position * _EXPIRY_ENTRY.size) # type: ignore
+            due.append((self._key(index).rstrip(b"\0").decode("utf-8"), expiry))
+            position += 1
+        return due, position
+
+class TokenTable(MutableMapping):
+    """
+    The invite tokens: {token: {"username", "expiry", "reuse"}}.
+    Reads go through the overlay of live changes, then the frozen overlay of a running
+    compaction, then the mmap'd snapshot. Every change is reported to `on_change`.
+    """
+
+    def __init__(self, snapshot: _Snapshot | None = None, on_change: Callable[[int, dict[str, Any]], None] | None = None):
+        self._snapshot = snapshot or _Snapshot()
+        self._layers: list[tuple[dict[str, TokenMeta], set[str]]] = [({}, set())] # newest first: (puts, deletes)
+        self._len = self._snapshot.count
+        self._bound = dict(self._snapshot.name_counts)
+        self._expiries: list[tuple[float, str]] = [] # heap of the expiries set since the snapshot, stale entries included
+        self._expiry_position = 0 # next entry of the snapshot's expiry index
+        self.on_change = on_change
+
+    # ==== #
+    # Mapping interface
+    # ==== #
+
+    def _lookup(self, token: str) -> TokenMeta | None:
+        for puts, deletes in self._layers:
+            if token in puts:
+                return puts[token]
+            if token in deletes:
+                return None
+        return self._snapshot.get(token)
+
+    def __getitem__(self, token: str) -> TokenMeta:
+        meta = self._lookup(token)
+        if meta is None:
+            raise KeyError(token)
+        return meta
+
+    def __contains__(self, token: object) -> bool:
+        return isinstance(token, str) and self._lookup(token) is not None
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __repr__(self) -> str:
+        # Never dump the tokens: logs would leak them and a big table would flood them
+        return f"<TokenTable: {self._len} token(s)>"
+
+    def __iter__(self) -> Iterator[str]:
+        for token, _ in self.items():
+            yield token
+
+    def items(self) -> Iterator[tuple[str, TokenMeta]]: # type: ignore[override]
+        """Every live token. Decodes the whole snapshot, meant for rare full scans."""
+        return self._iter_layers(self._layers)
+
+    def _iter_layers(self, layers: list[tuple[dict[str, TokenMeta], set[str]]]) -> Iterator[tuple[str, TokenMeta]]:
+        seen: set[str] = set()
+        for puts, deletes in layers:
+            for token, meta in puts.items():
+                if token not in seen:
+                    seen.add(token)
+                    yield token, meta
+            seen |= deletes
+        for token, meta in self._snapshot.items():
+            if token not in seen:
+                yield token, meta
+
+    def values(self) -> Iterator[TokenMeta]: # type: ignore[override]
+        for _, meta in self.items():
+            yield meta
+
+    def __setitem__(self, token: str, meta: TokenMeta) -> None:
+        _encode_token(token)
+        meta = {"username": meta.get("username"), "expiry": meta.get("expiry"), "reuse": bool(meta.get("reuse", False))}
+        previous = self._lookup(token)
+        self._forget(previous)
+
+        puts, deletes = self._layers[0]
+        puts[token] = meta
+        deletes.discard(token)
+        self._len += 1
+        if meta["username"]:
+            self._bound[meta["username"]] = self._bound.get(meta["username"], 0) + 1
+        if meta["expiry"] is not None:
+            heapq.heappush(self._expiries, (meta["expiry"], token))
+
+        if self.on_change:
+            self.on_change(OP_TOKEN_PUT, {"token": token, **meta})
+
+    def __delitem__(self, token: str) -> None:
+        previous = self._lookup(token)
+        if previous is None:
+            raise KeyError(token)
+        self._forget(previous)
+
+        puts, deletes = self._layers[0]
+        puts.pop(token, None)
+        deletes.add(token)
+
+        if self.on_change:
+            self.on_change(OP_TOKEN_DEL, {"token": token})
+
+    def _forget(self, meta: TokenMeta | None) -> None:
+        if meta is None:
+            return
+        self._len -= 1
+        if meta["username"]:
+            self._bound[meta["username"]] -= 1
+
+    # ==== #
+    # Fast paths for the server
+    # ==== #
+
+    def is_bound(self, username: str) -> bool:
+        """True if some live token is bound to `username`."""
+        return self._bound.get(username, 0) > 0
+
+    def pop_expired(self, now: float) -> list[str]:
+        """
+        Removes and returns the tokens expired at `now`. Only the entries that are due are read:
+        the snapshot's expiry index from where the last call stopped, and the top of the heap.
+        An entry whose token was removed or given another expiry since is skipped.
+        """
+        due, self._expiry_position = self._snapshot.expired(self._expiry_position, now)
+        while self._expiries and self._expiries[0][0] < now:
+            due.append(heapq.heappop(self._expiries)[::-1])
+
+        expired = []
+        for token, expiry in due:
+            meta = self._lookup(token)
+            if meta is not None and meta["expiry"] == expiry:
+                del self[token]
+                expired.append(token)
+        return expired
+
+    # ==== #
+    # Compaction support
+    # ==== #
+
+    def freeze(self) -> None:
+        """Starts a new overlay layer, the previous ones are what the next snapshot will contain."""
+        self._layers.insert(0, ({}, set()))
+
+    def frozen_items(self) -> Iterator[tuple[str, TokenMeta]]:
+        """The tokens as of the last freeze(). Changes only touch the live layer, so a worker thread can read this."""
+        return self._iter_layers(self._layers[1:])
+
+    def replace_snapshot(self, snapshot: _Snapshot) -> None:
+        """Swaps in the snapshot written from the frozen layers and drops them."""
+        old = self._snapshot
+        self._snapshot = snapshot
+        self._layers = self._layers[:1]
+        self._expiry_position = 0 # tokens already removed are tombstoned in the live layer
+        old.close()
+
+class BlockList(set):
+    """The blocked usernames. Additions and removals are reported to `on_change`."""
+
+    def __init__(self, *args: Any, on_change: Callable[[int, dict[str, Any]], None] | None = None):
+        super().__init__(*args)
+        self.on_change = on_change
+
+    def add(self, username: str) -> None:
+        if username not in self:
+            super().add(username)
+            if self.on_change:
+                self.on_change(OP_BLOCK_ADD, {"username": username})
+
+    def discard(self, username: str) -> None:
+        if username in self:
+            super().discard(username)
+            if self.on_change:
+                self.on_change(OP_BLOCK_DEL, {"username": username})
+
+    def remove(self, username: str) -> None:
+        if username not in self:
+            raise KeyError(username)
+        self.discard(username)
+
+class ServerStateStore:
+    """
+    Owns the snapshot and the WAL of a state directory.
+    - open(): load the state, returns (tokens, blocklist) wired to the WAL
+    - sync(): fsync the WAL if it changed
+    - compact(): write a new snapshot in a worker thread and start over with an empty WAL
+    - start_compaction(): compact() in a background task
+    - close(): compact and release the files
+    """
+
+    def __init__(self, directory: str, compact_after: int = COMPACT_AFTER):
+        self.directory = directory
+        self.compact_after = compact_after
+        self.tokens: TokenTable | None = None
+        self.blocked: BlockList | None = None
+        self._wal = None
+        self._wal_records = 0
+        self._dirty = False
+        self._compacting = False
+        self._compaction: asyncio.Task | None = None # the loop only keeps weak references to tasks
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def open(self) -> tuple[TokenTable, BlockList]:
+        os.makedirs(self.directory, exist_ok=True)
+        snapshot = _Snapshot(self._path(SNAPSHOT_FILE))
+        tokens = TokenTable(snapshot)
+        blocked = BlockList(snapshot.blocked)
+
+        # A compaction interrupted by a crash leaves the frozen WAL behind, replaying it twice is harmless
+        interrupted = os.path.exists(self._path(WAL_FROZEN_FILE))
+        for name in (WAL_FROZEN_FILE, WAL_FILE):
+            self._wal_records += self._replay(self._path(name), tokens, blocked)
+
+        # Finish that compaction before the next one rotates the WAL over the frozen one
+        if interrupted:
+            path = self._write_snapshot(tokens.items(), sorted(blocked))
+            snapshot.close()
+            snapshot = _Snapshot(path)
+            tokens = TokenTable(snapshot)
+            blocked = BlockList(snapshot.blocked)
+            os.remove(self._path(WAL_FROZEN_FILE))
+            open(self._path(WAL_FILE), "wb").close()
+            self._wal_records = 0
+            logger.info(f"[ServerStateStore] Finished an interrupted compaction: {snapshot.count} token(s) and {len(blocked)} blocked username(s)")
+
+        tokens.on_change = blocked.on_change = self._append
+        self.tokens, self.blocked = tokens, blocked
+        self._wal = open(self._path(WAL_FILE), "ab")
+        return tokens, blocked
+
+    @staticmethod
+    def _replay(path: str, tokens: TokenTable, blocked: BlockList) -> int:
+        """Applies the records of a WAL file, truncating it after the last valid one. Returns the number applied."""
+        try:
+            f = open(path, "r+b")
+        except FileNotFoundError:
+            return 0
+
+        applied, offset = 0, 0
+        with f:
+            data = f.read()
+            while offset + _WAL_RECORD.size <= len(data):
+                crc, op, length = _WAL_RECORD.unpack_from(data, offset)
+                payload = data[offset + _WAL_RECORD.size:offset + _WAL_RECORD.size + length]
+                if len(payload) < length or zlib.crc32(bytes([op]) + payload) != crc:
+                    break
+                apply_change(tokens, blocked, op, json.loads(payload))
+                offset += _WAL_RECORD.size + length
+                applied += 1
+
+            if offset < len(data):
+                logger.warning(f"[ServerStateStore] Dropping {len(data) - offset} byte(s) of torn records at the end of {path}")
+                f.truncate(offset)
+        return applied
+
+    def _append(self, op: int, record: dict[str, Any]) -> None:
+        payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+        self._wal.write(_WAL_RECORD.pack(zlib.crc32(bytes([op]) + payload), op, len(payload)) + payload) # type: ignore
+        self._wal.flush() # type: ignore
+        self._wal_records += 1
+        self._dirty = True
+
+    def needs_compaction(self) -> bool:
+        return self._wal_records >= self.compact_after and not self._compacting
+
+    async def sync(self) -> None:
+        """Makes the WAL durable. Changes reach the OS on every write, this covers power loss."""
+        if self._dirty and self._wal is not None:
+            self._dirty = False
+            await asyncio.to_thread(os.fsync, self._wal.fileno())
+
+    def start_compaction(self) -> None:
+        if self._compaction is None or self._compaction.done():
+            self._compaction = asyncio.create_task(self.compact())
+            self._compaction.add_done_callback(self._compaction_done)
+
+    @staticmethod
+    def _compaction_done(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"[ServerStateStore] Compaction failed, the WAL keeps growing: {task.exception()}")
+
+    async def compact(self) -> None:
+        if self._compacting or self.tokens is None or self.blocked is None:
+            return
+        self._compacting = True
+        try:
+            # Freeze the current state: new changes go to a new overlay layer and a new WAL
+            self._wal.close() # type: ignore
+            os.replace(self._path(WAL_FILE), self._path(WAL_FROZEN_FILE))
+            self._wal = open(self._path(WAL_FILE), "ab")
+            self._wal_records = 0
+
+            self.tokens.freeze()
+            blocked = sorted(self.blocked)
+
+            path = await asyncio.to_thread(self._write_snapshot, self.tokens.frozen_items(), blocked)
+            self.tokens.replace_snapshot(_Snapshot(path))
+            os.remove(self._path(WAL_FROZEN_FILE))
+            logger.info(f"[ServerStateStore] Snapshot written with {self.tokens._snapshot.count} token(s) and {len(blocked)} blocked username(s)")
+        finally:
+            self._compacting = False
+
+    def _write_snapshot(self, items: Iterator[tuple[str, TokenMeta]], blocked: list[str]) -> str:
+        """Runs in a worker thread: writes the snapshot next to the current one and swaps it in."""
+        entries = []
+        names: dict[str, int] = {}
+        name_counts: dict[str, int] = {}
+
+        for token, meta in items:
+            username = meta["username"]
+            if username:
+                if username not in names:
+                    names[username] = len(names) + 1
+                name_counts[username] = name_counts.get(username, 0) + 1
+            expiry = meta["expiry"]
+            entries.append((_TOKEN_ENTRY.pack(_encode_token(token), names.get(username, 0) if username else 0, math.nan if expiry is None else expiry, FLAG_REUSE if meta.get("reuse") else 0), expiry))
+        entries.sort(key=lambda entry: entry[0])
+        expiries = sorted((expiry, index) for index, (_, expiry) in enumerate(entries) if expiry is not None)
+
+        blocked_blob = "\n".join(blocked).encode("utf-8")
+        tmp = self._path(SNAPSHOT_FILE + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(entries), len(names), len(blocked_blob), len(expiries)))
+            for username in names: # insertion order matches the indexes
+                encoded = username.encode("utf-8")
+                f.write(_NAME_HEADER.pack(len(encoded)) + encoded + _NAME_COUNT.pack(name_counts[username]))
+            f.write(blocked_blob)
+            f.write(b"".join(entry for entry, _ in entries))
+            f.write(b"".join(_EXPIRY_ENTRY.pack(expiry, index) for expiry, index in expiries))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path(SNAPSHOT_FILE))
+        return self._path(SNAPSHOT_FILE)
+
+    async def close(self) -> None:
+        """Compacts so that the next start only maps the snapshot, then closes the WAL."""
+        if self._compaction is not None:
+            await asyncio.gather(self._compaction, return_exceptions=True)
+            self._compaction = None
+        if self._wal_records:
+            await self.compact()
+        # The tables may outlive the store (graceful restart), later changes stay in memory
+        if self.tokens is not None and self.blocked is not None:
+            self.tokens.on_change = self.blocked.on_change = None
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
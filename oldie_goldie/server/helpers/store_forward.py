@@ -0,0 +1,325 @@
+# server/helpers/store_forward.py
+"""Disk-backed store-and-forward queues for users who are offline.
+
+Every user gets a directory of append-only segment files and a cursor recording how
+far the queue has been delivered:
+
+    <directory>/<username>/000000000001.seg
+    <directory>/<username>/cursor
+
+A record is a fixed header followed by the sender and the frame, exactly as it would
+have been relayed:
+
+    expiry(f64) | binary(u8) | sender_len(u8) | frame_len(u32) | sender | frame
+
+Queues written since the server started are mirrored in memory (hot) and served from
+there. Queues left over from a previous run, or evicted from memory, are cold and are
+paged in from disk one batch at a time. Delivery is at-least-once: the cursor only
+moves once a batch has been handed over.
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import struct
+import time
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 24 * 3600 # seconds
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024 # per user
+DEFAULT_SEGMENT_BYTES = 256 * 1024
+DEFAULT_HOT_USERS = 128 # queues mirrored in memory
+DEFAULT_HOT_BYTES = 64 * 1024 # per hot queue, bigger queues are served from disk
+DEFAULT_BATCH_SIZE = 64 # frames per delivery batch
+
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor"
+
+_RECORD_HEADER = struct.Struct("!dBBI")
+
+class StoredFrame(NamedTuple):
+    sender: str
+    frame: str | bytes
+    expiry: float
+    segment: int # segment holding the record
+    end: int # offset right after the record in its segment
+    size: int # record size on disk
+
+class _UserQueue:
+    """Bookkeeping of one user's queue, the records themselves live on disk."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.segments: list[int] = [] # oldest first
+        self.tail_size = 0 # bytes in the newest segment
+        self.size = 0 # bytes on disk, delivered records included until their segment is dropped
+        self.cursor = (0, 0) # (segment, offset) delivered so far
+        self.hot: deque[StoredFrame] | None = deque() # undelivered records, None once the queue is cold
+        self.hot_bytes = 0
+
+    def at_end(self) -> bool:
+        return not self.segments or self.cursor == (self.segments[-1], self.tail_size)
+
+class OfflineFrameStore:
+    """
+    Per-user append-only queues with a TTL and a size cap.
+    - append(): queue a frame for an offline user
+    - read_batch() / commit(): stream the queue back once they register
+    - purge_expired(): drop segments whose records have all expired
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        ttl: float = DEFAULT_TTL,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        segment_bytes: int = DEFAULT_SEGMENT_BYTES,
+        hot_users: int = DEFAULT_HOT_USERS,
+        hot_bytes: int = DEFAULT_HOT_BYTES,
+    ):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.hot_users = hot_users
+        self.hot_bytes = hot_bytes
+        self._queues: dict[str, _UserQueue] = {}
+        self._hot_lru: OrderedDict[str, None] = OrderedDict()
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    # ==== #
+    # Disk layout
+    # ==== #
+
+    def _load(self) -> None:
+        """Picks up the queues left by a previous run. Only file sizes are read, records are paged in on delivery."""
+        for username in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, username)
+            if not os.path.isdir(path):
+                continue
+
+            segments = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(path) if name.endswith(SEGMENT_SUFFIX))
+            if not segments:
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+
+            queue = _UserQueue(path)
+            queue.hot = None
+            queue.segments = segments
+            queue.size = sum(os.path.getsize(self._segment_path(queue, segment)) for segment in segments)
+            queue.tail_size = os.path.getsize(self._segment_path(queue, segments[-1]))
+            queue.cursor = self._read_cursor(queue) or (segments[0], 0)
+            if queue.cursor[0] < segments[0]:
+                queue.cursor = (segments[0], 0)
+
+            if queue.at_end():
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            self._queues[username] = queue
+
+        if self._queues:
+            logger.info(f"[OfflineFrameStore] Loaded {len(self._queues)} queue(s) from {self.directory}")
+
+    @staticmethod
+    def _segment_path(queue: _UserQueue, segment: int) -> str:
+        return os.path.join(queue.directory, f"{segment:012d}{SEGMENT_SUFFIX}")
+
+    @staticmethod
+    def _read_cursor(queue: _UserQueue) -> tuple[int, int] | None:
+        try:
+            with open(os.path.join(queue.directory, CURSOR_FILE)) as f:
+                segment, offset = f.read().split()
+            return int(segment), int(offset)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_cursor(queue: _UserQueue) -> None:
+        path = os.path.join(queue.directory, CURSOR_FILE)
+        with open(path + ".tmp", "w") as f:
+            f.write(f"{queue.cursor[0]} {queue.cursor[1]}")
+        os.replace(path + ".tmp", path)
+
+    def _drop(self, username: str) -> None:
+        queue = self._queues.pop(username, None)
+        self._hot_lru.pop(username, None)
+        if queue is not None:
+            shutil.rmtree(queue.directory, ignore_errors=True)
+
+    # ==== #
+    # Hot queues
+    # ==== #
+
+    def _touch_hot(self, username: str) -> None:
+        self._hot_lru[username] = None
+        self._hot_lru.move_to_end(username)
+        while len(self._hot_lru) > self.hot_users:
+            self._make_cold(next(iter(self._hot_lru)))
+
+    def _make_cold(self, username: str) -> None:
+        self._hot_lru.pop(username, None)
+        queue = self._queues.get(username)
+        if queue is not None:
+            queue.hot = None
+            queue.hot_bytes = 0
+
+    # ==== #
+    # Queue operations
+    # ==== #
+
+    def has_pending(self, username: str) -> bool:
+        return username in self._queues
+
+    def pending_users(self) -> int:
+        return len(self._queues)
+
+    def append(self, username: str, sender: str, frame: str | bytes) -> bool:
+        """Queues a frame for an offline user. Returns False when their queue is full."""
+        payload = frame if isinstance(frame, bytes) else frame.encode("utf-8")
+        sender_bytes = sender.encode("utf-8")
+        expiry = time.time() + self.ttl
+        record = _RECORD_HEADER.pack(expiry, isinstance(frame, bytes), len(sender_bytes), len(payload)) + sender_bytes + payload
+
+        queue = self._queues.get(username)
+        if queue is None:
+            queue = _UserQueue(os.path.join(self.directory, username))
+            os.makedirs(queue.directory, exist_ok=True)
+            self._queues[username] = queue
+
+        if queue.size + len(record) > self.max_bytes:
+            if not queue.segments:
+                self._drop(username)
+            return False
+
+        if not queue.segments or queue.tail_size + len(record) > self.segment_bytes:
+            queue.segments.append(queue.segments[-1] + 1 if queue.segments else 1)
+            queue.tail_size = 0
+            if len(queue.segments) == 1:
+                queue.cursor = (queue.segments[0], 0)
+
+        segment = queue.segments[-1]
+        with open(self._segment_path(queue, segment), "ab") as f:
+            f.write(record)
+        queue.tail_size += len(record)
+        queue.size += len(record)
+
+        if queue.hot is not None:
+            if queue.hot_bytes + len(record) > self.hot_bytes:
+                self._make_cold(username)
+            else:
+                queue.hot.append(StoredFrame(sender, frame, expiry, segment, queue.tail_size, len(record)))
+                queue.hot_bytes += len(record)
+                self._touch_hot(username)
+        return True
+
+    async def read_batch(self, username: str, limit: int = DEFAULT_BATCH_SIZE) -> list[StoredFrame]:
+        """Next undelivered frames of a user, oldest first. Empty once the queue is drained."""
+        while True:
+            queue = self._queues.get(username)
+            if queue is None:
+                return []
+            if queue.hot is not None:
+                return list(islice(queue.hot, limit))
+
+            size_before = queue.size
+            batch = await asyncio.to_thread(self._read_from_disk, queue, list(queue.segments), queue.cursor, limit)
+            if batch:
+                return batch
+
+            # Nothing readable: either a frame was appended while reading, or the tail is torn
+            if self._queues.get(username) is queue and queue.size == size_before:
+                logger.warning(f"[OfflineFrameStore] Discarding the unreadable queue of @{username}")
+                self._drop(username)
+                return []
+
+    def _read_from_disk(self, queue: _UserQueue, segments: list[int], cursor: tuple[int, int], limit: int) -> list[StoredFrame]:
+        """Runs in a worker thread. Stops at the first incomplete record of a segment."""
+        batch: list[StoredFrame] = []
+        for segment in segments:
+            if segment < cursor[0]:
+                continue
+            try:
+                f = open(self._segment_path(queue, segment), "rb")
+            except FileNotFoundError:
+                continue
+
+            with f:
+                f.seek(cursor[1] if segment == cursor[0] else 0)
+                while len(batch) < limit:
+                    header = f.read(_RECORD_HEADER.size)
+                    if len(header) < _RECORD_HEADER.size:
+                        break
+                    expiry, binary, sender_len, frame_len = _RECORD_HEADER.unpack(header)
+                    body = f.read(sender_len + frame_len)
+                    if len(body) < sender_len + frame_len:
+                        break
+                    sender = body[:sender_len].decode("utf-8")
+                    frame = body[sender_len:] if binary else body[sender_len:].decode("utf-8")
+                    batch.append(StoredFrame(sender, frame, expiry, segment, f.tell(), _RECORD_HEADER.size + len(body)))
+
+            if len(batch) >= limit:
+                break
+        return batch
+
+    def commit(self, username: str, batch: list[StoredFrame]) -> None:
+        """Marks a batch returned by read_batch as delivered. A drained queue is removed from disk."""
+        queue = self._queues.get(username)
+        if queue is None or not batch:
+            return
+
+        if queue.hot is not None:
+            for _ in batch:
+                queue.hot_bytes -= queue.hot.popleft().size
+
+        queue.cursor = (batch[-1].segment, batch[-1].end)
+        if queue.at_end():
+            self._drop(username)
+            return
+
+        # Segments before the cursor are fully delivered
+        while queue.segments and queue.segments[0] < queue.cursor[0]:
+            segment = queue.segments.pop(0)
+            path = self._segment_path(queue, segment)
+            try:
+                queue.size -= os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._write_cursor(queue)
+
+    def purge_expired(self) -> int:
+        """
+        Drops the segments whose newest record has expired (its mtime is the time of the last append).
+        Returns the number of users whose queue got emptied.
+        """
+        now = time.time()
+        emptied = 0
+        for username, queue in list(self._queues.items()):
+            while queue.segments:
+                path = self._segment_path(queue, queue.segments[0])
+                try:
+                    if os.path.getmtime(path) + self.ttl >= now:
+                        break
+                    queue.size -= os.path.getsize(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                queue.segments.pop(0)
+
+            if not queue.segments:
+                self._drop(username)
+                emptied += 1
+            elif queue.cursor[0] < queue.segments[0]:
+                queue.cursor = (queue.segments[0], 0)
+                if queue.hot is not None:
+                    while queue.hot and queue.hot[0].segment < queue.segments[0]:
+                        queue.hot_bytes -= queue.hot.popleft().size
+                self._write_cursor(queue)
+        return emptied
@@ -1,62 +1,222 @@
+import asyncio
 import atexit
+import os
 import re
+import signal
 import subprocess
 import sys
-import threading
+import time
 from typing import Optional
 
+class _AdoptedProcess:
+    """
+    Popen look-alike for a cloudflared started by the og-server this one took over from (graceful restart).
+    It is not our child, so it is polled with signal 0 rather than waited for.
+    """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+
+    def poll(self) -> Optional[int]:
+        try:
+            os.kill(self.pid, 0)
+        except ProcessLookupError:
+            return 0
+        return None
+
+    def terminate(self):
+        os.kill(self.pid, signal.SIGTERM)
+
+    def kill(self):
+        os.kill(self.pid, signal.SIGKILL)
+
+    def wait(self, timeout: Optional[float] = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and time.monotonic() > deadline:
+                raise subprocess.TimeoutExpired("cloudflared", timeout) # type: ignore
+            time.sleep(0.05)
+
 class TunnelManager:
     """
-    Manage a cloudflared ephemeral tunnel process:
-    - start subprocess
-    - read stdout in background thread to find trycloudflare URL
+    Manage a cloudflared ephemeral tunnel process from the event loop:
+    - start() spawns cloudflared, a supervisor task reads its output for the trycloudflare URL
+    - url_ready is set once the URL is known, wait_for_url() waits for it
+    - when cloudflared exits it is started again after a backoff (quick tunnels get a new URL)
     - stop() terminates the process
+
+    cloudflared writes to a pipe created here rather than through asyncio.create_subprocess_exec:
+    asyncio kills the children it spawned when their transport goes away, and after a graceful
+    restart cloudflared has to outlive this process.
     """
     URL_REGEX = re.compile(r'https://[-\w]+\.trycloudflare\.com')
+    RESTART_DELAY = 1.0 # doubled after every quick failure...
+    RESTART_DELAY_MAX = 30.0 # ...up to this
+    STABLE_AFTER = 60.0 # a run at least this long resets the delay
+    EXIT_GRACE = 5.0 # after its output closed, how long cloudflared gets to exit before it is killed
 
-    def __init__(self, proc: subprocess.Popen):
+    def __init__(self, command: Optional[list[str]], proc: subprocess.Popen | _AdoptedProcess | None = None, stdout_fd: Optional[int] = None, url: Optional[str] = None):
+        self.command = command # None: cannot be restarted
         self._proc = proc
-        self.url: Optional[str] = None
-        self._lock = threading.Lock()
-        self._reader_thread = threading.Thread(target=self._read_stdout, daemon=True)
-        self._reader_thread.start()
+        self._stdout_fd = stdout_fd
+        self.url: Optional[str] = url
+        self.url_ready = asyncio.Event()
+        if url:
+            self.url_ready.set()
+        self.restarts = 0
+        self._detached = False
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
         atexit.register(self.stop)  # safety net
-    
-    def _read_stdout(self):
+
+    @classmethod
+    def launch(cls, command: list[str]) -> "TunnelManager":
+        """Starts cloudflared (`command`) and supervises it. Raises OSError if it cannot be started."""
+        manager = cls(command)
+        manager._spawn()
+        manager.start()
+        return manager
+
+    @classmethod
+    def adopt(cls, pid: int, stdout_fd: int, url: Optional[str], command: Optional[list[str]] = None) -> "TunnelManager":
+        """Takes over the cloudflared of the og-server this process replaced, the public URL stays the same."""
+        manager = cls(command, proc=_AdoptedProcess(pid), stdout_fd=stdout_fd, url=url)
+        manager.start()
+        return manager
+
+    def start(self):
+        """Starts supervising the current process, needs a running event loop."""
+        self._task = asyncio.create_task(self._supervise())
+
+    def _spawn(self):
+        assert self.command is not None
+        read_fd, write_fd = os.pipe()
+        try:
+            self._proc = subprocess.Popen(self.command, stdin=subprocess.DEVNULL, stdout=write_fd, stderr=subprocess.STDOUT)
+        except BaseException:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+        self._stdout_fd = read_fd
+
+    # ==== #
+    # Supervision
+    # ==== #
+
+    async def _supervise(self):
+        failures = 0
+        while True:
+            started = time.monotonic()
+            if self._proc is not None:
+                try:
+                    await self._read_output()
+                finally:
+                    await self._reap()
+            if self._stopping or self._detached:
+                return
+            if self.command is None:
+                print("----\n⚠️ cloudflared exited and cannot be restarted, the public URL is gone. Local clients are not affected.\n----")
+                return
+
+            failures = 0 if time.monotonic() - started >= self.STABLE_AFTER else failures + 1
+            delay = min(self.RESTART_DELAY * 2 ** max(failures - 1, 0), self.RESTART_DELAY_MAX)
+            self.url = None
+            self.url_ready.clear()
+            print(f"----\n⚠️ cloudflared exited, restarting it in {delay:.0f}s (the public URL will change)\n----")
+            await asyncio.sleep(delay)
+            if self._stopping or self._detached:
+                return
+            try:
+                self._spawn()
+                self.restarts += 1
+            except OSError as e:
+                print(f"Failed to restart cloudflared: {e}", file=sys.stderr)
+
+    async def _read_output(self):
+        """Reads cloudflared's output until it closes, picking up the URL on the way."""
+        assert self._stdout_fd is not None
+        reader = asyncio.StreamReader()
+        transport, _ = await asyncio.get_running_loop().connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(self._stdout_fd, "rb", buffering=0)
+        )
         try:
-            assert self._proc.stdout is not None
-            for raw in self._proc.stdout:
-                line = raw.rstrip("\n")
+            async for raw in reader:
+                line = raw.decode("utf-8", errors="replace").rstrip("\n")
                 ## keep logging the cloudflared output
                 # print("[cloudflared]", line)
                 # Print only the URL
-                with self._lock:
-                    if self.url is None:
-                        m = self.URL_REGEX.search(line)
-                        if m:
-                            self.url = m.group(0)
-                            print(f"🌐 Tunnel active at ↓↓↓\n====\n{self.url}\n====")
-        except Exception as e:
-            # reader thread should never crash silently
-            print("Error reading cloudflared output:", e, file=sys.stderr)
-    
+                if self.url is None:
+                    m = self.URL_REGEX.search(line)
+                    if m:
+                        self.url = m.group(0)
+                        self.url_ready.set()
+                        print(f"🌐 Tunnel active at ↓↓↓\n====\n{self.url}\n====")
+        finally:
+            transport.close() # closes the fd
+            self._stdout_fd = None
+
+    async def _reap(self):
+        proc, self._proc = self._proc, None
+        if proc is None or self._detached:
+            return
+        deadline = time.monotonic() + self.EXIT_GRACE
+        while proc.poll() is None:
+            if time.monotonic() > deadline:
+                try:
+                    proc.kill()
+                except ProcessLookupError:
+                    pass
+                return
+            await asyncio.sleep(0.1)
+
+    async def wait_for_url(self, timeout: float) -> Optional[str]:
+        """The public URL, None if cloudflared did not report one within `timeout` seconds."""
+        try:
+            await asyncio.wait_for(self.url_ready.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.url
+
+    # ==== #
+    # Handoff (graceful restart)
+    # ==== #
+
+    @property
+    def pid(self) -> Optional[int]:
+        """None while cloudflared is being restarted."""
+        return self._proc.pid if self._proc is not None else None
+
+    def stdout_fd(self) -> Optional[int]:
+        return self._stdout_fd
+
+    def detach(self):
+        """Leaves cloudflared running for the og-server that took over, stop() becomes a no-op."""
+        self._detached = True
+        atexit.unregister(self.stop)
+        if self._task is not None:
+            self._task.cancel()
+
     def stop(self, timeout: float = 5.0):
         """
         Terminate the cloudflared process if still running.
         Safe to call multiple times.
         """
+        if self._detached:
+            return
+        self._stopping = True
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        proc = self._proc
         try:
-            if self._proc.poll() is None:
+            if proc is not None and proc.poll() is None:
                 print("Stopping cloudflared tunnel...")
-                self._proc.terminate()
+                proc.terminate()
                 try:
-                    self._proc.wait(timeout=timeout)
+                    proc.wait(timeout=timeout)
                 except subprocess.TimeoutExpired:
                     print("cloudflared did not exit, killing...")
-                    self._proc.kill()
-                    self._proc.wait(timeout=timeout)
+                    proc.kill()
+                    proc.wait(timeout=timeout)
         except Exception as e:
             print("Error stopping cloudflared:", e, file=sys.stderr)
-    
-
-
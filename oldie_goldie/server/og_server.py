@@ -0,0 +1,1304 @@
+# server/og_server.py
+"""
+OGServer: the og-server core (registration, tunnels, relay, invite tokens) as an object.
+
+Each instance owns its registries, tokens and stores, so several servers can run in one
+process, e.g. shards of a service or one per test. og-server (server.py) is the command
+line around it: arguments, cloudflared, invite token printing and graceful restarts.
+
+    server = OGServer(["127.0.0.1:0"])
+    await server.start()
+    print(server.addresses)  # ['127.0.0.1:41557']
+    ...
+    await server.stop()
+"""
+
+import asyncio
+import hmac
+import logging
+import secrets
+import socket
+import time
+from http import HTTPStatus
+from typing import Any, Callable, Iterable
+
+import websockets
+
+from oldie_goldie.shared import encode_message, decode_message, parse_binary_header, make_register_message, make_user_disconnected_message, make_system_response
+from oldie_goldie.shared.protocol import FRAME_KIND_MESSAGE
+from oldie_goldie.server.helpers.listeners import open_listener, describe_listener
+from oldie_goldie.server.helpers.connections import ConnectionRecord, ConnectionRegistry, SessionTickets, TunnelValidation, IDLE, VALIDATING
+from oldie_goldie.server.helpers.journal import EventJournal
+from oldie_goldie.server.helpers.liveness import LivenessMonitor, SERVE_OPTIONS as LIVENESS_SERVE_OPTIONS
+from oldie_goldie.server.helpers.memory_budget import MemoryBudget, MAX_TEXT_FRAME
+from oldie_goldie.server.helpers.metrics import Metric, loop_metrics
+from oldie_goldie.shared.loop_monitor import LoopMonitor, loop_activity
+from oldie_goldie.server.helpers.state_store import ServerStateStore, TokenTable, BlockList
+from oldie_goldie.server.helpers.store_forward import OfflineFrameStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LISTEN = "127.0.0.1:8765"
+FAST_HANDSHAKE_TIMEOUT = 60 # seconds
+RESUME_WINDOW = 120 # seconds
+STORE_PURGE_INTERVAL = 60 # seconds
+
+def is_valid_username_format(username: str) -> tuple[bool, str]:
+    """Validates the format of the username and returns a tuple of (is_valid, reason)"""
+    reserved_keywords = {
+        "None", "True", "False", "and", "or", "not", "if", "else", "elif", "while", "for", "in", "def", "class", "import", "from", "as", "return", "break", "continue"
+    }
+
+    if not username:
+        return False, "Username is required."
+    if not username.islower():
+        return False, "Username must only contain lowercase alphabetical characters and/or numerical characters."
+    if not username[0].isalpha():
+        return False, "Username must start with a letter."
+    if not username.isalnum():
+        return False, "Username must be either alphabetic or alphanumeric."
+    if len(username) > 50:
+        return False, "Username must be no longer than 50 characters."
+    if username in reserved_keywords:
+        return False, "Username is a reserved keyword."
+    if username == "server":
+        return False, "Username 'server' is not for you bro 😤"
+    return True, ""
+
+async def send_to_pair(ws1: websockets.ServerConnection, ws2: websockets.ServerConnection, message1: str, message2: str | None = None) -> None:
+    """Sends to both peers of a tunnel concurrently. `message2` defaults to `message1`."""
+    await asyncio.gather(ws1.send(message1), ws2.send(message1 if message2 is None else message2))
+
+class OGServer:
+    """
+    An og-server and all of its state.
+    - start() binds the `listen` addresses (or serves the given `listeners`) and returns once clients can connect
+    - serve_forever() runs until stop(), stop() closes the connections and flushes the state store and the journal
+    - also an async context manager: `async with OGServer([...]) as server:`
+
+    The stores are optional, as in og-server: `state_store` keeps `invite_tokens` and `blocked_usernames`
+    on disk (pass the tables it opened), `offline_store` enables store-and-forward, `journal` the event journal.
+    With a `liveness` monitor, the housekeeping pings the clients instead of the websockets library.
+    A `memory_budget` sizes the connection buffers and refuses connections when they are full.
+    A `loop_monitor` (started by the caller) is reported in metrics() and refuses connections while the loop lags.
+    """
+
+    def __init__(
+        self,
+        listen: Iterable[str] = (DEFAULT_LISTEN,),
+        *,
+        listeners: list[socket.socket] | None = None,
+        compression_options: dict[str, Any] | None = None,
+        invite_token: bool = False,
+        invite_tokens: TokenTable | None = None,
+        blocked_usernames: BlockList | None = None,
+        state_store: ServerStateStore | None = None,
+        offline_store: OfflineFrameStore | None = None,
+        journal: EventJournal | None = None,
+        liveness: LivenessMonitor | None = None,
+        memory_budget: MemoryBudget | None = None,
+        loop_monitor: LoopMonitor | None = None,
+    ):
+        self.listen = list(listen)
+        self.listeners = listeners # bound by start() when None
+        self.compression_options = compression_options or {}
+
+        # One ConnectionRecord per registered user, by username and by websocket.
+        # A record also holds the user's tunnel peer, so tunnel checks and cleanup need no search.
+        self.connections = ConnectionRegistry()
+
+        # Blocked usernames set (persistent with --state-dir)
+        self.blocked_usernames: BlockList = blocked_usernames if blocked_usernames is not None else BlockList()
+
+        # PSK validations in progress, keyed by (requester, responder) for the timeout sweep.
+        # Both records point to their validation while it runs.
+        self.pending_validations: dict[tuple[str, str], TunnelValidation] = {}
+
+        # Fast handshake offers carried by `connect_request`, keyed by (requester, responder).
+        # Each holds the requester's public key, PSK proof and features until the responder answers.
+        # The keys are also kept in the `offers` of both records, to drop them when either disconnects.
+        self.pending_fast_handshakes: dict[tuple[str, str], dict[str, Any]] = {}
+
+        # Session tickets. Every registered user holds one, keyed here by username: {"ticket", "peer", "expiry"},
+        # `peer` being their tunnel peer if they are in a tunnel. The expiry is None while the user is connected
+        # and starts running when they drop. Until then the username is reserved, and a reconnect presenting the
+        # ticket (X-OG-Ticket header) registers it again without an invite token and rejoins the tunnel.
+        # Also indexed by ticket, so a handshake presenting one costs a single lookup.
+        self.resumption_tickets = SessionTickets()
+
+        # Called with (username, ticket record or None) after every change to resumption_tickets.
+        # Set during a graceful restart to stream the changes to the successor.
+        self.on_ticket_change: Callable[[str, dict[str, Any] | None], None] | None = None
+
+        # Connected users whose tunnel peer dropped and may still resume: username -> absent peer
+        self.suspended_tunnels: dict[str, str] = {}
+
+        # Invite tokens, checked when invite_token is set: {token: {"username", "expiry", "reuse"}}
+        self.invite_token = invite_token
+        self.invite_tokens: TokenTable = invite_tokens if invite_tokens is not None else TokenTable()
+
+        # Durable tokens and blocklist (--state-dir DIR): a WAL of every change plus a snapshot mmap'd at startup
+        self.state_store = state_store
+
+        # Store-and-forward (--store-forward DIR). Frames for an offline user who can prove their identity when
+        # they come back (token-bound username, or tunnel user holding a resumption ticket) are queued on disk
+        self.offline_store = offline_store
+
+        # Event journal (--journal DIR): durable record of registrations, tunnels and token use, read with og-journal
+        self.journal = journal
+
+        # Adaptive keepalive and reaping of vanished clients, see helpers/liveness.py
+        self.liveness = liveness
+
+        # Frame and buffer limits of the connections, see helpers/memory_budget.py.
+        # A tenant only uses it to refuse oversized frames, its TenantRouter owns the connections.
+        self.memory_budget = memory_budget
+        self.loop_monitor = loop_monitor
+
+        self.ws_servers: list[websockets.Server] = [] # one per listener
+        self._housekeeping: asyncio.Task | None = None
+        self._next_store_purge = time.time() + STORE_PURGE_INTERVAL
+        self._stopping = False
+        self._stopped = asyncio.Event()
+
+    # ==== #
+    # Lifecycle
+    # ==== #
+
+    async def start(self) -> "OGServer":
+        """Binds the listeners unless they were given, and starts serving. Raises OSError if an address cannot be bound."""
+        if self.ws_servers:
+            return self
+        if self.listeners is None:
+            self.listeners = [open_listener(address) for address in self.listen]
+        keepalive = LIVENESS_SERVE_OPTIONS if self.liveness is not None else {}
+        limits = self.memory_budget.serve_options if self.memory_budget is not None else {}
+        for listener in self.listeners:
+            self.ws_servers.append(await websockets.serve(self.handler, sock=listener, process_request=self.process_request, **self.compression_options, **keepalive, **limits))
+        self._housekeeping = asyncio.create_task(self.check_tunnel_timeouts())
+        return self
+
+    async def serve_forever(self) -> None:
+        """Starts the server if needed and runs until stop()."""
+        await self.start()
+        await self._stopped.wait()
+
+    def stop_accepting(self) -> None:
+        """Closes the listeners, connected clients carry on (graceful restart)."""
+        for server in self.ws_servers:
+            server.close(close_connections=False)
+
+    async def stop(self) -> None:
+        """Closes the listeners and the connections, then flushes the state store and the journal. Safe to call multiple times."""
+        if self._stopping:
+            await self._stopped.wait()
+            return
+        self._stopping = True
+        try:
+            for server in self.ws_servers:
+                server.close()
+            await asyncio.gather(*(server.wait_closed() for server in self.ws_servers))
+            if self._housekeeping is not None:
+                self._housekeeping.cancel()
+
+            # Snapshot the state so the next start only has to map it
+            if self.state_store is not None:
+                await self.state_store.close()
+                self.state_store = None
+
+            # Commit what is still buffered in the journal
+            if self.journal is not None:
+                self.journal_event("server_stop")
+                await self.journal.close()
+                self.journal = None
+        finally:
+            self._stopped.set()
+
+    async def __aenter__(self) -> "OGServer":
+        return await self.start()
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.stop()
+
+    @property
+    def addresses(self) -> list[str]:
+        """The listening addresses in --listen syntax, with the actual port when it was 0."""
+        return [describe_listener(listener) for listener in self.listeners or []]
+
+    def metrics(self) -> list[Metric]:
+        """Current state for the metrics endpoint (helpers/metrics.py)."""
+        metrics = [
+            Metric.single("og_connections", "gauge", "Open websocket connections", len(self.open_connections())),
+            Metric.single("og_users", "gauge", "Registered users", len(self.connections)),
+            Metric.single("og_tunnels", "gauge", "Active tunnels", self.connections.tunnel_count()),
+        ]
+        if self.memory_budget is not None:
+            metrics += self.memory_budget.metrics()
+        if self.loop_monitor is not None:
+            metrics += loop_metrics(self.loop_monitor)
+        return metrics
+
+    # ==== #
+    # Protocol
+    # ==== #
+
+    def journal_event(self, event: str, **fields: Any) -> None:
+        """Records an event in the journal if it is enabled. Tokens are only ever journaled by their first characters."""
+        if self.journal is not None:
+            self.journal.record(event, **fields)
+
+    async def handle_registration(self, websocket:websockets.ServerConnection, bound_username:str, resuming_username: str | None = None) -> str | None:
+        TIMEOUT = 10
+        MAX_ATTEMPTS = 4
+        attempts = 0
+        start_time = asyncio.get_event_loop().time()
+
+        while True:
+            time_left = TIMEOUT - (asyncio.get_event_loop().time() - start_time)
+            if time_left <=0:
+                await websocket.send(encode_message(
+                    type="register_error",
+                    sender="Server",
+                    message="⏰ Time expired bruh! You didn't register in time. Connection will be closed.\n Try again sooner this time 👍"
+                ))
+                await websocket.close()
+                return None
+        
+            try:
+                message = await asyncio.wait_for(websocket.recv(), timeout=time_left)
+                decoded = decode_message(message)
+                if decoded.get("type") != "register" or "username" not in decoded or not decoded.get("username"):
+                    await websocket.send(encode_message(
+                        type="register_error",
+                        sender="Server",
+                        message="❌ Invalid registration format. Must send a 'register' message with 'username'."
+                    ))
+                    attempts += 1
+                else:
+                    username = decoded["username"].strip()
+                    is_valid, reason = is_valid_username_format(username=username)
+                    if not is_valid:
+                        attempts += 1
+                        if attempts >= MAX_ATTEMPTS:
+                            await websocket.send(encode_message(
+                                type="register_error",
+                                sender="Server",
+                                message=f"❌ Invalid username: {reason}\n⚠️ Maximum attempts reached. Disconnecting."
+                            ))
+                            await websocket.close()
+                            return None
+                        await websocket.send(encode_message(
+                            type="register_error",
+                            sender="Server",
+                            message=f"❌ Invalid username: {reason}\n🔁 Attempts remaining: {MAX_ATTEMPTS - attempts}"
+                        ))
+                    elif username in self.connections:
+                        await websocket.send(encode_message(
+                            type="register_error",
+                            sender="Server",
+                            message=f"⚠️ Username '{username}' is already taken. Try another.\n⌛ Time left: {int(time_left)}s"
+                        ))
+                    elif username != resuming_username and self.is_reserved_for_resumption(username):
+                        await websocket.send(encode_message(
+                            type="register_error",
+                            sender="Server",
+                            message=f"⌛ Username '{username}' is reserved while its owner can reconnect. Try another.\n⌛ Time left: {int(time_left)}s"
+                        ))
+                    elif username in self.blocked_usernames:
+                        await websocket.send(encode_message(
+                            type="register_error",
+                            sender="Server",
+                            message=f"⛔ Username '{username}' has been blocked. Restart required with a new identity."
+                        ))
+                    elif bound_username and (username != bound_username):
+                        await websocket.send(
+                            encode_message(
+                                type="register_error",
+                                sender="Server",
+                                message=f"⛔ You are using a token bound to another username. If you have misspelled please try again else do not misuse the token that's not meant for you!"
+                            )
+                        )
+                    else:
+                        return username # ✅ Success
+            except asyncio.TimeoutError:
+                await websocket.send(encode_message(
+                    type="register_error",
+                    sender="Server",
+                    message="🥚 Timeout waiting for username. Connection closing."
+                ))
+                await websocket.close()
+                return None
+            except websockets.exceptions.ConnectionClosedOK:
+                logger.info("[handle_registration] Registration cancelled from user's side")
+                return None
+            except Exception as e:
+                logger.exception(f"Error during registration: {e}")
+                await websocket.send(encode_message(
+                    type="register_error",
+                    sender="Server",
+                    message="❌ Unexpected error occurred. Try again later."
+                ))
+                await websocket.close()
+                return None
+
+
+    def issue_resumption_ticket(self, username: str, peer: str | None) -> str:
+        """Issues (or rotates) the session ticket of a user, `peer` being their tunnel peer if any."""
+        ticket = secrets.token_urlsafe(24)
+        self.resumption_tickets[username] = {"ticket": ticket, "peer": peer, "expiry": None}
+        self.ticket_changed(username)
+        return ticket
+
+    def discard_resumption(self, username: str | None) -> None:
+        """Forgets the tunnel of a user whose tunnel ended for good. Their session ticket stays valid."""
+        if username in self.resumption_tickets:
+            self.resumption_tickets[username]["peer"] = None # type: ignore
+            self.ticket_changed(username) # type: ignore
+        self.suspended_tunnels.pop(username, None) # type: ignore
+
+    def end_session(self, username: str) -> None:
+        """Forgets the session ticket of a user who left for good, releasing their username."""
+        self.resumption_tickets.pop(username, None)
+        self.suspended_tunnels.pop(username, None)
+        self.ticket_changed(username)
+
+    def ticket_changed(self, username: str) -> None:
+        if self.on_ticket_change is not None:
+            self.on_ticket_change(username, self.resumption_tickets.get(username))
+
+    def find_resumption_ticket(self, ticket: str | None) -> str | None:
+        """Returns the username a presented ticket can register again, None if it is unknown, in use or expired."""
+        if not ticket:
+            return None
+        username = self.resumption_tickets.owner(ticket)
+        if username is None or username in self.connections or not SessionTickets.is_live(self.resumption_tickets[username], time.time()):
+            return None
+        return username
+
+    def is_reserved_for_resumption(self, username: str) -> bool:
+        """True while a user who dropped can still come back under this username, until their ticket expires."""
+        record = self.resumption_tickets.get(username)
+        return record is not None and username not in self.connections and SessionTickets.is_live(record, time.time())
+
+    async def expire_resumption(self, username: str) -> None:
+        """Drops the expired session ticket of a user who did not come back. Their tunnel is over, a waiting peer is told."""
+        peer = self.resumption_tickets.pop(username)["peer"]
+        self.ticket_changed(username)
+        if peer is None:
+            return
+        self.journal_event("resumption_expired", username=username, peer=peer)
+        if self.resumption_tickets.get(peer, {}).get("peer") == username:
+            self.resumption_tickets[peer]["peer"] = None
+            self.ticket_changed(peer)
+        if self.suspended_tunnels.get(peer) == username:
+            del self.suspended_tunnels[peer]
+            peer_record = self.connections.get(peer)
+            try:
+                if peer_record is not None:
+                    await peer_record.websocket.send(make_user_disconnected_message(username=username))
+            except Exception:
+                pass
+
+    async def resume_tunnel(self, record: ConnectionRecord) -> None:
+        """Puts a user who reconnected with a valid ticket back into their tunnel, or parks them until the peer is back."""
+        websocket, username = record.websocket, record.username
+        peer = self.resumption_tickets[username]["peer"]
+        ticket = self.resumption_tickets[username]["ticket"] # rotated on registration
+
+        # What the peer sent meanwhile goes first: the cipher counters only accept frames in order.
+        # The tunnel stays suspended until the queue is drained, so new frames keep being queued behind.
+        await self.deliver_stored_frames(websocket=websocket, username=username)
+
+        peer_record = self.connections.get(peer)
+        if peer_record is not None and self.suspended_tunnels.get(peer) == username:
+            del self.suspended_tunnels[peer]
+            self.connections.open_tunnel(record, peer_record)
+
+            logger.info(f"[resume_tunnel] @{username} resumed their tunnel with @{peer}")
+            self.journal_event("tunnel_resumed", username=username, peer=peer)
+
+            await send_to_pair(
+                websocket, peer_record.websocket,
+                encode_message(type="tunnel_resumed", sender=peer, ticket=ticket, message=f"Tunnel with @{peer} resumed."),
+                encode_message(type="tunnel_resumed", sender=username, message=f"@{username} is back. Tunnel resumed."),
+            )
+        else:
+            # The peer dropped too, whoever comes back second completes the resumption
+            self.suspended_tunnels[username] = peer
+            logger.info(f"[resume_tunnel] @{username} is back, waiting for @{peer} to resume")
+            self.journal_event("tunnel_resume_waiting", username=username, peer=peer)
+            await websocket.send(encode_message(type="tunnel_suspended", sender=peer, ticket=ticket, stored=self.offline_store is not None, message=f"Waiting for @{peer} to reconnect."))
+
+    # ==== #
+    # Handshake state
+    # ==== #
+
+    def add_fast_handshake(self, requester: ConnectionRecord, responder: ConnectionRecord, offer: dict[str, Any]) -> None:
+        pair = (requester.username, responder.username)
+        self.pending_fast_handshakes[pair] = offer
+        for record in (requester, responder):
+            if record.offers is None:
+                record.offers = set()
+            record.offers.add(pair)
+
+    def pop_fast_handshake(self, pair: tuple[str, str]) -> dict[str, Any] | None:
+        """Removes a fast handshake offer, returns it or None if there was none."""
+        offer = self.pending_fast_handshakes.pop(pair, None)
+        if offer is not None:
+            for username in pair:
+                record = self.connections.get(username)
+                if record is not None and record.offers:
+                    record.offers.discard(pair)
+                    if not record.offers:
+                        record.offers = None
+        return offer
+
+    def start_validation(self, requester: ConnectionRecord, responder: ConnectionRecord) -> None:
+        validation = TunnelValidation(requester, responder, deadline=asyncio.get_event_loop().time() + 10)
+        self.pending_validations[validation.pair] = validation
+        for record in (requester, responder):
+            record.validation = validation
+            record.state = VALIDATING
+
+    def end_validation(self, validation: TunnelValidation) -> None:
+        """Forgets a finished validation. Records that are in the tunnel it opened are left as they are."""
+        if self.pending_validations.get(validation.pair) is validation:
+            del self.pending_validations[validation.pair]
+        for record in (validation.requester, validation.responder):
+            if record.validation is validation:
+                record.validation = None
+                record.state = IDLE
+
+    # ==== #
+    # Store-and-forward
+    # ==== #
+
+    def can_store_for(self, username: str | None) -> bool:
+        """True if frames for this offline user may be queued: only they can claim the username when they come back."""
+        if self.offline_store is None or not username or username in self.connections or username in self.blocked_usernames:
+            return False
+        if self.is_reserved_for_resumption(username):
+            return True
+        return self.invite_tokens.is_bound(username)
+
+    async def store_tunnel_frame(self, websocket: websockets.ServerConnection, source_user: str, target_user: str, frame: str | bytes) -> None:
+        """Queues tunnel traffic for a peer who dropped, it is delivered before the tunnel resumes."""
+        if self.offline_store.append(target_user, source_user, frame): # type: ignore
+            logger.debug(f"[store_tunnel_frame] Stored a tunnel frame from @{source_user} for @{target_user}")
+            return
+
+        await websocket.send(encode_message(
+            type='store_full',
+            sender='Server',
+            message=f'Too many messages are waiting for @{target_user}, this one was not stored.'
+        ))
+
+    async def deliver_stored_frames(self, websocket: websockets.ServerConnection, username: str) -> None:
+        """
+        Streams the frames queued while the user was offline, in batches.
+        Connection requests are delivered if the requester is still online, tunnel frames if
+        they come from the peer of the tunnel being resumed. Anything else is stale and dropped.
+        """
+        if self.offline_store is None or not self.offline_store.has_pending(username):
+            return
+
+        delivered = dropped = 0
+        tunnel_peer = self.resumption_tickets.get(username, {}).get("peer")
+
+        while batch := await self.offline_store.read_batch(username):
+            now = time.time()
+            for stored in batch:
+                if stored.expiry < now:
+                    dropped += 1
+                    continue
+
+                if isinstance(stored.frame, str) and decode_message(stored.frame).get("type") == "connect_request":
+                    deliverable = stored.sender in self.connections
+                else:
+                    deliverable = stored.sender == tunnel_peer
+
+                if deliverable:
+                    await websocket.send(stored.frame)
+                    delivered += 1
+                else:
+                    dropped += 1
+
+            self.offline_store.commit(username, batch)
+
+        logger.info(f"[deliver_stored_frames] @{username}: {delivered} stored frame(s) delivered, {dropped} dropped")
+        self.journal_event("stored_delivered", username=username, delivered=delivered, dropped=dropped)
+
+    async def relay_binary_frame(self, record: ConnectionRecord, frame: bytes) -> None:
+        """
+        Relays an encrypted binary tunnel frame to its target.
+        Only the routing header is parsed, the payload is forwarded untouched as a binary frame.
+        """
+        websocket, source_user = record.websocket, record.username
+
+        try:
+            kind, _, target_user, _ = parse_binary_header(frame)
+        except ValueError as e:
+            logger.warning(f"[relay_binary_frame] Dropping malformed binary frame from @{source_user}: {e}")
+            return
+
+        logger.debug(f'[relay_binary_frame] Received binary frame from {source_user}. Relaying to {target_user}')
+
+        target = self.connections.get(target_user)
+        if self.offline_store is not None and self.suspended_tunnels.get(source_user) == target_user:
+            if kind == FRAME_KIND_MESSAGE:
+                await self.store_tunnel_frame(websocket=websocket, source_user=source_user, target_user=target_user, frame=frame)
+        elif target is None:
+            await websocket.send(
+                encode_message(
+                    type='connect_error',
+                    sender='Server',
+                    message=f'Could not find user @{target_user} to connect.'
+                )
+            )
+        elif not self.connections.in_tunnel_together(record, target):
+            await websocket.send(
+                encode_message(
+                    type='connect_error',
+                    sender='Server',
+                    message=f'User @{target_user} is not participating in an active tunnel with you.'
+                )
+            )
+        else:
+            record.relayed += 1
+            await target.websocket.send(frame)
+
+    async def reject_tunnel(self, a: str, b: str, ws1: websockets.ServerConnection, ws2: websockets.ServerConnection) -> None:
+        """PSK mismatch: block both usernames, notify them and close both connections."""
+        logger.debug(f"[reject_tunnel] validation of secrets unsuccessful. Adding usernames to `blocked_usernames`. Closing connection with clinets.")
+        print("----\nValidation Unsuccessful. Adding usernames to block list.\n----")
+
+        for u in (a, b):
+            self.blocked_usernames.add(u)
+        self.journal_event("tunnel_failed", requester=a, responder=b, reason="psk_mismatch")
+
+        await send_to_pair(ws1, ws2, encode_message(
+            type="tunnel_failed",
+            sender="Server",
+            message="Validation failed. This username is now blocked."
+        ))
+
+        await asyncio.gather(ws1.close(), ws2.close())
+        print(f"----\nClosed connection with {a} and {b}\n----")
+
+    async def complete_fast_handshake(self, requester_record: ConnectionRecord, responder_record: ConnectionRecord, offer: dict[str, Any], accept: dict[str, Any]) -> None:
+        """
+        Fast handshake: compare the PSK proofs of the `connect_request` offer and the `connect_accept`,
+        then hand each peer the other's public key in a single `tunnel_ok`.
+        """
+        requester, responder = requester_record.username, responder_record.username
+        ws1, ws2 = requester_record.websocket, responder_record.websocket
+
+        if not hmac.compare_digest(str(offer["proof"]).encode(), str(accept.get("proof")).encode()):
+            await self.reject_tunnel(requester, responder, ws1, ws2)
+            return
+
+        logger.debug(f"[complete_fast_handshake] PSK proofs match. Opening the tunnel")
+        print(f"----\nValidation Successful.\nEstablishing peer to peer relay between `{requester}` and `{responder}`.\n----")
+        self.connections.open_tunnel(requester_record, responder_record)
+        self.journal_event("tunnel_established", requester=requester, responder=responder, handshake="fast")
+
+        await send_to_pair(
+            ws1, ws2,
+            encode_message(
+                type="tunnel_ok",
+                sender=responder,
+                key=accept.get("key"),
+                features=accept.get("features", []),
+                ticket=self.issue_resumption_ticket(username=requester, peer=responder),
+                message=f"@{responder} accepted your connection. Tunnel successfully established!"
+            ),
+            encode_message(
+                type="tunnel_ok",
+                sender=requester,
+                key=offer["key"],
+                features=offer["features"],
+                ticket=self.issue_resumption_ticket(username=responder, peer=requester),
+                message="Tunnel successfully established!"
+            ),
+        )
+
+    async def broadcast(self, record: ConnectionRecord) -> None:
+        websocket = record.websocket
+        connections = self.connections
+        try:
+            async for message in websocket:
+                record.received += 1
+
+                # Binary frames are encrypted tunnel traffic, route them from the header alone
+                if isinstance(message, bytes):
+                    loop_activity.set("binary_frame")
+                    await self.relay_binary_frame(record=record, frame=message)
+                    continue
+
+                # Control messages and chat lines are small, a huge one is refused before it is decoded
+                if self.memory_budget is not None and len(message) > MAX_TEXT_FRAME:
+                    self.memory_budget.oversized += 1
+                    logger.warning(f"[broadcast] @{record.username} sent a text frame of {len(message)} characters, closing the connection")
+                    await websocket.close(code=1009, reason="Message too big")
+                    return
+
+                # Establishing peer connection
+                decoded = decode_message(message_str=message) #type: ignore
+                loop_activity.set(str(decoded.get("type"))[:64])
+
+                #### Connection Request Handling ####
+                # check if it's a connect request
+                if decoded.get("type") == "connect_request":
+                
+                    source_user = record.username
+                    target_user = decoded.get("target")
+                    target = connections.get(target_user)
+
+                    logger.info(f"[broadcast] received `connect_request` from @{source_user} to @{target_user} ")
+                
+                    # An offline user who will be able to come back gets the request on registration.
+                    # Stored requests carry no fast handshake offer, they fall back to PSK validation.
+                    if target is None and self.can_store_for(target_user) and self.offline_store.append( # type: ignore
+                        target_user, source_user, encode_message(
+                            type="connect_request",
+                            sender=source_user,
+                            message=f"Connection request from @{source_user} (sent while you were offline). Use /accept or /deny."
+                        )
+                    ):
+                        logger.info(f"[broadcast] @{target_user} is offline, `connect_request` from @{source_user} stored")
+                        self.journal_event("connect_request", requester=source_user, responder=target_user, queued=True)
+                        await websocket.send(
+                            encode_message(
+                                type="connect_queued",
+                                sender="Server",
+                                message=f"@{target_user} is offline. Your request will be delivered when they connect."
+                            )
+                        )
+
+                    # checking if target's connected
+                    elif target is None:
+                        self.journal_event("connect_error", requester=source_user, responder=target_user, reason="not_found")
+                        await websocket.send(
+                            encode_message(
+                                type="connect_error",
+                                sender="Server",
+                                message=f"Could not find user '{target_user}' to connect."
+                            )
+                        )
+
+                    # Forward the request to the target user
+                    else:
+                        self.journal_event("connect_request", requester=source_user, responder=target_user, fast=bool(decoded.get("key") and decoded.get("proof")))
+                        # Fast handshake: the request carries the requester's public key and PSK proof.
+                        # The key and features are forwarded, the proof stays with the server.
+                        fast_fields = {}
+                        if decoded.get("key") and decoded.get("proof"):
+                            self.add_fast_handshake(record, target, {
+                                "key": decoded["key"],
+                                "proof": decoded["proof"],
+                                "features": decoded.get("features", []),
+                                "deadline": asyncio.get_event_loop().time() + FAST_HANDSHAKE_TIMEOUT
+                            })
+                            fast_fields = {"key": decoded["key"], "features": decoded.get("features", [])}
+
+                        await target.websocket.send(
+                            encode_message(
+                                type="connect_request",
+                                sender=source_user,
+                                message=f"Connection request from @{source_user}. Use /accept or /deny.",
+                                **fast_fields
+                            )
+                        )
+                
+                #### Connect Busy ####
+                # If peer already has a `connect_request`
+                if decoded.get("type") == 'connect_busy':
+                
+                    requester : str | None = ""
+                    requester = decoded['target'] # The one who initiated the request
+                    responder = record.username
+
+                    self.journal_event("connect_busy", requester=requester, responder=responder)
+                    logger.info(f"[broadcast] (server) Connection request from @{requester} to @{responder} denied by server. @{responder} is not idle, they either have pending connection requests or is in a private tunnel.")
+
+                    await connections.by_username[requester].websocket.send(
+                        encode_message(
+                            type='connect_busy',
+                            sender=responder,
+                            message=f"(server) Connection request to @{responder} denied. They may either have \n- pending connection requests or \n- could be in a private tunnel.\n"
+                        )
+                    )
+
+                #### Connect Accept ####
+                if decoded.get("type") == "connect_accept":
+                    responder = record.username
+                    requester = decoded["target"] # The user who initiated request
+                    requester_record = connections.get(requester)
+
+                    if requester_record is None:
+                        await websocket.send(encode_message(
+                            type="connect_error",
+                            sender="Server",
+                            message=f"Requester @{requester} not found."
+                        ))
+                        continue
+
+                    # Both peers sent their key and proof: the tunnel is settled right here
+                    offer = self.pop_fast_handshake((requester, responder))
+                    self.journal_event("connect_accept", requester=requester, responder=responder)
+                    if offer is not None and decoded.get("key") and decoded.get("proof"):
+                        logger.info(f"[broadcast] connect_accept (fast handshake): (responder) @{responder} <-> (requester) @{requester}.")
+                        await self.complete_fast_handshake(requester_record=requester_record, responder_record=record, offer=offer, accept=decoded)
+                        continue
+
+                    # Otherwise fall back to the PSK round trips. A fast requester answers `tunnel_validate` with its cached PSK.
+                    await requester_record.websocket.send(
+                        encode_message(
+                            type="connect_accept",
+                            sender=responder,
+                            message=f"@{responder} accepted your connection. Tunnel validation will start."
+                        )
+                    )
+                
+                    logger.info(f"[broadcast] connect_accept: (responder) @{responder} <-> (requester) @{requester}.")
+                               
+                    # Accepting connection - trigger tunnel validation
+                    await send_to_pair(requester_record.websocket, websocket, encode_message(
+                        type="tunnel_validate",
+                        sender="Server",
+                        message="Enter the pre-shared secret to validate the tunnel (within 10 seconds)"
+                    ))
+
+                    # Save validation state
+                    self.start_validation(requester_record, record)
+            
+                #### Connection Deny ####
+                if decoded.get("type") == "connect_deny":
+                    responder = record.username
+                    requester= decoded["target"]
+
+                    logger.info(f"[broadcast] received `connect_deny` from {responder} for {requester}")
+                    self.journal_event("connect_deny", username=responder, peer=requester)
+
+                    # Either side may deny, drop a fast handshake offer in both directions
+                    self.pop_fast_handshake((requester, responder))
+                    self.pop_fast_handshake((responder, requester))
+
+                    requester_record = connections.get(requester)
+                    if requester_record is not None:
+                        await requester_record.websocket.send(
+                            encode_message(
+                                type="connect_deny",
+                                sender=responder,
+                                message=f"@{responder} denied your connection request."
+                            )
+                        )
+                        logger.info(f"[server] connect_deny: @{responder} rejected @{requester}")
+            
+                #### Tunnel Secret Submission ####
+                # Now when a user submits their secret
+                if decoded.get("type") == "tunnel_secret":
+                    sender = record.username
+                    secret = decoded.get("secret")
+
+                    logger.info(f"[broadcast.tunnel_secret] Received Message Of Type tunnel_secret")
+                    print(f"----\nsender: {sender} ) has sent their secret: {secret[:2] if isinstance(secret, str) else None}...\n----")
+                    logger.debug(f"[broadcast.tunnel_secret] sender: @{sender}, secret: @{secret}")
+
+                    # The pending validation involving this sender
+                    validation = record.validation
+                    if validation is not None:
+                        validation.secrets[sender] = secret
+
+                        logger.debug(f"[broadcast.tunnel_secret] Tunnel Secrets now: {validation.secrets}")
+
+                        # check if both responded
+                        if len(validation.secrets) == 2:
+                            s1, s2 = validation.secrets.values()
+                            a, b = validation.pair
+                            ws1, ws2 = validation.requester.websocket, validation.responder.websocket
+
+                            print(f"----\nBoth Users `{a}` and `{b}` have entered their secrets. Moving to Validation.\n----")
+                            logger.debug(f"[broadcast.tunnel_secret] Both have entered secrets.\n{(a, b)}: {validation.secrets} ")
+
+                            if s1 == s2:
+                                # Success
+                                logger.debug(f"[broadcast.tunnel_secret] validation of secrets successful. Opening the tunnel")
+                                print(f"----\nValidation Successful.\nEstablishing peer to peer relay between `{a}` and `{b}`.\n----")
+
+                                self.connections.open_tunnel(validation.requester, validation.responder)
+                                self.end_validation(validation)
+                                self.journal_event("tunnel_established", requester=a, responder=b, handshake="psk")
+
+                                # Send the message stating that the secret is verified and initialise key generation and transfer
+                                await send_to_pair(
+                                    ws1, ws2,
+                                    encode_message(
+                                        type="tunnel_ok_key_init",
+                                        sender="Server",
+                                        ticket=self.issue_resumption_ticket(username=a, peer=b),
+                                        message="Tunnel successfully established!"
+                                    ),
+                                    encode_message(
+                                        type="tunnel_ok_key_init",
+                                        sender="Server",
+                                        ticket=self.issue_resumption_ticket(username=b, peer=a),
+                                        message="Tunnel successfully established!"
+                                    ),
+                                )
+                            else:
+                                # Failure
+                                self.end_validation(validation)
+                                await self.reject_tunnel(a, b, ws1, ws2)
+
+                if decoded.get('type') == 'key_share':
+                    sender = record.username
+                    target = decoded.get('target')
+                    key = decoded.get('key')
+                
+                    logger.info("[broadcast.key_share] received message of type `key_share`")
+                    logger.debug(f'[broadcast.key_share] Received Public key from @{sender}: {key}')
+                    print(f"----\nReceived Public Key From `{sender}`. Relaying to `{target}`\n----")
+
+                    target_record = connections.get(target)
+                    if target_record is not None:
+                        await target_record.websocket.send(
+                            encode_message(
+                                type='key_share',
+                                sender=sender,
+                                key = key,
+                                features=decoded.get('features', []),
+                                message=f"@{sender} is sharing their public key"
+                            )
+                        )
+                    else:
+                        logger.warning(f'[broadcast.key_share] Target: {target} not found in the registry')
+                        await websocket.send(encode_message(
+                            type="connect_error",
+                            sender="Server",
+                            message=f"Requester @{target} not found."
+                        ))
+
+                #### TUNNEL EXIT ####
+                if decoded.get("type") == "tunnel_exit":
+                    logger.info(f"[broadcast.tunnel_exit] received message of type `tunnel_exit`")
+                
+                    source_user = record.username
+                    target_user = decoded.get("target")
+                    target = connections.get(target_user)
+
+                    logger.debug(f"[broadcast] received `tunnel_exit` by {source_user}. Forwarding to {target_user}")
+
+                    # The tunnel is over, it cannot be resumed anymore
+                    self.journal_event("tunnel_exit", username=source_user, peer=target_user)
+                    self.discard_resumption(source_user)
+                    self.discard_resumption(target_user)
+                
+                    # checking if target's connected
+                    if target is None:
+                        await websocket.send(
+                            encode_message(
+                                type="connect_error",
+                                sender="Server",
+                                message=f"Could not find user '{target_user}' to connect."
+                            )
+                        )
+                
+                    # Forward the `tunnel_exit` notification to the target user
+                    else:
+                        await target.websocket.send(
+                            encode_message(
+                                type="tunnel_exit",
+                                sender=source_user,
+                                message=f"(server) {source_user} has exited the tunnel"
+                            )
+                        )
+
+                        # End the tunnel on both records
+                        logger.debug(f'[broadcast.tunnel_exit] Closing the tunnel of @{source_user} (with @{record.peer.username if record.peer else None})')
+                        connections.close_tunnel(record)
+                        print(f"----\nUsers `{source_user}` and `{target_user}` have ended the tunnel.\n----")
+
+                if decoded.get('type') == 'encrypted_message':
+                    logger.info("[broadcast.encrypted_message] received message of type `encrypted_message`")
+                
+                    source_user = record.username
+                    target_user = decoded.get('target')
+
+                    # Log the event
+                    logger.debug(f'[broadcast] Received `encrypted_message` from {source_user}. Relaying to {target_user} ')
+                    print(f"----\nReceived Encrypted Message From `{source_user}`, Relaying To `{target_user}`\n----")
+
+                    # Relay the payload
+                    # Check for the presence of peer connection
+                    # Check for the presence in active_tunnel
+                    # If any of the peer is not present in any of either, respond to the sender with a connect error
+                    source_user_web = websocket
+                    target = connections.get(target_user)
+
+                    if self.offline_store is not None and target_user and self.suspended_tunnels.get(source_user) == target_user:
+                        await self.store_tunnel_frame(websocket=source_user_web, source_user=source_user, target_user=target_user, frame=message) # type: ignore
+                    elif target is None:
+                        await source_user_web.send(
+                            encode_message(
+                                type='connect_error',
+                                sender='Server',
+                                message=f'Could not find user @{target_user} to connect.'
+                            )
+                        )
+                    elif connections.in_tunnel_together(record, target):
+                        # Relay the message
+                        record.relayed += 1
+                        await target.websocket.send(message=message)
+                    else:
+                        await source_user_web.send(
+                            encode_message(
+                                type='connect_error',
+                                sender='Server',
+                                message=f'User @{target_user} is not participating in an active tunnel with you.'
+                            )
+                        )                
+
+                #### Client System Request Events #####
+                # this includes the response to following needs:
+                # 1. 'list_users'
+                if decoded['type'] == 'system_request':
+                    sender = decoded['sender']
+                    if decoded['need'] == 'list_users':
+                        await websocket.send(
+                            make_system_response(
+                                res_need='list_users',
+                                res_obj=connections.usernames()
+                            )
+                        )
+            
+                # Normal broadcast (only for idle chat)
+                if decoded["type"] == 'chat_message':
+                    logger.info(f"[broadcast] Received message of type `chat_message`")
+
+                    current_user = record.username
+
+                    # Users in an active tunnel (a peer on their record) do not get idle chat
+                    for other in connections:
+                        if other is not record and other.peer is None:
+                            print(f"----\nBroadcasting message from `{current_user}` to {other.username}\n----")
+                            other.fanout += 1
+                            await other.websocket.send(message)
+
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def handler(self, websocket: websockets.ServerConnection):
+        """Handles incoming websocket connections and registration of users."""
+
+        # Extract the token from connection info
+        token = None
+    
+        resuming_username = None
+        if websocket.request:
+            token = websocket.request.headers.get('Authorization')
+            resuming_username = self.find_resumption_ticket(websocket.request.headers.get('X-OG-Ticket'))
+    
+        token_bound_username: str = ""
+    
+        # A valid resumption ticket stands in for the (already consumed) invite token, bound to its username
+        if resuming_username:
+            token = None
+            token_bound_username = resuming_username
+
+        elif self.invite_token:
+            if not token or (token not in self.invite_tokens):
+                logger.info(f"[handler] Invalid Token, Closing connection")
+                self.journal_event("token_rejected", token=(token or "")[:6], stage="handler")
+                await websocket.close(code=4001, reason='Invalid or missing token')
+                return
+        
+            token_bound_username: str | None = self.invite_tokens[token]['username']
+
+            logger.info(f"[handler] token_bound_username: {token_bound_username}, type: {bool(token_bound_username)}")
+
+            # Handling Consumption of unbound tokens here, apart from this block, the rest will be for bind tokens.
+            if not token_bound_username:
+                del self.invite_tokens[token]
+                self.journal_event("token_consumed", token=token[:6], bound_username=None)
+                logger.info(f'[handler] Consuming token {token}. Updated invite_tokens: {self.invite_tokens}')
+
+        try:
+            # Receive the initial (register) message from the client
+            # This is expected to be a registration message containing the username
+            logger.info("[handler] Starting registration phase...")
+            username = await self.handle_registration(websocket=websocket, bound_username=token_bound_username, resuming_username=resuming_username)
+        
+            if username is None:
+                logger.info("[handler] Registration failed or timed out")
+                self.journal_event("register_failed", bound_username=token_bound_username or None)
+                return
+
+            # Consume (Delete) the token only if reuse is false else leave it to the automatic cleanup/deletion using expiry via `check_tunnel_timeouts`
+            if token and token_bound_username and username and not self.invite_tokens[token]['reuse'] :
+                if token:
+                    del self.invite_tokens[token]
+                    self.journal_event("token_consumed", token=token[:6], bound_username=token_bound_username)
+
+            # Register the user: one record, found by username or by websocket
+            record = ConnectionRecord(username=username, websocket=websocket, token=token)
+            self.connections.add(record)
+
+            # Log the registration
+            logger.debug(f"[handler] [+] User '{username}' has been registered with {websocket}")
+            print(f"----\n[+] User `{username}` has been registered\n----")
+
+            # A new user may take the username of one whose ticket expired before housekeeping dropped it
+            if username != resuming_username and username in self.resumption_tickets:
+                await self.expire_resumption(username)
+
+            # The session ticket lets the user reconnect without their (possibly single-use) invite token,
+            # a reconnecting user keeps their tunnel peer
+            tunnel_peer = self.resumption_tickets.get(username, {}).get("peer") if username == resuming_username else None
+            ticket = self.issue_resumption_ticket(username=username, peer=tunnel_peer)
+        
+            # Send a confirmation message back to the client
+            # `resumed` tells a reconnecting client whether its tunnel survived
+            confirmation_message = make_register_message(username=username, resumed=tunnel_peer is not None, ticket=ticket)
+            self.journal_event("register", username=username, resumed=username == resuming_username, token_bound=bool(token_bound_username))
+            await websocket.send(confirmation_message)
+    
+        except websockets.exceptions.ConnectionClosedOK:
+            logger.warning("[handler] [!] Connection closed from client while registration")
+            return
+
+        except Exception as e:
+            # If any error occurs during the registration process, log the error and close the connection
+            logger.error(f"[handler] [!] Error during registration: {e}")
+            error_message = encode_message(message="An error occurred during registration. Please try again later.", sender="Server")
+            await websocket.send(error_message)
+            await websocket.close()
+            return
+
+        try:
+            # Rejoin the tunnel, or hand over what was queued while the user was offline
+            if tunnel_peer is not None:
+                await self.resume_tunnel(record)
+            else:
+                await self.deliver_stored_frames(websocket=websocket, username=username)
+
+            await self.broadcast(record)
+    
+        except (websockets.exceptions.ConnectionClosedError, websockets.exceptions.ConnectionClosedOK) as e:
+            # Handle the case where the connection is closed unexpectedly
+            logger.error(f"[handler] [!] Connection closed unexpectedly for user '{username}'. Error: {e}")
+
+        finally:
+            # Remove the user from the registry, ending their tunnel if they were in one
+            suspended_peer = self.connections.remove(record)
+            logger.debug(f"[handler] [-] User '{username}' has been removed from the registry.")
+        
+            # Drop fast handshake offers made by or to this user
+            for pair in list(record.offers or ()):
+                self.pop_fast_handshake(pair)
+            record.offers = None
+
+            if suspended_peer is not None:
+                logger.info(f'[handler] @{username} left their tunnel with @{suspended_peer.username} by disconnecting.')
+
+            self.journal_event("disconnect", username=username, in_tunnel=suspended_peer is not None)
+
+            # A clean close (1000: /exit, OGClient.close()) ends the session and any tunnel for good
+            if websocket.close_code == 1000 and username in self.resumption_tickets:
+                peer = self.resumption_tickets[username]["peer"]
+                self.end_session(username)
+                if peer is not None and self.resumption_tickets.get(peer, {}).get("peer") == username:
+                    self.discard_resumption(peer)
+                if suspended_peer is not None:
+                    self.journal_event("tunnel_exit", username=username, peer=suspended_peer.username)
+                    try:
+                        await suspended_peer.websocket.send(encode_message(
+                            type="tunnel_exit",
+                            sender=username,
+                            message=f"(server) {username} has exited the tunnel"
+                        ))
+                    except (websockets.exceptions.ConnectionClosedError, websockets.exceptions.ConnectionClosedOK):
+                        logger.info(f"[handler] [!] Tunnel peer @{suspended_peer.username} is already disconnected.")
+
+            # Otherwise the user may come back with their ticket: start its clock, and tell a tunnel peer the tunnel is suspended
+            self.suspended_tunnels.pop(username, None)
+            if username in self.resumption_tickets:
+                self.resumption_tickets[username]["expiry"] = time.time() + RESUME_WINDOW
+                self.ticket_changed(username)
+
+                peer = self.resumption_tickets[username]["peer"]
+                if suspended_peer is not None and peer is not None and peer in self.connections:
+                    self.suspended_tunnels[peer] = username
+                    self.journal_event("tunnel_suspended", username=username, peer=peer)
+                    try:
+                        await suspended_peer.websocket.send(encode_message(
+                            type="tunnel_suspended",
+                            sender=username,
+                            stored=self.offline_store is not None,
+                            message=f"@{username} lost their connection. The tunnel is suspended for up to {RESUME_WINDOW}s."
+                        ))
+                    except (websockets.exceptions.ConnectionClosedError, websockets.exceptions.ConnectionClosedOK):
+                        logger.info(f"[handler] [!] Tunnel peer @{peer} is already disconnected.")
+
+            # Notify all connected clients about the disconnection
+            disconnect_message = make_user_disconnected_message(username=username)
+            logger.debug(f"[handler] [!] User '{username}' has disconnected. Sending disconnection message to all clients.")
+            print(f"----\n[-] User `{username}` has disconnected. Sending Disconnection message to all clients.\n----")
+        
+            # Send the disconnection message to all connected clients
+            # This informs all other clients that the user has disconnected
+            # 
+            # And while informing the clients, there are two flows:
+            # We should not inform the disconnection of general users to tunnel users to not disturb the session
+            # if a tunnel user is disconnected, all the users should be informed
+            for other in self.connections: # a copy, the registry may change while we await
+                if other.peer is None and other is not suspended_peer:
+                    other.fanout += 1
+                    try:
+                        await other.websocket.send(disconnect_message)
+                
+                    except (websockets.exceptions.ConnectionClosedError, websockets.exceptions.ConnectionClosedOK):
+                        # If the client is already disconnected, we can ignore this error
+                        logger.info(f"[handler] [!] Client @{other.username} is already disconnected.")
+
+    async def check_tunnel_timeouts(self):
+        """Runs housekeeping() every second."""
+        while True:
+            await self.housekeeping()
+            await asyncio.sleep(1)
+
+    # If one user never sends their secret, the pending_validations entry remains forever. We should schedule a timeout cleanup task. Also for expired tokens
+    async def housekeeping(self) -> None:
+        """One pass of the periodic cleanup: keepalive pings, buffer limits, validation and handshake timeouts, resumption and token expiry, store upkeep."""
+        # Clients that stopped answering are aborted, their handler then disconnects them as usual
+        if self.liveness is not None:
+            for record in await self.liveness.sweep(self.connections):
+                self.journal_event("reaped", username=record.username, in_tunnel=record.peer is not None)
+
+        # Connection buffer limits follow the number of connections and the memory in use
+        if self.memory_budget is not None and self.ws_servers:
+            self.memory_budget.rebalance(self.open_connections())
+
+        now = asyncio.get_event_loop().time()
+        expired = [validation for validation in self.pending_validations.values() if now > validation.deadline]
+        for validation in expired:
+            pair = validation.pair
+            self.end_validation(validation)
+            for ws in (validation.requester.websocket, validation.responder.websocket):
+                try:
+                    await ws.send(encode_message(
+                        type="tunnel_failed",
+                        sender="Server",
+                        message="Validation timeout. Usernames are blocked"
+                    ))
+                    await ws.close()
+                except Exception:
+                    pass
+            for u in pair:
+                self.blocked_usernames.add(u)
+            self.journal_event("tunnel_failed", requester=pair[0], responder=pair[1], reason="validation_timeout")
+    
+        # Unanswered fast handshake offers, a late accept falls back to PSK validation
+        for pair in [pair for pair, data in self.pending_fast_handshakes.items() if now > data["deadline"]]:
+            self.pop_fast_handshake(pair)
+
+        # Expired session tickets: release the username, a tunnel is over and a waiting peer is told
+        wall_clock = time.time()
+        for username in [u for u, record in self.resumption_tickets.items() if not SessionTickets.is_live(record, wall_clock)]:
+            await self.expire_resumption(username)
+
+        # Clean Up Expired Invite Tokens (expiries are wall clock times)
+        for tok in self.invite_tokens.pop_expired(wall_clock):
+            self.journal_event("token_expired", token=tok[:6])
+
+        # Durable state: fsync the WAL written during the last second, fold a long WAL into a new snapshot
+        if self.state_store is not None:
+            await self.state_store.sync()
+            if self.state_store.needs_compaction():
+                self.state_store.start_compaction()
+
+        # Offline queues whose frames all outlived the TTL
+        if self.offline_store is not None and wall_clock > self._next_store_purge:
+            self._next_store_purge = wall_clock + STORE_PURGE_INTERVAL
+            emptied = self.offline_store.purge_expired()
+            if emptied:
+                logger.info(f"[housekeeping] Dropped {emptied} expired offline queue(s)")
+
+    def open_connections(self) -> list[websockets.ServerConnection]:
+        return [connection for server in self.ws_servers for connection in server.connections]
+
+    async def process_request(self, connection: websockets.ServerConnection, request: websockets.Request):
+        """
+        This runs before the websocket handshake.
+        We can reject unauthorized clients here.
+        """
+        logger.info('[process_request] Inside Process Request')
+
+        # Lagging loop or over the memory budget: come back later. Otherwise the connection gets the current limits.
+        if self.loop_monitor is not None and self.loop_monitor.overloaded:
+            self.loop_monitor.shed += 1
+            return connection.respond(HTTPStatus.SERVICE_UNAVAILABLE, "Server busy, try again later.\n")
+        if self.memory_budget is not None and self.ws_servers:
+            if self.memory_budget.saturated:
+                self.memory_budget.refused += 1
+                return connection.respond(HTTPStatus.SERVICE_UNAVAILABLE, "Server busy, try again later.\n")
+            self.memory_budget.apply(connection)
+
+        now = time.time()
+    
+        logger.debug('[process_request] Triggering token cleanup')
+        logger.debug(f"[process_request] Current invite_tokens:\n{self.invite_tokens}")
+
+        # Clean up expired tokens
+        for tok in self.invite_tokens.pop_expired(now):
+            logger.debug(f"[process_request] Deleted expired token: {tok[:6]}...")
+            self.journal_event("token_expired", token=tok[:6])
+    
+        logger.debug(f"[process_request] Updated Invite Tokens:\n{self.invite_tokens}")
+
+         # Skip check if no tokens configured
+        if not self.invite_token:
+            return None  # continue to handshake
+    
+        # A client holding a session ticket already spent its invite token
+        if self.find_resumption_ticket(request.headers.get('X-OG-Ticket')):
+            return None
+
+        # Only check if tokens are enabled
+        auth_header = request.headers.get('Authorization')
+
+        # Invalid or missing token → return 401 and skip handler
+        if not auth_header or (auth_header not in self.invite_tokens):
+            logger.warning(f"[process_request] Invalid/missing token: {auth_header}")
+            self.journal_event("token_rejected", token=(auth_header or "")[:6], stage="handshake", remote=str(connection.remote_address[0]) if connection.remote_address else None)
+
+            # Build proper HTTP 401 response
+            response = (
+                b"HTTP/1.1 401 Unauthorized\r\n"
+                b"Content-Type: text/plain\r\n"
+                b"Content-Length: 23\r\n"
+                b"Connection: close\r\n"
+                b"\r\n"
+                b"Unauthorized or invalid.\n"
+            )
+
+            # Send response directly over the transport
+            try:
+                logger.info(f"[process_request] Sending 401 to the client")
+                connection.transport.write(response)
+        
+            # yield control to flush socket buffer
+                await asyncio.sleep(0)
+        
+            except Exception as e:
+                logger.error(f"[process_request] Error sending response: {e}")
+        
+            finally:
+                logger.info("[process_request] Closing Client TCP connection")
+                connection.transport.close()
+        
+            return # stop handshake
+        
+    
+        # Valid token, Don't consume token here; just allow connection
+        return None # Continue to handshake
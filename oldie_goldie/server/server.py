@@ -3,14 +3,28 @@ import time
 from typing import Any, Optional
 import websockets
 import logging
-from oldie_goldie.shared import encode_message, decode_message, make_register_message, make_user_disconnected_message, make_system_response, version_banner
+from oldie_goldie.shared import encode_message, version_banner, package_version
 import argparse
+import os
 import sys
 import shutil
+import signal
+import socket
 import subprocess
+from oldie_goldie.server.og_server import OGServer, is_valid_username_format, RESUME_WINDOW
+from oldie_goldie.server.tenants import TenantRouter, is_valid_tenant_name
 from oldie_goldie.server.helpers.tunnel_manager import TunnelManager
+from oldie_goldie.server.helpers.listeners import open_listener, parse_listen_address, describe_listener, tunnel_origin, unix_socket_path, remove_unix_socket
+from oldie_goldie.server.helpers.handoff import READY, UpdateStream, spawn_successor, send_handoff, receive_handoff, notify_ready, follow_predecessor
+from oldie_goldie.server.helpers.journal import EventJournal
+from oldie_goldie.server.helpers.liveness import LivenessMonitor, DEFAULT_TIMEOUT as PING_DEFAULT_TIMEOUT
+from oldie_goldie.server.helpers.memory_budget import MemoryBudget, DEFAULT_BUDGET as MEMORY_DEFAULT_BUDGET
+from oldie_goldie.server.helpers.metrics import serve_metrics
+from oldie_goldie.server.helpers.state_store import ServerStateStore, apply_change
+from oldie_goldie.server.helpers.store_forward import OfflineFrameStore, DEFAULT_TTL as STORE_DEFAULT_TTL, DEFAULT_MAX_BYTES as STORE_DEFAULT_MAX_BYTES
+from oldie_goldie.shared.ws_compression import add_compression_arguments, server_compression_options
+from oldie_goldie.shared.loop_monitor import add_loop_monitor_arguments, loop_monitor_from_args
 import secrets
-from importlib.metadata import version, PackageNotFoundError
 
 # Logging configuration and setup
 # This will log messages to the console with a specific format
@@ -25,644 +39,195 @@ logging.basicConfig(
 # This allows us to log messages specific to this module
 logger = logging.getLogger(__name__)
 
-# This will hold all connected clients' websockets
-# The keys are usernames and the values are the respective websocket connections
-# This allows us to keep track of connected users and their respective websockets
-user_registry_by_id: dict[str, websockets.ServerConnection] = {}
-
-# This will hold the mapping of websockets to usernames
-# This allows us to quickly find the username associated with a given websocket connection
-user_registry_by_websocket: dict[websockets.ServerConnection, str] = {}
-
-# Blocked usernames set (non-persistent)
-blocked_usernames: set[str] = set()
-
-# Pending tunnel validation states
-pending_validations: Any = {}
-
-# active tunnels. This is of no consequence
-active_tunnels: set[tuple[websockets.ServerConnection, websockets.ServerConnection]] = set()
-
-# If invite_tokens is passed for authorization
-invite_tokens: dict[str, dict[str, str | float | None]] = {}
-
-invite_token = False
-
-def is_valid_username_format(username: str) -> tuple[bool, str]:
-    """Validates the format of the username and returns a tuple of (is_valid, reason)"""
-    reserved_keywords = {
-        "None", "True", "False", "and", "or", "not", "if", "else", "elif", "while", "for", "in", "def", "class", "import", "from", "as", "return", "break", "continue"
-    }
-
-    if not username:
-        return False, "Username is required."
-    if not username.islower():
-        return False, "Username must only contain lowercase alphabetical characters and/or numerical characters."
-    if not username[0].isalpha():
-        return False, "Username must start with a letter."
-    if not username.isalnum():
-        return False, "Username must be either alphabetic or alphanumeric."
-    if len(username) > 50:
-        return False, "Username must be no longer than 50 characters."
-    if username in reserved_keywords:
-        return False, "Username is a reserved keyword."
-    if username == "server":
-        return False, "Username 'server' is not for you bro 😤"
-    return True, ""
-
-async def handle_registration(websocket:websockets.ServerConnection, bound_username:str) -> str | None:
-    TIMEOUT = 10
-    MAX_ATTEMPTS = 4
-    attempts = 0
-    start_time = asyncio.get_event_loop().time()
-
-    while True:
-        time_left = TIMEOUT - (asyncio.get_event_loop().time() - start_time)
-        if time_left <=0:
-            await websocket.send(encode_message(
-                type="register_error",
-                sender="Server",
-                message="⏰ Time expired bruh! You didn't register in time. Connection will be closed.\n Try again sooner this time 👍"
-            ))
-            await websocket.close()
-            return None
-        
-        try:
-            message = await asyncio.wait_for(websocket.recv(), timeout=time_left)
-            decoded = decode_message(message)
-            if decoded.get("type") != "register" or "username" not in decoded or not decoded.get("username"):
-                await websocket.send(encode_message(
-                    type="register_error",
-                    sender="Server",
-                    message="❌ Invalid registration format. Must send a 'register' message with 'username'."
-                ))
-                attempts += 1
-            else:
-                username = decoded["username"].strip()
-                is_valid, reason = is_valid_username_format(username=username)
-                if not is_valid:
-                    attempts += 1
-                    if attempts >= MAX_ATTEMPTS:
-                        await websocket.send(encode_message(
-                            type="register_error",
-                            sender="Server",
-                            message=f"❌ Invalid username: {reason}\n⚠️ Maximum attempts reached. Disconnecting."
-                        ))
-                        await websocket.close()
-                        return None
-                    await websocket.send(encode_message(
-                        type="register_error",
-                        sender="Server",
-                        message=f"❌ Invalid username: {reason}\n🔁 Attempts remaining: {MAX_ATTEMPTS - attempts}"
-                    ))
-                elif username in user_registry_by_id:
-                    await websocket.send(encode_message(
-                        type="register_error",
-                        sender="Server",
-                        message=f"⚠️ Username '{username}' is already taken. Try another.\n⌛ Time left: {int(time_left)}s"
-                    ))
-                elif username in blocked_usernames:
-                    await websocket.send(encode_message(
-                        type="register_error",
-                        sender="Server",
-                        message=f"⛔ Username '{username}' has been blocked. Restart required with a new identity."
-                    ))
-                elif bound_username and (username != bound_username):
-                    await websocket.send(
-                        encode_message(
-                            type="register_error",
-                            sender="Server",
-                            message=f"⛔ You are using a token bound to another username. If you have misspelled please try again else do not misuse the token that's not meant for you!"
-                        )
-                    )
-                else:
-                    return username # ✅ Success
-        except asyncio.TimeoutError:
-            await websocket.send(encode_message(
-                type="register_error",
-                sender="Server",
-                message="🥚 Timeout waiting for username. Connection closing."
-            ))
-            await websocket.close()
-            return None
-        except websockets.exceptions.ConnectionClosedOK:
-            logger.info("[handle_registration] Registration cancelled from user's side")
-            return None
-        except Exception as e:
-            logger.exception(f"Error during registration: {e}")
-            await websocket.send(encode_message(
-                type="register_error",
-                sender="Server",
-                message="❌ Unexpected error occurred. Try again later."
-            ))
-            await websocket.close()
-            return None
-
-
-async def broadcast(websocket:websockets.ServerConnection, user_reg_id:dict[str, websockets.ServerConnection], user_reg_web:dict[websockets.ServerConnection, str]) -> None:
-    try:
-        async for message in websocket:
-
-            # Establishing peer connection
-            decoded = decode_message(message_str=message) #type: ignore
-
-            #### Connection Request Handling ####
-            # check if it's a connect request
-            if decoded.get("type") == "connect_request":
-                
-                source_user = user_reg_web.get(websocket)
-                target_user = decoded.get("target")
-
-                logger.info(f"[broadcast] received `connect_request` from @{source_user} to @{target_user} ")
-                
-                # checking if target's connected
-                if not source_user or not target_user or target_user not in user_reg_id:
-                    await websocket.send(
-                        encode_message(
-                            type="connect_error",
-                            sender="Server",
-                            message=f"Could not find user '{target_user}' to connect."
-                        )
-                    )
-
-                # Forward the request to the target user
-                else:
-                    await user_reg_id[target_user].send(
-                        encode_message(
-                            type="connect_request",
-                            sender=source_user,
-                            message=f"Connection request from @{source_user}. Use /accept or /deny."
-                        )
-                    )
-                
-            #### Connect Busy ####
-            # If peer already has a `connect_request`
-            if decoded.get("type") == 'connect_busy':
-                
-                requester : str | None = ""
-                requester = decoded['target'] # The one who initiated the request
-                responder = user_reg_web[websocket]
-
-                logger.info(f"[broadcast] (server) Connection request from @{requester} to @{responder} denied by server. @{responder} is not idle, they either have pending connection requests or is in a private tunnel.")
-
-                await user_reg_id[requester].send(
-                    encode_message(
-                        type='connect_busy',
-                        sender=responder,
-                        message=f"(server) Connection request to @{responder} denied. They may either have \n- pending connection requests or \n- could be in a private tunnel.\n"
-                    )
-                )
-
-            #### Connect Accept ####
-            if decoded.get("type") == "connect_accept":
-                responder = user_reg_web[websocket]
-                requester = decoded["target"] # The user who initiated request
-
-                if requester not in user_reg_id:
-                    await websocket.send(encode_message(
-                        type="connect_error",
-                        sender="Server",
-                        message=f"Requester @{requester} not found."
-                    ))
-                
-                await user_reg_id[requester].send(
-                    encode_message(
-                        type="connect_accept",
-                        sender=responder,
-                        message=f"@{responder} accepted your connection. Tunnel validation will start."
-                    )
-                )
-                
-                logger.info(f"[broadcast] connect_accept: (responder) @{responder} <-> (requester) @{requester}.")
-                               
-                # Accepting connection - trigger tunnel validation
-                await user_reg_id[requester].send(
-                    encode_message(
-                        type="tunnel_validate",
-                        sender="Server",
-                        message="Enter the pre-shared secret to validate the tunnel (within 10 seconds)"
-                    )
-                )
-                await user_reg_id[responder].send(encode_message(
-                    type="tunnel_validate",
-                    sender="Server",
-                    message="Enter the pre-shared secret to validate the tunnel (within 10 seconds)"
-                ))
-
-                # Save validation state
-                pending_validations[(requester, responder)] = {
-                    "websockets": (user_reg_id[requester], user_reg_id[responder]),
-                    "secrets": {},
-                    "deadline": asyncio.get_event_loop().time() + 10
-                }
-            
-            #### Connection Deny ####
-            if decoded.get("type") == "connect_deny":
-                responder = user_reg_web[websocket]
-                requester= decoded["target"]
-
-                logger.info(f"[broadcast] received `connect_deny` from {responder} for {requester}")
-
-                if requester in user_reg_id:
-                    await user_reg_id[requester].send(
-                        encode_message(
-                            type="connect_deny",
-                            sender=responder,
-                            message=f"@{responder} denied your connection request."
-                        )
-                    )
-                    logger.info(f"[server] connect_deny: @{responder} rejected @{requester}")
-            
-            #### Tunnel Secret Submission ####
-            # Now when a user submits their secret
-            if decoded.get("type") == "tunnel_secret":
-                sender = user_reg_web.get(websocket)
-                secret = decoded.get("secret")
-
-                logger.info(f"[broadcast.tunnel_secret] Received Message Of Type tunnel_secret")
-                print(f"----\nsender: {sender} ) has sent their secret: {secret[:2] if isinstance(secret, str) else None}...\n----")
-                logger.debug(f"[broadcast.tunnel_secret] sender: @{sender}, secret: @{secret}")
-
-
-                # Find the pending validation involving this sender
-                for (a, b), val_data in list(pending_validations.items()):
-                    if sender in (a, b):
-                        val_data["secrets"][sender] = secret
-
-                        logger.debug(f"[broadcast.tunnel_secret] Tunnel Secrets now: {pending_validations}")
-                        
-                        # check if both responded
-                        if len(val_data["secrets"]) == 2:
-                            s1, s2 = val_data["secrets"].values()
-                            ws1, ws2 = val_data["websockets"]
-                            u1, u2 = user_reg_web.get(ws1), user_reg_web.get(ws2)
-                            
-                            print(f"----\nBoth Users `{u1}` and `{u2}` have entered their secrets. Moving to Validation.\n----")
-                            logger.debug(f"[broadcast.tunnel_secret] Both have entered secrets.\n{(a, b)}: {val_data['secrets']} ")
-
-                            if s1 == s2:
-                                # Success
-                                logger.debug(f"[broadcast.tunnel_secret] validation of secrets successful. Adding websockets to `active_tunnels`")
-                                print(f"----\nValidation Successful.\nEstablishing peer to peer relay between `{u1}` and `{u2}`.\n----")
-                            
-                                # add the websockets to the active_tunnels holder
-                                active_tunnels.add((ws1, ws2))
-
-                                # Send the message stating that the secret is verified and initialise key generation and transfer
-                                await ws1.send(encode_message(
-                                    type="tunnel_ok_key_init",
-                                    sender="Server",
-                                    message="Tunnel successfully established!"
-                                ))
-                                await ws2.send(encode_message(
-                                    type="tunnel_ok_key_init",
-                                    sender="Server",
-                                    message="Tunnel successfully established!"
-                                ))
-                            else:
-                                # Failure
-                                logger.debug(f"[broadcast.tunnel_secret] validation of secrets unsuccessful. Adding usernames to `blocked_usernames`. Closing connection with clinets.")
-                                print("----\nValidation Unsuccessful. Adding usernames to block list.\n----")
-                                
-                                for u in (a, b):
-
-                                    blocked_usernames.add(u)
-
-                                await ws1.send(encode_message(
-                                    type="tunnel_failed",
-                                    sender="Server",
-                                    message="Validation failed. This username is now blocked."
-                                ))
-
-                                await ws2.send(encode_message(
-                                    type="tunnel_failed",
-                                    sender="Server",
-                                    message="Validation failed. This username is now blocked."
-                                ))
-
-                                await ws1.close()
-                                print(f"----\nClosed connection with {u1}\n----")
-                                
-                                await ws2.close()
-                                print(f"----\nClosed connection with {u2}\n----")
-
-                            del pending_validations[(a, b)]
-
-            if decoded.get('type') == 'key_share':
-                sender = user_reg_web[websocket]
-                target = decoded.get('target')
-                key = decoded.get('key')
-                
-                logger.info("[broadcast.key_share] received message of type `key_share`")
-                logger.debug(f'[broadcast.key_share] Received Public key from @{sender}: {key}')
-                print(f"----\nReceived Public Key From `{sender}`. Relaying to `{target}`\n----")
-
-                if target in user_reg_id:
-                    target_websocket = user_reg_id[target]
-                    await target_websocket.send(
-                        encode_message(
-                            type='key_share',
-                            sender=sender,
-                            key = key,
-                            message=f"@{sender} is sharing their public key"
-                        )
-                    )
-                else:
-                    logger.warning(f'[broadcast.key_share] Target: {target} not found in user_reg_id')
-                    await websocket.send(encode_message(
-                        type="connect_error",
-                        sender="Server",
-                        message=f"Requester @{target} not found."
-                    ))
-
-            #### TUNNEL EXIT ####
-            if decoded.get("type") == "tunnel_exit":
-                logger.info(f"[broadcast.tunnel_exit] received message of type `tunnel_exit`")
-                
-                source_user = user_reg_web.get(websocket)
-                target_user = decoded.get("target")
-
-                logger.debug(f"[broadcast] received `tunnel_exit` by {source_user}. Forwarding to {target_user}")
-                
-                # checking if target's connected
-                if not source_user or not target_user or target_user not in user_reg_id:
-                    await websocket.send(
-                        encode_message(
-                            type="connect_error",
-                            sender="Server",
-                            message=f"Could not find user '{target_user}' to connect."
-                        )
-                    )
-                
-                # Forward the `tunnel_exit` notification to the target user
-                else:
-                    await user_reg_id[target_user].send(
-                        encode_message(
-                            type="tunnel_exit",
-                            sender=source_user,
-                            message=f"(server) {source_user} has exited the tunnel"
-                        )
-                    )
-
-                    # Remove the pair from active_tunnels
-                    for ws_pair in list(active_tunnels):
-                        if websocket in ws_pair:
-                            logger.debug(f'[broadcast.tunnel_exit] Removing ({source_user, target_user}) from active tunnel set')
-                            active_tunnels.remove(ws_pair)
-                    
-                    # Log the updated active tunnel set
-                    logger.debug(f'Updated Active Tunnel Set: {active_tunnels}')                
-                    print(f"----\nUsers `{source_user}` and `{target_user}` have ended the tunnel.\n----")
-
-            if decoded.get('type') == 'encrypted_message':
-                logger.info("[broadcast.encrypted_message] received message of type `encrypted_message`")
-                
-                source_user = user_reg_web.get(websocket)
-                target_user = decoded.get('target')
-
-                # Log the event
-                logger.debug(f'[broadcast] Received `encrypted_message` from {source_user}. Relaying to {target_user} ')
-                print(f"----\nReceived Encrypted Message From `{source_user}`, Relaying To `{target_user}`\n----")
-
-                # Relay the payload
-                # Check for the presence of peer connection
-                # Check for the presence in active_tunnel
-                # If any of the peer is not present in any of either, respond to the sender with a connect error
-                source_user_web = websocket
-                target_user_web : websockets.ServerConnection | None = None
-
-                if target_user:
-                    target_user_web = user_reg_id.get(target_user)
-                if (not source_user) or (not target_user) or (target_user not in user_reg_id):
-                    await source_user_web.send(
-                        encode_message(
-                            type='connect_error',
-                            sender='Server',
-                            message=f'Could not find user @{target_user} to connect.'
-                        )
-                    )
-                else:
-                    for ws_pair in active_tunnels:
-                        if source_user_web in ws_pair and target_user_web in ws_pair:
-                            # Relay the message
-                            await target_user_web.send(message=message)
-                        else:
-                            await source_user_web.send(
-                                encode_message(
-                                    type='connect_error',
-                                    sender='Server',
-                                    message=f'User @{target_user} is not participating in an active tunnel with you.'
-                                )
-                            )                
-
-            #### Client System Request Events #####
-            # this includes the response to following needs:
-            # 1. 'list_users'
-            if decoded['type'] == 'system_request':
-                sender = decoded['sender']
-                if decoded['need'] == 'list_users':
-                    await websocket.send(
-                        make_system_response(
-                            res_need='list_users',
-                            res_obj=list(user_reg_id.keys())
-                        )
-                    )
-            
-            # Normal broadcast (only for idle chat)
-            if decoded["type"] == 'chat_message':
-                logger.info(f"[broadcast] Received message of type `chat_message`")
-
-                # this is to create a list for logging, it has not functional use
-                broadcast_to = list(user_reg_web.values())
-                current_user = user_reg_web.get(websocket)
-                if current_user in broadcast_to:
-                    broadcast_to.remove(current_user)
-                
-                # logger.debug(f"[broadcast] Received message from: {current_user}\nDecoded message: {decode_message(str(message))}\nBroadcasting to these users: {broadcast_to}")
-
-                # Before broadcasting, we have to make sure not to broadcast to active tunnel users
-                # For this, since we have the `active_tunnels` of type set[tuple], we will create a new one dimensional iterable object to help speed up the iteration
-                active_tunnels_iter:set[websockets.ServerConnection] = set()
-                for ws_pair in active_tunnels:
-                    active_tunnels_iter.add(ws_pair[0])
-                    active_tunnels_iter.add(ws_pair[1])
-
-                for client_ws in user_reg_id.values():
-                    if client_ws != websocket and client_ws not in active_tunnels_iter:
-                        print(f"----\nBroadcasting message from `{current_user}` to {user_reg_web.get(client_ws)}\n----")
-                        await client_ws.send(message)
+# Graceful restart (SIGHUP): a successor inherits the listening sockets while this process drains
+draining = False
+successor: subprocess.Popen | None = None
+HANDOFF_TIMEOUT = 30 # seconds for the successor to start serving
+DEFAULT_DRAIN_TIMEOUT = 300 # seconds
+
+def tenant_dir(directory: str, name: str) -> str:
+    """A tenant's subdirectory of --state-dir, --store-forward or --journal. Without --tenant the server is tenant ""."""
+    return os.path.join(directory, name) if name else directory
+
+# ==== #
+# Graceful restart
+# ==== #
+
+def handoff_state(server: OGServer, args: argparse.Namespace) -> dict[str, Any]:
+    """What the successor cannot read from disk: session tickets, and tokens and blocklist without --state-dir."""
+    # Tickets of users still connected here have no expiry yet, the changes made during the drain follow
+    state: dict[str, Any] = {"resumption_tickets": {username: dict(record) for username, record in server.resumption_tickets.items()}}
+    if not args.state_dir:
+        state["invite_tokens"] = list(server.invite_tokens.items())
+        state["blocked_usernames"] = list(server.blocked_usernames)
+    return state
+
+def apply_handoff_state(server: OGServer, state: dict[str, Any]) -> None:
+    for token, meta in state.get("invite_tokens", []):
+        server.invite_tokens[token] = meta
+    for username in state.get("blocked_usernames", []):
+        server.blocked_usernames.add(username)
+    server.resumption_tickets.update(state.get("resumption_tickets", {}))
+
+def apply_ticket_update(server: OGServer, inherited: dict[str, str], username: str, record: dict[str, Any] | None) -> None:
+    """
+    A session ticket changed on the draining server. `inherited` maps usernames to the last ticket it sent,
+    a user who registered here meanwhile holds a newer ticket of ours and is left alone.
+    """
+    current = server.resumption_tickets.get(username)
+    if username in server.connections or (current is not None and current["ticket"] != inherited.get(username)):
+        return
+    if record is None:
+        server.resumption_tickets.pop(username, None)
+        inherited.pop(username, None)
+    else:
+        server.resumption_tickets[username] = record
+        inherited[username] = record["ticket"]
 
-    except websockets.exceptions.ConnectionClosed:
-        pass
+def apply_predecessor_update(tenants: dict[str, OGServer], inherited: dict[str, dict[str, str]], update: dict[str, Any]) -> None:
+    """One change streamed by the draining server: a token or blocklist change, or a session ticket change."""
+    server = tenants.get(update["tenant"])
+    if server is None:
+        return
+    if "op" in update:
+        apply_change(server.invite_tokens, server.blocked_usernames, update["op"], update["record"])
+    else:
+        apply_ticket_update(server, inherited[update["tenant"]], update["username"], update["ticket"])
 
-async def handler(websocket: websockets.ServerConnection):
-    """Handles incoming websocket connections and registration of users."""
-    global invite_tokens
+def settle_inherited_tickets(server: OGServer, inherited: dict[str, str]) -> None:
+    """The draining server is gone: start the clock of the tickets it left without an expiry (it did not drain)."""
+    expiry = time.time() + RESUME_WINDOW
+    for username, ticket in inherited.items():
+        record = server.resumption_tickets.get(username)
+        if record is not None and record["ticket"] == ticket and record["expiry"] is None and username not in server.connections:
+            record["expiry"] = expiry
 
-    # Extract the token from connection info
-    token = None
-    
-    if websocket.request:
-        token = websocket.request.headers.get('Authorization')
-    
-    token_bound_username: str = ""
-    
-    if invite_token:
-        if not token or (token not in invite_tokens):
-            logger.info(f"[handler] Invalid Token, Closing connection")
-            await websocket.close(code=4001, reason='Invalid or missing token')
-            return
-        
-        token_bound_username: str | None = invite_tokens[token]['username']
+async def release_stores(server: OGServer, name: str, updates: UpdateStream) -> OfflineFrameStore | None:
+    """
+    Stops writing to the files the successor takes over, returns the offline store to take back on failure.
+    Tokens and blocklist keep changing during the drain (tokens used, usernames blocked): from the moment
+    the state store is closed, every change goes to the successor, which writes it to its own WAL.
+    """
+    offline_store, server.offline_store = server.offline_store, None
+    server.journal_event("server_handoff")
+    if server.journal is not None:
+        await server.journal.close()
+        server.journal = None
+    if server.state_store is not None:
+        await server.state_store.close()
+        server.state_store = None
+    server.invite_tokens.on_change = server.blocked_usernames.on_change = lambda op, record: updates.send({"tenant": name, "op": op, "record": record})
+    return offline_store
+
+async def reopen_stores(server: OGServer, name: str, args: argparse.Namespace, offline_store: OfflineFrameStore | None, updates: UpdateStream) -> None:
+    """Takes the files back after a failed handoff, with the changes made since they were released."""
+    server.offline_store = offline_store
+    server.invite_tokens.on_change = server.blocked_usernames.on_change = None
+    if args.state_dir:
+        server.state_store = ServerStateStore(directory=tenant_dir(args.state_dir, name))
+        server.invite_tokens, server.blocked_usernames = server.state_store.open()
+        for update in updates.pending:
+            if update.get("tenant") == name and "op" in update:
+                apply_change(server.invite_tokens, server.blocked_usernames, update["op"], update["record"])
+    if args.journal:
+        server.journal = EventJournal(directory=tenant_dir(args.journal, name))
+        await server.journal.start()
+
+async def graceful_restart(front: OGServer | TenantRouter, tenants: dict[str, OGServer], args: argparse.Namespace, tunnel_mgr: TunnelManager | None, metrics_server: asyncio.Server | None = None) -> None:
+    """
+    Starts a successor on our listening socket, then stops accepting and drains.
+    Registered users get a `server_draining` notice and move over at their own pace. Tunnels
+    may carry on until --drain-timeout, the connections left then are closed with 1012.
+    """
+    global draining, successor
+    if draining or not front.ws_servers:
+        return
+    draining = True
+    print("----\n🔁 Graceful restart requested, starting the new server...\n----")
 
-        logger.info(f"[handler] token_bound_username: {token_bound_username}, type: {bool(token_bound_username)}")
+    # Files on disk change owner: the successor loads them, this process stops writing to them
+    # and sends it the token and blocklist changes instead
+    updates = UpdateStream()
+    saved_offline_stores = {name: await release_stores(server, name, updates) for name, server in tenants.items()}
 
-        # Handling Consumption of unbound tokens here, apart from this block, the rest will be for bind tokens.
-        if not token_bound_username:
-            del invite_tokens[token]
-            logger.info(f'[handler] Consuming token {token}. Updated invite_tokens: {invite_tokens}')
+    # Session tickets keep changing during the drain, the successor gets every change
+    for name, server in tenants.items():
+        server.on_ticket_change = lambda username, record, name=name: updates.send({"tenant": name, "username": username, "ticket": record})
 
+    proc, sock = None, None
     try:
-        # Receive the initial (register) message from the client
-        # This is expected to be a registration message containing the username
-        logger.info("[handler] Starting registration phase...")
-        username = await handle_registration(websocket=websocket, bound_username=token_bound_username)
-        
-        if username is None:
-            logger.info("[handler] Registration failed or timed out")
-            return
-
-        # Consume (Delete) the token only if reuse is false else leave it to the automatic cleanup/deletion using expiry via `check_tunnel_timeouts`
-        if token and token_bound_username and username and not invite_tokens[token]['reuse'] :
-            if token:
-                del invite_tokens[token]
-
-        # Register the user in the user registry
-        # Store the websocket connection in the user registry
-        # This allows us to keep track of connected users and their respective websockets
-        user_registry_by_id[username] = websocket
-
-        # Store the username in the user registry by websocket
-        # This allows us to quickly find the username associated with a given websocket connection
-        user_registry_by_websocket[websocket] = username
-
-        # Log the registration
-        logger.debug(f"[handler] [+] User '{username}' has been registered with {websocket}")
-        print(f"----\n[+] User `{username}` has been registered\n----")
-        
-        # Send a confirmation message back to the client
-        confirmation_message = make_register_message(username=username)
-        await websocket.send(confirmation_message)
-    
-    except websockets.exceptions.ConnectionClosedOK:
-        logger.warning("[handler] [!] Connection closed from client while registration")
-        return
+        fds = [listener.fileno() for ws_server in front.ws_servers for listener in ws_server.sockets]
+        handoff = {"listeners": len(fds), "tunnel": None, "tenants": {name: handoff_state(server, args) for name, server in tenants.items()}}
+        if tunnel_mgr is not None:
+            # Between two cloudflared runs there is nothing to hand over, the successor starts its own
+            tunnel_fd = tunnel_mgr.stdout_fd()
+            handoff["tunnel"] = {"pid": None, "url": None, "command": tunnel_mgr.command}
+            if tunnel_mgr.pid is not None and tunnel_fd is not None:
+                fds.append(tunnel_fd)
+                handoff["tunnel"].update(pid=tunnel_mgr.pid, url=tunnel_mgr.url)
+        if metrics_server is not None:
+            # Last, after the listeners and cloudflared's output
+            fds.append(metrics_server.sockets[0].fileno())
+            handoff["metrics"] = True
+
+        proc, sock = spawn_successor("oldie_goldie.server.server")
+        await asyncio.to_thread(send_handoff, sock, fds, handoff)
+
+        sock.setblocking(False)
+        if await asyncio.wait_for(asyncio.get_running_loop().sock_recv(sock, 1), timeout=HANDOFF_TIMEOUT) != READY:
+            raise ConnectionError("the new server exited before serving")
+        await updates.attach(sock)
 
     except Exception as e:
-        # If any error occurs during the registration process, log the error and close the connection
-        logger.error(f"[handler] [!] Error during registration: {e}")
-        error_message = encode_message(message="An error occurred during registration. Please try again later.", sender="Server")
-        await websocket.send(error_message)
-        await websocket.close()
+        logger.error(f"[graceful_restart] Handoff failed: {e}")
+        print(f"----\n❌ Graceful restart failed ({e}). This server keeps running.\n----")
+        if proc is not None and proc.poll() is None:
+            proc.kill()
+        if sock is not None:
+            sock.close()
+
+        # Take the files back
+        for name, server in tenants.items():
+            server.on_ticket_change = None
+            await reopen_stores(server, name, args, saved_offline_stores[name], updates)
+        draining = False
         return
 
-    try:
-
-        await broadcast(
-            websocket=websocket,
-            user_reg_id=user_registry_by_id,
-            user_reg_web=user_registry_by_websocket
-        )  
-    
-    except (websockets.exceptions.ConnectionClosedError, websockets.exceptions.ConnectionClosedOK) as e:
-        # Handle the case where the connection is closed unexpectedly
-        logger.error(f"[handler] [!] Connection closed unexpectedly for user '{user_registry_by_websocket.get(websocket)}'. Error: {e}")
-
-    finally:
-        # find which user is disconnecting
-        username = user_registry_by_websocket.get(websocket)
-
-        # Remove the user from the user registry
-        if username in user_registry_by_id:
-            
-            del user_registry_by_id[username]
-            del user_registry_by_websocket[websocket]
-            
-            logger.debug(f"[handler] [-] User '{username}' has been removed from the registry.")
-        
-        # Remove the pair if present from the active_tunnel when faced a client disconnect instead of a tunnel disconnect via exit_tunnel
-        for ws_pair in list(active_tunnels):
-            if websocket in ws_pair:
-                
-                # Log the removal via disconnection
-                logger.info('[handler] Client\'s presence found in active tunnel set. Removing the pair.')
-
-                active_tunnels.remove(ws_pair)
+    successor = proc
+    if tunnel_mgr is not None:
+        tunnel_mgr.detach()
+
+    # From here on only the successor accepts
+    front.stop_accepting()
+    if metrics_server is not None:
+        metrics_server.close()
+    logger.info(f"[graceful_restart] Successor pid {proc.pid} is serving, draining {len(front.open_connections())} connection(s)")
+    print(f"----\n🔁 New server running (pid {proc.pid}). Draining {len(front.open_connections())} connection(s) for up to {args.drain_timeout}s\n----")
+
+    notice = encode_message(
+        type="server_draining",
+        sender="Server",
+        deadline=args.drain_timeout,
+        message=f"The server is restarting. You will be moved to the new one shortly, tunnels can carry on for up to {args.drain_timeout}s."
+    )
+    for client_ws in [record.websocket for server in tenants.values() for record in server.connections]:
+        try:
+            await client_ws.send(notice)
+        except (websockets.exceptions.ConnectionClosedError, websockets.exceptions.ConnectionClosedOK):
+            pass
 
-                # Log the updated active tunnel set
-                logger.debug(f'[handler] updated active tunnel set: {active_tunnels}')
+    deadline = time.monotonic() + args.drain_timeout
+    while front.open_connections() and time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
 
-        # Notify all connected clients about the disconnection
-        disconnect_message = make_user_disconnected_message(username=username) # type: ignore
-        logger.debug(f"[handler] [!] User '{username}' has disconnected. Sending disconnection message to all clients.")
-        logger.debug(f'[handler] user_registry_update: ', user_registry_by_id)
-        print(f"----\n[-] User `{username}` has disconnected. Sending Disconnection message to all clients.\n----")
-        
-        # Send the disconnection message to all connected clients
-        # This informs all other clients that the user has disconnected
-        # 
-        # And while informing the clients, there are two flows:
-        # We should not inform the disconnection of general users to tunnel users to not disturb the session
-        # if a tunnel user is disconnected, all the users should be informed
-        active_tunnels_iter: set[websockets.ServerConnection] = set()
-        for ws_pair in active_tunnels:
-            active_tunnels_iter.add(ws_pair[0])
-            active_tunnels_iter.add(ws_pair[1])
-
-        # Now we are ready with a one dimensional iterable object containing the active_tunnel users
-        for client_ws in list(user_registry_by_id.values()): # ignore the list warning as we are trying to protect against concurrent overlapping and error due to in-loop dict modification.
-            
-            # This is assuming, the one disconnected is not in the active_tunnels list or has been terminated from it
-            # So not disturbing the ones in the active_tunnels list
-            if client_ws not in active_tunnels_iter:
-                try:
-                    await client_ws.send(disconnect_message)
-                
-                except (websockets.exceptions.ConnectionClosedError, websockets.exceptions.ConnectionClosedOK):
-                    # If the client is already disconnected, we can ignore this error
-                    logger.info(f"[handler] [!] Client {client_ws} is already disconnected.")
-
-# If one user never sends their secret, the pending_validations entry remains forever. We should schedule a timeout cleanup task. Also for expired tokens
-async def check_tunnel_timeouts():
-    while True:
-        now = asyncio.get_event_loop().time()
-        expired = [pair for pair, data in pending_validations.items() if now > data["deadline"]]
-        for pair in expired:
-            ws1, ws2 = pending_validations[pair]["websockets"]
-            for ws in (ws1, ws2):
-                try:
-                    await ws.send(encode_message(
-                        type="tunnel_failed",
-                        sender="Server",
-                        message="Validation timeout. Usernames are blocked"
-                    ))
-                    await ws.close()
-                except Exception:
-                    pass
-            for u in pair:
-                blocked_usernames.add(u)
-            del pending_validations[pair]
-        
-        # Clean Up Expired Invite Tokens
-        expired_tokens = [
-            tok for tok, meta in invite_tokens.items() 
-            if isinstance(meta['expiry'], (float, int)) and now > meta['expiry']
-            ]
-        
-        for tok in expired_tokens:
-            del invite_tokens[tok]
+    remaining = front.open_connections()
+    if remaining:
+        logger.info(f"[graceful_restart] Drain deadline reached, closing {len(remaining)} connection(s)")
+        await asyncio.gather(*(client_ws.close(code=1012, reason="Server restarting") for client_ws in remaining), return_exceptions=True)
 
-        await asyncio.sleep(1)
+    print("----\n🔁 Drained. Handing over to the new server.\n----")
+    await front.stop()
+    await updates.close()
 
 def parse_args():
     p = argparse.ArgumentParser(
@@ -679,19 +244,29 @@ def parse_args():
     )
     p.add_argument('--host', choices=['local','public'], required=True, help='local or public (cloudflared)')
     p.add_argument('--port', type=int, default=8765, help='port to run the server on. default is 8765')
+    p.add_argument('--listen', action='append', metavar='ADDR', help='listen on ADDR instead of 0.0.0.0:PORT, repeat it for several listeners: HOST:PORT, [IPV6]:PORT or unix:PATH (Unix domain socket, for clients on the same host)')
+    p.add_argument('--tenant', nargs='+', action='extend', metavar='NAME', help='host isolated chat groups on the same listener and cloudflared tunnel. Clients join one with the URL path /NAME, or with one of its invite tokens (tokens are issued per group). Per-group data goes to DIR/NAME of --state-dir, --store-forward and --journal')
     p.add_argument('--invite-token', action='store_true', help='generate single-use invite tokens on startup. Default expiry is 10 min')
     p.add_argument('--bind', nargs='+', help='optional list of usernames to bind tokens to (only when --invite-token used)')
     p.add_argument('--token-count', type=int, help='how many tokens to create per bound username or globally')
-    p.add_argument('--no-expiry', action='store_true', help='remove expiration of tokens. The tokens will however be discarded when server is closed.')
+    p.add_argument('--no-expiry', action='store_true', help='remove expiration of tokens. The tokens will however be discarded when server is closed, unless --state-dir is used.')
     p.add_argument('--reuse', action='store_true', help='reuse the token indefinetly until the server is closed. only available for bind tokens')
+    p.add_argument('--store-forward', metavar='DIR', help='queue messages and connection requests for offline token-bound users (and dropped tunnel peers) in DIR')
+    p.add_argument('--store-ttl', type=int, default=STORE_DEFAULT_TTL, help=f'seconds a stored frame is kept (default: {STORE_DEFAULT_TTL})')
+    p.add_argument('--store-max-kib', type=int, default=STORE_DEFAULT_MAX_BYTES // 1024, help=f'size cap of a user\'s offline queue in KiB (default: {STORE_DEFAULT_MAX_BYTES // 1024})')
+    p.add_argument('--drain-timeout', type=int, default=DEFAULT_DRAIN_TIMEOUT, help=f'on SIGHUP (graceful restart), seconds left to open tunnels before their connections are moved to the new server (default: {DEFAULT_DRAIN_TIMEOUT})')
+    p.add_argument('--handoff-fd', type=int, help=argparse.SUPPRESS) # set by a graceful restart
+    p.add_argument('--state-dir', metavar='DIR', help='keep invite tokens and blocked usernames in DIR so they survive restarts. With it, --invite-token alone reuses the stored tokens')
+    p.add_argument('--journal', metavar='DIR', help='write an append-only event journal (registrations, tunnels, tokens) to DIR. Read it with og-journal')
+    p.add_argument('--keepalive', choices=['adaptive', 'fixed'], default='adaptive', help='adaptive: the server pings quiet clients from one timer, more often when they are in a tunnel or receive broadcasts, and drops those that stop answering. fixed: a ping every 20s on each connection (websockets default). Default: adaptive')
+    p.add_argument('--ping-timeout', type=float, default=PING_DEFAULT_TIMEOUT, help=f'with --keepalive adaptive, seconds a client has to answer a ping before it is disconnected (default: {PING_DEFAULT_TIMEOUT:g})')
+    p.add_argument('--memory-budget', type=int, default=MEMORY_DEFAULT_BUDGET // 2**20, metavar='MIB', help=f'memory for connection buffers in MiB. Frame and write buffer limits shrink as connections add up or buffers fill, new connections are refused when it is nearly used up (default: {MEMORY_DEFAULT_BUDGET // 2**20})')
+    p.add_argument('--metrics', metavar='ADDR', help='serve Prometheus metrics (connections, tunnels, buffer usage and limits) at http://ADDR/metrics, ADDR as for --listen. Keep it off public interfaces')
+    add_loop_monitor_arguments(p, shedding=True)
+    add_compression_arguments(p)
 
     # 👇 Add version flag
-    try:
-        pkg_version = version("oldie-goldie")
-    except PackageNotFoundError:
-        pkg_version = "0.0.0-dev"
-    
-    p.add_argument("--version", action="version", version=f"Oldie Goldie {pkg_version}")
+    p.add_argument("--version", action="version", version=f"Oldie Goldie {package_version()}")
     
     return p.parse_args()
 
@@ -735,7 +310,7 @@ def validate_args(args: argparse.Namespace):
         has_bind = (args.bind is not None and len(args.bind) > 0)
         has_token_count = (args.token_count is not None and args.token_count > 0)
         
-        if not (has_bind or has_token_count):
+        if not (has_bind or has_token_count) and not args.state_dir:
             logger.error("[validate_args] Error: when using --invite-token you must pass either --token-count N (N>0) or --bind <username> [users...]")
             sys.exit(1)
         
@@ -751,16 +326,65 @@ def validate_args(args: argparse.Namespace):
             logger.error("[validate_args] Error: --reuse can be used only with --bind. And unbound (general) tokens cannot be reused")
             sys.exit(1)
 
+    # --store-ttl and --store-max-kib only make sense with --store-forward
+    if not args.store_forward and (args.store_ttl != STORE_DEFAULT_TTL or args.store_max_kib != STORE_DEFAULT_MAX_BYTES // 1024):
+        logger.error("[validate_args] --store-ttl and --store-max-kib should be passed only with --store-forward")
+        sys.exit(1)
+    if args.store_ttl <= 0 or args.store_max_kib <= 0:
+        logger.error("[validate_args] --store-ttl and --store-max-kib must be > 0")
+        sys.exit(1)
+
     # If --no-expiry is used without --invite-tokens
     if args.no_expiry:
         if not args.invite_token:
             logger.error("[validate_args] --no-expiry should be passed only when --invite-tokens is invoked")
             sys.exit(1)
 
-def launch_tunnel(port: int) -> Optional[TunnelManager]:
+    for name in args.tenant or []:
+        if not is_valid_tenant_name(name):
+            logger.error(f"[validate_args] --tenant {name!r}: use lowercase letters, digits, '-' and '_' (up to 64 characters)")
+            sys.exit(1)
+    if args.tenant and len(set(args.tenant)) != len(args.tenant):
+        logger.error("[validate_args] --tenant names must be unique")
+        sys.exit(1)
+
+    if args.ping_timeout <= 0:
+        logger.error("[validate_args] --ping-timeout must be > 0")
+        sys.exit(1)
+    if args.keepalive != 'adaptive' and args.ping_timeout != PING_DEFAULT_TIMEOUT:
+        logger.error("[validate_args] --ping-timeout should be passed only with --keepalive adaptive")
+        sys.exit(1)
+
+    for address in args.listen or []:
+        try:
+            parse_listen_address(address)
+        except ValueError as e:
+            logger.error(f"[validate_args] --listen {e}")
+            sys.exit(1)
+
+    if args.loop_monitor is not None and args.loop_monitor <= 0:
+        logger.error("[validate_args] --loop-monitor must be > 0")
+        sys.exit(1)
+    if args.shed_lag is not None and (args.loop_monitor is None or args.shed_lag <= 0):
+        logger.error("[validate_args] --shed-lag must be > 0 and needs --loop-monitor")
+        sys.exit(1)
+
+    if args.memory_budget <= 0:
+        logger.error("[validate_args] --memory-budget must be > 0")
+        sys.exit(1)
+    if args.metrics is not None:
+        try:
+            parse_listen_address(args.metrics)
+        except ValueError as e:
+            logger.error(f"[validate_args] --metrics {e}")
+            sys.exit(1)
+
+def launch_tunnel(listeners: list[socket.socket]) -> Optional[TunnelManager]:
     """
-    Launch an ephemeral cloudflared tunnel to localhost:port.
+    Launch an ephemeral cloudflared tunnel to our listener, restarted by the TunnelManager if it exits.
+    cloudflared connects through the Unix socket if there is one.
     Returns a TunnelManager or None if cloudflared not found or failed to start.
+    Does not wait for the public URL, `report_tunnel_url()` prints it once cloudflared has it.
     """
    # Try pycloudflared first (auto-downloads Cloudflare binary)
     cmd = shutil.which('pycloudflared')
@@ -774,49 +398,40 @@ def launch_tunnel(port: int) -> Optional[TunnelManager]:
         print("Install via: pip install pycloudflared")
         return None
 
-    print(f"✅ Launching Cloudflare tunnel on port {port} using {cmd}...")
+    kind, origin = tunnel_origin(listeners)
+    print(f"✅ Launching Cloudflare tunnel to {origin} using {cmd}...")
 
     try:
-        proc = subprocess.Popen(
-            [cmd, 'tunnel', '--url', f"http://localhost:{port}"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1
-        )
+        return TunnelManager.launch([cmd, 'tunnel', '--unix-socket' if kind == 'unix' else '--url', origin])
     except Exception as e:
         print('Failed to launch cloudflared:', e)
         return None
 
-    return TunnelManager(proc)
-
-async def wait_for_tunnel_url(manager: TunnelManager, timeout: float = 5.0) -> Optional[str]:
+async def report_tunnel_url(manager: TunnelManager, timeout: float = 8.0) -> None:
     """
-    Async helper to wait up to `timeout` seconds for manager.url to become available.
-    Returns the URL or None on timeout.
+    Runs next to the listener, which is already serving local clients: prints the public URL
+    or a warning if cloudflared has not reported it within `timeout` seconds.
     """
-    start = time.monotonic()
-    while time.monotonic() - start < timeout:
-        if manager.url:
-            return manager.url
-        await asyncio.sleep(0.1)
-    return manager.url  # might be None
+    url = await manager.wait_for_url(timeout=timeout)
+    if url:
+        print(f"\nPublic ephemeral URL: {url}\n")
+    else:
+        print("⚠️ Cloudflared started but URL not yet available (continuing anyway).")
 
 # Invite Token Generation
-def generate_invite_tokens(args: argparse.Namespace):
+def generate_invite_tokens(server: OGServer, args: argparse.Namespace):
     """Generate Invite Tokens if invite_tokens is true in the args dictionary.
     Added to Validtions:
     1. If bind is passed, there is no need of passing the token_count.
     2. If bind and token_count, both are passed, the token_count should not be less than the number of usernames given for bind
 
     Args:
+        server (OGServer): server the tokens are issued for
         args (args.Namespace): args object provided by Argparser
     """
 
-    global invite_tokens
-    global invite_token
-
-    invite_token = True
+    server.invite_token = True
+    invite_tokens = server.invite_tokens
 
     # Expiry of tokens in accordance with --no-expiry flag
     expiry_time = (time.time() + 600) if not args.no_expiry else None # Token valid for 10 minutes
@@ -872,72 +487,42 @@ def generate_invite_tokens(args: argparse.Namespace):
                 print(f"----\ntoken: {token}, expiry: {expiry_display} min")
                 
 
-async def process_request(connection: websockets.ServerConnection, request: websockets.Request):
-    """
-    This runs before the websocket handshake.
-    We can reject unauthorized clients here.
-    """
-    logger.info('[process_request] Inside Process Request')
-
-    now = time.time()
-    
-    logger.debug('[process_request] Triggering token cleanup')
-    logger.debug(f"[process_request] Current invite_tokens:\n{invite_tokens}")
 
-    # Clean up expired tokens
-    expired = [
-        tok for tok, meta in invite_tokens.items()
-        if isinstance(meta['expiry'], (float, int)) and now > meta["expiry"]]
+async def setup_tenant(server: OGServer, name: str, args: argparse.Namespace, handoff: dict[str, Any] | None) -> None:
+    """Stores, handed over state and invite tokens of one tenant (the server itself without --tenant)."""
+    # Tokens and blocked usernames of the previous run, before new tokens get issued
+    if args.state_dir:
+        started = time.perf_counter()
+        server.state_store = ServerStateStore(directory=tenant_dir(args.state_dir, name))
+        server.invite_tokens, server.blocked_usernames = server.state_store.open()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        print(f"----\n💾 State loaded from {server.state_store.directory} in {elapsed_ms:.1f} ms: {len(server.invite_tokens)} token(s), {len(server.blocked_usernames)} blocked username(s)\n----")
+
+    if handoff is not None:
+        apply_handoff_state(server, handoff["tenants"].get(name, {}))
+
+    # The server handing over already issued the tokens of --bind / --token-count
+    if args.invite_token and (args.bind or args.token_count) and handoff is None:
+        if name:
+            print(f"----\n👥 Group `{name}`\n----")
+        generate_invite_tokens(server, args=args)
+    elif args.invite_token:
+        # --state-dir without new tokens: stay protected with the tokens issued before the restart
+        server.invite_token = True
+        if not server.invite_tokens:
+            print(f"⚠️ No stored invite tokens left{f' for group `{name}`' if name else ''}, nobody will be able to join. Pass --bind or --token-count to issue some.")
+
+    if args.store_forward:
+        store_dir = tenant_dir(args.store_forward, name)
+        server.offline_store = OfflineFrameStore(directory=store_dir, ttl=args.store_ttl, max_bytes=args.store_max_kib * 1024)
+        print(f"----\n📬 Store-and-forward enabled in {store_dir} ({server.offline_store.pending_users()} queued user(s))\n----")
     
-    for tok in expired:
-
-        logger.debug(f"[process_request] Deleting Token: {invite_tokens[tok]}")
-
-        del invite_tokens[tok]
-    
-    logger.debug(f"[process_request] Updated Invite Tokens:\n{invite_tokens}")
-
-     # Skip check if no tokens configured
-    if not invite_token:
-        return None  # continue to handshake
-    
-    # Only check if tokens are enabled
-    auth_header = request.headers.get('Authorization')
-
-    # Invalid or missing token → return 401 and skip handler
-    if not auth_header or (auth_header not in invite_tokens):
-        logger.warning(f"[process_request] Invalid/missing token: {auth_header}")
-
-        # Build proper HTTP 401 response
-        response = (
-            b"HTTP/1.1 401 Unauthorized\r\n"
-            b"Content-Type: text/plain\r\n"
-            b"Content-Length: 23\r\n"
-            b"Connection: close\r\n"
-            b"\r\n"
-            b"Unauthorized or invalid.\n"
-        )
-
-        # Send response directly over the transport
-        try:
-            logger.info(f"[process_request] Sending 401 to the client")
-            connection.transport.write(response)
-        
-        # yield control to flush socket buffer
-            await asyncio.sleep(0)
-        
-        except Exception as e:
-            logger.error(f"[process_request] Error sending response: {e}")
-        
-        finally:
-            logger.info("[process_request] Closing Client TCP connection")
-            connection.transport.close()
-        
-        return # stop handshake
-        
-    
-    # Valid token, Don't consume token here; just allow connection
-    return None # Continue to handshake
+    if args.journal:
+        journal_dir = tenant_dir(args.journal, name)
+        server.journal = EventJournal(directory=journal_dir)
+        await server.journal.start()
+        server.journal_event("server_start", host=args.host, port=args.port, invite_token=bool(args.invite_token), tenant=name or None)
+        print(f"----\n📓 Event journal enabled in {journal_dir}\n----")
 
 async def main():
     # Add support for command line arguments to take in an optional port number
@@ -949,32 +534,115 @@ async def main():
     app_name = 'Protected Server' if args.invite_token else 'Unprotected Server'
     print(version_banner(app_name=app_name))
 
+    # Started by a graceful restart: inherit the listening sockets, cloudflared and the in-memory state
+    handoff, handoff_sock, handoff_fds = None, None, []
+    if args.handoff_fd is not None:
+        handoff_sock, handoff_fds, handoff = receive_handoff(args.handoff_fd)
+        listeners = [socket.socket(fileno=fd) for fd in handoff_fds[:handoff["listeners"]]]
+    else:
+        # Bound before anything else starts, cloudflared included, so that clients can connect right away
+        try:
+            listeners = [open_listener(address) for address in args.listen or [f"0.0.0.0:{args.port}"]]
+        except OSError as e:
+            logger.error(f"[main] Cannot listen: {e}")
+            sys.exit(1)
+    # Read now, the sockets are closed by the time the files get removed
+    unix_paths = [path for path in map(unix_socket_path, listeners) if path]
+
+    compression_options = server_compression_options(
+        mode=args.ws_compression,
+        threshold=args.ws_compression_threshold,
+        no_context_takeover=args.ws_no_context_takeover,
+        max_window_bits=args.ws_max_window_bits,
+    )
+    liveness = LivenessMonitor(timeout=args.ping_timeout) if args.keepalive == 'adaptive' else None
+    memory_budget = MemoryBudget(args.memory_budget * 2**20)
+    loop_monitor = loop_monitor_from_args(args)
+
+    # With --tenant, one isolated OGServer per group behind a router on the same listeners
+    front: OGServer | TenantRouter
+    if args.tenant:
+        front = TenantRouter(listeners=listeners, compression_options=compression_options, liveness=liveness, memory_budget=memory_budget, loop_monitor=loop_monitor)
+        tenants = {name: front.add_tenant(name) for name in args.tenant}
+    else:
+        front = OGServer(listeners=listeners, compression_options=compression_options, liveness=liveness, memory_budget=memory_budget, loop_monitor=loop_monitor)
+        tenants = {"": front}
+
+    # cloudflared comes up while the listener binds, the URL is printed when it is known
     tunnel_mgr = None
-    if args.host == 'public':
-        tunnel_mgr = launch_tunnel(args.port)
+    if handoff is not None and handoff["tunnel"] is not None and handoff["tunnel"]["pid"] is not None:
+        tunnel = handoff["tunnel"]
+        tunnel_mgr = TunnelManager.adopt(pid=tunnel["pid"], stdout_fd=handoff_fds[handoff["listeners"]], url=tunnel["url"], command=tunnel.get("command"))
+        print(f"\nPublic ephemeral URL: {tunnel_mgr.url}\n")
+    elif args.host == 'public':
+        tunnel_mgr = launch_tunnel(listeners)
         if tunnel_mgr is None:
             print("⚠️ Failed to start cloudflared. Falling back to local only mode.")
         else:
-            url = await wait_for_tunnel_url(tunnel_mgr, timeout=8.0)
-            if url:
-                print(f"\nPublic ephemeral URL: {url}\n")
-            else:
-                print("⚠️ Cloudflared started but URL not yet available (continuing anyway).")
+            asyncio.create_task(report_tunnel_url(tunnel_mgr, timeout=8.0))
     
-    if args.invite_token:
-        generate_invite_tokens(args=args)
-    
-    asyncio.create_task(check_tunnel_timeouts()) # Start background task
+    for name, server in tenants.items():
+        await setup_tenant(server, name, args, handoff)
 
+    metrics_server, follow_task = None, None
+    if loop_monitor is not None:
+        loop_monitor.start()
     try:
-        async with websockets.serve(handler, "0.0.0.0", port=args.port, process_request=process_request):
-            logger.info(f"Serving on port {args.port} (host={args.host})")
-            await asyncio.Future() # Run Forever
+        await front.start()
+        addresses = ", ".join(front.addresses)
+        logger.info(f"Serving on {addresses} (host={args.host})")
+        print(f"----\n👂 Listening on {addresses}" + (f" for {len(tenants)} groups: /{', /'.join(tenants)}" if args.tenant else "") + "\n----")
+
+        if args.metrics is not None:
+            # Handed over on a graceful restart like the websocket listeners
+            try:
+                metrics_listener = socket.socket(fileno=handoff_fds[-1]) if handoff is not None and handoff.get("metrics") else open_listener(args.metrics)
+                metrics_server = await serve_metrics(metrics_listener, front.metrics)
+                unix_paths += filter(None, [unix_socket_path(metrics_listener)])
+                print(f"----\n📈 Metrics on {describe_listener(metrics_listener)} (GET /metrics)\n----")
+            except OSError as e:
+                logger.warning(f"[main] Cannot serve metrics on {args.metrics}: {e}")
+
+        if handoff_sock is not None:
+            notify_ready(handoff_sock)
+            # The old server streams its session ticket, token and blocklist changes until it has drained
+            inherited = {name: {username: record["ticket"] for username, record in handoff["tenants"].get(name, {}).get("resumption_tickets", {}).items()} for name in tenants}
+            async def follow() -> None:
+                await follow_predecessor(handoff_sock, lambda update: apply_predecessor_update(tenants, inherited, update))
+                for name, server in tenants.items():
+                    settle_inherited_tickets(server, inherited[name])
+            follow_task = asyncio.create_task(follow())
+        if hasattr(signal, "SIGHUP"):
+            restart_tasks: set[asyncio.Task] = set() # the loop only keeps weak references to tasks
+            def on_sighup():
+                task = asyncio.create_task(graceful_restart(front, tenants, args, tunnel_mgr, metrics_server))
+                restart_tasks.add(task)
+                task.add_done_callback(restart_tasks.discard)
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, on_sighup)
+
+        await front.serve_forever() # Run until a graceful restart has drained
     finally:
+        if follow_task is not None:
+            follow_task.cancel()
+        if metrics_server is not None:
+            metrics_server.close()
+
+        # Closes the connections, snapshots the state stores and commits the journals
+        await front.stop()
+
+        if loop_monitor is not None:
+            loop_monitor.stop()
+            logger.info(f"[main] {loop_monitor.summary()}")
+
         # ensure tunnel is shut down when server exits
         if tunnel_mgr is not None:
             tunnel_mgr.stop()
 
+        # After a handoff the Unix sockets belong to the successor
+        if not draining:
+            for path in unix_paths:
+                remove_unix_socket(path)
+
 if __name__ == "__main__":
     try:
         asyncio.run(main())
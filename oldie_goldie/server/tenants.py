@@ -0,0 +1,205 @@
+# server/tenants.py
+"""
+Tenants: many separate chat groups served by one og-server process (`--tenant NAME`).
+
+Each tenant is an OGServer without listeners of its own. Its users, tunnels, broadcasts and
+invite tokens are not visible to the other tenants. A TenantRouter owns the listeners and picks
+the tenant of every connection from:
+- the URL path, ws://host:8765/<tenant>
+- otherwise the invite token (Authorization header)
+- or the session ticket (X-OG-Ticket) of a client reconnecting
+Unknown tenants get a 404 before the handshake. The housekeeping of all tenants runs in one loop
+rather than one task each, so an idle tenant costs a few dicts.
+"""
+
+import asyncio
+import logging
+import re
+import socket
+from http import HTTPStatus
+from typing import Any, Iterable
+from urllib.parse import unquote, urlsplit
+
+import websockets
+
+from oldie_goldie.server.og_server import OGServer, DEFAULT_LISTEN
+from oldie_goldie.server.helpers.liveness import LivenessMonitor, SERVE_OPTIONS as LIVENESS_SERVE_OPTIONS
+from oldie_goldie.server.helpers.memory_budget import MemoryBudget
+from oldie_goldie.server.helpers.metrics import Metric, loop_metrics
+from oldie_goldie.shared.loop_monitor import LoopMonitor
+from oldie_goldie.server.helpers.listeners import open_listener, describe_listener
+
+logger = logging.getLogger(__name__)
+
+TENANT_NAME = re.compile(r"[a-z0-9][a-z0-9_-]{0,63}")
+
+def is_valid_tenant_name(name: str) -> bool:
+    """Lowercase letters, digits, '-' and '_', up to 64 characters: it goes in URLs and directory names."""
+    return TENANT_NAME.fullmatch(name) is not None
+
+class TenantRouter:
+    """
+    Serves several OGServer tenants on shared listeners, with the same lifecycle as an OGServer:
+    start(), serve_forever(), stop() and `async with`.
+
+        router = TenantRouter(["0.0.0.0:8765"])
+        router.add_tenant("chess", invite_token=True, invite_tokens=tokens)
+        router.add_tenant("band")
+        await router.serve_forever()
+    """
+
+    def __init__(self, listen: Iterable[str] = (DEFAULT_LISTEN,), *, listeners: list[socket.socket] | None = None, compression_options: dict[str, Any] | None = None, liveness: LivenessMonitor | None = None, memory_budget: MemoryBudget | None = None, loop_monitor: LoopMonitor | None = None):
+        self.listen = list(listen)
+        self.listeners = listeners # bound by start() when None
+        self.compression_options = compression_options or {}
+        self.liveness = liveness # shared by the tenants, each one sweeps its own users
+        self.memory_budget = memory_budget # applied here to every connection, tenants only check frame sizes
+        self.loop_monitor = loop_monitor # load shedding and metrics, for the whole process
+        self.tenants: dict[str, OGServer] = {}
+        self.ws_servers: list[websockets.Server] = []
+        self._housekeeping: asyncio.Task | None = None
+        self._stopping = False
+        self._stopped = asyncio.Event()
+
+    # ==== #
+    # Tenants
+    # ==== #
+
+    def add_tenant(self, name: str, **options: Any) -> OGServer:
+        """Creates tenant `name`. `options` are OGServer keyword arguments (tokens, stores). Raises ValueError."""
+        if not is_valid_tenant_name(name):
+            raise ValueError(f"{name!r}: tenant names are lowercase letters, digits, '-' and '_'")
+        if name in self.tenants:
+            raise ValueError(f"tenant {name!r} already exists")
+        tenant = OGServer(listeners=[], liveness=self.liveness, memory_budget=self.memory_budget, **options)
+        self.tenants[name] = tenant
+        return tenant
+
+    async def remove_tenant(self, name: str) -> None:
+        """Disconnects the users of tenant `name` and flushes its stores."""
+        tenant = self.tenants.pop(name)
+        await asyncio.gather(*(websocket.close(code=1001, reason="Group closed") for websocket in list(tenant.connections.by_websocket)), return_exceptions=True)
+        await tenant.stop()
+
+    def resolve(self, request: websockets.Request | None) -> OGServer | None:
+        """The tenant a handshake request is for, None if there is no such tenant."""
+        if request is None:
+            return None
+        path = unquote(urlsplit(request.path).path).strip("/")
+        if path:
+            return self.tenants.get(path)
+
+        token = request.headers.get("Authorization")
+        ticket = request.headers.get("X-OG-Ticket")
+        if not token and not ticket:
+            return None
+        for tenant in self.tenants.values():
+            if (token and token in tenant.invite_tokens) or (ticket and tenant.find_resumption_ticket(ticket)):
+                return tenant
+        return None
+
+    async def process_request(self, connection: websockets.ServerConnection, request: websockets.Request):
+        if self.loop_monitor is not None and self.loop_monitor.overloaded:
+            self.loop_monitor.shed += 1
+            return connection.respond(HTTPStatus.SERVICE_UNAVAILABLE, "Server busy, try again later.\n")
+        if self.memory_budget is not None:
+            if self.memory_budget.saturated:
+                self.memory_budget.refused += 1
+                return connection.respond(HTTPStatus.SERVICE_UNAVAILABLE, "Server busy, try again later.\n")
+            self.memory_budget.apply(connection)
+
+        tenant = self.resolve(request)
+        if tenant is None:
+            logger.info(f"[process_request] No tenant for path {request.path!r}")
+            return connection.respond(HTTPStatus.NOT_FOUND, "Unknown group.\n")
+        return await tenant.process_request(connection, request)
+
+    async def handler(self, websocket: websockets.ServerConnection):
+        # Resolved again rather than remembered: process_request may reject the connection without a handler run
+        tenant = self.resolve(websocket.request)
+        if tenant is None:
+            await websocket.close(code=4004, reason="Unknown group")
+            return
+        await tenant.handler(websocket)
+
+    async def check_tunnel_timeouts(self):
+        """One housekeeping loop for every tenant, and the buffer limits of all connections."""
+        while True:
+            if self.memory_budget is not None:
+                self.memory_budget.rebalance(self.open_connections())
+            for name, tenant in list(self.tenants.items()):
+                try:
+                    await tenant.housekeeping()
+                except Exception:
+                    logger.exception(f"[check_tunnel_timeouts] Housekeeping failed for tenant {name!r}")
+            await asyncio.sleep(1)
+
+    # ==== #
+    # Lifecycle
+    # ==== #
+
+    async def start(self) -> "TenantRouter":
+        """Binds the listeners unless they were given, and starts serving. Raises OSError if an address cannot be bound."""
+        if self.ws_servers:
+            return self
+        if self.listeners is None:
+            self.listeners = [open_listener(address) for address in self.listen]
+        keepalive = LIVENESS_SERVE_OPTIONS if self.liveness is not None else {}
+        limits = self.memory_budget.serve_options if self.memory_budget is not None else {}
+        for listener in self.listeners:
+            self.ws_servers.append(await websockets.serve(self.handler, sock=listener, process_request=self.process_request, **self.compression_options, **keepalive, **limits))
+        self._housekeeping = asyncio.create_task(self.check_tunnel_timeouts())
+        return self
+
+    async def serve_forever(self) -> None:
+        """Starts the router if needed and runs until stop()."""
+        await self.start()
+        await self._stopped.wait()
+
+    def stop_accepting(self) -> None:
+        """Closes the listeners, connected clients carry on (graceful restart)."""
+        for server in self.ws_servers:
+            server.close(close_connections=False)
+
+    async def stop(self) -> None:
+        """Closes the listeners and the connections, then stops every tenant. Safe to call multiple times."""
+        if self._stopping:
+            await self._stopped.wait()
+            return
+        self._stopping = True
+        try:
+            for server in self.ws_servers:
+                server.close()
+            await asyncio.gather(*(server.wait_closed() for server in self.ws_servers))
+            if self._housekeeping is not None:
+                self._housekeeping.cancel()
+            await asyncio.gather(*(tenant.stop() for tenant in self.tenants.values()))
+        finally:
+            self._stopped.set()
+
+    async def __aenter__(self) -> "TenantRouter":
+        return await self.start()
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.stop()
+
+    def open_connections(self) -> list[websockets.ServerConnection]:
+        return [connection for server in self.ws_servers for connection in server.connections]
+
+    @property
+    def addresses(self) -> list[str]:
+        """The listening addresses in --listen syntax, with the actual port when it was 0."""
+        return [describe_listener(listener) for listener in self.listeners or []]
+
+    def metrics(self) -> list[Metric]:
+        """Current state for the metrics endpoint, users and tunnels labelled by tenant."""
+        metrics = [
+            Metric.single("og_connections", "gauge", "Open websocket connections", len(self.open_connections())),
+            Metric("og_users", "gauge", "Registered users", [("", {"tenant": name}, len(tenant.connections)) for name, tenant in self.tenants.items()]),
+            Metric("og_tunnels", "gauge", "Active tunnels", [("", {"tenant": name}, tenant.connections.tunnel_count()) for name, tenant in self.tenants.items()]),
+        ]
+        if self.memory_budget is not None:
+            metrics += self.memory_budget.metrics()
+        if self.loop_monitor is not None:
+            metrics += loop_metrics(self.loop_monitor)
+        return metrics
@@ -1,15 +1,61 @@
 """_summary_
 Contains Core utilities for OG
+
+Exports are imported on first use: og-server only needs the protocol. The crypto
+modules (and `cryptography`) are loaded by the first import of one of their names,
+e.g. `from oldie_goldie.shared import SessionCipher`, so keep those imports out of
+the module level of code that must start fast.
 """
-from .protocol import encode_message, decode_message, make_register_message, make_connect_request, make_connect_response, make_user_disconnected_message, make_system_notification, make_system_request, make_system_response
-from .command_handler import CommandHandler
-from .art_forms import SYMBOL_BANNER, version_banner
-from .crypto.session_keys import SecureMethodsForOG
-from .crypto.encryption_handlers import EncryptionUtilsForOG
+from typing import TYPE_CHECKING
+
+from oldie_goldie.utilities.lazy_imports import lazy_exports
+
+_PROTOCOL = ".protocol"
+_SESSION_KEYS = ".crypto.session_keys"
+_ENCRYPTION = ".crypto.encryption_handlers"
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    "encode_message": _PROTOCOL,
+    "decode_message": _PROTOCOL,
+    "encode_binary_message": _PROTOCOL,
+    "decode_binary_message": _PROTOCOL,
+    "decode_binary_frame": _PROTOCOL,
+    "parse_binary_header": _PROTOCOL,
+    "encode_file_chunk": _PROTOCOL,
+    "parse_file_chunk": _PROTOCOL,
+    "make_register_message": _PROTOCOL,
+    "make_connect_request": _PROTOCOL,
+    "make_connect_response": _PROTOCOL,
+    "make_user_disconnected_message": _PROTOCOL,
+    "make_system_notification": _PROTOCOL,
+    "make_system_request": _PROTOCOL,
+    "make_system_response": _PROTOCOL,
+    "CommandHandler": ".command_handler",
+    "SYMBOL_BANNER": ".art_forms",
+    "version_banner": ".art_forms",
+    "package_version": ".art_forms",
+    "SecureMethodsForOG": _SESSION_KEYS,
+    "EncryptionUtilsForOG": _ENCRYPTION,
+    "SessionCipher": _ENCRYPTION,
+    "ReplayError": _ENCRYPTION,
+})
+
+if TYPE_CHECKING:
+    from .protocol import encode_message, decode_message, encode_binary_message, decode_binary_message, decode_binary_frame, parse_binary_header, encode_file_chunk, parse_file_chunk, make_register_message, make_connect_request, make_connect_response, make_user_disconnected_message, make_system_notification, make_system_request, make_system_response
+    from .command_handler import CommandHandler
+    from .art_forms import SYMBOL_BANNER, version_banner, package_version
+    from .crypto.session_keys import SecureMethodsForOG
+    from .crypto.encryption_handlers import EncryptionUtilsForOG, SessionCipher, ReplayError
 
 __all__ = [
     "encode_message",
     "decode_message",
+    "encode_binary_message",
+    "decode_binary_message",
+    "decode_binary_frame",
+    "parse_binary_header",
+    "encode_file_chunk",
+    "parse_file_chunk",
     "make_register_message",
     "make_connect_request",
     "make_connect_response",
@@ -21,6 +67,8 @@ __all__ = [
     "SYMBOL_BANNER",
     "SecureMethodsForOG",
     "EncryptionUtilsForOG",
-    "SYMBOL_BANNER",
-    "version_banner"
-]
\ No newline at end of file
+    "SessionCipher",
+    "ReplayError",
+    "version_banner",
+    "package_version"
+]
@@ -1,4 +1,4 @@
-from importlib.metadata import version, PackageNotFoundError
+from functools import lru_cache
 
 SYMBOL_BANNER = (r"""
      .--------.
@@ -17,12 +17,24 @@ SYMBOL_BANNER = (r"""
 """)
 
 
-def version_banner(app_name: str):
-    """Return a banner string with version info."""
+@lru_cache(maxsize=None)
+def _installed_version() -> str | None:
+    # importlib.metadata alone takes tens of milliseconds to import, so only import it here
+    from importlib.metadata import version, PackageNotFoundError
     try:
-        pkg_version = version("oldie-goldie")
+        return version("oldie-goldie")
     except PackageNotFoundError:
-        pkg_version = "dev"
+        return None
+
+
+def package_version(default: str = "0.0.0-dev") -> str:
+    """The installed oldie-goldie version (looked up once), `default` when running from a checkout."""
+    return _installed_version() or default
+
+
+def version_banner(app_name: str):
+    """Return a banner string with version info."""
+    pkg_version = package_version(default="dev")
 
     banner = f"""
 ╔═════════════════════════════════════════════════╗
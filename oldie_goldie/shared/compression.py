@@ -0,0 +1,84 @@
+# shared/compression.py
+"""Compression applied to tunnel payloads before they are encrypted.
+
+Once a payload is encrypted, websocket permessage-deflate can no longer shrink it,
+so the compression step has to happen on the plaintext. Peers advertise the codecs
+they can decode as tunnel features and the first codec both sides support is used.
+Payloads under the threshold, or that do not shrink, are sent as-is.
+"""
+
+import zlib
+
+# zstd is optional: pip install "oldie-goldie[zstd]"
+try:
+    import zstandard # type: ignore
+except ImportError:
+    zstandard = None
+
+CODEC_ZSTD = "zstd"
+CODEC_ZLIB = "zlib"
+
+# Payloads smaller than this are never compressed, the codec overhead is not worth it
+COMPRESSION_THRESHOLD = 256 # bytes
+
+# Upper bound when decompressing, protects the receiver against decompression bombs
+MAX_DECOMPRESSED_SIZE = 16 * 1024 * 1024 # bytes
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+_zstd_compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL) if zstandard else None
+_zstd_decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+def available_codecs() -> tuple[str, ...]:
+    """Codecs this installation can compress and decompress, in order of preference."""
+    if zstandard is not None:
+        return (CODEC_ZSTD, CODEC_ZLIB)
+    return (CODEC_ZLIB,)
+
+def negotiate_codec(peer_features: set[str] | list[str] | tuple[str, ...]) -> str | None:
+    """Returns the preferred codec supported by both this client and the peer, or None."""
+    for codec in available_codecs():
+        if codec in peer_features:
+            return codec
+    return None
+
+def compress(data: bytes | memoryview, codec: str | None, threshold: int = COMPRESSION_THRESHOLD) -> tuple[bytes | memoryview, str | None]:
+    """
+    Compress `data` with `codec`.
+    Returns (payload, codec_used), codec_used is None when the data was left uncompressed
+    (no codec, below the threshold, or not smaller once compressed).
+    """
+    if codec is None or len(data) < threshold:
+        return data, None
+
+    if codec == CODEC_ZLIB:
+        compressed = zlib.compress(data, ZLIB_LEVEL)
+    elif codec == CODEC_ZSTD and _zstd_compressor is not None:
+        compressed = _zstd_compressor.compress(data)
+    else:
+        raise ValueError(f"Unsupported compression codec: {codec}")
+
+    if len(compressed) >= len(data):
+        return data, None
+    return compressed, codec
+
+def decompress(data: bytes | memoryview, codec: str, max_size: int = MAX_DECOMPRESSED_SIZE) -> bytes:
+    """Decompress `data`, refusing anything that expands beyond `max_size` bytes."""
+    if codec == CODEC_ZLIB:
+        decompressor = zlib.decompressobj()
+        plaintext = decompressor.decompress(data, max_size)
+        if decompressor.unconsumed_tail or not decompressor.eof:
+            raise ValueError("Compressed payload is truncated or exceeds the size limit")
+        return plaintext
+
+    if codec == CODEC_ZSTD and _zstd_decompressor is not None:
+        try:
+            # Reject frames that announce an oversized content before anything gets allocated
+            if zstandard.frame_content_size(data) > max_size:
+                raise ValueError("Compressed payload exceeds the size limit")
+            return _zstd_decompressor.decompress(data, max_output_size=max_size)
+        except zstandard.ZstdError as e:
+            raise ValueError(f"Invalid zstd payload: {e}") from e
+
+    raise ValueError(f"Unsupported compression codec: {codec}")
@@ -4,7 +4,9 @@ from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.backends import default_backend
+from typing import Iterable
 import os
 
 class EncryptionUtilsForOG:
@@ -66,4 +68,103 @@ class EncryptionUtilsForOG:
         plaintext = unpadder.update(padded_plaintext) + unpadder.finalize()
 
         return plaintext.decode('utf-8')
-        
\ No newline at end of file
+
+
+class ReplayError(ValueError):
+    """Raised when an encrypted frame reuses a nonce that was already accepted."""
+
+
+class SessionCipher:
+    """
+    AES-256-GCM cipher bound to one session key.
+
+    The `AESGCM` context is built once and reused for every message, plaintext is
+    not padded (GCM is a stream mode) and nonces are counter based instead of random:
+
+        nonce(12)  = prefix(4) || counter(8, big-endian)
+        Format     : nonce(12) || ciphertext || tag(16)
+
+    Every instance picks its own random prefix, so both peers of a tunnel can encrypt
+    with the same key without ever colliding on a nonce. The receiving side remembers
+    the last counter accepted per prefix and rejects anything that is not strictly
+    newer, which gives replay detection for free over the ordered websocket stream.
+    """
+
+    NONCE_SIZE = 12
+    TAG_SIZE = 16
+    PREFIX_SIZE = 4
+    MAX_COUNTER = 2**64 - 1
+
+    def __init__(self, session_key: bytes, nonce_prefix: bytes | None = None):
+        if not isinstance(session_key, (bytes, bytearray)) or len(session_key) != 32:
+            raise ValueError("session_key must be 32 bytes for AES-256-GCM")
+        if nonce_prefix is None:
+            nonce_prefix = os.urandom(self.PREFIX_SIZE)
+        if len(nonce_prefix) != self.PREFIX_SIZE:
+            raise ValueError(f"nonce_prefix must be {self.PREFIX_SIZE} bytes")
+
+        self._key = bytes(session_key)
+        self._aead = AESGCM(self._key)
+        self._prefix = bytes(nonce_prefix)
+        self._send_counter = 0
+
+        # Highest counter accepted so far for every peer prefix
+        self._recv_counters: dict[bytes, int] = {}
+
+    @property
+    def key(self) -> bytes:
+        return self._key
+
+    @property
+    def nonce_prefix(self) -> bytes:
+        return self._prefix
+
+    def _next_nonce(self) -> bytes:
+        if self._send_counter >= self.MAX_COUNTER:
+            raise OverflowError("Nonce counter exhausted, a new session key is required")
+        self._send_counter += 1
+        return self._prefix + self._send_counter.to_bytes(8, "big")
+
+    def encrypt(self, message: str | bytes, associated_data: bytes | None = None) -> bytes:
+        """Encrypt `message` and return nonce||ciphertext||tag."""
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+
+        nonce = self._next_nonce()
+        return nonce + self._aead.encrypt(nonce, message, associated_data)
+
+    def decrypt(self, encrypted_message: bytes | memoryview, associated_data: bytes | None = None) -> bytes:
+        """
+        Decrypt nonce||ciphertext||tag and return the plaintext bytes.
+        Accepts any bytes-like object, a `memoryview` is decrypted without being copied.
+        Raises `ReplayError` if the nonce is not newer than the last one accepted from that peer.
+        """
+        if len(encrypted_message) < self.NONCE_SIZE + self.TAG_SIZE:
+            raise ValueError("Encrypted message is too short")
+
+        view = memoryview(encrypted_message)
+        prefix = bytes(view[:self.PREFIX_SIZE])
+        counter = int.from_bytes(view[self.PREFIX_SIZE:self.NONCE_SIZE], "big")
+
+        if prefix == self._prefix:
+            raise ReplayError("Refusing a message encrypted with our own nonce prefix")
+        if counter <= self._recv_counters.get(prefix, 0):
+            raise ReplayError(f"Replayed or out of order message (counter {counter})")
+
+        plaintext = self._aead.decrypt(view[:self.NONCE_SIZE], view[self.NONCE_SIZE:], associated_data)
+
+        # Only advance the window once the tag has been verified
+        self._recv_counters[prefix] = counter
+        return plaintext
+
+    def encrypt_many(self, messages: Iterable[str | bytes], associated_data: bytes | None = None) -> list[bytes]:
+        """Encrypt a batch of messages, in order, with consecutive nonces."""
+        return [self.encrypt(message, associated_data) for message in messages]
+
+    def decrypt_many(self, encrypted_messages: Iterable[bytes | memoryview], associated_data: bytes | None = None) -> list[bytes]:
+        """Decrypt a batch of messages, in order. Stops at the first invalid or replayed message."""
+        return [self.decrypt(encrypted_message, associated_data) for encrypted_message in encrypted_messages]
+
+    def decrypt_legacy(self, encrypted_message: bytes) -> str:
+        """Read the original nonce||tag||ciphertext (PKCS7 padded) format with this session's key."""
+        return EncryptionUtilsForOG.decrypt_message(session_key=self._key, encrypted_message=encrypted_message)
@@ -5,6 +5,7 @@ from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
 import hashlib
+import hmac
 from cryptography.hazmat.primitives import serialization
 
 class SecureMethodsForOG:
@@ -47,6 +48,17 @@ class SecureMethodsForOG:
         )
         return hkdf.derive(shared_secret) # Final AES key (32 bytes)
     
+    # === Fast handshake: PSK proof for the server === #
+    @staticmethod
+    def derive_psk_proof(psk_hash: bytes, requester: str, responder: str) -> bytes:
+        """
+        Derives the value both peers hand to the server to prove they entered the same PSK.
+        It is bound to the pair of usernames and, unlike the PSK hash, reveals nothing that
+        goes into the session key.
+        """
+        context = f"oldie-goldie-psk-proof|{requester}|{responder}".encode()
+        return hmac.new(psk_hash, context, hashlib.sha256).digest()
+
     # Helper method for serializing the public key (raw bytes)
     @staticmethod
     def public_key_to_bytes(public_key: x25519.X25519PublicKey) -> bytes:
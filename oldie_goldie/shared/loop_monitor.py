@@ -0,0 +1,257 @@
+# shared/loop_monitor.py
+"""Event loop lag sampler and slow callback reporter shared by og-server and og-client (`--loop-monitor`).
+
+Everything runs on one event loop, so synchronous work (print(), the cryptography calls,
+blocking waits) holds up every connection. The monitor:
+- samples the loop lag: how late a timer set `SAMPLE_INTERVAL` ahead fires, in a histogram
+- times every callback the loop runs, and reports those over the threshold with the task or
+  function, the activity set by the handler (`loop_activity`, e.g. the message type) and a
+  stack sample taken by a watchdog thread while the callback was still running
+- with `shed_lag`, flags the loop as overloaded while the smoothed lag is over it, og-server
+  then refuses new connections
+
+Callbacks are timed by wrapping asyncio's Handle._run, which costs two clock reads per callback
+while a monitor is running and nothing otherwise.
+"""
+
+import argparse
+import asyncio
+import asyncio.events
+import contextvars
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SLOW_CALLBACK = 0.1 # seconds
+SAMPLE_INTERVAL = 0.05 # seconds
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0) # seconds
+LAG_SMOOTHING = 0.2 # weight of a new sample in the smoothed lag used for shedding
+STACK_DEPTH = 12 # innermost frames kept in a stack sample
+REPORT_INTERVAL = 1.0 # seconds between two logged reports, the others are only counted
+MAX_ACTIVITIES = 64 # distinct activity labels counted, the rest go to "other"
+
+# What the running task is handling, e.g. the type of the message it decoded. The handlers set it,
+# it lives in the task's context so a slow callback is reported with the activity of its own task.
+loop_activity: contextvars.ContextVar[str] = contextvars.ContextVar("loop_activity", default="")
+
+_original_run = asyncio.events.Handle._run
+_EVENTS_FILE = asyncio.events.__file__
+_active: "LoopMonitor | None" = None
+
+def _timed_run(handle: asyncio.Handle) -> None:
+    monitor = _active
+    if monitor is None or threading.get_ident() != monitor.thread_id:
+        return _original_run(handle)
+    return monitor.run_callback(handle)
+
+def describe_callback(handle: asyncio.Handle) -> str:
+    """The task a callback steps, or the function it calls."""
+    callback = handle._callback # type: ignore[attr-defined]
+    owner = getattr(callback, "__self__", None)
+    if isinstance(owner, asyncio.Task):
+        coro = owner.get_coro()
+        return f"task {owner.get_name()} ({getattr(coro, '__qualname__', coro)})"
+    return getattr(callback, "__qualname__", repr(callback))
+
+class LagHistogram:
+    """Cumulative histogram of lag samples over LAG_BUCKETS, in seconds."""
+
+    def __init__(self, buckets: tuple[float, ...] = LAG_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets) # samples <= each bucket bound, not cumulative
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        """(bound, samples <= bound) for each bucket, then (inf, count)."""
+        total, result = 0, []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        result.append((float("inf"), self.count))
+        return result
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile."""
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return min(bound, self.max)
+        return self.max
+
+class LoopMonitor:
+    """Watches the event loop it is started on. One per process."""
+
+    def __init__(self, slow_callback: float = DEFAULT_SLOW_CALLBACK, shed_lag: float | None = None, interval: float = SAMPLE_INTERVAL):
+        if slow_callback <= 0 or interval <= 0 or (shed_lag is not None and shed_lag <= 0):
+            raise ValueError("expected slow_callback, interval and shed_lag > 0")
+        self.slow_callback = slow_callback
+        self.shed_lag = shed_lag
+        self.interval = interval
+
+        self.lag = LagHistogram()
+        self.smoothed_lag = 0.0
+        self.slow: dict[str, int] = {} # activity -> slow callbacks
+        self.shed = 0 # connections refused while overloaded
+        self.overloaded = False
+
+        self.thread_id = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._timer: asyncio.TimerHandle | None = None
+        self._expected = 0.0
+        self._watchdog: threading.Thread | None = None
+        self._stopping = threading.Event()
+
+        # Shared with the watchdog thread: the running callback and the stack sampled during it
+        self._sequence = 0
+        self._started = 0.0
+        self._sample: tuple[int, list[str]] | None = None
+
+        self._last_report = 0.0
+        self._suppressed = 0
+
+    # ==== #
+    # Lifecycle
+    # ==== #
+
+    def start(self) -> "LoopMonitor":
+        """Starts watching the running loop."""
+        global _active
+        if _active is not None:
+            raise RuntimeError("a loop monitor is already running")
+        self._loop = asyncio.get_running_loop()
+        self.thread_id = threading.get_ident()
+        _active = self
+        asyncio.events.Handle._run = _timed_run # type: ignore[method-assign]
+
+        self._expected = self._loop.time() + self.interval
+        self._timer = self._loop.call_at(self._expected, self._tick)
+        self._stopping.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="og-loop-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"[loop_monitor] Reporting callbacks over {self.slow_callback * 1000:.0f} ms" + (f", shedding load over {self.shed_lag * 1000:.0f} ms of lag" if self.shed_lag else ""))
+        return self
+
+    def stop(self) -> None:
+        global _active
+        if _active is not self:
+            return
+        _active = None
+        asyncio.events.Handle._run = _original_run # type: ignore[method-assign]
+        if self._timer is not None:
+            self._timer.cancel()
+        self._stopping.set()
+
+    # ==== #
+    # Lag sampling
+    # ==== #
+
+    def _tick(self) -> None:
+        now = self._loop.time() # type: ignore[union-attr]
+        lag = max(now - self._expected, 0.0)
+        self.lag.observe(lag)
+        self.smoothed_lag += LAG_SMOOTHING * (lag - self.smoothed_lag)
+
+        if self.shed_lag is not None:
+            overloaded = self.smoothed_lag >= self.shed_lag
+            if overloaded != self.overloaded:
+                self.overloaded = overloaded
+                if overloaded:
+                    logger.warning(f"[loop_monitor] Loop lag at {self.smoothed_lag * 1000:.0f} ms, refusing new connections")
+                else:
+                    logger.info(f"[loop_monitor] Loop lag back to {self.smoothed_lag * 1000:.0f} ms, accepting connections")
+
+        self._expected = now + self.interval
+        self._timer = self._loop.call_at(self._expected, self._tick) # type: ignore[union-attr]
+
+    # ==== #
+    # Slow callbacks
+    # ==== #
+
+    def run_callback(self, handle: asyncio.Handle) -> None:
+        self._sequence += 1
+        self._started = started = time.perf_counter()
+        try:
+            _original_run(handle)
+        finally:
+            self._started = 0.0
+            elapsed = time.perf_counter() - started
+            if elapsed >= self.slow_callback:
+                self._report(handle, elapsed)
+
+    def _watch(self) -> None:
+        """Watchdog thread: samples the loop thread's stack while a callback runs past the threshold."""
+        sampled = 0
+        while not self._stopping.wait(self.slow_callback / 2):
+            sequence = self._sequence
+            started = self._started
+            if not started or sequence == sampled or time.perf_counter() - started < self.slow_callback:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None or sequence != self._sequence:
+                continue
+            # Only the callback's own frames, below asyncio's Handle._run
+            stack = traceback.extract_stack(frame)
+            for index in range(len(stack) - 1, -1, -1):
+                if stack[index].name == "_run" and stack[index].filename == _EVENTS_FILE:
+                    stack = stack[index + 1:]
+                    break
+            self._sample = (sequence, traceback.format_list(stack[-STACK_DEPTH:]))
+            sampled = sequence
+
+    def _report(self, handle: asyncio.Handle, elapsed: float) -> None:
+        activity = handle._context.get(loop_activity, "") # type: ignore[attr-defined]
+        label = activity if activity in self.slow or len(self.slow) < MAX_ACTIVITIES else "other"
+        self.slow[label] = self.slow.get(label, 0) + 1
+
+        now = time.monotonic()
+        if now - self._last_report < REPORT_INTERVAL:
+            self._suppressed += 1
+            return
+        self._last_report = now
+
+        sample = self._sample
+        if sample is None or sample[0] != self._sequence:
+            stack = "  (no stack sample, the callback ended before the watchdog looked)"
+        else:
+            stack = "".join(sample[1]) or "  (no Python frames, the callback is a builtin)"
+        suppressed = f" ({self._suppressed} more since the last report)" if self._suppressed else ""
+        self._suppressed = 0
+        logger.warning(
+            f"[loop_monitor] {describe_callback(handle)} blocked the event loop for {elapsed * 1000:.0f} ms"
+            + (f" handling `{activity}`" if activity else "") + suppressed + f"\n{stack.rstrip()}"
+        )
+
+    def summary(self) -> str:
+        """One line for the logs on exit."""
+        return (
+            f"loop lag p50 {self.lag.quantile(0.5) * 1000:.0f} ms, p99 {self.lag.quantile(0.99) * 1000:.0f} ms, "
+            f"max {self.lag.max * 1000:.0f} ms over {self.lag.count} samples, {sum(self.slow.values())} slow callback(s)"
+        )
+
+def add_loop_monitor_arguments(parser: argparse.ArgumentParser, shedding: bool = False) -> None:
+    parser.add_argument('--loop-monitor', nargs='?', type=float, const=DEFAULT_SLOW_CALLBACK * 1000, metavar='MS', help=f'sample the event loop lag and log the callbacks that block it for MS or more, with a stack sample (default: {DEFAULT_SLOW_CALLBACK * 1000:.0f})')
+    if shedding:
+        parser.add_argument('--shed-lag', type=float, metavar='MS', help='with --loop-monitor, refuse new connections (503) while the loop lag stays over MS')
+
+def loop_monitor_from_args(args: Any) -> LoopMonitor | None:
+    """The monitor asked for by add_loop_monitor_arguments() options, None without --loop-monitor."""
+    if args.loop_monitor is None:
+        return None
+    shed_lag = getattr(args, "shed_lag", None)
+    return LoopMonitor(slow_callback=args.loop_monitor / 1000, shed_lag=shed_lag / 1000 if shed_lag is not None else None)
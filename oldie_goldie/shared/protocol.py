@@ -4,12 +4,27 @@
 import json
 from datetime import datetime
 import base64
-from typing import Any
-from .crypto.encryption_handlers import EncryptionUtilsForOG
+import struct
+from typing import Any, TYPE_CHECKING
+from .compression import compress, decompress, CODEC_ZLIB, CODEC_ZSTD
+
+# The ciphers are handed in by the callers, only the legacy key format needs the crypto module
+# here, so og-server never imports `cryptography`
+if TYPE_CHECKING:
+    from .crypto.encryption_handlers import SessionCipher
 
 # Protocol Version
 PROTOCOL_VERSION = "1.0"
 
+# Encryption formats carried in the `enc` field of an 'encrypted_message' envelope.
+# Envelopes without the field are in the original EncryptionUtilsForOG format.
+ENC_FORMAT_SESSION_CIPHER = "sc1"
+
+# Message length limits. Tunnel messages sent as binary frames may be much longer,
+# they are compressed before encryption when both peers support it.
+MAX_MESSAGE_LENGTH = 500
+MAX_TUNNEL_MESSAGE_LENGTH = 64 * 1024
+
 # === Chat Messages === #
 
 # Chat message structure:
@@ -21,28 +36,18 @@ PROTOCOL_VERSION = "1.0"
 #     "timestamp": "2023-10-01T12:34:56.789Z"
 # }
 
-# Function to encode a chat message
-# Takes a sender, message, and an optional timestamp
-def encode_message(
-        sender: str, 
-        message: str, 
-        timestamp:str | None = None, 
-        type: str = 'chat_message', 
-        session_key: bytes | None = None,
-        **kwargs: Any) -> str:
-    """
-    Encodes a chat message (or other type) into a JSON string with support for extra fields.
-    If session_key is provided, encrypts the JSON string and returns an 'encrypted_message' wrapper instead.
-    Ensure you pass `target` via **kwargs, if the message is intended for a peer/recipient
-    """
-    
+# Function to build and validate the chat message dictionary
+# Shared by the JSON (text frame) and binary frame encoders
+def _build_message_dict(sender: str, message: str, timestamp: str | None, type: str, max_length: int = MAX_MESSAGE_LENGTH, **kwargs: Any) -> dict[str, Any]:
+    """Validates the inputs and returns the message dictionary, including any extra fields."""
+
     # Validate inputs
     if not sender or not message:
         raise ValueError("Sender and message cannot be empty.")
     if len(sender) > 50:
         raise ValueError("Sender name cannot exceed 50 characters.")
-    if len(message) > 500:
-        raise ValueError("Message cannot exceed 500 characters.")
+    if len(message) > max_length:
+        raise ValueError(f"Message cannot exceed {max_length} characters.")
     
     # If timestamp is not provided, use the current time in ISO format
     # with timezone information
@@ -60,33 +65,75 @@ def encode_message(
     
     # Add any additional fields
     message_dict.update(kwargs)
+    return message_dict
 
-    # If no session_key -> return plaintext JSON
-    if session_key is None:
+# The envelope fields a relay must not change, authenticated like the binary frame header:
+# flipping or stripping `comp` would make the receiver decompress data that is not compressed, or the reverse
+def _envelope_associated_data(envelope: dict[str, Any]) -> bytes:
+    return json.dumps([envelope.get("enc"), envelope.get("comp"), envelope.get("target")], separators=(",", ":")).encode("utf-8")
+
+# Function to encode a chat message
+# Takes a sender, message, and an optional timestamp
+def encode_message(
+        sender: str, 
+        message: str, 
+        timestamp:str | None = None, 
+        type: str = 'chat_message', 
+        session_key: bytes | None = None,
+        cipher: "SessionCipher | None" = None,
+        compression: str | None = None,
+        **kwargs: Any) -> str:
+    """
+    Encodes a chat message (or other type) into a JSON string with support for extra fields.
+    If session_key or cipher is provided, encrypts the JSON string and returns an 'encrypted_message' wrapper instead.
+    A `cipher` takes precedence over `session_key` and produces the SessionCipher format.
+    With a cipher, the inner JSON is compressed with `compression` (a negotiated codec) before
+    encryption when it is large enough, the codec is then recorded in the envelope's `comp` field.
+    The `enc`, `comp` and `target` fields are authenticated as associated data.
+    Ensure you pass `target` via **kwargs, if the message is intended for a peer/recipient
+    """
+    
+    message_dict = _build_message_dict(sender=sender, message=message, timestamp=timestamp, type=type, **kwargs)
+    timestamp = message_dict["timestamp"]
+
+    # If no session_key or cipher -> return plaintext JSON
+    if session_key is None and cipher is None:
         return json.dumps(message_dict)
     
     # Else: encrypt the full JSON string
     inner_json = json.dumps(message_dict)
-    encrypted_bytes = EncryptionUtilsForOG.encrypt_message(session_key=session_key, message=inner_json)
-
-    # Wrap as encrypted message
-    return json.dumps({
+    envelope = {
         "protocol_version":PROTOCOL_VERSION,
         "type": "encrypted_message",
         "sender":sender,
-        "payload_b64": base64.b64encode(encrypted_bytes).decode('ascii'),
         "timestamp": timestamp,
         "target": kwargs.get('target', None)        
-    })
+    }
+
+    if cipher is not None:
+        payload, codec = compress(inner_json.encode('utf-8'), compression)
+        envelope["enc"] = ENC_FORMAT_SESSION_CIPHER
+        if codec is not None:
+            envelope["comp"] = codec
+        encrypted_bytes = cipher.encrypt(payload, associated_data=_envelope_associated_data(envelope))
+    else:
+        from .crypto.encryption_handlers import EncryptionUtilsForOG
+        encrypted_bytes = EncryptionUtilsForOG.encrypt_message(session_key=session_key, message=inner_json)
+
+    # Wrap as encrypted message
+    envelope["payload_b64"] = base64.b64encode(encrypted_bytes).decode('ascii')
+    return json.dumps(envelope)
     
 
 # Function to decode a chat message
 # Takes a JSON string and returns a dictionary
-def decode_message(message_str: str | bytes, session_key: bytes | None = None) -> dict[str, str]:
+def decode_message(message_str: str | bytes, session_key: bytes | None = None, cipher: "SessionCipher | None" = None) -> dict[str, str]:
     """
     Decodes a chat message from a JSON string into a dictionary.
-    If the message is 'encrypted_message' and session_key is provided,
+    If the message is 'encrypted_message' and session_key or cipher is provided,
     it will decrypt and then decode the inner message.
+    SessionCipher envelopes (`enc` == "sc1") require the cipher, the original format
+    is readable with either the session_key or the cipher's key.
     """
 
     try:
@@ -101,25 +148,161 @@ def decode_message(message_str: str | bytes, session_key: bytes | None = None) -
         }
     
     if msg.get('type') == 'encrypted_message':
+        if msg.get('enc') == ENC_FORMAT_SESSION_CIPHER:
+            if cipher is None:
+                # Can't decrypt, return as-is
+                return msg
+            payload = cipher.decrypt(base64.b64decode(msg["payload_b64"]), associated_data=_envelope_associated_data(msg))
+            if msg.get('comp'):
+                payload = decompress(payload, msg['comp'])
+            return json.loads(payload)
+
+        if session_key is None and cipher is not None:
+            session_key = cipher.key
         if session_key is None:
             # Can't decrypt, return as-is
             return msg
         payload = base64.b64decode(msg["payload_b64"])
+        from .crypto.encryption_handlers import EncryptionUtilsForOG
         inner_json = EncryptionUtilsForOG.decrypt_message(session_key=session_key, encrypted_message=payload)
         return json.loads(inner_json)
     
     return msg
 
+# === Binary Tunnel Frames === #
+# Tunnel traffic is sent as binary websocket frames instead of base64-in-JSON.
+# Frame structure:
+#     magic(1) | version(1) | kind(1) | flags(1) | target_len(1) | target(utf-8) | nonce(12) || ciphertext || tag(16)
+#
+# The server only parses the header to route the frame to `target`, it never touches the payload.
+# The header is authenticated as AEAD associated data, so a relay cannot retarget or relabel a frame.
+
+BINARY_FRAME_MAGIC = 0x4F # 'O'
+BINARY_FRAME_VERSION = 1
+
+# Frame kinds
+FRAME_KIND_MESSAGE = 1 # payload is an inner JSON message
+FRAME_KIND_FILE_CHUNK = 2 # payload is transfer_id(16) | offset(8) | raw file bytes
+
+# Frame flags
+FLAG_COMPRESSED_ZLIB = 0x01 # plaintext was zlib compressed before encryption
+FLAG_COMPRESSED_ZSTD = 0x02 # plaintext was zstd compressed before encryption
+_COMPRESSION_FLAGS = {CODEC_ZLIB: FLAG_COMPRESSED_ZLIB, CODEC_ZSTD: FLAG_COMPRESSED_ZSTD}
+
+# Feature advertised in `key_share` by clients that can receive binary frames.
+# Peers that do not advertise it keep receiving JSON 'encrypted_message' envelopes.
+FEATURE_BINARY_FRAMES = "binary_frames"
+# Feature advertised by clients that can receive `/send_file` transfers
+FEATURE_FILE_TRANSFER = "file_transfer"
+
+_BINARY_HEADER = struct.Struct("!BBBBB")
+_FILE_CHUNK_HEADER = struct.Struct("!16sQ")
+
+def encode_binary_frame(kind: int, target: str, payload: bytes, cipher: "SessionCipher", flags: int = 0, compression: str | None = None) -> bytes:
+    """
+    Encrypts `payload` with the session cipher and prefixes the routing header.
+    If `compression` names a codec, the payload is compressed first (when it is worth it)
+    and the codec is recorded in the header flags.
+    """
+    
+    target_bytes = target.encode('utf-8')
+    if not target_bytes or len(target_bytes) > 255:
+        raise ValueError("Binary frame target must be between 1 and 255 bytes.")
+
+    payload, codec = compress(payload, compression)
+    if codec is not None:
+        flags |= _COMPRESSION_FLAGS[codec]
+
+    header = _BINARY_HEADER.pack(BINARY_FRAME_MAGIC, BINARY_FRAME_VERSION, kind, flags, len(target_bytes)) + target_bytes
+    return header + cipher.encrypt(payload, associated_data=header)
+
+def parse_binary_header(frame: bytes | memoryview) -> tuple[int, int, str, int]:
+    """
+    Parses the header of a binary frame without touching the encrypted payload.
+    Returns (kind, flags, target, payload_offset). Raises ValueError for malformed frames.
+    """
+    view = memoryview(frame)
+    if len(view) < _BINARY_HEADER.size:
+        raise ValueError("Binary frame is too short")
+
+    magic, frame_version, kind, flags, target_len = _BINARY_HEADER.unpack_from(view)
+    if magic != BINARY_FRAME_MAGIC or frame_version != BINARY_FRAME_VERSION:
+        raise ValueError("Unknown binary frame format")
+
+    offset = _BINARY_HEADER.size + target_len
+    if len(view) < offset:
+        raise ValueError("Binary frame is truncated")
+    
+    target = str(view[_BINARY_HEADER.size:offset], 'utf-8')
+    return kind, flags, target, offset
+
+def decode_binary_frame(frame: bytes | memoryview, cipher: "SessionCipher") -> tuple[int, int, str, bytes]:
+    """
+    Authenticates and decrypts a binary frame, reading it through a memoryview so the
+    payload is not copied before decryption. Compressed payloads are decompressed.
+    Returns (kind, flags, target, plaintext).
+    """
+    view = memoryview(frame)
+    kind, flags, target, offset = parse_binary_header(view)
+    plaintext = cipher.decrypt(view[offset:], associated_data=view[:offset])
+
+    if flags & FLAG_COMPRESSED_ZSTD:
+        plaintext = decompress(plaintext, CODEC_ZSTD)
+    elif flags & FLAG_COMPRESSED_ZLIB:
+        plaintext = decompress(plaintext, CODEC_ZLIB)
+
+    return kind, flags, target, plaintext
+
+def encode_binary_message(
+        sender: str, 
+        message: str, 
+        target: str,
+        cipher: "SessionCipher",
+        timestamp: str | None = None, 
+        type: str = 'encrypted_message', 
+        compression: str | None = None,
+        **kwargs: Any) -> bytes:
+    """
+    Encodes a chat message (or other type) into an encrypted binary frame addressed to `target`.
+    The inner message carries the same fields as `encode_message`, messages may be up to
+    MAX_TUNNEL_MESSAGE_LENGTH characters and are compressed with `compression` before encryption.
+    """
+    message_dict = _build_message_dict(sender=sender, message=message, timestamp=timestamp, type=type, max_length=MAX_TUNNEL_MESSAGE_LENGTH, target=target, **kwargs)
+    return encode_binary_frame(kind=FRAME_KIND_MESSAGE, target=target, payload=json.dumps(message_dict).encode('utf-8'), cipher=cipher, compression=compression)
+
+def decode_binary_message(frame: bytes | memoryview, cipher: "SessionCipher") -> dict[str, Any]:
+    """Decrypts a binary message frame and returns the inner message dictionary."""
+    
+    kind, _, _, plaintext = decode_binary_frame(frame, cipher)
+    if kind != FRAME_KIND_MESSAGE:
+        raise ValueError(f"Binary frame of kind {kind} is not a message")
+    return json.loads(plaintext)
+
+def encode_file_chunk(target: str, transfer_id: bytes, offset: int, data: bytes | memoryview, cipher: "SessionCipher", compression: str | None = None) -> bytes:
+    """Encodes one chunk of a file transfer as an encrypted binary frame (AEAD per chunk)."""
+    
+    payload = _FILE_CHUNK_HEADER.pack(transfer_id, offset) + data
+    return encode_binary_frame(kind=FRAME_KIND_FILE_CHUNK, target=target, payload=payload, cipher=cipher, compression=compression)
+
+def parse_file_chunk(plaintext: bytes) -> tuple[bytes, int, memoryview]:
+    """Splits a decrypted file chunk payload into (transfer_id, offset, data) without copying the data."""
+    
+    if len(plaintext) < _FILE_CHUNK_HEADER.size:
+        raise ValueError("File chunk is too short")
+    transfer_id, offset = _FILE_CHUNK_HEADER.unpack_from(plaintext)
+    return transfer_id, offset, memoryview(plaintext)[_FILE_CHUNK_HEADER.size:]
+
 # === Control Messages === #
 # Control messages are used for user registration, connection requests, and system notifications.
-def make_register_message(username: str) -> str:
-    """Creates a registration message for a new user."""
+def make_register_message(username: str, **kwargs: Any) -> str:
+    """Creates a registration message for a new user, including any extra fields (e.g. `resumed` in the server's confirmation)."""
     
     return json.dumps({
         "protocol_version": PROTOCOL_VERSION,
         "type": "register",
         "username": username,
-        "timestamp": datetime.now().astimezone().isoformat()
+        "timestamp": datetime.now().astimezone().isoformat(),
+        **kwargs
     })
 
 def make_connect_request(username: str, target: str) -> str:
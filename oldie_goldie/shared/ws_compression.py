@@ -0,0 +1,166 @@
+# shared/ws_compression.py
+"""Websocket (permessage-deflate) compression policy shared by og-server and og-client.
+
+Modes:
+- `selective` (default): permessage-deflate is negotiated, but binary frames, encrypted
+  envelopes and messages under the threshold are sent uncompressed (RSV1 unset, which
+  RFC 7692 allows per message). Deflate contexts are only allocated once a connection
+  actually sends or receives a compressed message.
+- `deflate`: the websockets library behaviour, every data frame is compressed.
+- `off`: permessage-deflate is not negotiated at all.
+
+`no_context_takeover` drops the deflate contexts after every message, which caps the
+memory held by idle connections at the cost of a lower compression ratio.
+"""
+
+import argparse
+import zlib
+from typing import Any
+
+from websockets.extensions.permessage_deflate import (
+    ClientPerMessageDeflateFactory,
+    PerMessageDeflate,
+    ServerPerMessageDeflateFactory,
+)
+from websockets.frames import CTRL_OPCODES, OP_BINARY, OP_CONT, Frame
+
+COMPRESSION_MODES = ("selective", "deflate", "off")
+DEFAULT_COMPRESSION_THRESHOLD = 128 # bytes
+DEFAULT_MAX_WINDOW_BITS = 12
+DEFAULT_MEM_LEVEL = 5
+
+# Message types whose payload is ciphertext and does not compress.
+# Matched against the start of the JSON document, which encode_message always begins with the type.
+UNCOMPRESSED_MESSAGE_TYPES = ("encrypted_message",)
+_SNIFF_BYTES = 64
+
+class SelectivePerMessageDeflate(PerMessageDeflate):
+    """
+    permessage-deflate that only compresses the messages worth compressing,
+    and allocates its zlib contexts lazily.
+    """
+
+    def __init__(self, *args: Any, min_size: int = DEFAULT_COMPRESSION_THRESHOLD, compress_binary: bool = False, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+        self.compress_binary = compress_binary
+        self._skip_markers = tuple(f'"type": "{msg_type}"'.encode() for msg_type in UNCOMPRESSED_MESSAGE_TYPES)
+        self._encoding_message = False
+
+        # Drop the contexts the base class allocated eagerly, they are recreated on first use
+        if not self.local_no_context_takeover:
+            del self.encoder
+        if not self.remote_no_context_takeover:
+            del self.decoder
+
+    @classmethod
+    def from_extension(cls, extension: PerMessageDeflate, min_size: int, compress_binary: bool) -> "SelectivePerMessageDeflate":
+        return cls(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+            min_size=min_size,
+            compress_binary=compress_binary,
+        )
+
+    def _should_compress(self, frame: Frame) -> bool:
+        if frame.opcode is OP_BINARY and not self.compress_binary:
+            return False
+        if len(frame.data) < self.min_size:
+            return False
+        head = bytes(frame.data[:_SNIFF_BYTES])
+        return not any(marker in head for marker in self._skip_markers)
+
+    def encode(self, frame: Frame) -> Frame:
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+
+        # The decision is taken on the first frame and applies to the continuation frames
+        if frame.opcode is not OP_CONT:
+            self._encoding_message = self._should_compress(frame)
+
+        if not self._encoding_message:
+            return frame
+
+        if not self.local_no_context_takeover and not hasattr(self, 'encoder'):
+            self.encoder = zlib.compressobj(wbits=-self.local_max_window_bits, **self.compress_settings)
+
+        return super().encode(frame)
+
+    def decode(self, frame: Frame, *, max_size: int | None = None) -> Frame:
+        if frame.rsv1 and not self.remote_no_context_takeover and not hasattr(self, 'decoder'):
+            self.decoder = zlib.decompressobj(wbits=-self.remote_max_window_bits)
+        return super().decode(frame, max_size=max_size)
+
+class SelectiveServerDeflateFactory(ServerPerMessageDeflateFactory):
+    """Server-side factory negotiating permessage-deflate with a SelectivePerMessageDeflate extension."""
+
+    def __init__(self, *, min_size: int = DEFAULT_COMPRESSION_THRESHOLD, compress_binary: bool = False, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.min_size = min_size
+        self.compress_binary = compress_binary
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        return response_params, SelectivePerMessageDeflate.from_extension(extension, self.min_size, self.compress_binary)
+
+class SelectiveClientDeflateFactory(ClientPerMessageDeflateFactory):
+    """Client-side factory negotiating permessage-deflate with a SelectivePerMessageDeflate extension."""
+
+    def __init__(self, *, min_size: int = DEFAULT_COMPRESSION_THRESHOLD, compress_binary: bool = False, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.min_size = min_size
+        self.compress_binary = compress_binary
+
+    def process_response_params(self, params, accepted_extensions):
+        extension = super().process_response_params(params, accepted_extensions)
+        return SelectivePerMessageDeflate.from_extension(extension, self.min_size, self.compress_binary)
+
+def add_compression_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the websocket compression flags shared by og-server and og-client."""
+    parser.add_argument('--ws-compression', choices=COMPRESSION_MODES, default='selective', help="websocket compression: 'selective' skips binary/encrypted/small frames (default), 'deflate' compresses every frame, 'off' disables it")
+    parser.add_argument('--ws-compression-threshold', type=int, default=DEFAULT_COMPRESSION_THRESHOLD, help=f'smallest message in bytes compressed in selective mode (default: {DEFAULT_COMPRESSION_THRESHOLD})')
+    parser.add_argument('--ws-no-context-takeover', action='store_true', help='reset deflate contexts after every message to cap memory per connection')
+    parser.add_argument('--ws-max-window-bits', type=int, default=DEFAULT_MAX_WINDOW_BITS, choices=range(9, 16), metavar='{9..15}', help=f'deflate window size, smaller uses less memory (default: {DEFAULT_MAX_WINDOW_BITS})')
+
+def server_compression_options(mode: str = 'selective', threshold: int = DEFAULT_COMPRESSION_THRESHOLD, no_context_takeover: bool = False, max_window_bits: int = DEFAULT_MAX_WINDOW_BITS) -> dict[str, Any]:
+    """Keyword arguments for `websockets.serve` implementing the given compression policy."""
+    if mode == 'off':
+        return {'compression': None}
+
+    factory_options = dict(
+        server_no_context_takeover=no_context_takeover,
+        client_no_context_takeover=no_context_takeover,
+        server_max_window_bits=max_window_bits,
+        client_max_window_bits=max_window_bits,
+        compress_settings={'memLevel': DEFAULT_MEM_LEVEL},
+    )
+
+    if mode == 'deflate':
+        factory: ServerPerMessageDeflateFactory = ServerPerMessageDeflateFactory(**factory_options)
+    else:
+        factory = SelectiveServerDeflateFactory(min_size=threshold, **factory_options)
+
+    return {'compression': None, 'extensions': [factory]}
+
+def client_compression_options(mode: str = 'selective', threshold: int = DEFAULT_COMPRESSION_THRESHOLD, no_context_takeover: bool = False, max_window_bits: int = DEFAULT_MAX_WINDOW_BITS) -> dict[str, Any]:
+    """Keyword arguments for `websockets.connect` implementing the given compression policy."""
+    if mode == 'off':
+        return {'compression': None}
+
+    factory_options = dict(
+        server_no_context_takeover=no_context_takeover,
+        client_no_context_takeover=no_context_takeover,
+        server_max_window_bits=max_window_bits,
+        client_max_window_bits=max_window_bits,
+        compress_settings={'memLevel': DEFAULT_MEM_LEVEL},
+    )
+
+    if mode == 'deflate':
+        factory: ClientPerMessageDeflateFactory = ClientPerMessageDeflateFactory(**factory_options)
+    else:
+        factory = SelectiveClientDeflateFactory(min_size=threshold, **factory_options)
+
+    return {'compression': None, 'extensions': [factory]}
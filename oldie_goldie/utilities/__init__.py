@@ -1,3 +1,14 @@
-from .async_io import get_async_input, get_async_print
+from typing import TYPE_CHECKING
 
-__all__ = ["get_async_input", "get_async_print"]
\ No newline at end of file
+from .lazy_imports import lazy_exports
+
+# async_io picks an input backend (prompt_toolkit, aioconsole, readline) on import, only do that when asked
+__getattr__, __dir__ = lazy_exports(__name__, {
+    "get_async_input": ".async_io",
+    "get_async_print": ".async_io",
+})
+
+if TYPE_CHECKING:
+    from .async_io import get_async_input, get_async_print
+
+__all__ = ["get_async_input", "get_async_print", "lazy_exports"]
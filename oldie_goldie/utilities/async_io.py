@@ -6,7 +6,7 @@ import asyncio
 import sys
 import warnings
 import platform
-import subprocess
+import importlib.util
 from typing import Callable
 
 def get_pip_install_hint(package: str = "aioconsole") -> str:
@@ -14,12 +14,10 @@ def get_pip_install_hint(package: str = "aioconsole") -> str:
     
     python_exec = sys.executable or "python"
 
-    # Check if pip is available via subprocess
-    try:
-        subprocess.run([python_exec, "-m", "pip", "--version"], check=True, capture_output=True)
+    # Check if `python -m pip` would work, by locating the module rather than running it in a subprocess
+    if importlib.util.find_spec("pip") is not None:
         return f"To install {package}, run:\n\n    {python_exec} -m pip install {package}\n or\n    pip install {package}\n"
-    except (subprocess.SubprocessError, FileNotFoundError):
-        return f"To install {package}, ensure pip is installed and run:\n\n    {python_exec} -m ensurepip\n    {python_exec} -m pip install {package}\n or\n    pip install {package}\n"
+    return f"To install {package}, ensure pip is installed and run:\n\n    {python_exec} -m ensurepip\n    {python_exec} -m pip install {package}\n or\n    pip install {package}\n"
     
 
 try:
@@ -27,10 +25,14 @@ try:
     from prompt_toolkit.patch_stdout import patch_stdout # type: ignore
     from prompt_toolkit.shortcuts import PromptSession # type: ignore
 
-    session = PromptSession()
+    # Created on first input, it needs a terminal and is costly to set up
+    session: PromptSession | None = None
 
     async def prompt_async_input(prompt: str = "") -> str:
         """Async input using prompt_toolkit's PromptSession"""
+        global session
+        if session is None:
+            session = PromptSession()
         
         with patch_stdout():
             return await session.prompt_async(prompt)
@@ -0,0 +1,30 @@
+# utilities/lazy_imports.py
+"""Lazy package exports (PEP 562), so that importing a package does not import all of its modules.
+
+A package lists its exports and the submodule each comes from:
+
+    __getattr__, __dir__ = lazy_exports(__name__, {"OGClient": ".og_client"})
+
+`from package import OGClient` then imports `.og_client` on first use only, and
+caches the attribute on the package so later lookups are plain attribute reads.
+"""
+
+import importlib
+import sys
+from typing import Any, Callable
+
+def lazy_exports(package: str, exports: dict[str, str]) -> tuple[Callable[[str], Any], Callable[[], list[str]]]:
+    """Returns the module level `__getattr__` and `__dir__` for `package`."""
+
+    def __getattr__(name: str) -> Any:
+        module_name = exports.get(name)
+        if module_name is None:
+            raise AttributeError(f"module {package!r} has no attribute {name!r}")
+        value = getattr(importlib.import_module(module_name, package), name)
+        setattr(sys.modules[package], name, value)
+        return value
+
+    def __dir__() -> list[str]:
+        return sorted(set(vars(sys.modules[package])) | set(exports))
+
+    return __getattr__, __dir__
@@ -0,0 +1,36 @@
+"""
+Shared helpers for the tests that run an OGServer on localhost and drive it with
+OGClient, like benchmarks/_tunnel.py does for the benchmarks.
+"""
+import asyncio
+import time
+
+from oldie_goldie.client.og_client import OGClient
+
+
+async def wait_for(condition, timeout: float = 5.0) -> None:
+    """Polls `condition` until it holds, fails the test after `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+async def receive_text(client: OGClient, text: str) -> dict:
+    """Skips the notices queued before the message `text` arrives, returns it."""
+    while (message := await client.receive(timeout=5)) is not None:
+        if message.get("message") == text:
+            return message
+    raise AssertionError(f"connection closed before {text!r}")
+
+
+async def open_tunnel(uri: str, requester: str = "alice", responder: str = "bob", psk: str = "correct horse", **client_kwargs) -> tuple[OGClient, OGClient]:
+    """Registers two clients and opens a tunnel between them. Returns (requester, responder)."""
+    a, b = await OGClient(uri, **client_kwargs).connect(), await OGClient(uri, **client_kwargs).connect()
+    await a.register(requester)
+    await b.register(responder)
+    request = asyncio.create_task(a.request_tunnel(responder, psk=psk))
+    await wait_for(lambda: b.status == "request_received")
+    await b.accept_tunnel(requester, psk=psk)
+    await request
+    return a, b
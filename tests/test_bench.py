@@ -0,0 +1,56 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+from oldie_goldie.bench.stats import LatencyRecorder, percentile
+
+
+def test_nearest_rank_percentiles():
+    samples = [float(i) for i in range(1, 1001)]
+
+    assert percentile(samples, 0.50) == 500.0
+    assert percentile(samples, 0.99) == 990.0
+    assert percentile(samples, 0.999) == 999.0
+    assert percentile([7.0], 0.999) == 7.0
+    assert percentile([], 0.5) is None
+
+
+def test_recorders_merge_into_one_summary():
+    parent, worker = LatencyRecorder(), LatencyRecorder()
+    for ms in range(1, 51):
+        parent.add("register", ms / 1000)
+    for ms in range(51, 101):
+        worker.add("register", ms / 1000)
+    with pytest.raises(TimeoutError):
+        with worker.measure("connect"):
+            raise TimeoutError
+
+    # Workers send their state back as a plain dict
+    parent.merge(worker.to_dict())
+    summary = parent.summary(elapsed=2.0)
+
+    assert summary["register"]["count"] == 100
+    assert summary["register"]["throughput_per_s"] == 50.0
+    assert summary["register"]["p50_ms"] == 50.0
+    assert summary["register"]["p99_ms"] == 99.0
+    assert summary["register"]["max_ms"] == 100.0
+    assert summary["connect"] == dict(summary["connect"], count=0, errors=1, p50_ms=None)
+
+
+def test_inline_run_prints_a_json_report():
+    run = subprocess.run(
+        [sys.executable, "-m", "oldie_goldie.bench.cli", "register", "relay", "--server", "inline", "--clients", "4", "--messages", "3", "--json"],
+        capture_output=True, text=True, timeout=60,
+    )
+    assert run.returncode == 0, run.stderr
+
+    report = json.loads(run.stdout)
+    assert report["meta"]["server"] == "inline"
+    register, relay = report["results"]
+    assert register["ops"]["register"]["count"] == 4
+    assert register["ops"]["register"]["errors"] == 0
+    # Two pairs, each of the four clients sends three lines to its peer
+    assert relay["ops"]["relay_delivery"]["count"] == 6
+    assert all(stats["errors"] == 0 for stats in relay["ops"].values())
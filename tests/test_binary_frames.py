@@ -0,0 +1,76 @@
+import asyncio
+import os
+
+import pytest
+from cryptography.exceptions import InvalidTag
+
+from oldie_goldie.client.og_client import OGClient
+from oldie_goldie.server.og_server import OGServer
+from oldie_goldie.shared import SessionCipher, decode_binary_frame, encode_binary_message, parse_binary_header
+from oldie_goldie.shared.protocol import FRAME_KIND_FILE_CHUNK, FRAME_KIND_MESSAGE, decode_binary_message, encode_file_chunk, parse_file_chunk
+
+from _tunnel import open_tunnel, receive_text
+
+
+@pytest.fixture
+def pair():
+    key = os.urandom(32)
+    return SessionCipher(key), SessionCipher(key)
+
+
+def test_message_round_trip(pair):
+    alice, bob = pair
+    frame = encode_binary_message(sender="alice", message="x" * 10_000, target="bob", cipher=alice)
+    kind, _, target, _ = parse_binary_header(frame)
+    assert (kind, target) == (FRAME_KIND_MESSAGE, "bob")
+    assert b"xxxx" not in frame # no plaintext, no base64 or outer JSON
+    assert decode_binary_message(frame, bob)["message"] == "x" * 10_000
+
+
+def test_file_chunk_round_trip(pair):
+    alice, bob = pair
+    transfer_id = bytes(range(16))
+    frame = encode_file_chunk(target="bob", transfer_id=transfer_id, offset=4096, data=b"chunk", cipher=alice)
+    kind, _, _, plaintext = decode_binary_frame(frame, bob)
+    assert kind == FRAME_KIND_FILE_CHUNK
+    received_id, offset, data = parse_file_chunk(plaintext)
+    assert (received_id, offset, bytes(data)) == (transfer_id, 4096, b"chunk")
+
+
+def test_header_is_authenticated(pair):
+    alice, bob = pair
+    frame = encode_binary_message(sender="alice", message="hi", target="bob", cipher=alice)
+    retargeted = frame.replace(b"bob", b"eve", 1)
+    with pytest.raises(InvalidTag):
+        decode_binary_frame(retargeted, bob)
+
+
+def test_malformed_header_is_rejected():
+    with pytest.raises(ValueError):
+        parse_binary_header(b"\x4f\x01")
+    with pytest.raises(ValueError):
+        parse_binary_header(b"\x00\x01\x01\x00\x03bob")
+
+
+def test_server_relays_binary_frames_within_the_tunnel_only():
+    async def run():
+        async with OGServer(["127.0.0.1:0"]) as server:
+            uri = f"ws://{server.addresses[0]}"
+            alice, bob = await open_tunnel(uri)
+            await alice.send("sent as a binary frame")
+            assert (await receive_text(bob, "sent as a binary frame"))["sender"] == "alice"
+            assert server.connections.get("alice").relayed == 1
+
+            # A frame for bob from outside the tunnel is refused, not relayed
+            carol = await OGClient(uri).connect()
+            await carol.register("carol")
+            await carol.websocket.send(encode_binary_message(sender="carol", message="let me in", target="bob", cipher=SessionCipher(os.urandom(32))))
+            message = await carol.receive(timeout=5)
+            while message["type"] != "connect_error":
+                message = await carol.receive(timeout=5)
+            assert "not participating" in message["message"]
+            assert server.connections.get("carol").relayed == 0
+            for client in (alice, bob, carol):
+                await client.close()
+
+    asyncio.run(run())
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from oldie_goldie.client.helpers.chat_history import ChatHistoryForOG, HistoryPassphraseError
+
+
+async def open_history(path, passphrase: str = "hunter2") -> ChatHistoryForOG:
+    history = ChatHistoryForOG(str(path))
+    await history.open(passphrase)
+    return history
+
+
+def test_search_matches_whole_words_and_senders(tmp_path):
+    async def run():
+        history = await open_history(tmp_path / "history.db")
+        history.record("lobby", "alice", "Meet me at the old mill", timestamp=1.0)
+        history.record("lobby", "bob", "The mill is closed today", timestamp=2.0)
+        history.record("@alice", "carol", "bring the map", timestamp=3.0)
+        await history.close()
+
+        history = await open_history(tmp_path / "history.db")
+        results = await history.search("mill")
+        assert [(r["sender"], r["timestamp"]) for r in results] == [("bob", 2.0), ("alice", 1.0)]
+
+        assert [r["text"] for r in await history.search("from:@alice mill")] == ["Meet me at the old mill"]
+        assert [r["channel"] for r in await history.search("MAP")] == ["@alice"]
+        assert await history.search("mil") == []
+        assert await history.search("mill", limit=1) == [results[0]]
+        await history.close()
+
+    asyncio.run(run())
+
+
+def test_history_is_encrypted_at_rest(tmp_path):
+    async def run():
+        history = await open_history(tmp_path / "history.db")
+        history.record("lobby", "alice", "attack at dawn")
+        await history.close()
+
+    asyncio.run(run())
+
+    raw = b"".join(path.read_bytes() for path in tmp_path.iterdir())
+    for plaintext in (b"attack", b"dawn", b"alice", b"lobby"):
+        assert plaintext not in raw
+
+
+def test_wrong_passphrase_is_refused(tmp_path):
+    async def run():
+        history = await open_history(tmp_path / "history.db")
+        history.record("lobby", "alice", "secret plans")
+        await history.close()
+
+        intruder = ChatHistoryForOG(str(tmp_path / "history.db"))
+        with pytest.raises(HistoryPassphraseError):
+            await intruder.open("password")
+        await intruder.close()
+
+    asyncio.run(run())
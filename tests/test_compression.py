@@ -0,0 +1,81 @@
+import json
+import os
+import zlib
+
+import pytest
+from cryptography.exceptions import InvalidTag
+
+from oldie_goldie.shared import SessionCipher, decode_message, encode_message
+from oldie_goldie.shared.compression import CODEC_ZLIB, CODEC_ZSTD, available_codecs, compress, decompress
+
+CODECS = available_codecs()
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_round_trip(codec):
+    data = b"oldie goldie " * 100
+    payload, used = compress(data, codec)
+    assert used == codec
+    assert len(payload) < len(data)
+    assert decompress(payload, used) == data
+
+
+def test_small_payload_is_left_alone():
+    payload, used = compress(b"short", CODEC_ZLIB)
+    assert (payload, used) == (b"short", None)
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_decompression_bomb_is_rejected(codec):
+    bomb, used = compress(bytes(4 * 1024 * 1024), codec) # a few KiB that expand to 4 MiB
+    assert used == codec
+    with pytest.raises(ValueError):
+        decompress(bomb, codec, max_size=1024 * 1024)
+
+
+def test_payload_at_the_limit_is_accepted():
+    data = bytes(64 * 1024)
+    assert decompress(zlib.compress(data), CODEC_ZLIB, max_size=len(data)) == data
+
+
+def test_truncated_zlib_payload_is_rejected():
+    payload = zlib.compress(b"x" * 10_000)
+    with pytest.raises(ValueError):
+        decompress(payload[:len(payload) // 2], CODEC_ZLIB)
+
+
+def test_zstd_frame_announcing_too_much_is_rejected():
+    zstandard = pytest.importorskip("zstandard")
+    frame = zstandard.ZstdCompressor().compress(bytes(2 * 1024 * 1024))
+    with pytest.raises(ValueError):
+        decompress(frame, CODEC_ZSTD, max_size=1024 * 1024)
+
+
+def test_unknown_codec_is_rejected():
+    with pytest.raises(ValueError):
+        decompress(b"data", "brotli")
+
+
+def envelope_pair():
+    key = os.urandom(32)
+    alice, bob = SessionCipher(key), SessionCipher(key)
+    envelope = json.loads(encode_message(sender="alice", message="hello " * 50, cipher=alice, compression=CODEC_ZLIB, target="bob"))
+    return envelope, bob
+
+
+def test_compressed_envelope_round_trip():
+    envelope, bob = envelope_pair()
+    assert envelope["comp"] == CODEC_ZLIB
+    assert decode_message(json.dumps(envelope), cipher=bob)["message"] == "hello " * 50
+
+
+@pytest.mark.parametrize("tamper", [
+    lambda envelope: envelope.pop("comp"),
+    lambda envelope: envelope.update(comp=CODEC_ZSTD),
+    lambda envelope: envelope.update(target="mallory"),
+])
+def test_envelope_fields_are_authenticated(tamper):
+    envelope, bob = envelope_pair()
+    tamper(envelope)
+    with pytest.raises(InvalidTag):
+        decode_message(json.dumps(envelope), cipher=bob)
@@ -0,0 +1,48 @@
+from oldie_goldie.server.helpers.connections import IDLE, TUNNEL, ConnectionRecord, ConnectionRegistry
+
+
+def registry_with(*usernames: str) -> tuple[ConnectionRegistry, list[ConnectionRecord]]:
+    registry = ConnectionRegistry()
+    records = [ConnectionRecord(username, websocket=object()) for username in usernames]
+    for record in records:
+        registry.add(record)
+    return registry, records
+
+
+def test_records_are_found_by_username_and_by_websocket():
+    registry, (alice, bob) = registry_with("alice", "bob")
+
+    assert registry.get("alice") is alice and registry.of(bob.websocket) is bob
+    assert "alice" in registry and len(registry) == 2
+    assert registry.usernames() == ["alice", "bob"]
+    assert registry.get(None) is None
+
+    assert registry.remove(alice) is None
+    assert "alice" not in registry and registry.of(alice.websocket) is None
+    assert list(registry) == [bob]
+
+
+def test_removing_a_stale_record_keeps_the_new_one():
+    registry, (old,) = registry_with("alice")
+    new = ConnectionRecord("alice", websocket=object())
+    registry.add(new) # alice came back before the old connection was cleaned up
+
+    registry.remove(old)
+    assert registry.get("alice") is new and registry.of(new.websocket) is new
+
+
+def test_tunnels_link_both_records():
+    registry, (alice, bob, carol) = registry_with("alice", "bob", "carol")
+
+    registry.open_tunnel(alice, bob)
+    assert alice.peer is bob and bob.peer is alice
+    assert alice.state == bob.state == TUNNEL
+    assert registry.in_tunnel_together(alice, bob)
+    assert not registry.in_tunnel_together(alice, carol)
+    assert registry.tunnel_count() == 1
+
+    # Leaving ends the tunnel on both ends
+    assert registry.remove(bob) is alice
+    assert alice.peer is None and alice.state == IDLE
+    assert registry.tunnel_count() == 0
+    assert registry.close_tunnel(carol) is None
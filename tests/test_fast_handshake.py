@@ -0,0 +1,102 @@
+import asyncio
+import inspect
+
+import pytest
+
+from oldie_goldie.client.og_client import OGClient, OGClientError
+from oldie_goldie.server.og_server import OGServer
+
+from _tunnel import open_tunnel, receive_text, wait_for
+
+
+def spy(server: OGServer, name: str) -> list:
+    """Records the calls to the server method `name`, still running it."""
+    calls = []
+    method = getattr(server, name)
+
+    def wrapper(*args, **kwargs):
+        calls.append(kwargs or args)
+        return method(*args, **kwargs)
+
+    async def async_wrapper(*args, **kwargs):
+        calls.append(kwargs or args)
+        return await method(*args, **kwargs)
+
+    setattr(server, name, async_wrapper if inspect.iscoroutinefunction(method) else wrapper)
+    return calls
+
+
+def test_fast_handshake_opens_the_tunnel_in_one_exchange():
+    async def run():
+        async with OGServer(["127.0.0.1:0"]) as server:
+            uri = f"ws://{server.addresses[0]}"
+            fast = spy(server, "complete_fast_handshake")
+            slow = spy(server, "start_validation")
+            alice, bob = await open_tunnel(uri)
+
+            assert len(fast) == 1
+            assert not slow
+            assert alice.status == bob.status == "tunnel_active"
+            assert server.connections.tunnel_count() == 1
+
+            # Both sides derived the same session keys
+            await alice.send("over the fast tunnel")
+            assert (await receive_text(bob, "over the fast tunnel"))["sender"] == "alice"
+            await bob.send("and back")
+            assert (await receive_text(alice, "and back"))["sender"] == "bob"
+            for client in (alice, bob):
+                await client.close()
+
+    asyncio.run(run())
+
+
+def test_mismatched_psk_blocks_both_usernames():
+    async def run():
+        async with OGServer(["127.0.0.1:0"]) as server:
+            uri = f"ws://{server.addresses[0]}"
+            alice, bob = await OGClient(uri).connect(), await OGClient(uri).connect()
+            await alice.register("alice")
+            await bob.register("bob")
+
+            request = asyncio.create_task(alice.request_tunnel("bob", psk="correct horse"))
+            await wait_for(lambda: bob.status == "request_received")
+            with pytest.raises(OGClientError):
+                await bob.accept_tunnel("alice", psk="battery staple")
+            with pytest.raises(OGClientError):
+                await request
+
+            assert "alice" in server.blocked_usernames and "bob" in server.blocked_usernames
+            assert server.connections.tunnel_count() == 0
+
+            again = await OGClient(uri).connect()
+            with pytest.raises(OGClientError):
+                await again.register("alice")
+            for client in (alice, bob, again):
+                await client.close()
+
+    asyncio.run(run())
+
+
+def test_requester_without_fast_handshake_uses_the_psk_round_trips():
+    async def run():
+        async with OGServer(["127.0.0.1:0"]) as server:
+            uri = f"ws://{server.addresses[0]}"
+            fast = spy(server, "complete_fast_handshake")
+            slow = spy(server, "start_validation")
+            alice, bob = await OGClient(uri, fast_handshake=False).connect(), await OGClient(uri).connect()
+            await alice.register("alice")
+            await bob.register("bob")
+
+            request = asyncio.create_task(alice.request_tunnel("bob", psk="correct horse"))
+            await wait_for(lambda: bob.status == "request_received")
+            await bob.accept_tunnel("alice", psk="correct horse")
+            await request
+
+            assert not fast and len(slow) == 1
+            assert server.connections.tunnel_count() == 1
+            await alice.send("over the slow tunnel")
+            assert (await receive_text(bob, "over the slow tunnel"))["sender"] == "alice"
+            for client in (alice, bob):
+                await client.close()
+
+    asyncio.run(run())
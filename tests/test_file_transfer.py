@@ -0,0 +1,106 @@
+import asyncio
+import json
+import os
+
+from oldie_goldie.client.helpers.file_transfer import FileTransferUtilsForOG
+from oldie_goldie.shared import SessionCipher, decode_binary_frame
+
+TRANSFER_ID = bytes(range(16))
+
+
+class RecordingWebSocket:
+    """Collects the frames sent to the peer and decrypts them with the peer's cipher."""
+    def __init__(self, peer_cipher):
+        self.peer_cipher = peer_cipher
+        self.sent = []
+
+    async def send(self, frame):
+        _, _, _, plaintext = decode_binary_frame(frame, cipher=self.peer_cipher)
+        self.sent.append(json.loads(plaintext))
+
+
+def make_receiver(tmp_path, **kwargs):
+    key = os.urandom(32)
+    said = []
+
+    async def notify(text):
+        said.append(text)
+
+    files = FileTransferUtilsForOG(download_dir=str(tmp_path), notify=notify, **kwargs)
+    return files, RecordingWebSocket(SessionCipher(key)), SessionCipher(key), said
+
+
+def offer(size=10, name="notes.txt"):
+    return {"type": "file_offer", "sender": "alice", "transfer_id": TRANSFER_ID.hex(), "name": name, "size": size, "sha256": "00", "chunk_size": 4}
+
+
+def test_offer_waits_for_the_user(tmp_path):
+    async def run():
+        files, websocket, cipher, said = make_receiver(tmp_path)
+        await files.handle_message(offer(), websocket=websocket, cipher=cipher, username="bob")
+        assert websocket.sent == []
+        assert files.pending_offers() == ["notes.txt (10 bytes) from @alice"]
+        assert "/accept_file" in said[-1]
+
+        assert not await files.answer_offer(True, name="other.txt")
+        assert await files.answer_offer(True, name="notes.txt")
+        assert [(message["type"], message["offset"]) for message in websocket.sent] == [("file_accept", 0)]
+        assert files.pending_offers() == []
+        files.reset()
+
+    asyncio.run(run())
+
+
+def test_rejected_offer_is_cancelled(tmp_path):
+    async def run():
+        files, websocket, cipher, _ = make_receiver(tmp_path)
+        await files.handle_message(offer(), websocket=websocket, cipher=cipher, username="bob")
+        assert await files.answer_offer(False)
+        assert [(message["type"], message["reason"]) for message in websocket.sent] == [("file_cancel", "rejected")]
+        assert not await files.answer_offer(True)
+        assert not os.listdir(tmp_path)
+
+    asyncio.run(run())
+
+
+def test_offer_over_the_limit_is_refused(tmp_path):
+    async def run():
+        files, websocket, cipher, _ = make_receiver(tmp_path, max_file_size=5)
+        await files.handle_message(offer(size=6), websocket=websocket, cipher=cipher, username="bob")
+        assert [(message["type"], message["reason"]) for message in websocket.sent] == [("file_cancel", "file too large")]
+        assert files.pending_offers() == []
+
+    asyncio.run(run())
+
+
+def test_offer_larger_than_the_free_space_is_refused(tmp_path):
+    async def run():
+        files, websocket, cipher, _ = make_receiver(tmp_path, max_file_size=None, auto_accept=True)
+        await files.handle_message(offer(size=2**62), websocket=websocket, cipher=cipher, username="bob")
+        assert [(message["type"], message["reason"]) for message in websocket.sent] == [("file_cancel", "not enough disk space")]
+        assert not os.listdir(tmp_path)
+
+    asyncio.run(run())
+
+
+def test_interrupted_transfer_resumes_without_asking(tmp_path):
+    async def run():
+        files, websocket, cipher, _ = make_receiver(tmp_path)
+        (tmp_path / f"{TRANSFER_ID.hex()}.part").write_bytes(b"x" * 6)
+        await files.handle_message(offer(), websocket=websocket, cipher=cipher, username="bob")
+        assert [(message["type"], message["offset"]) for message in websocket.sent] == [("file_accept", 4)]
+        assert files.pending_offers() == []
+        files.reset()
+
+    asyncio.run(run())
+
+
+def test_withdrawn_offer_is_forgotten(tmp_path):
+    async def run():
+        files, websocket, cipher, said = make_receiver(tmp_path)
+        await files.handle_message(offer(), websocket=websocket, cipher=cipher, username="bob")
+        await files.handle_message({"type": "file_cancel", "sender": "alice", "transfer_id": TRANSFER_ID.hex(), "reason": "timeout"}, websocket=websocket, cipher=cipher, username="bob")
+        assert files.pending_offers() == []
+        assert "withdrew" in said[-1]
+
+    asyncio.run(run())
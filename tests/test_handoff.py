@@ -0,0 +1,57 @@
+import argparse
+import asyncio
+import socket
+
+from oldie_goldie.server.helpers.handoff import UpdateStream, follow_predecessor
+from oldie_goldie.server.helpers.state_store import ServerStateStore
+from oldie_goldie.server.og_server import OGServer
+from oldie_goldie.server.server import apply_handoff_state, apply_predecessor_update, handoff_state, release_stores
+
+TOKEN_A = "a" * 22
+TOKEN_B = "b" * 22
+
+
+def test_changes_made_during_the_drain_reach_the_successor(tmp_path):
+    async def run():
+        old = OGServer()
+        old.state_store = ServerStateStore(str(tmp_path))
+        old.invite_tokens, old.blocked_usernames = old.state_store.open()
+        old.invite_tokens[TOKEN_A] = {"username": "alice", "expiry": None, "reuse": False}
+        old.invite_tokens[TOKEN_B] = {"username": None, "expiry": None, "reuse": False}
+        old.issue_resumption_ticket("erin", peer="frank")
+
+        # As graceful_restart does: release the files, stream the changes, start the successor on them
+        updates = UpdateStream()
+        await release_stores(old, "", updates)
+        old.on_ticket_change = lambda username, record: updates.send({"tenant": "", "username": username, "ticket": record})
+        new = OGServer()
+        new.state_store = ServerStateStore(str(tmp_path))
+        new.invite_tokens, new.blocked_usernames = new.state_store.open()
+        state = handoff_state(old, argparse.Namespace(state_dir=str(tmp_path)))
+        apply_handoff_state(new, state)
+        inherited = {"": {username: record["ticket"] for username, record in state["resumption_tickets"].items()}}
+
+        # Changes made before the successor answered READY are buffered
+        old.blocked_usernames.add("mallory")
+        ours, theirs = socket.socketpair()
+        await updates.attach(ours)
+        follow = asyncio.create_task(follow_predecessor(theirs, lambda update: apply_predecessor_update({"": new}, inherited, update)))
+
+        del old.invite_tokens[TOKEN_B] # consumed during the drain
+        old.blocked_usernames.add("eve") # failed PSK validation during the drain
+        ticket = old.issue_resumption_ticket("dave", peer=None)
+        await updates.close()
+        await follow
+
+        assert set(new.blocked_usernames) == {"mallory", "eve"}
+        assert list(new.invite_tokens) == [TOKEN_A]
+        assert new.find_resumption_ticket(ticket) == "dave" # he can move over with it
+        assert new.resumption_tickets["erin"]["peer"] == "frank"
+        await new.state_store.close()
+
+    asyncio.run(run())
+
+    # The successor wrote them to its own WAL and snapshot
+    tokens, blocked = ServerStateStore(str(tmp_path)).open()
+    assert list(tokens) == [TOKEN_A]
+    assert set(blocked) == {"mallory", "eve"}
@@ -0,0 +1,46 @@
+import asyncio
+
+from oldie_goldie.server.helpers.journal import EventJournal, iter_events, list_segments
+
+
+def write_events(directory, count, segment_bytes=1024 * 1024, commit_events=256):
+    async def run():
+        journal = EventJournal(str(directory), segment_bytes=segment_bytes, commit_events=commit_events, fsync=False)
+        await journal.start()
+        for i in range(count):
+            journal.record("register", username=f"user{i % 3}", index=i)
+            if i % 5 == 4:
+                await asyncio.sleep(0.01) # let a commit happen
+        await journal.close()
+    asyncio.run(run())
+
+
+def test_events_are_read_back_in_order(tmp_path):
+    write_events(tmp_path, 20)
+    events = [event for _, event in iter_events(str(tmp_path))]
+    assert [event["seq"] for event in events] == list(range(1, 21))
+    assert [event["index"] for event in events] == list(range(20))
+
+
+def test_segments_rotate_by_size(tmp_path):
+    write_events(tmp_path, 60, segment_bytes=500, commit_events=5)
+    segments = list_segments(str(tmp_path))
+    assert len(segments) > 2
+    assert [event["seq"] for _, event in iter_events(str(tmp_path))] == list(range(1, 61))
+
+
+def test_restart_continues_the_sequence_in_a_new_segment(tmp_path):
+    write_events(tmp_path, 5)
+    write_events(tmp_path, 5)
+    assert len(list_segments(str(tmp_path))) == 2
+    assert [event["seq"] for _, event in iter_events(str(tmp_path))] == list(range(1, 11))
+
+
+def test_filters_and_torn_lines(tmp_path):
+    write_events(tmp_path, 9)
+    with open(list_segments(str(tmp_path))[-1], "a", encoding="utf-8") as f:
+        f.write('{"ts": 1, "seq": 10, "event": "regi') # torn by a crash
+
+    assert [event["index"] for _, event in iter_events(str(tmp_path), user="user1")] == [1, 4, 7]
+    assert list(iter_events(str(tmp_path), events={"tunnel_failed"})) == []
+    assert len(list(iter_events(str(tmp_path)))) == 9
@@ -0,0 +1,53 @@
+import errno
+import socket
+import sys
+
+import pytest
+
+from oldie_goldie.server.helpers.listeners import describe_listener, open_listener, parse_listen_address
+
+unix_only = pytest.mark.skipif(not hasattr(socket, "AF_UNIX") or sys.platform == "win32", reason="Unix sockets")
+
+
+@pytest.mark.parametrize("address, expected", [
+    ("0.0.0.0:8765", ("ipv4", "0.0.0.0", 8765)),
+    ("[::1]:8765", ("ipv6", "::1", 8765)),
+    ("unix:/run/og.sock", ("unix", "/run/og.sock", 0)),
+])
+def test_parse_listen_address(address, expected):
+    assert parse_listen_address(address) == expected
+
+
+@pytest.mark.parametrize("address", ["8765", "::1:8765", "host:99999", "unix:"])
+def test_parse_listen_address_rejects(address):
+    with pytest.raises(ValueError):
+        parse_listen_address(address)
+
+
+@unix_only
+def test_stale_unix_socket_is_replaced(tmp_path):
+    path = str(tmp_path / "og.sock")
+    open_listener(f"unix:{path}").close() # leaves the file behind, nobody listens on it
+
+    sock = open_listener(f"unix:{path}")
+    try:
+        assert describe_listener(sock) == f"unix:{path}"
+    finally:
+        sock.close()
+
+
+@unix_only
+def test_live_unix_socket_is_left_alone(tmp_path):
+    path = str(tmp_path / "og.sock")
+    running = open_listener(f"unix:{path}")
+    try:
+        with pytest.raises(OSError) as excinfo:
+            open_listener(f"unix:{path}")
+        assert excinfo.value.errno == errno.EADDRINUSE
+
+        # The running server still accepts
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(path)
+        client.close()
+    finally:
+        running.close()
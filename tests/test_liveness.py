@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+from oldie_goldie.client.og_client import OGClient
+from oldie_goldie.server.helpers.liveness import LivenessMonitor
+from oldie_goldie.server.og_server import OGServer
+
+from _tunnel import receive_text
+
+
+def test_silent_connection_is_reaped_and_a_responsive_one_is_kept():
+    async def run():
+        monitor = LivenessMonitor(min_interval=0.05, max_interval=0.4, timeout=0.2)
+        async with OGServer(["127.0.0.1:0"], liveness=monitor) as server:
+            uri = f"ws://{server.addresses[0]}"
+            alice, bob = await OGClient(uri).connect(), await OGClient(uri).connect()
+            await alice.register("alice")
+            await bob.register("bob")
+            bob_record = server.connections.get("bob")
+
+            # alice's laptop lid closes: her end stops reading, pings go unanswered
+            alice.websocket.transport.pause_reading()
+
+            for _ in range(100):
+                await server.housekeeping()
+                if "alice" not in server.connections:
+                    break
+                await asyncio.sleep(0.05)
+
+            assert "alice" not in server.connections
+            assert server.connections.get("bob") is bob_record
+            # bob answered every ping while idle, so he is pinged less and less often
+            assert bob_record.ping_interval > monitor.min_interval
+            assert (await receive_text(bob, "alice has disconnected."))["type"] == "user_disconnected"
+            await bob.close()
+
+    asyncio.run(run())
+
+
+def test_monitor_checks_its_intervals():
+    with pytest.raises(ValueError):
+        LivenessMonitor(min_interval=10, max_interval=5)
+    with pytest.raises(ValueError):
+        LivenessMonitor(timeout=0)
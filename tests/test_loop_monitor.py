@@ -0,0 +1,80 @@
+import asyncio
+import asyncio.events
+import logging
+import time
+
+import pytest
+
+from oldie_goldie.shared.loop_monitor import LagHistogram, LoopMonitor, loop_activity
+
+
+def hog_the_loop(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+def test_blocking_callback_is_reported_with_its_activity_and_stack(caplog):
+    async def handler():
+        loop_activity.set("file_chunk")
+        await asyncio.sleep(0)
+        hog_the_loop(0.2)
+
+    async def run():
+        monitor = LoopMonitor(slow_callback=0.05).start()
+        try:
+            await asyncio.create_task(handler())
+            await asyncio.sleep(0.01) # a quick callback is not reported
+        finally:
+            monitor.stop()
+        return monitor
+
+    with caplog.at_level(logging.WARNING, logger="oldie_goldie.shared.loop_monitor"):
+        monitor = asyncio.run(run())
+
+    assert monitor.slow == {"file_chunk": 1}
+    report = "\n".join(record.getMessage() for record in caplog.records)
+    assert "blocked the event loop" in report and "handling `file_chunk`" in report
+    assert "hog_the_loop" in report # the watchdog's stack sample
+    assert asyncio.events.Handle._run.__name__ == "_run" # stop() put asyncio back as it was
+
+
+def test_lag_over_the_shedding_threshold_marks_the_loop_overloaded():
+    async def run():
+        monitor = LoopMonitor(slow_callback=1.0, shed_lag=0.02, interval=0.01).start()
+        try:
+            overloaded = []
+            for _ in range(5):
+                hog_the_loop(0.1)
+                await asyncio.sleep(0.01)
+                overloaded.append(monitor.overloaded)
+            assert any(overloaded)
+            assert monitor.lag.max >= 0.03
+
+            await asyncio.sleep(0.5)
+            assert not monitor.overloaded
+        finally:
+            monitor.stop()
+
+    asyncio.run(run())
+
+
+def test_one_monitor_at_a_time():
+    async def run():
+        monitor = LoopMonitor().start()
+        try:
+            with pytest.raises(RuntimeError):
+                LoopMonitor().start()
+        finally:
+            monitor.stop()
+
+    asyncio.run(run())
+
+
+def test_histogram_quantiles():
+    histogram = LagHistogram(buckets=(0.01, 0.1, 1.0))
+    for value in [0.005] * 98 + [0.05, 0.5]:
+        histogram.observe(value)
+
+    assert histogram.quantile(0.5) == 0.01
+    assert histogram.quantile(0.99) == 0.1
+    assert histogram.quantile(1.0) == 0.5 # never past the largest sample
+    assert histogram.cumulative()[-1] == (float("inf"), 100)
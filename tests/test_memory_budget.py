@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+from websockets.exceptions import InvalidStatus
+
+from oldie_goldie.client.og_client import OGClient
+from oldie_goldie.server.helpers.memory_budget import (
+    MAX_FRAME,
+    MAX_TEXT_FRAME,
+    MAX_WRITE,
+    MIN_FRAME,
+    MIN_WRITE,
+    MemoryBudget,
+)
+from oldie_goldie.server.og_server import OGServer
+
+MIB = 1024 * 1024
+
+
+class FakeTransport:
+    def __init__(self, buffered: int = 0):
+        self.buffered = buffered
+        self.high = None
+
+    def get_write_buffer_size(self) -> int:
+        return self.buffered
+
+    def set_write_buffer_limits(self, high: int) -> None:
+        self.high = high
+
+    def is_closing(self) -> bool:
+        return False
+
+
+class FakeConnection:
+    def __init__(self, buffered: int = 0):
+        self.transport = FakeTransport(buffered)
+        self.protocol = type("Protocol", (), {"max_size": MAX_FRAME})()
+
+
+def test_limits_shrink_as_connections_grow():
+    budget = MemoryBudget(64 * MIB)
+
+    few = [FakeConnection() for _ in range(4)]
+    budget.rebalance(few)
+    assert (budget.frame_limit, budget.write_limit) == (MAX_FRAME, MAX_WRITE)
+
+    more = [FakeConnection() for _ in range(20)]
+    budget.rebalance(more)
+    assert MIN_FRAME < budget.frame_limit < MAX_FRAME
+    assert budget.reserved <= budget.budget
+    # Every connection is moved to the new limits
+    assert {c.protocol.max_size for c in more} == {budget.frame_limit}
+    assert {c.transport.high for c in more} == {budget.write_limit}
+
+    # Past some point the floor wins, a file chunk must still fit
+    budget.rebalance([FakeConnection() for _ in range(2000)])
+    assert (budget.frame_limit, budget.write_limit) == (MIN_FRAME, MIN_WRITE)
+
+    budget.rebalance(few)
+    assert budget.frame_limit == MAX_FRAME
+
+
+def test_full_write_buffers_drop_to_the_floor_then_saturate():
+    budget = MemoryBudget(1 * MIB)
+
+    budget.rebalance([FakeConnection(buffered=600 * 1024)])
+    assert (budget.frame_limit, budget.write_limit) == (MIN_FRAME, MIN_WRITE)
+    assert not budget.saturated
+
+    budget.rebalance([FakeConnection(buffered=950 * 1024)])
+    assert budget.saturated
+
+    budget.rebalance([FakeConnection()])
+    assert not budget.saturated
+
+
+def test_saturated_server_refuses_connections_and_oversized_frames():
+    async def run():
+        budget = MemoryBudget(1 * MIB)
+        async with OGServer(["127.0.0.1:0"], memory_budget=budget) as server:
+            uri = f"ws://{server.addresses[0]}"
+
+            # Saturation is decided from the real write buffers, keep the housekeeping from clearing it
+            budget.rebalance = lambda connections: None
+            budget.saturated = True
+            with pytest.raises(InvalidStatus) as refused:
+                await OGClient(uri).connect()
+            assert refused.value.response.status_code == 503
+            assert budget.refused == 1
+
+            budget.saturated = False
+            alice = await OGClient(uri).connect()
+            await alice.register("alice")
+            await alice.websocket.send("x" * (MAX_TEXT_FRAME + 1))
+            assert await alice.receive(timeout=5) is None
+            assert alice.websocket.close_code == 1009
+            assert budget.oversized == 1
+
+    asyncio.run(run())
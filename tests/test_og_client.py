@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from oldie_goldie.client.og_client import OGClient, OGClientError
+from oldie_goldie.server.og_server import OGServer
+
+from _tunnel import open_tunnel, receive_text, wait_for
+
+
+def test_chat_and_tunnel_without_a_terminal():
+    async def run():
+        async with OGServer(["127.0.0.1:0"]) as server:
+            uri = f"ws://{server.addresses[0]}"
+            alice, bob = await open_tunnel(uri)
+            carol = await OGClient(uri).connect()
+            await carol.register("carol")
+
+            assert sorted(await carol.list_users()) == ["alice", "bob", "carol"]
+
+            await alice.send("only for bob")
+            assert (await receive_text(bob, "only for bob"))["sender"] == "alice"
+
+            await alice.exit_tunnel()
+            await wait_for(lambda: bob.status == "idle" and server.connections.tunnel_count() == 0)
+
+            # Idle chat reaches the users who are not in a tunnel
+            await carol.send("hello everyone")
+            assert (await receive_text(alice, "hello everyone"))["sender"] == "carol"
+            for client in (alice, bob, carol):
+                await client.close()
+
+    asyncio.run(run())
+
+
+def test_taken_username_is_refused():
+    async def run():
+        async with OGServer(["127.0.0.1:0"]) as server:
+            uri = f"ws://{server.addresses[0]}"
+            first = await OGClient(uri).connect()
+            await first.register("alice")
+            second = await OGClient(uri, timeout=2).connect()
+            with pytest.raises(OGClientError):
+                await second.register("alice")
+            await first.close()
+            await second.close()
+
+    asyncio.run(run())
+
+
+def test_many_clients_in_one_process():
+    async def run():
+        async with OGServer(["127.0.0.1:0"]) as server:
+            uri = f"ws://{server.addresses[0]}"
+            clients = [await OGClient(uri).connect() for _ in range(20)]
+            await asyncio.gather(*(client.register(f"user{i}") for i, client in enumerate(clients)))
+            assert len(server.connections) == 20
+            await asyncio.gather(*(client.close() for client in clients))
+            await wait_for(lambda: len(server.connections) == 0)
+
+    asyncio.run(run())
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from oldie_goldie.client.og_client import OGClient, OGClientError
+from oldie_goldie.server.og_server import OGServer
+
+
+def test_two_servers_in_one_process_keep_their_own_state():
+    async def run():
+        async with OGServer(["127.0.0.1:0"]) as first, OGServer(["127.0.0.1:0"]) as second:
+            assert first.addresses != second.addresses
+            first_uri, second_uri = f"ws://{first.addresses[0]}", f"ws://{second.addresses[0]}"
+
+            alice = await OGClient(first_uri).connect()
+            await alice.register("alice")
+            # The same username is free on the other server
+            other_alice = await OGClient(second_uri).connect()
+            await other_alice.register("alice")
+            bob = await OGClient(second_uri).connect()
+            await bob.register("bob")
+
+            assert sorted(await alice.list_users()) == ["alice"]
+            assert sorted(await bob.list_users()) == ["alice", "bob"]
+
+            first.blocked_usernames.add("mallory")
+            refused = await OGClient(first_uri).connect()
+            with pytest.raises(OGClientError):
+                await refused.register("mallory")
+            mallory = await OGClient(second_uri).connect()
+            await mallory.register("mallory")
+            assert "mallory" not in second.blocked_usernames
+
+            for client in (alice, other_alice, bob, refused, mallory):
+                await client.close()
+
+    asyncio.run(run())
+
+
+def test_stop_closes_the_connections_of_that_server_only():
+    async def run():
+        async with OGServer(["127.0.0.1:0"]) as survivor:
+            doomed = await OGServer(["127.0.0.1:0"]).start()
+            alice = await OGClient(f"ws://{doomed.addresses[0]}").connect()
+            await alice.register("alice")
+            bob = await OGClient(f"ws://{survivor.addresses[0]}").connect()
+            await bob.register("bob")
+
+            await doomed.stop()
+            await doomed.stop() # safe to call twice
+
+            assert await alice.receive(timeout=5) is None
+            assert await bob.list_users() == ["bob"]
+            for client in (alice, bob):
+                await client.close()
+
+    asyncio.run(run())
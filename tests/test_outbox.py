@@ -0,0 +1,66 @@
+import asyncio
+import json
+from collections import deque
+
+import pytest
+import websockets
+
+from oldie_goldie.client import chat
+
+
+class FakeWebSocket:
+    """Records the chat lines sent, optionally loses the connection before send number `fail_at`."""
+    def __init__(self, fail_at=None):
+        self.sent = []
+        self.fail_at = fail_at
+
+    async def send(self, frame):
+        await asyncio.sleep(0) # lets lines typed meanwhile run
+        if self.fail_at is not None and len(self.sent) == self.fail_at:
+            raise websockets.exceptions.ConnectionClosed(None, None)
+        self.sent.append(json.loads(frame)["message"])
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def quiet(*args, **kwargs):
+        pass
+    monkeypatch.setattr(chat, "aprint", quiet)
+    monkeypatch.setattr(chat, "outbox", deque())
+    monkeypatch.setattr(chat, "link_up", True)
+    monkeypatch.setitem(chat.connection_state, "status", "idle")
+    return chat
+
+
+def test_outbox_flushes_in_order_after_a_reconnect(client):
+    async def run():
+        client.outbox.extend((line, "chat") for line in ("one", "two", "three"))
+        client.active_websocket = websocket = FakeWebSocket()
+
+        flush = asyncio.create_task(client.flush_outbox(username="alice"))
+        await asyncio.sleep(0)
+        await client.send_or_queue("typed during the flush", username="alice", session_cipher=None)
+        await flush
+
+        assert websocket.sent == ["one", "two", "three", "typed during the flush"]
+        assert not client.outbox
+
+    asyncio.run(run())
+
+
+def test_lost_connection_keeps_the_rest_in_order(client):
+    async def run():
+        client.outbox.extend((line, "chat") for line in ("one", "two", "three"))
+        client.active_websocket = FakeWebSocket(fail_at=1)
+        await client.flush_outbox(username="alice")
+        assert list(client.outbox) == [("two", "chat"), ("three", "chat")]
+
+        # Typed before the client noticed the connection is gone: it may not overtake the queue
+        await client.send_or_queue("four", username="alice", session_cipher=None)
+        assert [line for line, _ in client.outbox] == ["two", "three", "four"]
+
+        client.active_websocket = websocket = FakeWebSocket()
+        await client.flush_outbox(username="alice")
+        assert websocket.sent == ["two", "three", "four"]
+
+    asyncio.run(run())
@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+from oldie_goldie.client.og_client import OGClient
+from oldie_goldie.server.helpers.connections import SessionTickets
+from oldie_goldie.server.og_server import OGServer
+
+from _tunnel import open_tunnel, receive_text, wait_for
+
+
+def test_ticket_index_follows_rotation():
+    tickets = SessionTickets()
+    tickets["alice"] = {"ticket": "first", "peer": None, "expiry": None}
+    tickets["alice"] = {"ticket": "second", "peer": None, "expiry": None}
+    assert tickets.owner("first") is None
+    assert tickets.owner("second") == "alice"
+    tickets.pop("alice")
+    assert tickets.owner("second") is None and len(tickets) == 0
+
+
+def test_dropped_user_resumes_the_tunnel_with_the_ticket():
+    async def run():
+        async with OGServer(["127.0.0.1:0"]) as server:
+            uri = f"ws://{server.addresses[0]}"
+            alice, bob = await open_tunnel(uri)
+
+            alice.websocket.transport.abort() # the network goes away, no close frame
+            await wait_for(lambda: "alice" not in server.connections)
+            assert server.is_reserved_for_resumption("alice")
+
+            await alice.connect() # presents the session ticket
+            reply = await alice.register("alice")
+            assert reply["resumed"] is True
+            await wait_for(lambda: alice.status == "tunnel_active" and bob.status == "tunnel_active")
+
+            await alice.send("still there?")
+            assert (await receive_text(bob, "still there?"))["sender"] == "alice"
+            await alice.close()
+            await bob.close()
+
+    asyncio.run(run())
+
+
+def test_expired_ticket_is_rejected_and_frees_the_username():
+    async def run():
+        async with OGServer(["127.0.0.1:0"]) as server:
+            uri = f"ws://{server.addresses[0]}"
+            alice, bob = await open_tunnel(uri)
+            ticket = alice._ticket
+
+            alice.websocket.transport.abort()
+            await wait_for(lambda: "alice" not in server.connections)
+            assert server.find_resumption_ticket(ticket) == "alice"
+
+            server.resumption_tickets["alice"]["expiry"] = time.time() - 1 # housekeeping has not run yet
+            assert server.find_resumption_ticket(ticket) is None
+            assert not server.is_reserved_for_resumption("alice")
+
+            # Someone else takes the name, the old tunnel is over for bob
+            mallory = await OGClient(uri).connect()
+            reply = await mallory.register("alice")
+            assert reply["resumed"] is False
+            assert server.resumption_tickets.owner(ticket) is None
+            await wait_for(lambda: bob.status == "idle")
+            await mallory.close()
+            await bob.close()
+
+    asyncio.run(run())
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+from cryptography.exceptions import InvalidTag
+
+from oldie_goldie.shared import ReplayError, SessionCipher
+
+
+@pytest.fixture
+def pair():
+    key = os.urandom(32)
+    return SessionCipher(key), SessionCipher(key)
+
+
+def test_round_trip_both_ways(pair):
+    alice, bob = pair
+    assert bob.decrypt(alice.encrypt("hello bob")) == b"hello bob"
+    assert alice.decrypt(bob.encrypt(b"hello alice")) == b"hello alice"
+
+
+def test_replayed_frame_is_rejected(pair):
+    alice, bob = pair
+    frame = alice.encrypt("once")
+    assert bob.decrypt(frame) == b"once"
+    with pytest.raises(ReplayError):
+        bob.decrypt(frame)
+
+
+def test_out_of_order_frame_is_rejected(pair):
+    alice, bob = pair
+    first, second = alice.encrypt("first"), alice.encrypt("second")
+    assert bob.decrypt(second) == b"second"
+    with pytest.raises(ReplayError):
+        bob.decrypt(first)
+
+
+def test_own_frame_reflected_back_is_rejected(pair):
+    alice, _ = pair
+    with pytest.raises(ReplayError):
+        alice.decrypt(alice.encrypt("echo"))
+
+
+def test_tampered_frame_does_not_advance_the_window(pair):
+    alice, bob = pair
+    frame = alice.encrypt("intact")
+    tampered = frame[:-1] + bytes([frame[-1] ^ 0x01])
+    with pytest.raises(InvalidTag):
+        bob.decrypt(tampered)
+    # The genuine frame with the same counter is still accepted
+    assert bob.decrypt(frame) == b"intact"
+
+
+def test_associated_data_must_match(pair):
+    alice, bob = pair
+    frame = alice.encrypt("bound", associated_data=b"header")
+    with pytest.raises(InvalidTag):
+        bob.decrypt(frame, associated_data=b"other")
+
+
+def test_batches_stop_at_a_replay(pair):
+    alice, bob = pair
+    frames = alice.encrypt_many(["one", "two"])
+    assert bob.decrypt_many(frames) == [b"one", b"two"]
+    with pytest.raises(ReplayError):
+        bob.decrypt_many(frames[1:])
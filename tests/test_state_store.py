@@ -0,0 +1,181 @@
+import asyncio
+import os
+
+import pytest
+
+from oldie_goldie.server.helpers.state_store import ServerStateStore, SNAPSHOT_FILE, WAL_FILE, WAL_FROZEN_FILE
+
+TOKEN_A = "a" * 22
+TOKEN_B = "b" * 22
+TOKEN_C = "c" * 22
+
+
+def meta(username=None, expiry=None, reuse=False):
+    return {"username": username, "expiry": expiry, "reuse": reuse}
+
+
+def crash(store):
+    """Drops the store as a killed process would: no compaction, the WAL stays as written."""
+    store._wal.close()
+    store._wal = None
+
+
+def test_wal_is_replayed_after_a_crash(tmp_path):
+    store = ServerStateStore(str(tmp_path))
+    tokens, blocked = store.open()
+    tokens[TOKEN_A] = meta(username="alice")
+    tokens[TOKEN_B] = meta(expiry=123.0, reuse=True)
+    del tokens[TOKEN_A]
+    blocked.add("eve")
+    blocked.add("mallory")
+    blocked.discard("mallory")
+    crash(store)
+
+    tokens, blocked = ServerStateStore(str(tmp_path)).open()
+    assert dict(tokens.items()) == {TOKEN_B: meta(expiry=123.0, reuse=True)}
+    assert set(blocked) == {"eve"}
+    assert not tokens.is_bound("alice")
+
+
+def test_torn_record_is_dropped_and_truncated(tmp_path):
+    store = ServerStateStore(str(tmp_path))
+    tokens, _ = store.open()
+    tokens[TOKEN_A] = meta()
+    wal = tmp_path / WAL_FILE
+    size_after_first = wal.stat().st_size
+    tokens[TOKEN_B] = meta()
+    crash(store)
+
+    with open(wal, "r+b") as f:
+        f.truncate(wal.stat().st_size - 3) # the second record loses its last bytes
+
+    tokens, _ = ServerStateStore(str(tmp_path)).open()
+    assert list(tokens) == [TOKEN_A]
+    assert wal.stat().st_size == size_after_first
+
+
+def test_corrupted_record_stops_the_replay(tmp_path):
+    store = ServerStateStore(str(tmp_path))
+    tokens, _ = store.open()
+    tokens[TOKEN_A] = meta()
+    tokens[TOKEN_B] = meta()
+    crash(store)
+
+    wal = tmp_path / WAL_FILE
+    data = bytearray(wal.read_bytes())
+    data[-2] ^= 0xFF # fails the CRC of the last record
+    wal.write_bytes(bytes(data))
+
+    tokens, _ = ServerStateStore(str(tmp_path)).open()
+    assert list(tokens) == [TOKEN_A]
+
+
+def test_close_compacts_into_the_snapshot(tmp_path):
+    async def run():
+        store = ServerStateStore(str(tmp_path))
+        tokens, blocked = store.open()
+        tokens[TOKEN_A] = meta(username="alice", expiry=50.0)
+        blocked.add("eve")
+        await store.close()
+
+    asyncio.run(run())
+    assert (tmp_path / WAL_FILE).stat().st_size == 0
+    assert (tmp_path / SNAPSHOT_FILE).exists()
+
+    tokens, blocked = ServerStateStore(str(tmp_path)).open()
+    assert tokens[TOKEN_A] == meta(username="alice", expiry=50.0)
+    assert tokens.is_bound("alice")
+    assert set(blocked) == {"eve"}
+
+
+def test_interrupted_compaction_is_finished_on_open(tmp_path):
+    store = ServerStateStore(str(tmp_path))
+    tokens, blocked = store.open()
+    tokens[TOKEN_A] = meta()
+    blocked.add("eve")
+
+    # Killed right after compact() rotated the WAL, before the snapshot was written
+    store._wal.close()
+    os.replace(tmp_path / WAL_FILE, tmp_path / WAL_FROZEN_FILE)
+    store._wal = open(tmp_path / WAL_FILE, "ab")
+    tokens[TOKEN_B] = meta(username="bob")
+    del tokens[TOKEN_A]
+    crash(store)
+
+    store = ServerStateStore(str(tmp_path))
+    tokens, blocked = store.open()
+    assert list(tokens) == [TOKEN_B]
+    assert set(blocked) == {"eve"}
+    assert not (tmp_path / WAL_FROZEN_FILE).exists()
+
+    # The next compaction rotates the WAL again, nothing of the frozen one may be lost
+    async def run():
+        tokens[TOKEN_C] = meta()
+        await store.compact()
+        await store.close()
+
+    asyncio.run(run())
+    tokens, blocked = ServerStateStore(str(tmp_path)).open()
+    assert sorted(tokens) == [TOKEN_B, TOKEN_C]
+    assert tokens.is_bound("bob")
+    assert set(blocked) == {"eve"}
+
+
+def test_background_compaction_is_awaited_on_close(tmp_path):
+    async def run():
+        store = ServerStateStore(str(tmp_path), compact_after=2)
+        tokens, _ = store.open()
+        tokens[TOKEN_A] = meta()
+        tokens[TOKEN_B] = meta()
+        assert store.needs_compaction()
+        store.start_compaction()
+        await store.close()
+
+    asyncio.run(run())
+    assert not (tmp_path / WAL_FROZEN_FILE).exists()
+    tokens, _ = ServerStateStore(str(tmp_path)).open()
+    assert sorted(tokens) == [TOKEN_A, TOKEN_B]
+
+
+def test_expired_tokens_are_popped_without_a_scan(tmp_path, monkeypatch):
+    async def run():
+        store = ServerStateStore(str(tmp_path))
+        tokens, _ = store.open()
+        tokens[TOKEN_A] = meta(expiry=10.0)
+        tokens[TOKEN_B] = meta(expiry=30.0)
+        await store.close()
+
+    asyncio.run(run())
+    store = ServerStateStore(str(tmp_path))
+    tokens, _ = store.open()
+    monkeypatch.setattr(type(tokens), "items", lambda self: pytest.fail("pop_expired scanned the table"))
+
+    tokens[TOKEN_C] = meta(expiry=20.0) # in the overlay
+    tokens[TOKEN_B] = meta(expiry=None) # no longer expires
+    assert tokens.pop_expired(5.0) == []
+    assert tokens.pop_expired(15.0) == [TOKEN_A]
+    assert tokens.pop_expired(100.0) == [TOKEN_C]
+    assert len(tokens) == 1 and TOKEN_B in tokens
+    crash(store)
+
+
+def test_compaction_waits_for_a_scan_in_progress(tmp_path):
+    async def run():
+        store = ServerStateStore(str(tmp_path))
+        tokens, _ = store.open()
+        tokens[TOKEN_A] = meta()
+        tokens[TOKEN_B] = meta()
+        await store.compact()
+
+        scan = tokens.items()
+        first = next(scan) # paused inside the mmap'd snapshot
+        old = tokens._snapshot
+        tokens[TOKEN_C] = meta()
+        await store.compact() # swaps the snapshot in the meantime
+
+        assert [first[0]] + [token for token, _ in scan] == [TOKEN_A, TOKEN_B]
+        assert old._mm is None # unmapped once the scan ended
+        assert sorted(tokens) == [TOKEN_A, TOKEN_B, TOKEN_C]
+        await store.close()
+
+    asyncio.run(run())
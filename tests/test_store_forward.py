@@ -0,0 +1,76 @@
+import asyncio
+import os
+
+from oldie_goldie.server.helpers.store_forward import OfflineFrameStore
+
+
+def drain(store, username, limit=3):
+    """Reads and commits the whole queue of `username` in batches, returns the frames."""
+    async def run():
+        frames = []
+        while batch := await store.read_batch(username, limit=limit):
+            frames.extend(batch)
+            store.commit(username, batch)
+        return frames
+    return asyncio.run(run())
+
+
+def test_frames_come_back_in_order_across_segments(tmp_path):
+    store = OfflineFrameStore(str(tmp_path), segment_bytes=200)
+    for i in range(10):
+        assert store.append("bob", "alice", f"frame {i:02d} " + "x" * 40)
+    store.append("bob", "alice", b"\x00binary")
+    assert len(os.listdir(tmp_path / "bob")) > 2 # several segments
+
+    frames = drain(store, "bob")
+    assert [frame.frame for frame in frames] == [f"frame {i:02d} " + "x" * 40 for i in range(10)] + [b"\x00binary"]
+    assert {frame.sender for frame in frames} == {"alice"}
+    assert not store.has_pending("bob")
+    assert not (tmp_path / "bob").exists()
+
+
+def test_queue_survives_a_restart_from_the_cursor(tmp_path):
+    store = OfflineFrameStore(str(tmp_path), segment_bytes=200)
+    for i in range(6):
+        store.append("bob", "alice", f"frame {i} " + "x" * 40)
+
+    async def deliver_first_batch():
+        batch = await store.read_batch("bob", limit=2)
+        store.commit("bob", batch)
+    asyncio.run(deliver_first_batch())
+
+    # A new store reads the queue back from disk (cold), from where delivery stopped
+    restarted = OfflineFrameStore(str(tmp_path), segment_bytes=200)
+    assert restarted.has_pending("bob")
+    assert [frame.frame for frame in drain(restarted, "bob")] == [f"frame {i} " + "x" * 40 for i in range(2, 6)]
+
+
+def test_full_queue_refuses_frames(tmp_path):
+    store = OfflineFrameStore(str(tmp_path), max_bytes=300)
+    accepted = [store.append("bob", "alice", "y" * 80) for _ in range(5)]
+    assert accepted[0] and not accepted[-1]
+    assert len(drain(store, "bob")) == accepted.count(True)
+
+
+def test_torn_tail_is_skipped(tmp_path):
+    store = OfflineFrameStore(str(tmp_path))
+    store.append("bob", "alice", "complete")
+    store.append("bob", "alice", "torn in half")
+    segment = tmp_path / "bob" / sorted(os.listdir(tmp_path / "bob"))[0]
+    with open(segment, "r+b") as f:
+        f.truncate(segment.stat().st_size - 4)
+
+    restarted = OfflineFrameStore(str(tmp_path))
+    frames = drain(restarted, "bob")
+    assert [frame.frame for frame in frames] == ["complete"]
+
+
+def test_expired_segments_are_purged(tmp_path):
+    store = OfflineFrameStore(str(tmp_path), ttl=60)
+    store.append("bob", "alice", "old news")
+    segment = tmp_path / "bob" / sorted(os.listdir(tmp_path / "bob"))[0]
+    past = segment.stat().st_mtime - 120
+    os.utime(segment, (past, past))
+
+    assert store.purge_expired() == 1
+    assert not store.has_pending("bob")
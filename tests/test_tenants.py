@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+from websockets import Request
+from websockets.datastructures import Headers
+from websockets.exceptions import InvalidStatus
+
+from oldie_goldie.client.og_client import OGClient
+from oldie_goldie.server.helpers.state_store import TokenTable
+from oldie_goldie.server.tenants import TenantRouter
+
+from _tunnel import wait_for
+
+
+def handshake(path: str = "/", **headers: str) -> Request:
+    return Request(path, Headers(headers))
+
+
+def test_tenants_are_picked_by_path_and_kept_apart():
+    async def run():
+        async with TenantRouter(["127.0.0.1:0"]) as router:
+            chess, band = router.add_tenant("chess"), router.add_tenant("band")
+            base = f"ws://{router.addresses[0]}"
+
+            alice = await OGClient(f"{base}/chess").connect()
+            await alice.register("alice")
+            bob = await OGClient(f"{base}/chess").connect()
+            await bob.register("bob")
+            # The same username in the other group
+            other_alice = await OGClient(f"{base}/band").connect()
+            await other_alice.register("alice")
+
+            assert sorted(chess.connections.usernames()) == ["alice", "bob"]
+            assert band.connections.usernames() == ["alice"]
+            assert await other_alice.list_users() == ["alice"]
+
+            # bob only hears his own group
+            await other_alice.send("one two three four")
+            await alice.send("e4")
+            received = []
+            while (message := await bob.receive(timeout=5)) is not None:
+                received.append(message.get("message"))
+                if message.get("message") == "e4":
+                    break
+            assert "e4" in received and "one two three four" not in received
+
+            with pytest.raises(InvalidStatus):
+                await OGClient(f"{base}/golf").connect()
+            for client in (alice, bob, other_alice):
+                await client.close()
+
+    asyncio.run(run())
+
+
+def test_tenant_is_found_by_invite_token_or_session_ticket():
+    async def run():
+        async with TenantRouter(["127.0.0.1:0"]) as router:
+            tokens = TokenTable()
+            tokens["chess-invite"] = {"username": None, "expiry": None, "reuse": False}
+            chess = router.add_tenant("chess", invite_token=True, invite_tokens=tokens)
+            band = router.add_tenant("band")
+            base = f"ws://{router.addresses[0]}"
+
+            assert router.resolve(handshake(Authorization="chess-invite")) is chess
+            assert router.resolve(handshake(Authorization="unknown")) is None
+            assert router.resolve(handshake()) is None
+
+            # Without a path, the token alone leads to the group
+            alice = await OGClient(base, token="chess-invite").connect()
+            await alice.register("alice")
+            assert chess.connections.usernames() == ["alice"]
+
+            bob = await OGClient(f"{base}/band").connect()
+            await bob.register("bob")
+            bob.websocket.transport.abort()
+            await wait_for(lambda: "bob" not in band.connections)
+            assert router.resolve(handshake(**{"X-OG-Ticket": bob._ticket})) is band
+
+            # Reconnecting without the path, the session ticket leads back to the group
+            bob.uri = base
+            await bob.connect()
+            await bob.register("bob")
+            assert band.connections.usernames() == ["bob"]
+            for client in (alice, bob):
+                await client.close()
+
+    asyncio.run(run())
+
+
+def test_tenant_names_are_checked():
+    router = TenantRouter(["127.0.0.1:0"])
+    router.add_tenant("chess")
+    for name in ("Chess", "chess club", "../etc", "", "chess"):
+        with pytest.raises(ValueError):
+            router.add_tenant(name)
@@ -0,0 +1,50 @@
+import asyncio
+import sys
+
+from oldie_goldie.server.helpers.tunnel_manager import TunnelManager
+
+from _tunnel import wait_for
+
+# Stands in for cloudflared: reports a quick tunnel URL, then runs for `lifetime` seconds
+FAKE_CLOUDFLARED = """
+import os, sys, time
+print("INF |  https://fake-%d.trycloudflare.com  |" % os.getpid(), flush=True)
+time.sleep(float(sys.argv[1]))
+"""
+
+
+def fake_cloudflared(lifetime: float) -> list[str]:
+    return [sys.executable, "-c", FAKE_CLOUDFLARED, str(lifetime)]
+
+
+def test_cloudflared_is_restarted_when_it_exits():
+    async def run():
+        manager = TunnelManager.launch(fake_cloudflared(lifetime=0.2))
+        manager.RESTART_DELAY = 0.05
+        try:
+            first = await manager.wait_for_url(timeout=10)
+            assert first is not None and first.endswith(".trycloudflare.com")
+            first_pid = manager.pid
+
+            # The quick tunnel dies, a new one comes up with a new URL
+            await wait_for(lambda: manager.restarts >= 1 and manager.url is not None, timeout=10)
+            assert manager.url != first
+            assert manager.pid != first_pid
+        finally:
+            manager.stop()
+
+    asyncio.run(run())
+
+
+def test_stop_terminates_cloudflared_and_does_not_restart_it():
+    async def run():
+        manager = TunnelManager.launch(fake_cloudflared(lifetime=60))
+        await manager.wait_for_url(timeout=10)
+        proc = manager._proc
+
+        manager.stop()
+        assert proc.poll() is not None
+        await asyncio.sleep(0.1)
+        assert manager.restarts == 0
+
+    asyncio.run(run())
@@ -0,0 +1,76 @@
+import asyncio
+import json
+
+import websockets
+from websockets.frames import OP_BINARY, OP_TEXT, Frame
+
+from oldie_goldie.shared.ws_compression import (
+    SelectivePerMessageDeflate,
+    client_compression_options,
+    server_compression_options,
+)
+
+def make_extension(**kwargs):
+    return SelectivePerMessageDeflate(False, False, 12, 12, min_size=128, **kwargs)
+
+def test_large_text_is_compressed_and_round_trips():
+    sender, receiver = make_extension(), make_extension()
+    payload = json.dumps({"type": "chat_message", "message": "hello " * 100}).encode()
+
+    frame = sender.encode(Frame(OP_TEXT, payload))
+
+    assert frame.rsv1
+    assert len(frame.data) < len(payload)
+    assert receiver.decode(frame).data == payload
+
+def test_small_binary_and_encrypted_messages_are_sent_as_is():
+    extension = make_extension()
+    small = json.dumps({"type": "chat_message", "message": "hi"}).encode()
+    encrypted = json.dumps({"type": "encrypted_message", "ciphertext": "A" * 500}).encode()
+    binary = bytes(500)
+
+    for frame in (Frame(OP_TEXT, small), Frame(OP_TEXT, encrypted), Frame(OP_BINARY, binary)):
+        encoded = extension.encode(frame)
+        assert not encoded.rsv1
+        assert encoded.data == frame.data
+
+    # Nothing was compressed, so no deflate context was allocated
+    assert not hasattr(extension, 'encoder')
+
+def test_compress_binary_opt_in():
+    extension = make_extension(compress_binary=True)
+
+    assert extension.encode(Frame(OP_BINARY, bytes(500))).rsv1
+
+def test_negotiated_connection_round_trips():
+    async def run():
+        async def echo(websocket):
+            async for message in websocket:
+                await websocket.send(message)
+
+        async with websockets.serve(echo, "127.0.0.1", 0, **server_compression_options()) as server:
+            port = server.sockets[0].getsockname()[1]
+            async with websockets.connect(f"ws://127.0.0.1:{port}", **client_compression_options()) as websocket:
+                extensions = websocket.protocol.extensions
+                assert len(extensions) == 1
+                assert isinstance(extensions[0], SelectivePerMessageDeflate)
+
+                for message in ("x" * 1000, "short", bytes(range(256)) * 4):
+                    await websocket.send(message)
+                    assert await websocket.recv() == message
+
+    asyncio.run(run())
+
+def test_off_mode_negotiates_nothing():
+    async def run():
+        async def echo(websocket):
+            await websocket.send(await websocket.recv())
+
+        async with websockets.serve(echo, "127.0.0.1", 0, **server_compression_options('off')) as server:
+            port = server.sockets[0].getsockname()[1]
+            async with websockets.connect(f"ws://127.0.0.1:{port}", **client_compression_options()) as websocket:
+                assert websocket.protocol.extensions == []
+                await websocket.send("x" * 1000)
+                assert await websocket.recv() == "x" * 1000
+
+    asyncio.run(run())